@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+bench_basecamp.py
+-----------------
+
+Benchmarks for the :py:class:`everest.basecamp.Basecamp` regression
+core: the design matrices, the chunked and joint models, and the
+overfitting metrics.
+
+'''
+
+from __future__ import division, print_function, absolute_import
+from .synthetic import SyntheticTarget, PARAMS
+from everest.transit import TransitModel
+
+
+class DesignMatrix(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+
+    def setup(self, config):
+        self.star = SyntheticTarget(config)
+
+    def time_X(self, config):
+        for n in range(self.star.pld_order):
+            self.star.X(n)
+
+    def peakmem_X(self, config):
+        for n in range(self.star.pld_order):
+            self.star.X(n)
+
+
+class Compute(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 600
+
+    def setup(self, config):
+        self.star = SyntheticTarget(config, all_orders=True)
+
+    def time_compute(self, config):
+        self.star.compute()
+
+    def peakmem_compute(self, config):
+        self.star.compute()
+
+
+class ComputeJoint(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 600
+
+    def setup(self, config):
+        self.star = SyntheticTarget(config, all_orders=True)
+        t0 = self.star.time[len(self.star.time) // 2]
+        self.star.transit_model = TransitModel('b', t0=t0, per=100.,
+                                               sig_RpRs=0.01)
+
+    def time_compute_joint(self, config):
+        self.star.compute_joint()
+
+    def peakmem_compute_joint(self, config):
+        self.star.compute_joint()
+
+
+class Overfit(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 1200
+
+    def setup(self, config):
+        self.star = SyntheticTarget(config, all_orders=True)
+
+    def time_overfit(self, config):
+        self.star.overfit(plot=False, clobber=True)
+
+    def peakmem_overfit(self, config):
+        self.star.overfit(plot=False, clobber=True)
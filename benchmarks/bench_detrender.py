@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+bench_detrender.py
+------------------
+
+Benchmarks for the :py:class:`everest.detrender.Detrender` steps that
+dominate a production run: the cross-validation of :py:obj:`lambda`
+and the GP hyperparameter optimization.
+
+'''
+
+from __future__ import division, print_function, absolute_import
+from .synthetic import SyntheticTarget, PARAMS
+from everest.gp import GetKernelParams
+
+
+class CrossValidate(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 1200
+
+    def setup(self, config):
+        self.star = SyntheticTarget(config)
+
+    def time_cross_validate(self, config):
+        self.star.cross_validate()
+
+    def peakmem_cross_validate(self, config):
+        self.star.cross_validate()
+
+
+class KernelParams(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 600
+
+    def setup(self, config):
+        self.star = SyntheticTarget(config, all_orders=True)
+        self.star.compute()
+
+    def time_GetKernelParams(self, config):
+        GetKernelParams(self.star.time, self.star.flux, self.star.fraw_err,
+                        mask=self.star.mask, guess=self.star.kernel_params,
+                        giter=1, gmaxf=50)
+
+    def peakmem_GetKernelParams(self, config):
+        GetKernelParams(self.star.time, self.star.flux, self.star.fraw_err,
+                        mask=self.star.mask, guess=self.star.kernel_params,
+                        giter=1, gmaxf=50)
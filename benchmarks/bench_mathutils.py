@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+bench_mathutils.py
+------------------
+
+Benchmarks for the numerical kernels in :py:mod:`everest.mathutils`,
+:py:mod:`everest.masksolve` and :py:mod:`everest.search`, and for
+the :py:obj:`SysRem` CBV solver and the batched CBV regression.
+
+'''
+
+from __future__ import division, print_function, absolute_import
+from .synthetic import SyntheticTarget, SyntheticStack, CONFIGS, PARAMS
+from everest.gp import GetCovariance
+from everest.masksolve import MaskSolve
+from everest.mathutils import Scatter, Gram, SysRem, CBVFit
+from everest.search import Search
+import numpy as np
+
+
+class MaskSolveBench(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 600
+
+    def setup(self, config):
+        star = SyntheticTarget(config)
+        m = star.get_masked_chunk(0, pad=False)
+        self.A = GetCovariance(star.kernel, star.kernel_params,
+                               star.time[m], star.fraw_err[m]) + \
+            1e5 * Gram(star.X(0, m))
+        self.b = star.fraw[m] - np.median(star.fraw[m])
+
+    # The cost of each mask is the same, so we only time a few hundred
+    def time_MaskSolve(self, config):
+        MaskSolve(self.A, self.b, w=9, progress=False, niter=200)
+
+    def peakmem_MaskSolve(self, config):
+        MaskSolve(self.A, self.b, w=9, progress=False, niter=200)
+
+
+class ScatterBench(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+
+    def setup(self, config):
+        ncad = CONFIGS[config][0]
+        self.y = 1. + 1.e-4 * np.random.RandomState(42).randn(100, ncad)
+
+    def time_Scatter(self, config):
+        Scatter(self.y[0], remove_outliers=True)
+
+    def time_Scatter_stack(self, config):
+        Scatter(self.y, remove_outliers=True)
+
+
+class SearchBench(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 1200
+
+    def setup(self, config):
+        self.star = SyntheticTarget(config, all_orders=True)
+        self.star.compute()
+
+    def time_Search(self, config):
+        Search(self.star)
+
+    def peakmem_Search(self, config):
+        Search(self.star)
+
+
+class SysRemBench(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+    timeout = 600
+
+    def setup(self, config):
+        ncad, npix, _, _ = CONFIGS[config]
+        self.time, self.flux, self.err = SyntheticStack(10 * npix, ncad)
+
+    def time_SysRem(self, config):
+        SysRem(self.time, self.flux, self.err)
+
+    def peakmem_SysRem(self, config):
+        SysRem(self.time, self.flux, self.err)
+
+
+class CBVFitBench(object):
+    '''
+
+    '''
+
+    params = PARAMS
+    param_names = ['config']
+
+    def setup(self, config):
+        ncad, npix, _, _ = CONFIGS[config]
+        self.time, self.flux, self.err = SyntheticStack(10 * npix, ncad)
+        self.X = np.ones((ncad, 2))
+        self.X[:, 1] = SysRem(self.time, self.flux, self.err, ncbv=1)[0]
+        self.mask = np.random.RandomState(42).rand(*self.flux.shape) < 0.05
+        self.breakpoints = [ncad // 2, ncad - 1]
+
+    def time_CBVFit(self, config):
+        CBVFit(self.X, self.flux, self.mask, self.breakpoints)
+
+    def time_CBVFit_loop(self, config):
+        for f, m in zip(self.flux, self.mask):
+            CBVFit(self.X, f, m, self.breakpoints)
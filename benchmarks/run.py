@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+run.py
+------
+
+A minimal runner for the benchmark suite, for machines without
+`asv <https://asv.readthedocs.io>`_. Every ``time_*`` benchmark is run
+once per configuration in a fresh process, and its wall time and peak
+memory usage (see :py:mod:`everest.profiling`) are printed, or written
+as JSON lines with ``--json``. Run it from the repository root:
+
+.. code-block:: bash
+
+    python -m benchmarks.run [-c small medium] [-k compute] [--json out]
+
+With `asv` installed, ``asv run`` and ``asv continuous`` use the same
+benchmarks (see ``asv.conf.json``).
+
+'''
+
+from __future__ import division, print_function, absolute_import
+import os
+import sys
+import json
+import argparse
+import importlib
+import subprocess
+
+#: The benchmark modules
+MODULES = ['bench_basecamp', 'bench_detrender', 'bench_mathutils']
+
+SCRIPT = '''
+import json, importlib
+from everest.profiling import Profiler
+module = importlib.import_module('benchmarks.%s')
+bench = getattr(module, '%s')()
+bench.setup(%r)
+profiler = Profiler()
+with profiler.stage('%s'):
+    getattr(bench, '%s')(%r)
+if hasattr(bench, 'teardown'):
+    bench.teardown(%r)
+print(json.dumps(profiler.records[0]))
+'''
+
+
+def Discover(pattern=None):
+    '''
+    Returns a list of ``(module, class, method)`` tuples for all
+    ``time_*`` benchmarks whose name contains :py:obj:`pattern`.
+
+    '''
+
+    benchmarks = []
+    for name in MODULES:
+        module = importlib.import_module('benchmarks.' + name)
+        for cname in sorted(dir(module)):
+            klass = getattr(module, cname)
+            if not isinstance(klass, type) or \
+                    getattr(klass, '__module__', None) != module.__name__:
+                continue
+            for mname in sorted(dir(klass)):
+                if mname.startswith('time_') and \
+                        (pattern is None or pattern in mname):
+                    benchmarks.append((name, cname, mname))
+    return benchmarks
+
+
+def Run(module, klass, method, config):
+    '''
+    Runs a single benchmark in a fresh interpreter and returns its
+    profile record.
+
+    '''
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = SCRIPT % (module, klass, config, method[5:], method, config,
+                       config)
+    out = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+    return json.loads(out.decode('utf-8').strip().split('\n')[-1])
+
+
+if __name__ == '__main__':
+
+    from .synthetic import CONFIGS, PARAMS
+
+    parser = argparse.ArgumentParser(prog='benchmarks.run')
+    parser.add_argument('-c', '--configs', nargs='+', default=PARAMS,
+                        choices=list(CONFIGS.keys()),
+                        help='The problem sizes to run')
+    parser.add_argument('-k', '--keyword', default=None,
+                        help='Only run benchmarks matching this string')
+    parser.add_argument('--json', default=None,
+                        help='Append the results to this JSON lines file')
+    args = parser.parse_args()
+
+    print("BENCHMARK                      CONFIG         " +
+          "TIME [s]    PEAK RSS [MB]")
+    print("---------                      ------         " +
+          "--------    -------------")
+    for module, klass, method in Discover(args.keyword):
+        for config in args.configs:
+            try:
+                record = Run(module, klass, method, config)
+            except subprocess.CalledProcessError:
+                print("{:<30s} {:<10s} {:>12s}".format(method[5:], config,
+                                                        'FAILED'))
+                continue
+            print("{:<30s} {:<10s} {:>12.3f} {:>16.1f}".format(
+                  method[5:], config, record['time'], record['rss'] or 0))
+            if args.json is not None:
+                record.update({'config': config, 'ncad': CONFIGS[config][0],
+                               'npix': CONFIGS[config][1],
+                               'pld_order': CONFIGS[config][2],
+                               'nchunks': CONFIGS[config][3]})
+                with open(args.json, 'a') as f:
+                    print(json.dumps(record), file=f)
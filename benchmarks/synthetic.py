@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+synthetic.py
+------------
+
+Synthetic targets for the benchmark suite. The pixel data comes from
+the synthetic mission (see :py:mod:`everest.missions.synthetic`), which
+generates it offline from the target ID, so every run of the suite
+sees exactly the same inputs and exercises the same data path as an
+offline campaign run. The target pixel files are cached in the
+synthetic mission's data directory the first time they are needed.
+
+The size of the problem is set by a named configuration (see
+:py:data:`CONFIGS`). Additional configurations can be given in the
+``EVEREST_BENCH_CONFIGS`` environment variable as a comma-separated
+list of ``cadences:pixels:pld_order:chunks`` strings, i.e.,
+``EVEREST_BENCH_CONFIGS=3000:40:3:2``.
+
+'''
+
+from __future__ import division, print_function, absolute_import
+from everest.detrender import rPLD
+from everest.profiling import Profiler
+from everest.missions.synthetic.synthetic import GetData
+from everest.missions.synthetic.utils import CAMPAIGNS, CADENCE, THRESHOLDS, \
+     PRF, GetSyntheticCampaign, TargetInfo
+from collections import OrderedDict
+from tempfile import mkdtemp
+import os
+import shutil
+import atexit
+import numpy as np
+
+#: The benchmark problem sizes: (cadences, maximum aperture pixels,
+#: PLD order, chunks)
+CONFIGS = OrderedDict([('small', (1000, 20, 2, 1)),
+                       ('medium', (3500, 35, 2, 2)),
+                       ('large', (3500, 50, 3, 3))])
+for _config in os.environ.get('EVEREST_BENCH_CONFIGS', '').split(','):
+    if len(_config.strip()):
+        CONFIGS[_config.strip()] = tuple(int(n) for n in
+                                         _config.strip().split(':'))
+
+#: The configurations the suite runs by default
+PARAMS = [c for c in CONFIGS.keys() if c != 'large'] + \
+    [c for c in os.environ.get('EVEREST_BENCH_CONFIGS', '').split(',')
+     if len(c.strip())]
+
+#: The scratch directory for benchmarks that write to disk
+SCRATCH = mkdtemp(prefix='everest_bench_')
+atexit.register(shutil.rmtree, SCRATCH, True)
+
+
+def SyntheticData(ncad, npix, n=0):
+    '''
+    Returns the :py:class:`everest.utils.DataContainer` of the synthetic
+    mission target for a problem with :py:obj:`ncad` cadences and
+    :py:obj:`npix` aperture pixels: the :py:obj:`n`-th target of the
+    smallest synthetic campaign with at least :py:obj:`ncad` cadences
+    whose largest aperture has at least :py:obj:`npix` pixels. The data
+    is truncated to :py:obj:`ncad` cadences, and the aperture is the
+    largest one with at most :py:obj:`npix` pixels.
+
+    '''
+
+    seasons = [s for s in sorted(CAMPAIGNS) if CAMPAIGNS[s][1] >= ncad]
+    if not len(seasons):
+        raise ValueError("No synthetic campaign has %d cadences." % ncad)
+    season = seasons[0]
+
+    # Find a target that is bright enough
+    targets = []
+    for ID in GetSyntheticCampaign(season, epics_only=True):
+        info = TargetInfo(ID)
+        x, y, _ = info.sources[0]
+        image = PRF(x, y, info.sigma, info.shape)[0]
+        if (np.sum(image > THRESHOLDS[-1] * image.max()) >= npix) and \
+                (image.size > npix):
+            targets.append(ID)
+            if len(targets) > n:
+                break
+    else:
+        raise ValueError("Not enough synthetic targets with %d pixels." %
+                         npix)
+
+    data = GetData(targets[n], season=season, aperture_name='k2sff_19',
+                   max_pixels=npix, get_hires=False, get_nearby=False)
+    for key in ['cadn', 'time', 'fpix', 'fpix_err', 'quality']:
+        setattr(data, key, getattr(data, key)[:ncad])
+    data.nanmask = data.nanmask[data.nanmask < ncad]
+    data.badmask = data.badmask[data.badmask < ncad]
+    return data
+
+
+class SyntheticTarget(rPLD):
+    '''
+    An :py:class:`everest.detrender.rPLD` model of a synthetic target,
+    set up without touching any of the data access or plotting code,
+    so that its methods can be benchmarked in isolation. The model is
+    initialized at the first *PLD* order with
+    :math:`\\Lambda = 10^5`, unless :py:obj:`all_orders` is set, in
+    which case all orders are switched on, as in a de-trended model.
+
+    :param str config: The name of the configuration in \
+           :py:data:`CONFIGS`
+    :param int n: The index of the target among the eligible ones \
+           (see :py:func:`SyntheticData`). Default 0
+    :param bool all_orders: Switch on all the *PLD* orders? \
+           Default :py:obj:`False`
+
+    '''
+
+    def __init__(self, config='small', n=0, all_orders=False):
+        '''
+
+        '''
+
+        ncad, npix, pld_order, nchunks = CONFIGS[config]
+        data = SyntheticData(ncad, npix, n=n)
+
+        # Model setup
+        self.ID = data.ID
+        self._season = data.campaign
+        self.mission = 'synthetic'
+        self.cadence = 'lc'
+        self.clobber = True
+        self.debug = False
+        self.is_parent = False
+        self.profiler = Profiler(enabled=False)
+        self.lambda_arr = np.append(0, 10 ** np.arange(0, 18, 0.5))
+        self.leps = 0.05
+        self.osigma = 5
+        self.oiter = 10
+        self.cdivs = 3
+        self.giter = 1
+        self.gmaxf = 50
+        self.optimize_gp = True
+        self.kernel = 'Basic'
+        self.bpad = 100
+        self.cv_min = 'mad'
+        self.pld_order = pld_order
+        self.breakpoints = np.append(
+            (np.arange(1, nchunks) * ncad) // nchunks, [999999])
+        self._transit_model = None
+        self.X1N = None
+        self.XCBV = None
+        self.reclam = None
+        self.recmask = []
+        self.neighbors = []
+        self._weights = None
+        self.dvs_mode = 'none'
+        self.dvs_data = {}
+
+        # The data
+        self.time = data.time
+        self.fpix = data.fpix
+        self.fpix_err = data.fpix_err
+        self.fraw = np.sum(self.fpix, axis=1)
+        self.fraw_err = np.sqrt(np.sum(self.fpix_err ** 2, axis=1))
+        self.model = np.zeros_like(self.time)
+        self.cadn = data.cadn
+        self.quality = data.quality
+        self.nanmask = data.nanmask
+        self.badmask = data.badmask
+        self.outmask = []
+        self.transitmask = []
+        self.get_norm()
+
+        # Start at the first PLD order
+        white = np.median(self.fraw_err)
+        self.kernel_params = [white, 10. * white, 10.]
+        self.lam_idx = 0
+        self.lam = [[1e5] + [None for i in range(self.pld_order - 1)]
+                    for b in self.breakpoints]
+        if all_orders:
+            self.lam_idx = self.pld_order - 1
+            self.lam = [[10 ** (5 - 2 * n) for n in range(self.pld_order)]
+                        for b in self.breakpoints]
+        self.cdpp_arr = np.array([np.nan for b in self.breakpoints])
+        self.cdppv_arr = np.array([np.nan for b in self.breakpoints])
+
+    @property
+    def dir(self):
+        '''
+        The scratch directory of this target.
+
+        '''
+
+        path = os.path.join(SCRATCH, '%d' % self.ID)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+
+def SyntheticStack(nstars, ncad, seed=42):
+    '''
+    Returns ``(time, flux, err)`` for :py:obj:`nstars` synthetic light
+    curves sharing three common systematic trends, as expected by
+    :py:func:`everest.mathutils.SysRem`.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    time = 2000. + CADENCE * np.arange(ncad)
+    trends = np.array([np.sin(2 * np.pi * time / p)
+                       for p in [3., 7., 13.]])
+    weights = rng.randn(nstars, 3)
+    flux = 1.e4 * (1. + 1.e-3 * (np.dot(weights, trends) +
+                                 rng.randn(nstars, ncad)))
+    err = 10. * np.ones_like(flux)
+    return time, flux, err
@@ -14,29 +14,73 @@ except NameError:
     __EVEREST_SETUP__ = False
 
 if not __EVEREST_SETUP__:
-    # This is a regular everest run
-
-    # Import all modules
-    from . import config
-    from . import utils
-    from . import mathutils
-    from . import transit
-    from . import pool
-    from . import fits
-    from . import dvs
-    from . import gp
-    from . import search
-    from . import missions
-    from . import basecamp
-    from . import detrender
-    from . import inject
-    from . import user
-    from . import standalone
-
-    # Import the good stuff
-    from .detrender import *
-    from .standalone import DetrendFITS
-    from .inject import *
-    from .missions import *
-    from .transit import Transit, TransitModel, TransitShape
-    from .user import Everest, DVS, Search
+    # This is a regular everest run. The submodules are imported
+    # lazily, the first time one of their attributes is accessed,
+    # so that ``import everest`` does not pull in the plotting and
+    # data access stacks until they are actually needed.
+    import sys
+    import importlib
+
+    #: The :py:mod:`everest` submodules
+    _SUBMODULES = ['config', 'utils', 'mathutils', 'transit', 'pool', 'fits',
+                   'dvs', 'gp', 'modelstore', 'search', 'missions',
+                   'basecamp', 'detrender', 'inject', 'user', 'standalone',
+                   'profiling', 'download']
+
+    # The download manager is built on `asyncio` and requires Python 3.7
+    if sys.version_info < (3, 7):
+        _SUBMODULES.remove('download')
+
+    #: The good stuff, and the submodule each name lives in
+    _ATTRIBUTES = {'Detrender': 'detrender',
+                   'rPLD': 'detrender',
+                   'nPLD': 'detrender',
+                   'iPLD': 'detrender',
+                   'pPLD': 'detrender',
+                   'DetrendFITS': 'standalone',
+                   'Inject': 'inject',
+                   'InjectionEngine': 'inject',
+                   'RecoverDepth': 'inject',
+                   'k2': 'missions',
+                   'kepler': 'missions',
+                   'tess': 'missions',
+                   'Missions': 'missions',
+                   'Transit': 'transit',
+                   'TransitModel': 'transit',
+                   'TransitShape': 'transit',
+                   'Everest': 'user',
+                   'DVS': 'user',
+                   'Search': 'user',
+                   'Profiler': 'profiling'}
+
+    __all__ = _SUBMODULES + list(_ATTRIBUTES.keys())
+
+    def __getattr__(name):
+        '''
+        Imports the submodule or public attribute :py:obj:`name` on
+        first access.
+
+        '''
+
+        if name in _SUBMODULES:
+            return importlib.import_module('.' + name, __name__)
+        elif name in _ATTRIBUTES:
+            module = importlib.import_module('.' + _ATTRIBUTES[name],
+                                             __name__)
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+        raise AttributeError("module '%s' has no attribute '%s'" %
+                             (__name__, name))
+
+    def __dir__():
+        '''
+
+        '''
+
+        return sorted(set(list(globals().keys()) + __all__))
+
+    # Module-level ``__getattr__`` requires Python 3.7 (PEP 562)
+    if sys.version_info < (3, 7):
+        for _name in __all__:
+            globals()[_name] = __getattr__(_name)
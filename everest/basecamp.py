@@ -12,26 +12,60 @@ inherit from :py:class:`Basecamp`.
 from __future__ import division, print_function, absolute_import, \
     unicode_literals
 from . import missions
-from .utils import AP_SATURATED_PIXEL, prange
-from .mathutils import SavGol
+from .config import QUALITY_BAD, QUALITY_NAN, QUALITY_OUT, QUALITY_REC, \
+    QUALITY_TRN
+from .utils import AP_SATURATED_PIXEL, prange, LazyModule, IndexMap
+from .mathutils import SavGol, Gram, ConjugateGradient
 from .masksolve import MaskSolve
-from .gp import GetCovariance
+from .gp import GetCovariance, CovarianceProduct
 from .search import Search
 from .transit import TransitModel, TransitShape
 from .dvs import OVERFIT
 from scipy.linalg import block_diag, cholesky, cho_factor, cho_solve
+from scipy.linalg.blas import get_blas_funcs
+from tempfile import mkdtemp
 import os
+import shutil
 import numpy as np
-import matplotlib.pyplot as pl
 from scipy.ndimage import zoom
 from itertools import combinations_with_replacement as multichoose
 import logging
 import platform
 import subprocess
 log = logging.getLogger(__name__)
+pl = LazyModule('matplotlib.pyplot')
 
 __all__ = ['Basecamp', 'Overfitting']
 
+#: The bit that flags each of the cadence masks in
+#: :py:attr:`Basecamp.maskbits`. These are the same bits used in the
+#: `QUALITY` array of the published FITS files.
+MASK_BITS = {'badmask': 2 ** (QUALITY_BAD - 1),
+             'nanmask': 2 ** (QUALITY_NAN - 1),
+             'outmask': 2 ** (QUALITY_OUT - 1),
+             'recmask': 2 ** (QUALITY_REC - 1),
+             'transitmask': 2 ** (QUALITY_TRN - 1)}
+
+#: The masks whose union is :py:attr:`Basecamp.mask`
+MASK_ALL = ['outmask', 'badmask', 'transitmask', 'nanmask']
+
+
+def _MaskProperty(name, doc):
+    '''
+    Returns a property that exposes the cadences flagged with the
+    :py:obj:`MASK_BITS` bit of the mask :py:obj:`name` as a sorted
+    array of indices.
+
+    '''
+
+    def fget(self):
+        return self.get_mask_indices([name])
+
+    def fset(self, value):
+        self.set_mask(name, value)
+
+    return property(fget, fset, doc=doc)
+
 
 class Overfitting(object):
     """Stores information on the overfitting metrics for a light curve."""
@@ -74,6 +108,28 @@ class Basecamp(object):
 
     '''
 
+    #: The precision of the pixel data and the design matrices, either
+    #: `double` or `single`. The Gram matrices and the linear solves are
+    #: always computed in double precision.
+    precision = 'double'
+
+    #: The memory budget (in MB) for the joint model. If the dense
+    #: (*N*,*N*) matrices in :py:meth:`compute_joint` would not fit, the
+    #: model is computed with :py:meth:`compute_joint_blocked` instead.
+    joint_memory = 4096
+
+    @property
+    def dtype(self):
+        '''
+        The data type of the pixel data and the design matrices.
+
+        '''
+
+        if self.precision == 'single':
+            return np.dtype('float32')
+        else:
+            return np.dtype('float64')
+
     @property
     def _mission(self):
         '''
@@ -228,6 +284,144 @@ class Basecamp(object):
 
         raise NotImplementedError("Can't set this property.")
 
+    #: Attributes that are properties, but should be saved with the model
+    _store_properties = ['nanmask', 'badmask', 'outmask', 'transitmask',
+                         'recmask']
+
+    nanmask = _MaskProperty('nanmask', '''
+        The array of indices of the :py:obj:`NaN` cadences.
+
+        ''')
+
+    badmask = _MaskProperty('badmask', '''
+        The array of indices of the flagged cadences.
+
+        ''')
+
+    outmask = _MaskProperty('outmask', '''
+        The array of indices of the outliers.
+
+        ''')
+
+    transitmask = _MaskProperty('transitmask', '''
+        The array of indices of the masked transit cadences.
+
+        ''')
+
+    recmask = _MaskProperty('recmask', '''
+        The array of indices masked in the original model (for
+        recursive *PLD* only).
+
+        ''')
+
+    @property
+    def maskbits(self):
+        '''
+        The per-cadence mask bitfield. Bit :py:obj:`MASK_BITS[name]` is
+        set for every cadence in the mask :py:obj:`name`. The index arrays
+        :py:attr:`nanmask`, :py:attr:`badmask`, etc. are views of this
+        array. It always has the same length as :py:attr:`time`;
+        cadences past the end of the light curve are dropped.
+
+        '''
+
+        time = getattr(self, 'time', None)
+        n = len(time) if time is not None else 0
+        bits = self.__dict__.get('_maskbits', None)
+        if bits is None:
+            bits = np.zeros(n, dtype=np.uint32)
+        elif len(bits) < n:
+            bits = np.concatenate([bits, np.zeros(n - len(bits),
+                                                  dtype=np.uint32)])
+        elif len(bits) > n and time is not None:
+            bits = np.array(bits[:n])
+        else:
+            return bits
+        self._maskbits = bits
+        self._maskcache = {}
+        return bits
+
+    @maskbits.setter
+    def maskbits(self, value):
+        '''
+
+        '''
+
+        raise NotImplementedError("Can't set this property.")
+
+    def set_mask(self, name, inds):
+        '''
+        Sets the mask :py:obj:`name` (one of the keys of
+        :py:obj:`MASK_BITS`) to the cadences :py:obj:`inds`.
+
+        '''
+
+        bit = MASK_BITS[name]
+        if inds is None:
+            inds = []
+        inds = np.array(inds, dtype=int).reshape(-1)
+        bits = self.maskbits
+        if len(inds) and inds.max() >= len(bits):
+            bits = np.concatenate([bits, np.zeros(inds.max() + 1 - len(bits),
+                                                  dtype=np.uint32)])
+            self._maskbits = bits
+        bits &= np.uint32(~bit & 0xFFFFFFFF)
+        bits[inds] |= np.uint32(bit)
+        self._maskcache = {}
+
+    def get_mask(self, include=MASK_ALL, exclude=[]):
+        '''
+        Returns a (cached, read-only) boolean array that is :py:obj:`True`
+        for every cadence that is in any of the masks :py:obj:`include`
+        and in none of the masks :py:obj:`exclude`.
+
+        :param list include: The names of the masks to combine. Default \
+               :py:obj:`MASK_ALL`
+        :param list exclude: The names of the masks to exclude. Default `[]`
+
+        '''
+
+        bits = self.maskbits
+        key = ('bool', tuple(include), tuple(exclude))
+        res = self._maskcache.get(key, None)
+        if res is None:
+            res = (bits & np.uint32(sum([MASK_BITS[m]
+                                          for m in include]))) > 0
+            if len(exclude):
+                res &= (bits & np.uint32(sum([MASK_BITS[m]
+                                               for m in exclude]))) == 0
+            res.flags.writeable = False
+            self._maskcache[key] = res
+        return res
+
+    def get_mask_indices(self, include=MASK_ALL, exclude=[]):
+        '''
+        Same as :py:meth:`get_mask`, but returns the (sorted) indices of
+        the masked cadences.
+
+        '''
+
+        self.maskbits
+        key = ('inds', tuple(include), tuple(exclude))
+        res = self._maskcache.get(key, None)
+        if res is None:
+            res = np.flatnonzero(self.get_mask(include, exclude))
+            res.flags.writeable = False
+            self._maskcache[key] = res
+        return res
+
+    def is_masked(self, i, include=MASK_ALL):
+        '''
+        Returns :py:obj:`True` if cadence :py:obj:`i` is in any of the
+        masks :py:obj:`include`.
+
+        '''
+
+        bits = self.maskbits
+        if i < 0 or i >= len(bits):
+            return False
+        return bool(bits[i] & sum([MASK_BITS[m] for m in include]))
+
     @property
     def mask(self):
         '''
@@ -237,8 +431,7 @@ class Basecamp(object):
 
         '''
 
-        return np.array(list(set(np.concatenate([self.outmask, self.badmask,
-                        self.transitmask, self.nanmask]))), dtype=int)
+        return self.get_mask_indices(MASK_ALL)
 
     @mask.setter
     def mask(self, value):
@@ -319,10 +512,12 @@ class Basecamp(object):
 
         '''
 
-        X1 = self.fpix[j] / self.norm[j].reshape(-1, 1)
+        X1 = np.asarray(self.fpix[j] / self.norm[j].reshape(-1, 1),
+                        dtype=self.dtype)
         X = np.product(list(multichoose(X1.T, i + 1)), axis=1).T
         if self.X1N is not None:
-            return np.hstack([X, self.X1N[j] ** (i + 1)])
+            return np.hstack([X, np.asarray(self.X1N[j], dtype=self.dtype)
+                              ** (i + 1)])
         else:
             return X
 
@@ -353,9 +548,15 @@ class Basecamp(object):
                      ha='center', va='center', fontsize=12,
                      color='k')
 
-        axl.annotate(self.aperture_name if len(self.neighbors) == 0
-                     else "%s, %d neighbors" %
-                     (self.aperture_name, len(self.neighbors)),
+        if len(self.neighbors):
+            info = "%s, %d neighbors" % (self.aperture_name,
+                                         len(self.neighbors))
+        elif self.X1N is not None:
+            info = "%s, %d-vector neighbor basis" % (self.aperture_name,
+                                                     self.X1N.shape[1])
+        else:
+            info = self.aperture_name
+        axl.annotate(info,
                      xy=(0.5, 0.2), xycoords='axes fraction',
                      ha='center', va='center', fontsize=8, color='k',
                      fontstyle='italic')
@@ -412,8 +613,8 @@ class Basecamp(object):
                 if (self.lam_idx >= n) and (self.lam[b][n] is not None):
                     XM = self.X(n, m)
                     XC = self.X(n, c)
-                    A += self.lam[b][n] * np.dot(XM, XM.T)
-                    B += self.lam[b][n] * np.dot(XC, XM.T)
+                    A += self.lam[b][n] * Gram(XM)
+                    B += self.lam[b][n] * Gram(XC, XM)
                     del XM, XC
 
             # Compute the model
@@ -433,7 +634,7 @@ class Basecamp(object):
             for m in model[1:-1]:
                 # Join the chunks at the first non-outlier cadence
                 i = 1
-                while len(self.model) - i in self.mask:
+                while self.is_masked(len(self.model) - i):
                     i += 1
                 offset = self.model[-i] - m[self.bpad - i]
                 self.model = np.concatenate(
@@ -441,7 +642,7 @@ class Basecamp(object):
 
             # Last chunk
             i = 1
-            while len(self.model) - i in self.mask:
+            while self.is_masked(len(self.model) - i):
                 i += 1
             offset = self.model[-i] - model[-1][self.bpad - i]
             self.model = np.concatenate(
@@ -466,11 +667,6 @@ class Basecamp(object):
 
         '''
 
-        # Init
-        log.info('Computing the joint model...')
-        A = [None for b in self.breakpoints]
-        B = [None for b in self.breakpoints]
-
         # We need to make sure that we're not masking the transits we are
         # trying to fit!
         # NOTE: If there happens to be an index that *SHOULD* be masked during
@@ -483,10 +679,22 @@ class Basecamp(object):
             transit_inds = np.where(
                 np.sum([tm(self.time) for tm in self.transit_model],
                        axis=0) < 0)[0]
-            self.outmask = np.array(
-                [i for i in self.outmask if i not in transit_inds])
-            self.transitmask = np.array(
-                [i for i in self.transitmask if i not in transit_inds])
+            self.outmask = np.setdiff1d(self.outmask, transit_inds)
+            self.transitmask = np.setdiff1d(self.transitmask, transit_inds)
+
+        # Will the dense matrices fit in memory? Note that the
+        # number of unmasked cadences includes the transits
+        nm = len(self.apply_mask())
+        if 8 * (2 * nm + len(self.time)) * nm > self.joint_memory * 2 ** 20:
+            if self.transit_model is not None:
+                self.outmask = outmask
+                self.transitmask = transitmask
+            return self.compute_joint_blocked()
+
+        # Init
+        log.info('Computing the joint model...')
+        A = [None for b in self.breakpoints]
+        B = [None for b in self.breakpoints]
 
         # Loop over all chunks
         for b, brkpt in enumerate(self.breakpoints):
@@ -506,8 +714,8 @@ class Basecamp(object):
                 if (self.lam_idx >= n) and (self.lam[b][n] is not None):
                     XM = self.X(n, m)
                     XC = self.X(n, c)
-                    A[b] += self.lam[b][n] * np.dot(XM, XM.T)
-                    B[b] += self.lam[b][n] * np.dot(XC, XM.T)
+                    A[b] += self.lam[b][n] * Gram(XM)
+                    B[b] += self.lam[b][n] * Gram(XC, XM)
                     del XM, XC
 
         # Merge chunks. BIGA and BIGB are sparse, but unfortunately
@@ -534,36 +742,39 @@ class Basecamp(object):
             # Get the unmasked indices
             m = self.apply_mask()
 
+            # The transit models are zero outside of transit, so we
+            # only need their values on the in-transit cadences
+            XM = [tm.support(self.time[m]) for tm in self.transit_model]
+            XC = [tm.support(self.time) for tm in self.transit_model]
+
             # Subtract off the mean total transit model
-            mean_transit_model = med * \
-                np.sum([tm.depth * tm(self.time[m])
-                        for tm in self.transit_model], axis=0)
-            f -= mean_transit_model
-
-            # Now add each transit model to the matrix of regressors
-            for tm in self.transit_model:
-                XM = tm(self.time[m]).reshape(-1, 1)
-                XC = tm(self.time).reshape(-1, 1)
-                BIGA += med ** 2 * tm.var_depth * np.dot(XM, XM.T)
-                BIGB += med ** 2 * tm.var_depth * np.dot(XC, XM.T)
-                del XM, XC
+            for tm, (im, vm) in zip(self.transit_model, XM):
+                f[im] -= med * tm.depth * vm
+
+            # Now add each transit model to the matrix of regressors.
+            # These are rank-1 updates to the in-transit blocks only
+            for tm, (im, vm), (ic, vc) in zip(self.transit_model, XM, XC):
+                BIGA[np.ix_(im, im)] += med ** 2 * tm.var_depth * \
+                    np.outer(vm, vm)
+                BIGB[np.ix_(ic, im)] += med ** 2 * tm.var_depth * \
+                    np.outer(vc, vm)
 
             # Dot the inverse of the covariance matrix
             W = np.linalg.solve(mK + BIGA, f)
             self.model = np.dot(BIGB, W)
 
             # Compute the transit weights and maximum likelihood transit model
-            w_trn = med ** 2 * np.concatenate([tm.var_depth * np.dot(
-                    tm(self.time[m]).reshape(1, -1), W)
-                    for tm in self.transit_model])
+            w_trn = med ** 2 * np.array([tm.var_depth * np.dot(vm, W[im])
+                                         for tm, (im, vm) in
+                                         zip(self.transit_model, XM)])
             self.transit_depth = np.array(
                  [med * tm.depth + w_trn[i] for i, tm in
                   enumerate(self.transit_model)]) / med
 
             # Remove the transit prediction from the model
-            self.model -= np.dot(np.hstack([tm(self.time).reshape(-1, 1)
-                                 for tm in self.transit_model]),
-                                 w_trn)
+            for w, (ic, vc) in zip(w_trn, XC):
+                self.model[ic] -= w * vc
+            del XM, XC
 
         else:
 
@@ -584,6 +795,168 @@ class Basecamp(object):
         self.cdpp = self.get_cdpp()
         self._weights = None
 
+    def compute_joint_blocked(self):
+        '''
+        Same as :py:meth:`compute_joint`, but without ever building the
+        (*N*,*N*) matrices, so that joint models can be computed for
+        long (i.e., short cadence) light curves within a fixed memory
+        budget. The system is solved with preconditioned conjugate
+        gradients: the *PLD* term and the GP covariance within each
+        light curve chunk are factored one chunk at a time and used as
+        a block-diagonal preconditioner (with the transit models added
+        via the Woodbury identity), while the GP covariance between
+        chunks is applied implicitly with :py:func:`CovarianceProduct`.
+        If the factors exceed half of :py:attr:`joint_memory`, they
+        are memory-mapped to a temporary directory.
+
+        '''
+
+        log.info('Computing the joint model in blocks...')
+
+        # Don't mask the transits we are trying to fit (see compute_joint)
+        if self.transit_model is not None:
+            outmask = np.array(self.outmask)
+            transitmask = np.array(self.transitmask)
+            transit_inds = np.where(
+                np.sum([tm(self.time) for tm in self.transit_model],
+                       axis=0) < 0)[0]
+            self.outmask = np.setdiff1d(self.outmask, transit_inds)
+            self.transitmask = np.setdiff1d(self.transitmask, transit_inds)
+
+        # The masked arrays
+        m = self.apply_mask()
+        time = self.time[m]
+        errors = self.fraw_err[m]
+        f = self.fraw[m]
+        med = np.nanmedian(f)
+        f = f - med
+
+        # The masked chunks are contiguous slices of the masked arrays
+        chunks = []
+        for b in range(len(self.breakpoints)):
+            mb = self.get_masked_chunk(b, pad=False)
+            if len(mb):
+                i = np.searchsorted(m, mb[0])
+                chunks.append((b, slice(i, i + len(mb))))
+
+        # The transit models are rank-1 updates, U . U^T
+        if self.transit_model is not None:
+            XM = [tm.support(time) for tm in self.transit_model]
+            U = np.zeros((len(m), len(self.transit_model)))
+            for k, (tm, (im, vm)) in enumerate(zip(self.transit_model, XM)):
+                f[im] -= med * tm.depth * vm
+                U[im, k] = med * np.sqrt(tm.var_depth) * vm
+        else:
+            U = np.zeros((len(m), 0))
+
+        # Factor the diagonal blocks, K_bb + A_bb = L_b . L_b^T
+        tmpdir = None
+        if 8 * sum([(s.stop - s.start) ** 2 for _, s in chunks]) > \
+                self.joint_memory * 2 ** 19:
+            tmpdir = mkdtemp()
+        L = [None for c in chunks]
+        for k, (b, s) in enumerate(chunks):
+            P = GetCovariance(self.kernel, self.kernel_params,
+                              time[s], errors[s])
+            for n in range(self.pld_order):
+                if (self.lam_idx >= n) and (self.lam[b][n] is not None):
+                    X = self.X(n, m[s])
+                    P += self.lam[b][n] * Gram(X)
+                    del X
+            P = np.asfortranarray(cho_factor(P, lower=True,
+                                             overwrite_a=True)[0])
+            if tmpdir is not None:
+                L[k] = np.lib.format.open_memmap(
+                    os.path.join(tmpdir, '%d.npy' % k), mode='w+',
+                    dtype=P.dtype, shape=P.shape, fortran_order=True)
+                L[k][:] = P
+                L[k].flush()
+            else:
+                L[k] = P
+            del P
+        trmv = get_blas_funcs('trmv', (L[0],))
+
+        def Dot(x):
+            '''
+            The full matrix times :py:obj:`x`.
+
+            '''
+
+            y = CovarianceProduct(self.kernel, self.kernel_params, time, x)
+            for k, (b, s) in enumerate(chunks):
+                y[s] -= CovarianceProduct(self.kernel, self.kernel_params,
+                                          time[s], x[s])
+                y[s] += trmv(L[k], trmv(L[k], x[s], lower=1, trans=1),
+                             lower=1)
+            return y + np.dot(U, np.dot(U.T, x))
+
+        def BlockSolve(x):
+            '''
+            The block-diagonal matrix inverse times :py:obj:`x`.
+
+            '''
+
+            y = np.empty_like(x)
+            for k, (b, s) in enumerate(chunks):
+                y[s] = cho_solve((L[k], True), x[s])
+            return y
+
+        # The Woodbury update for the transit models
+        QU = np.transpose([BlockSolve(u) for u in U.T]).reshape(U.shape)
+        S = np.eye(U.shape[1]) + np.dot(U.T, QU)
+
+        def Precondition(x):
+            '''
+            The preconditioner inverse times :py:obj:`x`.
+
+            '''
+
+            y = BlockSolve(x)
+            if U.shape[1]:
+                y -= np.dot(QU, np.linalg.solve(S, np.dot(U.T, y)))
+            return y
+
+        # Solve
+        try:
+            W = ConjugateGradient(Dot, f, Precondition)
+        finally:
+            del L[:]
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+        # The model. The transit terms in BIGB cancel out when the
+        # transit prediction is removed, so only the PLD terms remain
+        self.model = np.zeros(len(self.time))
+        for b, s in chunks:
+            c = self.get_chunk(b, pad=False)
+            for n in range(self.pld_order):
+                if (self.lam_idx >= n) and (self.lam[b][n] is not None):
+                    self.model[c] += self.lam[b][n] * np.dot(
+                        self.X(n, c), np.dot(self.X(n, m[s]).T, W[s]))
+
+        # The transit weights and maximum likelihood transit model
+        if self.transit_model is not None:
+            w_trn = med ** 2 * np.array([tm.var_depth * np.dot(vm, W[im])
+                                         for tm, (im, vm) in
+                                         zip(self.transit_model, XM)])
+            self.transit_depth = np.array(
+                 [med * tm.depth + w_trn[i] for i, tm in
+                  enumerate(self.transit_model)]) / med
+            del XM
+
+        # Subtract the global median
+        self.model -= np.nanmedian(self.model)
+
+        # Restore the mask
+        if self.transit_model is not None:
+            self.outmask = outmask
+            self.transitmask = transitmask
+
+        # Get the CDPP and reset the weights
+        self.cdpp_arr = self.get_cdpp_arr()
+        self.cdpp = self.get_cdpp()
+        self._weights = None
+
     def apply_mask(self, x=None):
         '''
         Returns the outlier mask, an array of indices corresponding to the
@@ -594,8 +967,11 @@ class Basecamp(object):
 
         '''
 
+        keep = ~self.get_mask()
         if x is None:
-            return np.delete(np.arange(len(self.time)), self.mask)
+            return np.flatnonzero(keep)
+        elif len(x) == len(keep):
+            return np.asarray(x)[keep]
         else:
             return np.delete(x, self.mask, axis=0)
 
@@ -629,12 +1005,19 @@ class Basecamp(object):
 
         '''
 
-        M = self.apply_mask(np.arange(len(self.time)))
-        if b > 0:
-            res = M[(M > self.breakpoints[b - 1] - int(pad) * self.bpad)
-                    & (M <= self.breakpoints[b] + int(pad) * self.bpad)]
-        else:
-            res = M[M <= self.breakpoints[b] + int(pad) * self.bpad]
+        # The chunks only change when the masks do
+        self.maskbits
+        key = ('chunk', b, pad, self.bpad, tuple(self.breakpoints))
+        res = self._maskcache.get(key, None)
+        if res is None:
+            M = self.apply_mask()
+            if b > 0:
+                res = M[(M > self.breakpoints[b - 1] - int(pad) * self.bpad)
+                        & (M <= self.breakpoints[b] + int(pad) * self.bpad)]
+            else:
+                res = M[M <= self.breakpoints[b] + int(pad) * self.bpad]
+            res.flags.writeable = False
+            self._maskcache[key] = res
         if x is None:
             return res
         else:
@@ -670,7 +1053,7 @@ class Basecamp(object):
             for n in range(self.pld_order):
                 if self.lam_idx >= n:
                     X = self.X(n, m)
-                    _A[n] = np.dot(X, X.T)
+                    _A[n] = Gram(X)
                     del X
 
             # Compute the weights
@@ -897,7 +1280,7 @@ class Basecamp(object):
                     if (self.lam_idx >= n) and (self.lam[b][n] is not None):
                         X[n] = self.X(n, m, **kwargs)
                         XL[n] = (self.lam[b][n] / med ** 2) * X[n]
-                        XLX[n] = np.dot(XL[n], X[n].T)
+                        XLX[n] = Gram(XL[n], X[n])
                 X = np.hstack(X)
                 XL = np.hstack(XL)
                 XLX = np.sum(XLX, axis=0)
@@ -953,7 +1336,7 @@ class Basecamp(object):
                     # XLmX[:, n - 1] = \
                     #   np.dot(XL, np.delete(X, mask, axis=0).T)[:, n - 1]
                     if n == 0:
-                        XLmX = np.dot(XL, np.delete(X, mask, axis=0).T)
+                        XLmX = Gram(XL, np.delete(X, mask, axis=0))
                     else:
                         XLmX[:, n - 1] = np.dot(XL, X[n - 1, :].T)
 
@@ -1106,20 +1489,16 @@ class Basecamp(object):
         if refactor:
 
             # Smooth the light curve and reset the outlier mask
-            t = np.delete(self.time,
-                          np.concatenate([self.nanmask, self.badmask]))
-            f = np.delete(self.flux,
-                          np.concatenate([self.nanmask, self.badmask]))
-            f = SavGol(f)
+            imap = IndexMap(len(self.time),
+                            self.get_mask(['nanmask', 'badmask']))
+            f = SavGol(imap.apply(self.flux))
             med = np.nanmedian(f)
             MAD = 1.4826 * np.nanmedian(np.abs(f - med))
             pos_inds = np.where((f > med + pos_tol * MAD))[0]
-            pos_inds = np.array([np.argmax(self.time == t[i])
-                                 for i in pos_inds])
+            pos_inds = imap.unmask(pos_inds)
             MAD = 1.4826 * np.nanmedian(np.abs(f - med))
             neg_inds = np.where((f < med - neg_tol * MAD))[0]
-            neg_inds = np.array([np.argmax(self.time == t[i])
-                                 for i in neg_inds])
+            neg_inds = imap.unmask(neg_inds)
             outmask = np.array(self.outmask)
             transitmask = np.array(self.transitmask)
             self.outmask = np.concatenate([neg_inds, pos_inds])
@@ -1140,7 +1519,7 @@ class Basecamp(object):
                 A = np.zeros((len(m), len(m)))
                 for n in range(self.pld_order):
                     XM = self.X(n, m)
-                    A += self.lam[b][n] * np.dot(XM, XM.T)
+                    A += self.lam[b][n] * Gram(XM)
                 K += A
                 self._ll_info[b] = [cho_factor(K), m]
 
@@ -50,6 +50,8 @@ KEPPRF_DIR = os.path.expanduser(os.environ.get(
 
 #: The MAST url where the light curves are published
 MAST_ROOT = 'https://archive.stsci.edu/hlsps/everest/v2/'
+#: The maximum number of concurrent downloads from MAST
+EVEREST_DOWNLOADS = int(os.environ.get('EVEREST2_DOWNLOADS', 8))
 
 #: Everest quality bit: masked because a Kepler flag was raised
 QUALITY_BAD = 23
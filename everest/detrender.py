@@ -16,23 +16,24 @@ from __future__ import division, print_function, absolute_import, \
 from . import missions
 from .basecamp import Basecamp
 from .config import EVEREST_DAT
-from .utils import InitLog, Formatter, AP_SATURATED_PIXEL, AP_COLLAPSED_PIXEL
-from .mathutils import Chunks, Scatter, SavGol, Interpolate
-from .fits import MakeFITS
-from .gp import GetCovariance, GetKernelParams, GP
-from .dvs import DVS, CBV
+from .utils import InitLog, Formatter, AP_SATURATED_PIXEL, AP_COLLAPSED_PIXEL, \
+     LazyModule, IndexMap
+from .mathutils import Chunks, Scatter, SavGol, Interpolate, Gram
+from .fits import MakeFITS, UpdateFITS
+from .gp import GetCovariance, GetKernelParams, GP, CVPredictor
+from .profiling import Profiler
+from .dvs import DVS, CBV, Rasterize
+from .modelstore import SaveModel, LoadModel
 import os
 import sys
 import numpy as np
-import george
-from scipy.optimize import fmin_powell
-import matplotlib.pyplot as pl
-from matplotlib.ticker import MaxNLocator
-from matplotlib.backends.backend_pdf import PdfPages
-from PyPDF2 import PdfFileReader, PdfFileWriter
+from scipy.optimize import fmin_powell, fmin_l_bfgs_b
+from scipy.linalg import cho_factor, cho_solve, LinAlgError
+from multiprocessing.pool import ThreadPool
 import traceback
 import logging
 log = logging.getLogger(__name__)
+pl = LazyModule('matplotlib.pyplot')
 
 __all__ = ['Detrender', 'rPLD', 'nPLD', 'iPLD', 'pPLD']
 
@@ -92,6 +93,13 @@ class Detrender(Basecamp):
     :param str cv_min: The quantity to be minimized during cross-validation. \
            Default `MAD` (median absolute deviation). Can also be set to \
            `TV` (total variation).
+    :param str dvs_mode: How to produce the data validation summary (DVS) \
+           figure. In `inline` mode, the DVS is drawn and saved as a `pdf` \
+           at the end of the run. In `deferred` mode, only the (small) \
+           arrays needed to draw it are stored in the model file, and the \
+           figure can be rendered later with :py:meth:`plot_dvs` (for \
+           instance, in a separate, parallel batch stage). In `none` mode, \
+           no DVS data is recorded at all. Default `inline`
     :param int giter: The number of iterations when optimizing the GP. \
            During each iteration, the minimizer is initialized with a \
            perturbed guess; after :py:obj:`giter` iterations, the step with \
@@ -116,6 +124,10 @@ class Detrender(Basecamp):
            is the regularization parameter, or the standard deviation of \
            the Gaussian prior on the weights for each order of PLD. \
            Default ``10 ** np.arange(0,18,0.5)``
+    :param float joint_memory: The memory budget in MB for the joint \
+           transit model. Light curves whose dense joint model matrices \
+           would exceed it (typically short cadence ones) are solved \
+           iteratively, one chunk at a time. Default 4096
     :param float leps: The fractional tolerance when optimizing \
            :math:`\Lambda`. The chosen value of :math:`\Lambda` will be \
            within this amount of the minimum of the CDPP curve. \
@@ -144,6 +156,20 @@ class Detrender(Basecamp):
            for each of the planets to be masked (all values in days).
     :param int pld_order: The pixel level decorrelation order. Default `3`. \
            Higher orders may cause memory errors
+    :param bool profile: Record the wall time, CPU time and peak memory \
+           usage of each stage of the run? The records are written to a \
+           ``.prof`` file (one JSON object per line) next to the model, \
+           and the per-stage totals are stored in the :py:attr:`profile` \
+           attribute, the model file and the *FITS* header (the stages \
+           that run after the model is saved are only in the ``.prof`` \
+           file). \
+           See :py:mod:`everest.profiling`. Default :py:obj:`True`
+    :param str precision: The precision of the pixel data and the design \
+           matrices, either `double` or `single`. In `single` precision, \
+           the pixel fluxes and the *PLD* regressors are stored as \
+           `float32`, halving their memory footprint, while the \
+           :math:`X X^T` matrices and the linear solves are still \
+           computed in double precision. Default `double`
     :param str saturated_aperture_name: If the target is found to be \
            saturated, de-trending is performed \
            on this aperture instead. Defaults to the mission default
@@ -255,6 +281,13 @@ class Detrender(Basecamp):
         self.cbv_niter = kwargs.get('cbv_niter', 50)
         self.cbv_win = kwargs.get('cbv_win', 999)
         self.cbv_order = kwargs.get('cbv_order', 3)
+        self.precision = kwargs.get('precision', 'double').lower()
+        self.joint_memory = kwargs.get('joint_memory', 4096)
+        assert self.precision in ['double', 'single'], \
+            "Kwarg `precision` must be one of `double` or `single`."
+        self.dvs_mode = kwargs.get('dvs_mode', 'inline').lower()
+        assert self.dvs_mode in ['inline', 'deferred', 'none'], \
+            "Kwarg `dvs_mode` must be one of `inline`, `deferred` or `none`."
 
         # Get the pld order
         pld_order = kwargs.get('pld_order', 3)
@@ -282,9 +315,15 @@ class Detrender(Basecamp):
         self.neighbors = []
         self.loaded = False
         self._weights = None
+        self.dvs_data = {}
 
-        # Initialize plotting
-        self.dvs = DVS(len(self.breakpoints), pld_order=self.pld_order)
+        # Initialize profiling
+        self.profile = None
+        self.profiler = Profiler(
+            file=os.path.join(self.dir, self.name + '.prof'),
+            tags={'ID': self.ID, 'season': self.season,
+                  'model': self.name},
+            enabled=kwargs.get('profile', True))
 
         # Check for saved model
         if self.load_model():
@@ -353,22 +392,19 @@ class Detrender(Basecamp):
             if self.lam_idx >= n:
                 X2 = self.X(n, m2)
                 X1 = self.X(n, m1)
-                A[n] = np.dot(X2, X2.T)
-                B[n] = np.dot(X1, X2.T)
+                A[n] = Gram(X2)
+                B[n] = Gram(X1, X2)
                 del X1, X2
 
         if self.transit_model is None:
             C = 0
         else:
             C = np.zeros((len(m2), len(m2)))
-            mean_transit_model = med * \
-                np.sum([tm.depth * tm(self.time[m2])
-                        for tm in self.transit_model], axis=0)
-            f -= mean_transit_model
             for tm in self.transit_model:
-                X2 = tm(self.time[m2]).reshape(-1, 1)
-                C += tm.var_depth * np.dot(X2, X2.T)
-                del X2
+                # Only the in-transit cadences contribute
+                i2, v2 = tm.support(self.time[m2])
+                f[i2] -= med * tm.depth * v2
+                C[np.ix_(i2, i2)] += tm.var_depth * np.outer(v2, v2)
 
         return A, B, C, mK, f, m1, m2
 
@@ -406,9 +442,9 @@ class Detrender(Basecamp):
         log.info('Iter %d/%d: %d outliers' %
                  (0, self.oiter, len(self.outmask)))
 
-        def M(x): return np.delete(x, np.concatenate(
-            [self.nanmask, self.badmask, self.transitmask]), axis=0)
-        t = M(self.time)
+        # Maps the indices of the masked arrays back onto `self.time`
+        imap = IndexMap(len(self.time), self.get_mask(
+            ['nanmask', 'badmask', 'transitmask']))
         outmask = [np.array([-1]), np.array(self.outmask)]
 
         # Loop as long as the last two outlier arrays aren't equal
@@ -426,18 +462,22 @@ class Detrender(Basecamp):
                           'is going in circles. Skipping...')
                 break
 
-            # Compute the model to get the flux
-            self.compute()
+            with self.profiler.stage('get_outliers.iter',
+                                     order=self.lam_idx,
+                                     iter=len(outmask) - 1):
 
-            # Get the outliers
-            f = SavGol(M(self.flux))
-            med = np.nanmedian(f)
-            MAD = 1.4826 * np.nanmedian(np.abs(f - med))
-            inds = np.where((f > med + self.osigma * MAD) |
-                            (f < med - self.osigma * MAD))[0]
+                # Compute the model to get the flux
+                self.compute()
+
+                # Get the outliers
+                f = SavGol(imap.apply(self.flux))
+                med = np.nanmedian(f)
+                MAD = 1.4826 * np.nanmedian(np.abs(f - med))
+                inds = np.where((f > med + self.osigma * MAD) |
+                                (f < med - self.osigma * MAD))[0]
 
             # Project onto unmasked time array
-            inds = np.array([np.argmax(self.time == t[i]) for i in inds])
+            inds = imap.unmask(inds)
             self.outmask = np.array(inds, dtype=int)
 
             # Add them to the running list
@@ -476,8 +516,12 @@ class Detrender(Basecamp):
                 minr = r
         return min(maxm, minr)
 
-    def fobj(self, y, y0, t, gp, mask):
+    def fobj(self, y, y0, mask, gpm=None):
         '''
+        Returns the scatter in the de-trended flux :py:obj:`y` in the
+        cadences :py:obj:`mask`. For ``cv_min = 'mad'``,
+        :py:obj:`gpm` is the GP prediction at those cadences (see
+        :py:class:`everest.gp.CVPredictor`).
 
         '''
 
@@ -485,7 +529,6 @@ class Detrender(Basecamp):
             # Note that we're computing the MAD, not the
             # standard deviation, as this handles extremely variable
             # stars much better!
-            gpm, _ = gp.predict(y - y0, t[mask])
             fdet = (y[mask] - gpm) / y0
             scatter = 1.e6 * \
                 (1.4826 * np.nanmedian(np.abs(fdet - np.nanmedian(fdet))) /
@@ -495,19 +538,31 @@ class Detrender(Basecamp):
             # We're going to minimize the total variation instead
             return 1.e6 * np.sum(np.abs(np.diff(y[mask]))) / len(mask) / y0
 
-    def cross_validate(self, ax, info=''):
+    def cross_validate(self, ax=None, info=''):
         '''
         Cross-validate to find the optimal value of :py:obj:`lambda`.
+        The cross-validation curves are stored with :py:meth:`dvs_record`
+        so that they can be plotted by :py:meth:`plot_cv`.
 
-        :param ax: The current :py:obj:`matplotlib.pyplot` axis instance to \
-               plot the cross-validation results.
+        :param ax: The :py:obj:`matplotlib.pyplot` axis instance(s) on \
+               which to plot the cross-validation results right away. \
+               Default :py:obj:`None`
         :param str info: The label to show in the bottom right-hand corner \
                of the plot. Default `''`
 
         '''
 
+        # The cross-validation curves, for plotting
+        nseg = len(self.breakpoints)
+        nlam = len(self.lambda_arr)
+        cv = dict(info=info, lam=np.zeros(nseg),
+                  vbest=np.zeros(nseg) * np.nan,
+                  training=np.zeros((nseg, nlam)) * np.nan,
+                  validation=np.zeros((nseg, nlam)) * np.nan,
+                  sections=np.zeros((nseg, nlam, self.cdivs)) * np.nan,
+                  tmin=np.zeros(nseg) * np.nan)
+
         # Loop over all chunks
-        ax = np.atleast_1d(ax)
         for b, brkpt in enumerate(self.breakpoints):
 
             log.info("Cross-validating chunk %d/%d..." %
@@ -538,40 +593,54 @@ class Detrender(Basecamp):
             # The precision in the training set
             training = [[] for k, _ in enumerate(self.lambda_arr)]
 
-            # Setup the GP
-            gp = GP(self.kernel, self.kernel_params, white=False)
-            gp.compute(time, ferr)
-
             # The masks
             masks = list(Chunks(np.arange(0, len(time)),
                                 len(time) // self.cdivs))
 
+            # Setup the GP
+            if self.cv_min == 'mad':
+                gp = CVPredictor(self.kernel, self.kernel_params, time,
+                                 ferr, masks)
+
+            # Pre-compute (training set)
+            pre_t = self.cv_precompute([], b)
+
             # Loop over the different masks
             for i, mask in enumerate(masks):
 
                 log.info("Section %d/%d..." % (i + 1, len(masks)))
 
-                # Pre-compute (training set)
-                pre_t = self.cv_precompute([], b)
-
                 # Pre-compute (validation set)
                 pre_v = self.cv_precompute(mask, b)
 
-                # Iterate over lambda
-                for k, lam in enumerate(self.lambda_arr):
-
-                    # Update the lambda matrix
-                    self.lam[b][self.lam_idx] = lam
-
-                    # Training set
-                    model = self.cv_compute(b, *pre_t)
+                with self.profiler.stage('cross_validate.section',
+                                         order=self.lam_idx, chunk=b,
+                                         section=i,
+                                         lambdas=len(self.lambda_arr)):
+
+                    # Iterate over lambda
+                    models = []
+                    for k, lam in enumerate(self.lambda_arr):
+
+                        # Update the lambda matrix
+                        self.lam[b][self.lam_idx] = lam
+
+                        # Training and validation sets
+                        models.append(self.cv_compute(b, *pre_t))
+                        models.append(self.cv_compute(b, *pre_v))
+
+                    # Predict the GP for all the residuals at once
+                    y = flux.reshape(-1, 1) - np.transpose(models)
+                    if self.cv_min == 'mad':
+                        gpm = gp.predict(y - med, i)
+                    else:
+                        gpm = np.zeros((len(mask), y.shape[1]))
+                for k, _ in enumerate(self.lambda_arr):
                     training[k].append(
-                        self.fobj(flux - model, med, time, gp, mask))
-
-                    # Validation set
-                    model = self.cv_compute(b, *pre_v)
+                        self.fobj(y[:, 2 * k], med, mask, gpm[:, 2 * k]))
                     validation[k].append(
-                        self.fobj(flux - model, med, time, gp, mask))
+                        self.fobj(y[:, 2 * k + 1], med, mask,
+                                  gpm[:, 2 * k + 1]))
 
             # Finalize
             training = np.array(training)
@@ -591,29 +660,81 @@ class Detrender(Basecamp):
             log.info("Found optimum solution at log(lambda) = %.1f." %
                      np.log10(self.lam[b][self.lam_idx]))
 
-            # Plotting: There's not enough space in the DVS to show the
-            # cross-val results for more than three light curve segments.
-            if len(self.breakpoints) <= 3:
+            # Store the curves
+            cv['lam'][b] = self.lam[b][self.lam_idx]
+            cv['vbest'][b] = v_best
+            cv['training'][b] = med_training
+            cv['validation'][b] = med_validation
+            cv['sections'][b, :, :len(masks)] = validation
+            cv['tmin'][b] = np.min(training)
+
+        # Finally, compute the model
+        self.compute()
+
+        # There's not enough space in the DVS to show the cross-val
+        # results for more than three light curve segments, so we just
+        # keep the CDPP in each of them
+        if nseg > 3:
+            cv['cdpp_arr'] = self.get_cdpp_arr()
+            cv['cdppv_arr'] = self.cdppv_arr * cv['cdpp_arr']
+            for key in ['vbest', 'training', 'validation', 'sections',
+                        'tmin']:
+                del cv[key]
+        self.dvs_record('cv', **cv)
+        if ax is not None:
+            self.plot_cv(ax, cv)
+
+    def plot_cv(self, ax, cv):
+        '''
+        Plots the results of one cross-validation step.
+
+        :param ax: The :py:obj:`matplotlib.pyplot` axis instances (one \
+               per light curve segment)
+        :param dict cv: The cross-validation curves stored by \
+               :py:meth:`cross_validate`
+
+        '''
+
+        from matplotlib.ticker import MaxNLocator
+        ax = np.atleast_1d(ax)
+        info = cv['info']
+
+        if len(self.breakpoints) <= 3:
+
+            # Plotting hack: first x tick will be -infty
+            lambda_arr = np.array(self.lambda_arr)
+            lambda_arr[0] = 10 ** (np.log10(lambda_arr[1]) - 3)
+
+            # Fix the x ticks
+            xticks = [np.log10(lambda_arr[0])] + list(np.linspace(
+                np.log10(lambda_arr[1]), np.log10(lambda_arr[-1]), 6))
+            pad = 0.01 * \
+                (np.log10(lambda_arr[-1]) - np.log10(lambda_arr[0]))
 
-                # Plotting hack: first x tick will be -infty
-                lambda_arr = np.array(self.lambda_arr)
-                lambda_arr[0] = 10 ** (np.log10(lambda_arr[1]) - 3)
+            for b, brkpt in enumerate(self.breakpoints):
+
+                # Skip chunks that weren't cross-validated
+                if np.isnan(cv['vbest'][b]):
+                    continue
+                validation = cv['sections'][b]
 
                 # Plot cross-val
-                for n in range(len(masks)):
+                for n in range(validation.shape[1]):
+                    if np.all(np.isnan(validation[:, n])):
+                        continue
                     ax[b].plot(np.log10(lambda_arr),
                                validation[:, n], 'r-', alpha=0.3)
-
                 ax[b].plot(np.log10(lambda_arr),
-                           med_training, 'b-', lw=1., alpha=1)
+                           cv['training'][b], 'b-', lw=1., alpha=1)
                 ax[b].plot(np.log10(lambda_arr),
-                           med_validation, 'r-', lw=1., alpha=1)
-                ax[b].axvline(np.log10(self.lam[b][self.lam_idx]),
+                           cv['validation'][b], 'r-', lw=1., alpha=1)
+                ax[b].axvline(np.log10(cv['lam'][b]),
                               color='k', ls='--', lw=0.75, alpha=0.75)
-                ax[b].axhline(v_best, color='k', ls='--', lw=0.75, alpha=0.75)
+                ax[b].axhline(cv['vbest'][b], color='k', ls='--', lw=0.75,
+                              alpha=0.75)
                 ax[b].set_ylabel(r'Scatter (ppm)', fontsize=5)
-                hi = np.max(validation[0])
-                lo = np.min(training)
+                hi = np.nanmax(validation[0])
+                lo = cv['tmin'][b]
                 rng = (hi - lo)
                 ax[b].set_ylim(lo - 0.15 * rng, hi + 0.15 * rng)
                 if rng > 2:
@@ -626,14 +747,8 @@ class Detrender(Basecamp):
                 else:
                     ax[b].get_yaxis().set_major_formatter(Formatter.CDPP2F)
                     ax[b].get_yaxis().set_major_locator(MaxNLocator(4))
-
-                # Fix the x ticks
-                xticks = [np.log10(lambda_arr[0])] + list(np.linspace(
-                    np.log10(lambda_arr[1]), np.log10(lambda_arr[-1]), 6))
                 ax[b].set_xticks(xticks)
                 ax[b].set_xticklabels(['' for x in xticks])
-                pad = 0.01 * \
-                    (np.log10(lambda_arr[-1]) - np.log10(lambda_arr[0]))
                 ax[b].set_xlim(np.log10(lambda_arr[0]) - pad,
                                np.log10(lambda_arr[-1]) + pad)
                 ax[b].annotate('%s.%d' % (info, b), xy=(0.02, 0.025),
@@ -641,9 +756,6 @@ class Detrender(Basecamp):
                                ha='left', va='bottom', fontsize=7, alpha=0.25,
                                fontweight='bold')
 
-        # Finally, compute the model
-        self.compute()
-
         # Tidy up
         if len(ax) == 2:
             ax[0].xaxis.set_ticks_position('top')
@@ -663,22 +775,18 @@ class Detrender(Basecamp):
 
             # We're just going to plot lambda as a function of chunk number
             bs = np.arange(len(self.breakpoints))
-            ax[0].plot(bs + 1, [np.log10(self.lam[b][self.lam_idx])
-                                for b in bs], 'r.')
-            ax[0].plot(bs + 1, [np.log10(self.lam[b][self.lam_idx])
-                                for b in bs], 'r-', alpha=0.25)
+            ax[0].plot(bs + 1, np.log10(cv['lam']), 'r.')
+            ax[0].plot(bs + 1, np.log10(cv['lam']), 'r-', alpha=0.25)
             ax[0].set_ylabel(r'$\log\Lambda$', fontsize=5)
             ax[0].margins(0.1, 0.1)
             ax[0].set_xticks(np.arange(1, len(self.breakpoints) + 1))
             ax[0].set_xticklabels([])
 
             # Now plot the CDPP and approximate validation CDPP
-            cdpp_arr = self.get_cdpp_arr()
-            cdppv_arr = self.cdppv_arr * cdpp_arr
-            ax[1].plot(bs + 1, cdpp_arr, 'b.')
-            ax[1].plot(bs + 1, cdpp_arr, 'b-', alpha=0.25)
-            ax[1].plot(bs + 1, cdppv_arr, 'r.')
-            ax[1].plot(bs + 1, cdppv_arr, 'r-', alpha=0.25)
+            ax[1].plot(bs + 1, cv['cdpp_arr'], 'b.')
+            ax[1].plot(bs + 1, cv['cdpp_arr'], 'b-', alpha=0.25)
+            ax[1].plot(bs + 1, cv['cdppv_arr'], 'r.')
+            ax[1].plot(bs + 1, cv['cdppv_arr'], 'r-', alpha=0.25)
             ax[1].margins(0.1, 0.1)
             ax[1].set_ylabel(r'Scatter (ppm)', fontsize=5)
             ax[1].set_xlabel(r'Chunk', fontsize=5)
@@ -707,8 +815,7 @@ class Detrender(Basecamp):
 
         '''
 
-        bn = np.array(
-            list(set(np.concatenate([self.badmask, self.nanmask]))), dtype=int)
+        bn = self.get_mask_indices(['badmask', 'nanmask'])
         fraw = np.delete(self.fraw, bn)
         lo, hi = fraw[np.argsort(fraw)][[3, -3]]
         flux = np.delete(self.flux, bn)
@@ -755,7 +862,7 @@ class Detrender(Basecamp):
         ylim = self.get_ylim()
 
         # Plot the outliers, but not the NaNs
-        badmask = [i for i in self.badmask if i not in self.nanmask]
+        badmask = self.get_mask_indices(['badmask'], exclude=['nanmask'])
 
         def O1(x): return x[self.outmask]
 
@@ -771,11 +878,12 @@ class Detrender(Basecamp):
             ax.plot(O2(self.time), O2(self.flux), 'r.',
                     markersize=2, alpha=0.125, zorder=-1)
         for i in np.where(self.flux < ylim[0])[0]:
-            if i in badmask:
+            if self.is_masked(i, ['badmask']) and \
+                    not self.is_masked(i, ['nanmask']):
                 color = "#ffcccc"
-            elif i in self.outmask:
+            elif self.is_masked(i, ['outmask']):
                 color = "#cccccc"
-            elif i in self.nanmask:
+            elif self.is_masked(i, ['nanmask']):
                 continue
             else:
                 color = "#ccccff"
@@ -783,11 +891,12 @@ class Detrender(Basecamp):
                         xytext=(0, 15), textcoords='offset points',
                         arrowprops=dict(arrowstyle="-|>", color=color))
         for i in np.where(self.flux > ylim[1])[0]:
-            if i in badmask:
+            if self.is_masked(i, ['badmask']) and \
+                    not self.is_masked(i, ['nanmask']):
                 color = "#ffcccc"
-            elif i in self.outmask:
+            elif self.is_masked(i, ['outmask']):
                 color = "#cccccc"
-            elif i in self.nanmask:
+            elif self.is_masked(i, ['nanmask']):
                 continue
             else:
                 color = "#ccccff"
@@ -834,6 +943,34 @@ class Detrender(Basecamp):
         ax.set_ylim(*ylim)
         ax.get_yaxis().set_major_formatter(Formatter.Flux)
 
+    def final_gp(self):
+        '''
+        Computes the GP prediction for the final de-trended light curve
+        and the CDPP of the GP-de-trended flux, :py:attr:`cdppg`. This
+        is only done for long cadence light curves; returns the
+        prediction, or :py:obj:`None` in short cadence.
+
+        '''
+
+        if self.cadence == 'lc':
+            gp = GP(self.kernel, self.kernel_params, white=False)
+            gp.compute(self.apply_mask(self.time),
+                       self.apply_mask(self.fraw_err))
+            med = np.nanmedian(self.apply_mask(self.flux))
+            y, _ = gp.predict(self.apply_mask(self.flux) - med, self.time)
+            y += med
+
+            # Compute the CDPP of the GP-detrended flux
+            self.cdppg = self._mission.CDPP(self.apply_mask(
+                self.flux - y + med), cadence=self.cadence)
+            return y
+
+        else:
+
+            # We're not going to calculate this
+            self.cdppg = 0.
+            return None
+
     def plot_final(self, ax):
         '''
         Plots the final de-trended light curve.
@@ -841,8 +978,7 @@ class Detrender(Basecamp):
         '''
 
         # Plot the light curve
-        bnmask = np.array(
-            list(set(np.concatenate([self.badmask, self.nanmask]))), dtype=int)
+        bnmask = self.get_mask_indices(['badmask', 'nanmask'])
 
         def M(x): return np.delete(x, bnmask)
         if (self.cadence == 'lc') or (len(self.time) < 4000):
@@ -859,24 +995,12 @@ class Detrender(Basecamp):
         ax.plot(self.time[-1], np.nanmedian(M(self.flux)), marker='.', alpha=0)
 
         # Plot the GP (long cadence only)
-        if self.cadence == 'lc':
-            gp = GP(self.kernel, self.kernel_params, white=False)
-            gp.compute(self.apply_mask(self.time),
-                       self.apply_mask(self.fraw_err))
-            med = np.nanmedian(self.apply_mask(self.flux))
-            y, _ = gp.predict(self.apply_mask(self.flux) - med, self.time)
-            y += med
+        y = getattr(self, 'dvs_data', {}).get('gp', None)
+        if y is None:
+            y = self.final_gp()
+        if y is not None:
             ax.plot(M(self.time), M(y), 'r-', lw=0.5, alpha=0.5)
 
-            # Compute the CDPP of the GP-detrended flux
-            self.cdppg = self._mission.CDPP(self.apply_mask(
-                self.flux - y + med), cadence=self.cadence)
-
-        else:
-
-            # We're not going to calculate this
-            self.cdppg = 0.
-
         # Appearance
         ax.annotate('Final', xy=(0.98, 0.025), xycoords='axes fraction',
                     ha='right', va='bottom', fontsize=10, alpha=0.5,
@@ -900,8 +1024,7 @@ class Detrender(Basecamp):
         '''
 
         # Plot the light curve
-        bnmask = np.array(
-            list(set(np.concatenate([self.badmask, self.nanmask]))), dtype=int)
+        bnmask = self.get_mask_indices(['badmask', 'nanmask'])
 
         def M(x): return np.delete(x, bnmask)
         if self.cadence == 'lc':
@@ -966,10 +1089,10 @@ class Detrender(Basecamp):
             self.cadn = data.cadn
             self.time = data.time
             self.model = np.zeros_like(self.time)
-            self.fpix = data.fpix
-            self.fraw = np.sum(self.fpix, axis=1)
-            self.fpix_err = data.fpix_err
-            self.fraw_err = np.sqrt(np.sum(self.fpix_err ** 2, axis=1))
+            self.fraw = np.sum(data.fpix, axis=1)
+            self.fraw_err = np.sqrt(np.sum(data.fpix_err ** 2, axis=1))
+            self.fpix = np.asarray(data.fpix, dtype=self.dtype)
+            self.fpix_err = np.asarray(data.fpix_err, dtype=self.dtype)
             self.nanmask = data.nanmask
             self.badmask = data.badmask
             self.transitmask = np.array([], dtype=int)
@@ -1012,12 +1135,12 @@ class Detrender(Basecamp):
             if not self.is_parent:
                 log.info("Loading '%s.npz'..." % name)
             try:
-                data = np.load(file)
-                for key in data.keys():
-                    try:
-                        setattr(self, key, data[key][()])
-                    except NotImplementedError:
-                        pass
+                with LoadModel(file) as data:
+                    for key, value in data.items():
+                        try:
+                            setattr(self, key, value)
+                        except NotImplementedError:
+                            pass
 
                 # HACK: Backwards compatibility. Previous version stored
                 # the CDPP in the `cdpp6`
@@ -1058,32 +1181,118 @@ class Detrender(Basecamp):
     def save_model(self):
         '''
         Saves all of the de-trending information to disk in an `npz` file
-        and saves the DVS as a `pdf`.
+        (see :py:mod:`everest.modelstore`).
 
         '''
 
         # Save the data
         log.info("Saving data to '%s.npz'..." % self.name)
-        d = dict(self.__dict__)
-        d.pop('_weights', None)
-        d.pop('_A', None)
-        d.pop('_B', None)
-        d.pop('_f', None)
-        d.pop('_mK', None)
-        d.pop('K', None)
-        d.pop('dvs', None)
-        d.pop('clobber', None)
-        d.pop('clobber_tpf', None)
-        d.pop('_mission', None)
-        d.pop('debug', None)
-        d.pop('transit_model', None)
-        d.pop('_transit_model', None)
-        np.savez(os.path.join(self.dir, self.name + '.npz'), **d)
+        self.profile = self.profiler.summary()
+        SaveModel(os.path.join(self.dir, self.name + '.npz'), self)
+
+    def dvs_record(self, panel, **kwargs):
+        '''
+        Stores the data needed to draw one :py:obj:`panel` (`lc` or `cv`)
+        of the DVS figure in the :py:attr:`dvs_data` dictionary, which
+        is saved along with the model. Panels of the same kind are
+        numbered in the order in which they are recorded. Does nothing
+        if :py:attr:`dvs_mode` is `none`.
+
+        '''
+
+        if self.dvs_mode == 'none':
+            return
+        n = self.dvs_data.get('n' + panel, 0)
+        for key, value in kwargs.items():
+            self.dvs_data['%s%d_%s' % (panel, n, key)] = value
+        self.dvs_data['n' + panel] = n + 1
+
+    def dvs_records(self, panel):
+        '''
+        Returns a list of the data dictionaries of all the recorded DVS
+        panels of kind :py:obj:`panel`.
+
+        '''
+
+        res = []
+        for n in range(self.dvs_data.get('n' + panel, 0)):
+            prefix = '%s%d_' % (panel, n)
+            res.append(dict([(key[len(prefix):], value)
+                             for key, value in self.dvs_data.items()
+                             if key.startswith(prefix)]))
+        return res
+
+    def record_lc(self, info_left='', info_right='', color='b'):
+        '''
+        Records a snapshot of the current light curve (the model, the
+        outliers and the CDPP) for :py:meth:`plot_lc`.
+
+        '''
+
+        self.dvs_record('lc', model=np.asarray(self.model, dtype='float32'),
+                        outmask=np.asarray(self.outmask, dtype='int32'),
+                        cdpp_arr=np.array(self.cdpp_arr), cdpp=self.cdpp,
+                        info=[info_left, info_right, color])
+
+    def record_gp(self):
+        '''
+        Computes the GP prediction for the final light curve with
+        :py:meth:`final_gp` and records it for :py:meth:`plot_final`.
+
+        '''
+
+        y = self.final_gp()
+        if (y is not None) and (self.dvs_mode != 'none'):
+            self.dvs_data['gp'] = np.asarray(y, dtype='float32')
+
+    def plot_dvs(self, rasterized=False):
+        '''
+        Draws the data validation summary (DVS) figure from the data
+        recorded during the de-trending and saves it as a `pdf`.
+
+        :param bool rasterized: Rasterize the light curve scatter plots? \
+               This considerably reduces the rendering time and the size \
+               of the `pdf`. Default :py:obj:`False`
+
+        '''
+
+        lcs = self.dvs_records('lc')
+        if len(lcs) == 0:
+            raise Exception("No DVS data found for the `%s` model." %
+                            self.name)
+        log.info("Plotting the DVS...")
+        dvs = DVS(len(self.breakpoints), pld_order=self.pld_order)
+        self.plot_aperture([dvs.top_right() for i in range(4)])
+
+        # Plot each of the light curve snapshots
+        model, outmask = self.model, self.outmask
+        cdpp_arr, cdpp = self.cdpp_arr, self.cdpp
+        try:
+            for lc in lcs:
+                self.model = lc['model']
+                self.outmask = lc['outmask']
+                self.cdpp_arr = lc['cdpp_arr']
+                self.cdpp = lc['cdpp']
+                info_left, info_right, color = lc['info']
+                self.plot_lc(dvs.left(), info_left=info_left,
+                             info_right=info_right, color=color)
+        finally:
+            self.model, self.outmask = model, outmask
+            self.cdpp_arr, self.cdpp = cdpp_arr, cdpp
+
+        # Plot the cross-validation results
+        for cv in self.dvs_records('cv'):
+            self.plot_cv(dvs.right(), cv)
+        self.plot_final(dvs.top_left())
+        self.plot_info(dvs)
+        if rasterized:
+            Rasterize(dvs.fig)
 
         # Save the DVS
+        from matplotlib.backends.backend_pdf import PdfPages
         pdf = PdfPages(os.path.join(self.dir, self.name + '.pdf'))
-        pdf.savefig(self.dvs.fig)
-        pl.close(self.dvs.fig)
+        pdf.savefig(dvs.fig, dpi=300 if rasterized else None)
+        pl.close(dvs.fig)
         d = pdf.infodict()
         d['Title'] = 'EVEREST: %s de-trending of %s %d' % (
             self.name, self._mission.IDSTRING, self.ID)
@@ -1164,8 +1373,8 @@ class Detrender(Basecamp):
             t0 += np.ceil((self.time[0] - dur - t0) / period) * period
             for t in np.arange(t0, self.time[-1] + dur, period):
                 mask.extend(np.where(np.abs(self.time - t) < dur / 2.)[0])
-            self.transitmask = np.array(
-                list(set(np.concatenate([self.transitmask, mask]))))
+            self.set_mask('transitmask',
+                          np.concatenate([self.transitmask, mask]))
 
     def run(self):
         '''
@@ -1175,12 +1384,18 @@ class Detrender(Basecamp):
 
         try:
 
+            # Start from a clean profile
+            self.profiler.reset()
+            P = self.profiler.stage
+            self.dvs_data = {}
+
             # Load raw data
             log.info("Loading target data...")
-            self.load_tpf()
-            self.mask_planets()
-            self.plot_aperture([self.dvs.top_right() for i in range(4)])
-            self.init_kernel()
+            with P('load_tpf'):
+                self.load_tpf()
+                self.mask_planets()
+            with P('init_kernel'):
+                self.init_kernel()
             M = self.apply_mask(np.arange(len(self.time)))
             self.cdppr_arr = self.get_cdpp_arr()
             self.cdpp_arr = np.array(self.cdppr_arr)
@@ -1190,125 +1405,219 @@ class Detrender(Basecamp):
             self.cdppv = self.cdppr
 
             log.info("%s (Raw): CDPP = %s" % (self.name, self.cdpps))
-            self.plot_lc(self.dvs.left(), info_right='Raw', color='k')
+            self.record_lc(info_right='Raw', color='k')
 
             # Loop
             for n in range(self.pld_order):
                 self.lam_idx += 1
-                self.get_outliers()
+                with P('get_outliers', order=n):
+                    self.get_outliers()
                 if n > 0 and self.optimize_gp:
-                    self.update_gp()
-                self.cross_validate(self.dvs.right(), info='CV%d' % n)
+                    with P('update_gp', order=n):
+                        self.update_gp()
+                with P('cross_validate', order=n):
+                    self.cross_validate(info='CV%d' % n)
                 self.cdpp_arr = self.get_cdpp_arr()
                 self.cdppv_arr *= self.cdpp_arr
                 self.cdpp = self.get_cdpp()
                 self.cdppv = np.nanmean(self.cdppv_arr)
                 log.info("%s (%d/%d): CDPP = %s" %
                          (self.name, n + 1, self.pld_order, self.cdpps))
-                self.plot_lc(self.dvs.left(), info_right='LC%d' % (
-                    n + 1), info_left='%d outliers' % len(self.outmask))
+                self.record_lc(info_right='LC%d' % (n + 1),
+                               info_left='%d outliers' % len(self.outmask))
 
             # Save
-            self.finalize()
-            self.plot_final(self.dvs.top_left())
-            self.plot_info(self.dvs)
-            self.save_model()
+            with P('finalize'):
+                self.finalize()
+            with P('final_gp'):
+                self.record_gp()
+            if self.dvs_mode == 'inline':
+                with P('plot'):
+                    self.plot_dvs()
+            with P('save_model'):
+                self.save_model()
+            self.profile = self.profiler.summary(previous=self.profile)
 
         except:
 
             self.exception_handler(self.debug)
 
-    def publish(self, **kwargs):
+    def publish(self, dvs=None, update=False, **kwargs):
         '''
         Correct the light curve with the CBVs, generate a
         cover page for the DVS figure,
         and produce a FITS file for publication.
 
+        :param bool dvs: Produce the publication DVS `pdf`? If \
+               :py:obj:`False`, only the *FITS* file is written and the \
+               DVS can be rendered later with :py:meth:`publish_dvs`. \
+               Default is :py:obj:`True` if :py:attr:`dvs_mode` is \
+               `inline`
+        :param bool update: If the *FITS* file already exists, only \
+               update its CBV-corrected light curve in place (see \
+               :py:func:`everest.fits.UpdateFITS`)? Use this to \
+               republish a campaign after recomputing its CBVs. \
+               Default :py:obj:`False`
+
         '''
 
+        if dvs is None:
+            dvs = (self.dvs_mode == 'inline')
+
         try:
 
-            # HACK: Force these params for publication
-            self.cbv_win = 999
-            self.cbv_order = 3
-            self.cbv_num = 1
+            # Profile the publication stages separately
+            self.profiler.reset(truncate=False)
+            P = self.profiler.stage
 
-            # Get the CBVs
-            self._mission.GetTargetCBVs(self)
-
-            # Plot the final corrected light curve
-            cbv = CBV()
-            self.plot_info(cbv)
-            self.plot_cbv(cbv.body(), self.fcor, 'Corrected')
-            self.plot_cbv(cbv.body(), self.flux, 'De-trended', show_cbv=True)
-            self.plot_cbv(cbv.body(), self.fraw, 'Raw')
-
-            # Save the CBV pdf
-            pdf = PdfPages(os.path.join(self.dir, 'cbv.pdf'))
-            pdf.savefig(cbv.fig)
-            pl.close(cbv.fig)
-            d = pdf.infodict()
-            d['Title'] = 'EVEREST: %s de-trending of %s %d' % (
-                self.name, self._mission.IDSTRING, self.ID)
-            d['Author'] = 'Rodrigo Luger'
-            pdf.close()
-
-            # Now merge the two PDFs
-            assert os.path.exists(os.path.join(
-                self.dir, self.name + '.pdf')), \
-                "Unable to locate %s.pdf." % self.name
-            output = PdfFileWriter()
-            pdfOne = PdfFileReader(os.path.join(self.dir, 'cbv.pdf'))
-            pdfTwo = PdfFileReader(os.path.join(self.dir, self.name + '.pdf'))
-            # Add the CBV page
-            output.addPage(pdfOne.getPage(0))
-            # Add the original DVS page
-            output.addPage(pdfTwo.getPage(pdfTwo.numPages - 1))
-            # Write the final PDF
-            outputStream = open(os.path.join(self.dir, self._mission.DVSFile(
-                self.ID, self.season, self.cadence)), "wb")
-            output.write(outputStream)
-            outputStream.close()
-            os.remove(os.path.join(self.dir, 'cbv.pdf'))
+            with P('publish'):
+
+                # Get the CBVs
+                self.cbv_correct()
+
+                # Plot the final corrected light curve
+                if dvs:
+                    self.publish_dvs()
 
             # Make the FITS file
-            MakeFITS(self)
+            self.profile = self.profiler.summary(previous=self.profile)
+            with P('publish.fits'):
+                if update:
+                    UpdateFITS(self)
+                else:
+                    MakeFITS(self)
 
         except:
 
             self.exception_handler(self.debug)
 
-    def publish_csv(self, **kwargs):
+    def cbv_correct(self):
+        '''
+        Corrects the de-trended light curve with the campaign CBVs
+        using the publication settings.
+
+        '''
+
+        # HACK: Force these params for publication
+        self.cbv_win = 999
+        self.cbv_order = 3
+        self.cbv_num = 1
+
+        # Get the CBVs
+        self._mission.GetTargetCBVs(self)
+
+    def publish_dvs(self, rasterized=False):
+        '''
+        Plots the CBV-corrected light curve on a cover page and merges
+        it with the DVS figure into the publication `pdf`. The DVS is
+        rendered first if it has not been saved yet. Call
+        :py:meth:`cbv_correct` beforehand.
+
+        :param bool rasterized: Rasterize the light curve scatter plots? \
+               Default :py:obj:`False`
+
         '''
 
+        # Plot the final corrected light curve
+        cbv = CBV()
+        self.plot_info(cbv)
+        self.plot_cbv(cbv.body(), self.fcor, 'Corrected')
+        self.plot_cbv(cbv.body(), self.flux, 'De-trended',
+                      show_cbv=True)
+        self.plot_cbv(cbv.body(), self.fraw, 'Raw')
+        if rasterized:
+            Rasterize(cbv.fig)
+
+        # Save the CBV pdf
+        from matplotlib.backends.backend_pdf import PdfPages
+        pdf = PdfPages(os.path.join(self.dir, 'cbv.pdf'))
+        pdf.savefig(cbv.fig, dpi=300 if rasterized else None)
+        pl.close(cbv.fig)
+        d = pdf.infodict()
+        d['Title'] = 'EVEREST: %s de-trending of %s %d' % (
+            self.name, self._mission.IDSTRING, self.ID)
+        d['Author'] = 'Rodrigo Luger'
+        pdf.close()
+
+        # Render the DVS if we haven't yet
+        if not os.path.exists(os.path.join(self.dir, self.name + '.pdf')):
+            self.plot_dvs(rasterized=rasterized)
+
+        # Now merge the two PDFs
+        from PyPDF2 import PdfFileReader, PdfFileWriter
+        output = PdfFileWriter()
+        pdfOne = PdfFileReader(os.path.join(self.dir, 'cbv.pdf'))
+        pdfTwo = PdfFileReader(os.path.join(self.dir,
+                                            self.name + '.pdf'))
+        # Add the CBV page
+        output.addPage(pdfOne.getPage(0))
+        # Add the original DVS page
+        output.addPage(pdfTwo.getPage(pdfTwo.numPages - 1))
+        # Write the final PDF
+        outputStream = open(os.path.join(
+            self.dir, self._mission.DVSFile(
+                self.ID, self.season, self.cadence)), "wb")
+        output.write(outputStream)
+        outputStream.close()
+        os.remove(os.path.join(self.dir, 'cbv.pdf'))
+
+    def render(self, publish=False, rasterized=True):
+        '''
+        Renders the figures of a model that was de-trended with
+        :py:attr:`dvs_mode` set to `deferred`: the DVS `pdf` and, if
+        :py:obj:`publish` is :py:obj:`True`, the publication DVS.
+        This is meant to be run as a separate (parallel) batch stage,
+        with a non-interactive `matplotlib` backend.
+
+        :param bool publish: Render the publication DVS (CBV cover page \
+               and DVS)? Default :py:obj:`False`
+        :param bool rasterized: Rasterize the light curve scatter plots? \
+               Default :py:obj:`True`
 
         '''
 
         try:
 
-            # HACK: Force these params for publication
-            self.cbv_win = 999
-            self.cbv_order = 3
-            self.cbv_num = 1
+            # Profile the rendering stage separately
+            self.profiler.reset(truncate=False)
+            with self.profiler.stage('render', publish=publish):
+                if publish:
+                    self.cbv_correct()
+                    self.publish_dvs(rasterized=rasterized)
+                else:
+                    self.plot_dvs(rasterized=rasterized)
+
+        except:
+
+            self.exception_handler(self.debug)
+
+    def publish_csv(self, **kwargs):
+        '''
+
+
+        '''
+
+        try:
 
             # Get the CBVs
-            self._mission.GetTargetCBVs(self)
+            self.cbv_correct()
 
             # Write to file!
             outfile = os.path.join(self.dir, self._mission.CSVFile(self.ID))
             header = self._mission.CSVHEADER % self.ID
-            mask = np.zeros_like(self.cadn)
-            for i in range(len(mask)):
-                if i in self.nanmask:
-                    mask[i] = 1
-                elif i in self.badmask:
-                    mask[i] = 2
-                elif i in self.outmask:
-                    mask[i] = 3
-            data = np.vstack([self.time, self.cadn, self.fcor,
+            mask = np.zeros(len(self.cadn), dtype=int)
+            mask[self.get_mask(['outmask'])] = 3
+            mask[self.get_mask(['badmask'])] = 2
+            mask[self.get_mask(['nanmask'])] = 1
+
+            # Format all the rows at once; this is much faster
+            # than :py:func:`np.savetxt`, which formats row by row
+            data = np.vstack([self.time, self.cadn, np.reshape(self.fcor, -1),
                               self.flux, self.fraw, mask]).T
-            np.savetxt(outfile, data,
-                       fmt='%.6f,%d,%.6f,%.6f,%.6f,%d', header=header)
+            with open(outfile, 'w') as f:
+                f.write('# ' + header.replace('\n', '\n# ') + '\n')
+                f.write(('%.6f,%d,%.6f,%.6f,%.6f,%d\n' * len(data)) %
+                        tuple(data.ravel()))
 
         except:
 
@@ -1368,6 +1677,20 @@ class nPLD(Detrender):
                are associated with events such as thruster firings and are \
                present in all light curves, and therefore *help* in the \
                de-trending. Default `None`
+        :param str neighbor_mode: How the neighboring stars enter the \
+               design matrix. If `stars`, the normalized pixel fluxes of \
+               :py:obj:`neighbors` individual stars are used. If `basis`, \
+               the :py:obj:`basis_rank` dominant components of the \
+               normalized pixel fluxes of the bright stars on the \
+               target's module are used instead; these are computed once \
+               per campaign and module (see the mission's \
+               :py:func:`GetNeighborBasis`) and memory-mapped, so no \
+               neighbor data is loaded per target. The stars are split \
+               in two folds by ID parity, and each target uses the basis \
+               of the fold it is not in, so that its own signal is never \
+               regressed out. Default `stars`
+        :param int basis_rank: The number of neighbor basis vectors when \
+               :py:obj:`neighbor_mode` is `basis`. Default 20
 
         ..note :: Optionally, the :py:obj:`neighbors` may be specified \
                   directly as a list of target IDs to use. \
@@ -1377,8 +1700,25 @@ class nPLD(Detrender):
                   :py:obj:`neighbors_data` kwarg.
         '''
 
-        # Get neighbors
+        # Use the campaign-wide neighbor basis?
         self.parent_model = kwargs.get('parent_model', None)
+        neighbor_mode = kwargs.get('neighbor_mode', 'stars')
+        assert neighbor_mode in ['stars', 'basis'], \
+            "Invalid value for the `neighbor_mode` setting."
+        if neighbor_mode == 'basis':
+            log.info("Loading the neighbor basis...")
+            self.X1N = np.asarray(self._mission.GetNeighborBasis(
+                self.ID, season=self.season, cadence=self.cadence,
+                rank=kwargs.get('basis_rank', 20),
+                mag_range=kwargs.get('mag_range', (11., 13.)),
+                aperture_name=self.aperture_name,
+                saturated_aperture_name=self.saturated_aperture_name,
+                max_pixels=self.max_pixels,
+                saturation_tolerance=self.saturation_tolerance),
+                dtype=self.dtype)
+            return
+
+        # Get neighbors
         neighbors = kwargs.get('neighbors', 10)
         neighbors_data = kwargs.get('neighbors_data', None)
         if hasattr(neighbors, '__len__'):
@@ -1451,9 +1791,10 @@ class nPLD(Detrender):
             X1 = data.fpix / data.fraw.reshape(-1, 1)
             X1 = Interpolate(data.time, data.mask, X1)
             if self.X1N is None:
-                self.X1N = np.array(X1)
+                self.X1N = np.array(X1, dtype=self.dtype)
             else:
-                self.X1N = np.hstack([self.X1N, X1])
+                self.X1N = np.hstack([self.X1N,
+                                      np.asarray(X1, dtype=self.dtype)])
             del X1
             del data
 
@@ -1508,7 +1849,10 @@ class iPLD(Detrender):
 class pPLD(Detrender):
     '''
     A neighboring PLD extension that uses Powell's method to find the
-    cross-validation parameter :py:obj:`lambda`.
+    cross-validation parameter :py:obj:`lambda`. Alternatively, set
+    :py:obj:`poptimizer` to `lbfgs` to minimize a smooth version of the
+    validation scatter with analytic gradients (see
+    :py:meth:`smooth_validation_scatter`).
 
     '''
 
@@ -1523,6 +1867,11 @@ class pPLD(Detrender):
                iteration. Default 300
         :param float ppert: The fractional amplitude of the perturbation on \
                the initial guess. Default 0.1
+        :param str poptimizer: The minimizer, `powell` or `lbfgs`. The \
+               `lbfgs` minimizer runs the :py:obj:`piter` perturbed \
+               initial guesses in parallel threads. Default `powell`
+        :param tuple pbounds: The bounds on :math:`\\log\\Lambda` for the \
+               `lbfgs` minimizer. Default `(0, 18)`
 
         '''
 
@@ -1537,6 +1886,10 @@ class pPLD(Detrender):
         self.piter = kwargs.get('piter', 3)
         self.pmaxf = kwargs.get('pmaxf', 300)
         self.ppert = kwargs.get('ppert', 0.1)
+        self.poptimizer = kwargs.get('poptimizer', 'powell').lower()
+        assert self.poptimizer in ['powell', 'lbfgs'], \
+            "Kwarg `poptimizer` must be one of `powell` or `lbfgs`."
+        self.pbounds = kwargs.get('pbounds', (0., 18.))
 
     def run(self):
         '''
@@ -1546,32 +1899,46 @@ class pPLD(Detrender):
 
         try:
 
-            # Plot original
-            self.plot_aperture([self.dvs.top_right() for i in range(4)])
-            self.plot_lc(self.dvs.left(), info_right='nPLD', color='k')
+            # Start from a clean profile
+            self.profiler.reset()
+            P = self.profiler.stage
+
+            # Record original
+            self.dvs_data = {}
+            self.record_lc(info_right='nPLD', color='k')
 
             # Cross-validate
-            self.cross_validate(self.dvs.right())
-            self.compute()
+            with P('cross_validate'):
+                self.cross_validate()
+            with P('compute'):
+                self.compute()
             self.cdpp_arr = self.get_cdpp_arr()
             self.cdpp = self.get_cdpp()
 
-            # Plot new
-            self.plot_lc(self.dvs.left(), info_right='Powell', color='k')
+            # Record new
+            self.record_lc(info_right='Powell', color='k')
+            with P('final_gp'):
+                self.record_gp()
+            if self.dvs_mode == 'inline':
+                with P('plot'):
+                    self.plot_dvs()
 
             # Save
-            self.plot_final(self.dvs.top_left())
-            self.plot_info(self.dvs)
-            self.save_model()
+            with P('save_model'):
+                self.save_model()
+            self.profile = self.profiler.summary(previous=self.profile)
 
         except:
 
             self.exception_handler(self.debug)
 
-    def cross_validate(self, ax):
+    def cross_validate(self, ax=None):
         '''
         Performs the cross-validation step.
 
+        :param ax: The :py:obj:`matplotlib.pyplot` axis instances on \
+               which to plot the results right away. Default :py:obj:`None`
+
         '''
 
         # The CDPP to beat
@@ -1592,60 +1959,73 @@ class pPLD(Detrender):
             ferr = self.fraw_err[m]
             med = np.nanmedian(self.fraw)
 
-            # Setup the GP
-            gp = GP(self.kernel, self.kernel_params, white=False)
-            gp.compute(time, ferr)
-
             # The masks
             masks = list(Chunks(np.arange(0, len(time)),
                                 len(time) // self.cdivs))
 
+            # Setup the GP
+            gp = CVPredictor(self.kernel, self.kernel_params, time, ferr,
+                             masks)
+
             # The pre-computed matrices
             pre_v = [self.cv_precompute(mask, b) for mask in masks]
 
             # Initialize with the nPLD solution
             log_lam_opt = np.log10(self.lam[b])
             scatter_opt = self.validation_scatter(
-                log_lam_opt, b, masks, pre_v, gp, flux, time, med)
+                log_lam_opt, b, masks, pre_v, gp, flux, med)
             log.info("Iter 0/%d: " % (self.piter) +
                      "logL = (%s), s = %.3f" %
                      (", ".join(["%.3f" % l for l in log_lam_opt]),
                       scatter_opt))
 
-            # Do `piter` iterations
-            for p in range(self.piter):
-
-                # Perturb the initial condition a bit
-                log_lam = np.array(
-                    np.log10(self.lam[b])) * \
-                    (1 + self.ppert * np.random.randn(len(self.lam[b])))
-                scatter = self.validation_scatter(
-                    log_lam, b, masks, pre_v, gp, flux, time, med)
-                log.info("Initializing at: " +
-                         "logL = (%s), s = %.3f" %
-                         (", ".join(["%.3f" % l for l in log_lam]), scatter))
-
-                # Call the minimizer
-                log_lam, scatter, _, _, _, _ = \
-                    fmin_powell(self.validation_scatter, log_lam,
-                                args=(b, masks, pre_v, gp, flux, time, med),
-                                maxfun=self.pmaxf, disp=False,
-                                full_output=True)
-
-                # Did it improve the CDPP?
-                tmp = np.array(self.lam[b])
-                self.lam[b] = 10 ** log_lam
-                self.compute()
-                cdpp = self.get_cdpp_arr()[b]
-                self.lam[b] = tmp
-                if cdpp < cdpp_opt[b]:
-                    cdpp_opt[b] = cdpp
-                    log_lam_opt = log_lam
+            # Use the gradient-based minimizer?
+            if self.poptimizer == 'lbfgs':
+                with self.profiler.stage('cross_validate.lbfgs', chunk=b):
+                    log_lam_opt, scatter_opt = self.lbfgs_minimize(
+                        b, masks, pre_v, gp, flux, med, log_lam_opt,
+                        scatter_opt)
 
-                # Log it
-                log.info("Iter %d/%d: " % (p + 1, self.piter) +
-                         "logL = (%s), s = %.3f" %
-                         (", ".join(["%.3f" % l for l in log_lam]), scatter))
+            # Do `piter` iterations
+            else:
+                for p in range(self.piter):
+
+                    # Perturb the initial condition a bit
+                    log_lam = np.array(
+                        np.log10(self.lam[b])) * \
+                        (1 + self.ppert * np.random.randn(len(self.lam[b])))
+                    scatter = self.validation_scatter(
+                        log_lam, b, masks, pre_v, gp, flux, med)
+                    log.info("Initializing at: " +
+                             "logL = (%s), s = %.3f" %
+                             (", ".join(["%.3f" % l for l in log_lam]),
+                              scatter))
+
+                    # Call the minimizer
+                    with self.profiler.stage('cross_validate.powell',
+                                             chunk=b, iter=p):
+                        log_lam, scatter, _, _, _, _ = \
+                            fmin_powell(self.validation_scatter, log_lam,
+                                        args=(b, masks, pre_v, gp, flux,
+                                              med),
+                                        maxfun=self.pmaxf, disp=False,
+                                        full_output=True)
+
+                    # Did it improve the CDPP?
+                    tmp = np.array(self.lam[b])
+                    self.lam[b] = 10 ** log_lam
+                    self.compute()
+                    cdpp = self.get_cdpp_arr()[b]
+                    self.lam[b] = tmp
+                    if cdpp < cdpp_opt[b]:
+                        cdpp_opt[b] = cdpp
+                        log_lam_opt = log_lam
+
+                    # Log it
+                    log.info("Iter %d/%d: " % (p + 1, self.piter) +
+                             "logL = (%s), s = %.3f" %
+                             (", ".join(["%.3f" % l for l in log_lam]),
+                              scatter))
 
             # The best solution
             log.info("Found minimum: logL = (%s), s = %.3f" %
@@ -1653,21 +2033,38 @@ class pPLD(Detrender):
                       scatter_opt))
             self.lam[b] = 10 ** log_lam_opt
 
+        # Store the results
+        cv = dict(lam=np.array(self.lam, dtype=float),
+                  cdpp_arr=self.get_cdpp_arr())
+        self.dvs_record('cv', **cv)
+        if ax is not None:
+            self.plot_cv(ax, cv)
+
+    def plot_cv(self, ax, cv):
+        '''
+        Plots the optimized values of :py:obj:`lambda` and the CDPP
+        as a function of the chunk number.
+
+        :param ax: The :py:obj:`matplotlib.pyplot` axis instances
+        :param dict cv: The results stored by :py:meth:`cross_validate`
+
+        '''
+
         # We're just going to plot lambda as a function of chunk number
         bs = np.arange(len(self.breakpoints))
         color = ['k', 'b', 'r', 'g', 'y']
         for n in range(self.pld_order):
-            ax[0].plot(bs + 1, [np.log10(self.lam[b][n])
-                                for b in bs], '.', color=color[n])
-            ax[0].plot(bs + 1, [np.log10(self.lam[b][n])
-                                for b in bs], '-', color=color[n], alpha=0.25)
+            ax[0].plot(bs + 1, np.log10(cv['lam'][:, n]), '.',
+                       color=color[n])
+            ax[0].plot(bs + 1, np.log10(cv['lam'][:, n]), '-',
+                       color=color[n], alpha=0.25)
         ax[0].set_ylabel(r'$\log\Lambda$', fontsize=5)
         ax[0].margins(0.1, 0.1)
         ax[0].set_xticks(np.arange(1, len(self.breakpoints) + 1))
         ax[0].set_xticklabels([])
 
         # Now plot the CDPP
-        cdpp_arr = self.get_cdpp_arr()
+        cdpp_arr = cv['cdpp_arr']
         ax[1].plot(bs + 1, cdpp_arr, 'b.')
         ax[1].plot(bs + 1, cdpp_arr, 'b-', alpha=0.25)
         ax[1].margins(0.1, 0.1)
@@ -1675,8 +2072,112 @@ class pPLD(Detrender):
         ax[1].set_xlabel(r'Chunk', fontsize=5)
         ax[1].set_xticks(np.arange(1, len(self.breakpoints) + 1))
 
-    def validation_scatter(self, log_lam, b, masks, pre_v, gp, flux,
-                           time, med):
+    def lbfgs_minimize(self, b, masks, pre_v, gp, flux, med, log_lam_opt,
+                       scatter_opt):
+        '''
+        Minimizes :py:meth:`smooth_validation_scatter` for chunk
+        :py:obj:`b` with L-BFGS, starting from the current solution and
+        from :py:obj:`piter` perturbed guesses, all in parallel.
+        The best solution is kept if it lowers the
+        :py:meth:`validation_scatter`. Returns the (possibly unchanged)
+        optimal :math:`\\log\\Lambda` and validation scatter.
+
+        '''
+
+        args = (b, masks, pre_v, gp, flux, med)
+
+        # The initial guesses
+        bounds = [self.pbounds for l in self.lam[b]]
+        guesses = [np.array(log_lam_opt)] + \
+            [np.log10(self.lam[b]) *
+             (1 + self.ppert * np.random.randn(len(self.lam[b])))
+             for p in range(self.piter)]
+        guesses = [np.clip(g, *self.pbounds) for g in guesses]
+
+        def Minimize(x0):
+            '''
+
+            '''
+
+            x, s, info = fmin_l_bfgs_b(self.smooth_validation_scatter, x0,
+                                       args=args, bounds=bounds,
+                                       maxfun=self.pmaxf)
+            return x, s, info['funcalls']
+
+        pool = ThreadPool(len(guesses))
+        try:
+            results = pool.map(Minimize, guesses)
+        finally:
+            pool.close()
+            pool.join()
+        for p, (x, s, n) in enumerate(results):
+            log.info("Iter %d/%d: " % (p, self.piter) +
+                     "logL = (%s), s = %.5f, %d evaluations" %
+                     (", ".join(["%.3f" % l for l in x]), s, n))
+
+        # Did it improve the validation scatter?
+        log_lam = results[np.argmin([r[1] for r in results])][0]
+        tmp = np.array(self.lam[b])
+        scatter = self.validation_scatter(log_lam, b, masks, pre_v, gp,
+                                          flux, med)
+        self.lam[b] = tmp
+        if scatter < scatter_opt:
+            return log_lam, scatter
+        else:
+            return log_lam_opt, scatter_opt
+
+    def smooth_validation_scatter(self, log_lam, b, masks, pre_v, gp,
+                                  flux, med):
+        '''
+        A smooth version of :py:meth:`validation_scatter`: the log of
+        the mean variance of the GP-detrended validation residuals.
+        Returns the objective and its gradient with respect to
+        :math:`\\log\\Lambda`. The gradient comes from the same
+        Cholesky factorization of :math:`K + \\sum_n \\Lambda_n X_n X_n^T`
+        as the objective, at the cost of one extra solve per *PLD* order.
+        Unlike :py:meth:`validation_scatter`, this does not modify
+        :py:attr:`lam`, so it is safe to call from several threads.
+
+        :param gp: The :py:class:`everest.gp.CVPredictor` for the chunk
+
+        '''
+
+        lam = 10 ** np.array(log_lam, dtype=float)
+        S = 0.
+        dS = np.zeros_like(lam)
+        for i, mask in enumerate(masks):
+            A, B, C, mK, f, m1, m2 = pre_v[i]
+            orders = [n for n in range(len(lam)) if A[n] is not None]
+
+            # The model
+            try:
+                L = cho_factor(mK + C + np.sum([lam[n] * A[n]
+                                                for n in orders], axis=0))
+            except (LinAlgError, ValueError):
+                return 1.e30, np.zeros_like(lam)
+            W = cho_solve(L, f)
+            BW = np.transpose([np.dot(B[n], W) for n in orders])
+            model = np.dot(BW, lam[orders])
+
+            # Its derivatives with respect to log lambda
+            Z = cho_solve(L, np.transpose([np.dot(A[n], W) for n in orders]))
+            BZ = np.sum([lam[n] * np.dot(B[n], Z) for n in orders], axis=0)
+            dmodel = np.log(10.) * lam[orders] * (BW - BZ)
+
+            # The validation residuals after subtracting the GP prediction,
+            # and their derivatives
+            R = np.hstack([(flux - model - med).reshape(-1, 1), -dmodel])
+            D = R[mask] - gp.predict(R, i)
+            if not np.all(np.isfinite(D)):
+                return 1.e30, np.zeros_like(lam)
+            d = D[:, 0] - np.mean(D[:, 0])
+            S += np.mean(d ** 2) / len(masks)
+            dS[orders] += 2 * np.mean(d.reshape(-1, 1) * D[:, 1:],
+                                      axis=0) / len(masks)
+
+        return np.log(S), dS / S
+
+    def validation_scatter(self, log_lam, b, masks, pre_v, gp, flux, med):
         '''
         Computes the scatter in the validation set.
 
@@ -1690,7 +2191,7 @@ class pPLD(Detrender):
         for i in range(len(masks)):
             model = self.cv_compute(b, *pre_v[i])
             try:
-                gpm, _ = gp.predict(flux - model - med, time[masks[i]])
+                gpm = gp.predict(flux - model - med, i)
             except ValueError:
                 # Sometimes the model can have NaNs if
                 # `lambda` is a crazy value
@@ -0,0 +1,393 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`download.py` - Download manager
+----------------------------------------
+
+An :py:mod:`asyncio` download manager for the MAST products (target
+pixel files, published light curves, etc.). Files are fetched
+concurrently by a bounded pool of workers, each of which keeps its
+`HTTP` connections alive between requests. Failed requests are retried
+with exponential backoff, interrupted downloads are resumed from the
+partial file, and completed downloads are validated against their
+expected size (and, optionally, checksum) before being atomically
+renamed into place, so that the cache never contains partial files.
+
+.. code-block:: python
+
+    from everest.download import Request, FetchAll
+    FetchAll([Request(url, path) for url, path in files])
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from . import __version__ as EVEREST_VERSION
+from .config import EVEREST_DOWNLOADS
+from concurrent.futures import ThreadPoolExecutor
+from six.moves.urllib.parse import urlsplit, urljoin
+from six.moves.urllib.request import url2pathname
+import http.client
+import asyncio
+import hashlib
+import threading
+import shutil
+import os
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = ['DownloadError', 'Request', 'DownloadManager', 'Fetch',
+           'FetchAll']
+
+#: HTTP status codes worth retrying
+RETRY_CODES = [408, 429, 500, 502, 503, 504]
+
+
+class DownloadError(Exception):
+    '''
+    Raised when a file cannot be downloaded.
+
+    '''
+
+    pass
+
+
+class _Retry(Exception):
+    '''
+    A transient error; the request will be retried.
+
+    '''
+
+    pass
+
+
+class Request(object):
+    '''
+    A file to download.
+
+    :param str url: The `http`, `https` or `file` url of the file
+    :param str path: The full path to the file in the local cache
+    :param int size: The expected size of the file in bytes. Default \
+           :py:obj:`None`, in which case the size reported by the \
+           server is used
+    :param str checksum: The expected checksum of the file, in the form \
+           `algorithm:hexdigest` (i.e., `md5:...`). Default :py:obj:`None`
+
+    '''
+
+    def __init__(self, url, path, size=None, checksum=None):
+        '''
+
+        '''
+
+        self.url = url
+        self.path = path
+        self.size = size
+        self.checksum = checksum
+
+    def __repr__(self):
+        '''
+
+        '''
+
+        return "<Request %s>" % self.url
+
+
+class DownloadManager(object):
+    '''
+    Downloads batches of :py:class:`Request` instances concurrently.
+
+    :param int concurrency: The maximum number of simultaneous \
+           downloads. Default :py:obj:`EVEREST_DOWNLOADS` (the \
+           `EVEREST2_DOWNLOADS` environment variable, or 8)
+    :param int retries: The number of times a failed request is \
+           retried. Default 5
+    :param float backoff: The delay in seconds before the first retry; \
+           it doubles after every failed attempt. Default 1
+    :param float rate: The maximum number of requests started per \
+           second. Default :py:obj:`None` (no limit)
+    :param float timeout: The socket timeout in seconds. Default 60
+    :param int chunk_size: The read size in bytes. Default 64 kB
+    :param bool clobber: Download files that are already in the cache? \
+           Default :py:obj:`False`
+
+    '''
+
+    def __init__(self, concurrency=EVEREST_DOWNLOADS, retries=5, backoff=1.,
+                 rate=None, timeout=60., chunk_size=2 ** 16, clobber=False):
+        '''
+
+        '''
+
+        self.concurrency = max(1, int(concurrency))
+        self.retries = retries
+        self.backoff = backoff
+        self.rate = rate
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.clobber = clobber
+
+    def run(self, requests):
+        '''
+        Downloads all the :py:obj:`requests` and returns a list with the
+        local path of each file or, if it could not be downloaded, the
+        :py:class:`DownloadError` instance.
+
+        '''
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._run(list(requests)))
+
+        # We're already inside an event loop (i.e., in a notebook),
+        # so run ours in a separate thread
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(asyncio.run,
+                                   self._run(list(requests))).result()
+
+    async def _run(self, requests):
+        '''
+
+        '''
+
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._throttle_lock = asyncio.Lock()
+        self._next_start = 0.
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        executor = ThreadPoolExecutor(self.concurrency)
+        try:
+            return await asyncio.gather(*[self._fetch(r, executor)
+                                          for r in requests],
+                                        return_exceptions=True)
+        finally:
+            executor.shutdown(wait=True)
+            for connection in self._connections:
+                connection.close()
+
+    async def _throttle(self):
+        '''
+        Waits until a new request may be started.
+
+        '''
+
+        if not self.rate:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._throttle_lock:
+            now = loop.time()
+            if self._next_start > now:
+                await asyncio.sleep(self._next_start - now)
+            self._next_start = max(now, self._next_start) + 1. / self.rate
+
+    async def _fetch(self, request, executor):
+        '''
+        Downloads a single file, retrying on transient errors.
+
+        '''
+
+        if os.path.exists(request.path) and not self.clobber:
+            return request.path
+        elif self.clobber and os.path.exists(request.path + '.part'):
+            os.remove(request.path + '.part')
+
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            async with self._semaphore:
+                await self._throttle()
+                try:
+                    return await loop.run_in_executor(executor, self._get,
+                                                      request)
+                except DownloadError:
+                    raise
+                except (_Retry, http.client.HTTPException,
+                        IOError, OSError) as e:
+                    error = e
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt
+                log.warn("Error downloading '%s' (%s). Retrying in %.1f s..."
+                         % (request.url, error, delay))
+                await asyncio.sleep(delay)
+
+        raise DownloadError("Unable to download '%s': %s" %
+                            (request.url, error))
+
+    def _connection(self, scheme, netloc, reset=False):
+        '''
+        Returns this worker thread's (persistent) connection to the
+        server :py:obj:`netloc`.
+
+        '''
+
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        connection = connections.get((scheme, netloc), None)
+        if reset and connection is not None:
+            connection.close()
+            connection = None
+        if connection is None:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(
+                    netloc, timeout=self.timeout)
+            else:
+                connection = http.client.HTTPConnection(
+                    netloc, timeout=self.timeout)
+            connections[(scheme, netloc)] = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def _get(self, request):
+        '''
+        Downloads (or resumes) a single file into a partial file next to
+        its destination, validates it and moves it into place. This is
+        a blocking call, run in one of the worker threads.
+
+        '''
+
+        part = request.path + '.part'
+        if not os.path.exists(os.path.dirname(request.path)):
+            try:
+                os.makedirs(os.path.dirname(request.path))
+            except OSError:
+                # Another worker created it
+                pass
+
+        url = request.url
+        for redirect in range(5):
+
+            split = urlsplit(url)
+
+            # Local files are simply copied
+            if split.scheme == 'file':
+                src = url2pathname(split.path)
+                if not os.path.exists(src):
+                    raise DownloadError("File not found: '%s'." % src)
+                shutil.copyfile(src, part)
+                return self._validate(request, part, None)
+            elif split.scheme not in ['http', 'https']:
+                raise DownloadError("Unsupported url: '%s'." % url)
+
+            # Resume?
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'User-Agent': 'everest/%s' % EVEREST_VERSION}
+            if offset:
+                headers['Range'] = 'bytes=%d-' % offset
+            target = split.path + ('?' + split.query if split.query else '')
+
+            # Send the request. If the server closed our kept-alive
+            # connection, reconnect once before giving up
+            for reset in [False, True]:
+                connection = self._connection(split.scheme, split.netloc,
+                                              reset=reset)
+                try:
+                    connection.request('GET', target, headers=headers)
+                    response = connection.getresponse()
+                    break
+                except (http.client.HTTPException, IOError, OSError):
+                    connection.close()
+                    if reset:
+                        raise
+
+            # Redirect?
+            if response.status in [301, 302, 303, 307, 308]:
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+
+            # Nothing left to download?
+            if response.status == 416 and offset:
+                response.read()
+                return self._validate(request, part, None)
+
+            if response.status == 206:
+                mode = 'ab'
+                total = response.getheader('Content-Range', '').split('/')[-1]
+                total = int(total) if total.isdigit() else None
+            elif response.status == 200:
+                # The server ignored the range; start over
+                mode = 'wb'
+                length = response.getheader('Content-Length', None)
+                total = int(length) if length is not None else None
+            else:
+                response.read()
+                if response.status in RETRY_CODES:
+                    raise _Retry("HTTP error %d" % response.status)
+                raise DownloadError("HTTP error %d for url '%s'." %
+                                    (response.status, url))
+
+            # Stream to disk
+            with open(part, mode) as f:
+                while True:
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            if response.getheader('Connection', '').lower() == 'close':
+                connection.close()
+
+            return self._validate(request, part, total)
+
+        raise DownloadError("Too many redirects for url '%s'." % request.url)
+
+    def _validate(self, request, part, total):
+        '''
+        Checks the size and checksum of a completed partial file and
+        atomically renames it to its final destination.
+
+        '''
+
+        size = os.path.getsize(part)
+        expected = request.size if request.size is not None else total
+        if expected is not None and size < expected:
+            raise _Retry("Incomplete download (%d/%d bytes)" %
+                         (size, expected))
+        elif expected is not None and size > expected:
+            os.remove(part)
+            raise _Retry("Unexpected file size (%d/%d bytes)" %
+                         (size, expected))
+        if request.checksum is not None:
+            algorithm, digest = request.checksum.split(':')
+            h = hashlib.new(algorithm)
+            with open(part, 'rb') as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b''):
+                    h.update(chunk)
+            if h.hexdigest().lower() != digest.lower():
+                os.remove(part)
+                raise _Retry("Checksum mismatch")
+        os.replace(part, request.path)
+
+        return request.path
+
+
+def FetchAll(requests, **kwargs):
+    '''
+    Downloads a list of :py:class:`Request` instances with a
+    :py:class:`DownloadManager`, to which the keyword arguments are
+    passed. Returns a list with the local path of each file or, if it
+    could not be downloaded, the :py:class:`DownloadError` instance.
+
+    '''
+
+    return DownloadManager(**kwargs).run(requests)
+
+
+def Fetch(url, path, size=None, checksum=None, **kwargs):
+    '''
+    Downloads a single file to :py:obj:`path` and returns
+    :py:obj:`path`. Raises a :py:class:`DownloadError` on failure.
+    See :py:class:`Request` and :py:class:`DownloadManager` for the
+    arguments.
+
+    '''
+
+    res = FetchAll([Request(url, path, size=size, checksum=checksum)],
+                   **kwargs)[0]
+    if isinstance(res, Exception):
+        raise res
+    return res
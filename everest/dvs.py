@@ -10,9 +10,27 @@ Code for handling the "Data Validation Summary" plot.
 
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
-import matplotlib.pyplot as pl
+from .utils import LazyModule
 import numpy as np
-from mpl_toolkits.axes_grid1.inset_locator import InsetPosition
+pl = LazyModule('matplotlib.pyplot')
+
+
+def Rasterize(fig, npts=1000):
+    '''
+    Rasterizes all the lines with more than :py:obj:`npts` points
+    in the figure :py:obj:`fig`. When saved as a `pdf`, these are
+    drawn as a single image instead of thousands of vector markers,
+    which is much faster to render and to display.
+
+    :param fig: The :py:obj:`matplotlib.pyplot` figure instance
+    :param int npts: The minimum number of points. Default 1000
+
+    '''
+
+    for ax in fig.get_axes():
+        for line in ax.get_lines():
+            if len(line.get_xdata()) > npts:
+                line.set_rasterized(True)
 
 
 class Frame(object):
@@ -38,6 +56,7 @@ class Frame(object):
 
         if pos is None:
             pos = self.pos
+        from mpl_toolkits.axes_grid1.inset_locator import InsetPosition
         res = []
         for axis in np.atleast_1d(self.ax):
             ax = self.fig.add_subplot(111, label=np.random.randn())
@@ -16,6 +16,9 @@ from __future__ import division, print_function, absolute_import, \
 from . import __version__ as EVEREST_VERSION
 from .config import EVEREST_DAT, EVEREST_SRC, QUALITY_BAD, QUALITY_NAN, \
      QUALITY_OUT, QUALITY_REC, QUALITY_TRN, EVEREST_MAJOR_MINOR
+from .profiling import STAGES
+from .mathutils import CBVFit
+from .modelstore import LoadModel
 try:
     import pyfits
 except ImportError:
@@ -29,7 +32,7 @@ from time import strftime
 import logging
 log = logging.getLogger(__name__)
 
-__all__ = ['MakeFITS']
+__all__ = ['MakeFITS', 'UpdateFITS', 'UpdateCBVColumns', 'RefreshCBVColumns']
 
 
 def PrimaryHDU(model):
@@ -95,19 +98,20 @@ def LightcurveHDU(model):
     cards.append(('CDPPR', model.cdppr, 'Raw CDPP'))
     cards.append(('CDPPV', model.cdppv, 'Average validation CDPP'))
     cards.append(('CDPPG', model.cdppg, 'Average GP-de-trended CDPP'))
-    for i in range(99):
-        try:
-            cards.append(('CDPP%02d' % (i + 1),
-                          model.cdpp_arr[i] if not np.isnan(
-                model.cdpp_arr[i]) else 0, 'Chunk de-trended CDPP'))
-            cards.append(('CDPPR%02d' % (
-                i + 1), model.cdppr_arr[i] if not np.isnan(
-                model.cdppr_arr[i]) else 0, 'Chunk raw CDPP'))
-            cards.append(('CDPPV%02d' % (i + 1),
-                          model.cdppv_arr[i] if not np.isnan(
-                model.cdppv_arr[i]) else 0, 'Chunk validation CDPP'))
-        except:
-            break
+    nchunks = min(99, len(model.cdpp_arr), len(model.cdppr_arr),
+                  len(model.cdppv_arr))
+    cdpp_arr, cdppr_arr, cdppv_arr = [
+        np.where(np.isnan(x), 0, x) for x in
+        [np.array(model.cdpp_arr[:nchunks], dtype=float),
+         np.array(model.cdppr_arr[:nchunks], dtype=float),
+         np.array(model.cdppv_arr[:nchunks], dtype=float)]]
+    for i in range(nchunks):
+        cards.append(('CDPP%02d' % (i + 1), cdpp_arr[i],
+                      'Chunk de-trended CDPP'))
+        cards.append(('CDPPR%02d' % (i + 1), cdppr_arr[i],
+                      'Chunk raw CDPP'))
+        cards.append(('CDPPV%02d' % (i + 1), cdppv_arr[i],
+                      'Chunk validation CDPP'))
     cards.append(
         ('CVMIN', model.cv_min, 'Cross-validation objective function'))
     cards.append(
@@ -175,6 +179,13 @@ def LightcurveHDU(model):
             ('P%02dDUR' % (i + 1), planet[2],
              'Planet transit duration (days)'))
     cards.append(('PLDORDER', model.pld_order, 'PLD de-trending order'))
+    profile = getattr(model, 'profile', None) or {}
+    for stage, key in STAGES.items():
+        if stage in profile:
+            cards.append((key, profile[stage]['time'],
+                          'Time spent in %s (s)' % stage))
+    if profile.get('peak_rss', None):
+        cards.append(('PRFRSS', profile['peak_rss'], 'Peak memory usage (MB)'))
     cards.append(('SATUR', model.saturated, 'Is target saturated?'))
     cards.append(('SATTOL', model.saturation_tolerance,
                   'Fractional saturation tolerance'))
@@ -396,3 +407,135 @@ def MakeFITS(model, fitsfile=None):
     hdulist.writeto(outfile)
 
     return
+
+
+def UpdateFITS(model, fitsfile=None):
+    '''
+    Updates the CBV-corrected light curve (the `FCOR` and `CBV` columns
+    and the CBV cards of the `ARRAYS` HDU) in an existing *FITS* file,
+    i.e., after the CBVs of a campaign have been recomputed. When the
+    columns have the same shape, the data are overwritten in place and
+    all other HDUs are left untouched; otherwise, the `ARRAYS` HDU is
+    replaced. If the file does not exist, it is created with
+    :py:func:`MakeFITS`.
+
+    :param model: An :py:mod:`everest` model instance
+
+    '''
+
+    # Get the fits file name
+    if fitsfile is None:
+        outfile = os.path.join(model.dir, model._mission.FITSFile(
+            model.ID, model.season, model.cadence))
+    else:
+        outfile = os.path.join(model.dir, fitsfile)
+    if not os.path.exists(outfile):
+        return MakeFITS(model, fitsfile=fitsfile)
+
+    log.info('Updating FITS file...')
+    fcor = model.fcor
+    if fcor is None or not UpdateCBVColumns(
+            outfile, fcor, model.XCBV, cbv_num=model.cbv_num,
+            cbv_niter=model.cbv_niter, cbv_win=model.cbv_win,
+            cbv_order=model.cbv_order):
+        with pyfits.open(outfile, mode='update') as hdulist:
+            hdulist[hdulist.index_of('ARRAYS')] = LightcurveHDU(model)
+
+    return
+
+
+def UpdateCBVColumns(fitsfile, fcor, XCBV, cbv_num=1, cbv_niter=50,
+                     cbv_win=999, cbv_order=3):
+    '''
+    Overwrites the `FCOR` and `CBV` columns and the CBV cards of the
+    `ARRAYS` HDU of an existing *FITS* file in place. This needs neither
+    the :py:mod:`everest` model nor the other HDUs, so it is what
+    :py:func:`UpdateFITS` and the campaign-wide CBV refreshes use.
+    Returns :py:obj:`False` (and leaves the file untouched) if the file
+    does not exist or its columns do not match :py:obj:`XCBV`.
+
+    :param str fitsfile: The full path to the *FITS* file
+    :param array_like fcor: The CBV-corrected flux
+    :param array_like XCBV: The CBV design matrix
+    :param int cbv_num: The number of CBVs regressed on. Default 1
+    :param int cbv_niter: The number of :py:obj:`SysRem` iterations. \
+           Default 50
+    :param int cbv_win: The CBV smoothing window size. Default 999
+    :param int cbv_order: The CBV smoothing filter order. Default 3
+
+    '''
+
+    if not os.path.exists(fitsfile):
+        return False
+    with pyfits.open(fitsfile, mode='update') as hdulist:
+        hdu = hdulist['ARRAYS']
+        names = [n for n in hdu.columns.names
+                 if n == 'FCOR' or (n.startswith('CBV') and n[3:].isdigit())]
+        if (names != ['FCOR'] + ['CBV%02d' % (n + 1)
+                                 for n in range(XCBV.shape[1])]) or \
+                (len(hdu.data) != np.size(fcor)):
+            return False
+        hdu.data['FCOR'][:] = np.reshape(fcor, -1)
+        for n in range(XCBV.shape[1]):
+            hdu.data['CBV%02d' % (n + 1)][:] = XCBV[:, n]
+        hdu.header['CBVNUM'] = cbv_num
+        hdu.header['CBVNITER'] = cbv_niter
+        hdu.header['CBVWIN'] = cbv_win
+        hdu.header['CBVORD'] = cbv_order
+        hdu.header['DATE'] = strftime('%Y-%m-%d')
+
+    return True
+
+
+def RefreshCBVColumns(files, XCBV, cbv_num=1, cbv_niter=50, cbv_win=999,
+                      cbv_order=3):
+    '''
+    Refreshes the CBV-corrected light curves in the published *FITS* files
+    of a batch of long cadence targets (typically, all the targets on a
+    module) after the CBVs of their campaign were recomputed. Instead of
+    instantiating each model, only the de-trended flux, the masks and the
+    breakpoints are read from the stored models, the CBV regressions of all
+    targets are solved at once with :py:func:`everest.mathutils.CBVFit`,
+    and the columns are overwritten with :py:func:`UpdateCBVColumns`.
+
+    :param list files: A list of `(modelfile, fitsfile)` tuples
+    :param array_like XCBV: The CBV design matrix of the campaign
+
+    Returns the list of the `(modelfile, fitsfile)` tuples that could not
+    be refreshed this way; these must be republished from their models.
+
+    '''
+
+    # Load the light curves, grouped by their breakpoints
+    failed = []
+    groups = {}
+    for modelfile, fitsfile in files:
+        if not os.path.exists(fitsfile):
+            failed.append((modelfile, fitsfile))
+            continue
+        with LoadModel(modelfile) as data:
+            if data.get('cadence', 'lc') != 'lc':
+                failed.append((modelfile, fitsfile))
+                continue
+            flux = data['fraw'] - data['model']
+            mask = np.zeros(len(flux), dtype=bool)
+            for name in ['outmask', 'badmask', 'transitmask', 'nanmask']:
+                inds = np.asarray(data[name], dtype=int)
+                mask[inds[inds < len(flux)]] = True
+            key = tuple(np.asarray(data['breakpoints'], dtype=int))
+        groups.setdefault(key, []).append((modelfile, fitsfile, flux, mask))
+
+    # Regress and update
+    for breakpoints, group in groups.items():
+        flux = np.array([g[2] for g in group])
+        fcor = flux - CBVFit(XCBV, flux, np.array([g[3] for g in group]),
+                             breakpoints, ncbv=cbv_num)
+        for (modelfile, fitsfile, _, _), f in zip(group, fcor):
+            if not UpdateCBVColumns(fitsfile, f, XCBV, cbv_num=cbv_num,
+                                    cbv_niter=cbv_niter, cbv_win=cbv_win,
+                                    cbv_order=cbv_order):
+                failed.append((modelfile, fitsfile))
+    log.info('Refreshed the CBV correction of %d light curves.' %
+             (len(files) - len(failed)))
+
+    return failed
@@ -89,6 +89,151 @@ def GetCovariance(kernel, kernel_params, time, errors):
     return K
 
 
+def _Matern32Causal(time, x, c, span=20.):
+    '''
+    Returns the causal Matern-3/2 sums
+    `y_i = sum_{j <= i} x_j (1 + c dt_ij) exp(-c dt_ij)` for a sorted
+    :py:obj:`time` array, where `dt_ij = t_i - t_j`. The light curve is
+    split into blocks no longer than :py:obj:`span` / `c`; within each
+    block the sums are vectorized cumulative sums of the rescaled
+    vector, and the running sums are carried over from one block to
+    the next, so the cost is *O(N)* with only a short Python loop.
+
+    '''
+
+    res = np.empty_like(x)
+    if not len(x):
+        return res
+    blocks = np.floor(c * (time - time[0]) / span)
+    edges = np.concatenate([[0], np.flatnonzero(np.diff(blocks)) + 1,
+                            [len(time)]])
+    S = 0.
+    D = 0.
+    tprev = time[0]
+    for i, j in zip(edges[:-1], edges[1:]):
+
+        # The sums of `x_j exp(-c dt)` and `x_j dt exp(-c dt)`
+        # over the cadences in this block...
+        u = time[i:j] - time[i]
+        r = np.exp(c * u)
+        Sb = np.cumsum(x[i:j] * r) / r
+        Db = u * Sb - np.cumsum(x[i:j] * u * r) / r
+
+        # ...and over all the previous blocks
+        g = time[i] - tprev
+        decay = np.exp(-c * (g + u))
+        Db += decay * (D + (g + u) * S)
+        Sb += decay * S
+
+        res[i:j] = Sb + c * Db
+        S = Sb[-1]
+        D = Db[-1]
+        tprev = time[j - 1]
+
+    return res
+
+
+def CovarianceProduct(kernel, kernel_params, time, x, blocksize=None):
+    '''
+    Returns the product of the GP covariance matrix for a given light
+    curve segment and the vector :py:obj:`x`, without ever building
+    the (*N*,*N*) matrix. As in :py:func:`GetCovariance`, the white
+    noise term is not included, and neither are the data errors.
+    For the `Basic` (Matern-3/2) kernel, the product is computed
+    exactly in *O(N)* with a forward and a backward recursion; for
+    other kernels, the matrix is computed :py:obj:`blocksize` rows at
+    a time.
+
+    :param array_like kernel_params: A list of kernel parameters \
+          (white noise amplitude, red noise amplitude, and red noise timescale)
+    :param array_like time: The time array (*N*)
+    :param array_like x: The vector to multiply (*N*)
+    :param int blocksize: The number of rows of the covariance matrix \
+           to compute at a time. Default is 64 MB worth of rows
+
+    :returns: The product :py:obj:`K . x` (*N*)
+
+    '''
+
+    time = np.asarray(time, dtype=float)
+    x = np.asarray(x, dtype=float)
+
+    if kernel == 'Basic':
+
+        # k(dt) = a^2 (1 + c dt) exp(-c dt), with c = sqrt(3) / tau.
+        # The contribution of the cadences at or before each cadence,
+        # plus that of the cadences after it (computed by reversing
+        # time), minus the diagonal, which was counted twice
+        w, a, t = kernel_params
+        c = np.sqrt(3.) / t
+        o = np.argsort(time, kind='mergesort')
+        to = time[o]
+        xo = x[o]
+        res = _Matern32Causal(to, xo, c) + \
+            _Matern32Causal(-to[::-1], xo[::-1], c)[::-1] - xo
+
+        out = np.empty_like(res)
+        out[o] = a ** 2 * res
+        return out
+
+    else:
+
+        gp = GP(kernel, kernel_params, white=False)
+        if blocksize is None:
+            blocksize = max(1, 2 ** 23 // max(1, len(time)))
+        res = np.empty_like(x)
+        for i in range(0, len(time), blocksize):
+            res[i:i + blocksize] = np.dot(
+                gp.get_matrix(time[i:i + blocksize], time), x)
+        return res
+
+
+class CVPredictor(object):
+    '''
+    A GP predictor for cross-validation. The GP, the time array and
+    the validation masks are fixed across the whole :py:obj:`lambda`
+    sweep, so the covariance matrix is factorized and the
+    cross-covariance between each validation set and the full chunk
+    is computed only once. Calls to :py:meth:`predict` then cost a
+    single (multi right-hand side) triangular solve.
+
+    :param array_like kernel_params: A list of kernel parameters \
+          (white noise amplitude, red noise amplitude, and red noise timescale)
+    :param array_like time: The time array (*N*)
+    :param array_like errors: The data error array (*N*)
+    :param list masks: The indices of the cadences in each of the \
+           validation sets
+
+    '''
+
+    def __init__(self, kernel, kernel_params, time, errors, masks):
+        '''
+
+        '''
+
+        gp = GP(kernel, kernel_params, white=False)
+        self.masks = masks
+        self.K = cho_factor(GetCovariance(kernel, kernel_params,
+                                          time, errors))
+        self.Kx = [gp.get_matrix(time[mask], time) for mask in masks]
+
+    def predict(self, y, i):
+        '''
+        Returns the GP mean prediction at the cadences in validation
+        set :py:obj:`i`, conditioned on the full chunk. This is the
+        same as the mean returned by :py:obj:`george.GP.predict`.
+
+        :param array_like y: The residuals, either a single vector \
+               (*N*) or one per column (*N*, *M*)
+        :param int i: The index of the validation mask
+
+        :returns: The prediction (*len(mask)*) or (*len(mask)*, *M*)
+
+        '''
+
+        return np.dot(self.Kx[i], cho_solve(self.K, y))
+
+
 def GetKernelParams(time, flux, errors, kernel='Basic', mask=[],
                     giter=3, gmaxf=200, guess=None):
     '''
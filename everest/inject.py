@@ -13,16 +13,108 @@ from __future__ import division, print_function, absolute_import, \
      unicode_literals
 from .detrender import *
 from .transit import Transit
+from .gp import GetCovariance
+from .mathutils import Gram
 from .dvs import DVS
 import os
 import sys
 import numpy as np
-import matplotlib.pyplot as pl
+from scipy.linalg import cho_factor, cho_solve
 import traceback
 import logging
 log = logging.getLogger(__name__)
 
-__all__ = ['Inject']
+__all__ = ['Inject', 'InjectionEngine', 'RecoverDepth']
+
+
+def RecoverDepth(time, flux, t0, per, dur, depth, trn_win=5, poly_order=3,
+                 transit_model=None):
+    '''
+    Recovers the depth of a transit injected into a normalized,
+    de-trended light curve with a simple LLS solver, fitting a
+    separate polynomial baseline to the window around each transit.
+    Returns the recovered depth, its uncertainty, and the folded time
+    and de-trended flux arrays around the transits.
+
+    :param array_like time: The time array (with bad cadences removed)
+    :param array_like flux: The normalized flux array
+    :param float t0: The injected transit ephemeris in days
+    :param float per: The injected planet period in days
+    :param float dur: The transit duration in days
+    :param float depth: The injected fractional transit depth
+    :param float trn_win: The size of the transit window in units of the \
+           transit duration. Default 5
+    :param int poly_order: The order of the polynomial used to fit the \
+           continuum. Default 3
+    :param array_like transit_model: The injected transit model \
+           evaluated at :py:obj:`time`. Default :py:obj:`None` (computed \
+           here)
+
+    '''
+
+    if transit_model is None:
+        transit_model = Transit(time, t0=t0, per=per, dur=dur, depth=depth)
+    transit_model = (transit_model - 1) / depth
+
+    # Count the transits
+    t0 += np.ceil((time[0] - dur - t0) / per) * per
+    ttimes0 = np.arange(t0, time[-1] + dur, per)
+    tinds = []
+    for tt in ttimes0:
+        # Get indices for this chunk
+        inds = np.where(np.abs(time - tt) < trn_win * dur / 2.)[0]
+        # Ensure there's a transit in this chunk, and that
+        # there are enough points for the polynomial fit
+        if np.any(transit_model[inds] < 0.) and \
+                len(inds) > poly_order:
+            tinds.append(inds)
+
+    # Our design matrix
+    sz = (poly_order + 1) * len(tinds)
+    X = np.empty((0, 1 + sz), dtype=float)
+    Y = np.array([], dtype=float)
+    T = np.array([], dtype=float)
+
+    # Loop over all transits
+    for i, inds in enumerate(tinds):
+        # Get the transit model
+        trnvec = transit_model[inds].reshape(-1, 1)
+        # Normalize the time array
+        t = time[inds]
+        t = (t - t[0]) / (t[-1] - t[0])
+        # Cumulative arrays
+        T = np.append(T, time[inds])
+        Y = np.append(Y, flux[inds])
+        # Polynomial vector
+        polyvec = np.array(
+            [t ** o for o in range(0, poly_order + 1)]).T
+        # Update the design matrix with this chunk
+        lzeros = np.zeros((len(t), i * (poly_order + 1)))
+        rzeros = np.zeros(
+            (len(t), sz - (i + 1) * (poly_order + 1)))
+        chunk = np.hstack((trnvec, lzeros, polyvec, rzeros))
+        X = np.vstack((X, chunk))
+
+    # Get the relative depth
+    A = np.dot(X.T, X)
+    B = np.dot(X.T, Y)
+    C = np.linalg.solve(A, B)
+    rec_depth = C[0]
+
+    # Get the uncertainties
+    sig = 1.4826 * \
+        np.nanmedian(np.abs(flux - np.nanmedian(flux))
+                     ) / np.nanmedian(flux)
+    cov = sig ** 2 * np.linalg.solve(A, np.eye(A.shape[0]))
+    err = np.sqrt(np.diag(cov))
+    rec_depth_err = err[0]
+
+    # The detrended, folded data
+    D = (Y - np.dot(C[1:], X[:, 1:].T) +
+         np.nanmedian(Y)) / np.nanmedian(Y)
+    T = (T - t0 - per / 2.) % per - per / 2.
+
+    return rec_depth, rec_depth_err, T, D
 
 
 def Inject(ID, inj_model='nPLD', t0=None, per=None, dur=0.1, depth=0.001,
@@ -119,9 +211,8 @@ def Inject(ID, inj_model='nPLD', t0=None, per=None, dur=0.1, depth=0.001,
                 self.fpix[:, i] *= transit_model
             self.fraw = np.sum(self.fpix, axis=1)
             if self.inject['mask']:
-                self.transitmask = np.array(list(set(np.concatenate(
-                    [self.transitmask, np.where(transit_model < 1.)[0]]))),
-                    dtype=int)
+                self.set_mask('transitmask', np.concatenate(
+                    [self.transitmask, np.where(transit_model < 1.)[0]]))
 
             # Update the PLD normalization
             self.get_norm()
@@ -157,66 +248,12 @@ def Inject(ID, inj_model='nPLD', t0=None, per=None, dur=0.1, depth=0.001,
             for run, tag in zip([self, control], ['', '_control']):
 
                 # Compute the model
-                mask = np.array(
-                    list(set(np.concatenate([run.badmask, run.nanmask]))),
-                    dtype=int)
+                mask = run.get_mask_indices(['badmask', 'nanmask'])
                 flux = np.delete(run.flux / np.nanmedian(run.flux), mask)
                 time = np.delete(run.time, mask)
-                transit_model = (Transit(time, t0=t0, per=per,
-                                         dur=dur, depth=depth) - 1) / depth
-
-                # Count the transits
-                t0 += np.ceil((time[0] - dur - t0) / per) * per
-                ttimes0 = np.arange(t0, time[-1] + dur, per)
-                tinds = []
-                for tt in ttimes0:
-                    # Get indices for this chunk
-                    inds = np.where(np.abs(time - tt) < trn_win * dur / 2.)[0]
-                    # Ensure there's a transit in this chunk, and that
-                    # there are enough points for the polynomial fit
-                    if np.any(transit_model[inds] < 0.) and \
-                            len(inds) > poly_order:
-                        tinds.append(inds)
-
-                # Our design matrix
-                sz = (poly_order + 1) * len(tinds)
-                X = np.empty((0, 1 + sz), dtype=float)
-                Y = np.array([], dtype=float)
-                T = np.array([], dtype=float)
-
-                # Loop over all transits
-                for i, inds in enumerate(tinds):
-                    # Get the transit model
-                    trnvec = transit_model[inds].reshape(-1, 1)
-                    # Normalize the time array
-                    t = time[inds]
-                    t = (t - t[0]) / (t[-1] - t[0])
-                    # Cumulative arrays
-                    T = np.append(T, time[inds])
-                    Y = np.append(Y, flux[inds])
-                    # Polynomial vector
-                    polyvec = np.array(
-                        [t ** o for o in range(0, poly_order + 1)]).T
-                    # Update the design matrix with this chunk
-                    lzeros = np.zeros((len(t), i * (poly_order + 1)))
-                    rzeros = np.zeros(
-                        (len(t), sz - (i + 1) * (poly_order + 1)))
-                    chunk = np.hstack((trnvec, lzeros, polyvec, rzeros))
-                    X = np.vstack((X, chunk))
-
-                # Get the relative depth
-                A = np.dot(X.T, X)
-                B = np.dot(X.T, Y)
-                C = np.linalg.solve(A, B)
-                rec_depth = C[0]
-
-                # Get the uncertainties
-                sig = 1.4826 * \
-                    np.nanmedian(np.abs(flux - np.nanmedian(flux))
-                                 ) / np.nanmedian(flux)
-                cov = sig ** 2 * np.linalg.solve(A, np.eye(A.shape[0]))
-                err = np.sqrt(np.diag(cov))
-                rec_depth_err = err[0]
+                rec_depth, rec_depth_err, T, D = RecoverDepth(
+                    time, flux, t0, per, dur, depth, trn_win=trn_win,
+                    poly_order=poly_order)
 
                 # Store the results
                 self.inject.update(
@@ -224,9 +261,6 @@ def Inject(ID, inj_model='nPLD', t0=None, per=None, dur=0.1, depth=0.001,
                      'rec_depth_err%s' % tag: rec_depth_err})
 
                 # Store the detrended, folded data
-                D = (Y - np.dot(C[1:], X[:, 1:].T) +
-                     np.nanmedian(Y)) / np.nanmedian(Y)
-                T = (T - t0 - per / 2.) % per - per / 2.
                 self.inject.update(
                     {'fold_time%s' % tag: T, 'fold_flux%s' % tag: D})
 
@@ -308,8 +342,6 @@ def Inject(ID, inj_model='nPLD', t0=None, per=None, dur=0.1, depth=0.001,
             N = int(0.995 * len(self.inject['fold_flux_control']))
             hi, lo = self.inject['fold_flux_control'][np.argsort(
                 self.inject['fold_flux_control'])][[N, -N]]
-            fsort = self.inject['fold_flux_control'][np.argsort(
-                self.inject['fold_flux_control'])]
             pad = (hi - lo) * 0.2
             ylim = (lo - 2 * pad, hi + pad)
             ax2.set_ylim(ylim)
@@ -332,3 +364,289 @@ def Inject(ID, inj_model='nPLD', t0=None, per=None, dur=0.1, depth=0.001,
 
     return Injection(ID, inject=inject, parent_class=inj_model,
                      make_fits=make_fits, **kwargs)
+
+
+class InjectionEngine(object):
+    r'''
+    A batched transit injection and recovery engine. The de-trended
+    :py:obj:`inj_model` for the target is loaded from disk once, and the
+    regularized PLD operator for each light curve chunk (the Cholesky
+    factor of :math:`\mathbf{K} + \mathbf{X \Lambda X^\top}` and the
+    cross term :math:`\mathbf{X_c \Lambda X^\top}`) is computed and cached.
+    Since a transit injected at the pixel level scales every pixel by the
+    same factor, the fractional PLD regressors are not affected by the
+    injection, so the de-trended light curves for many injections follow
+    from a single multi-RHS solve. Masked injections remove the in-transit
+    cadences from the regression with a low-rank update of the cached
+    factorization.
+
+    Note that, unlike :py:func:`Inject`, the PLD hyperparameters (the
+    regularization parameters, the GP kernel and the outlier mask) are
+    held fixed at the values of the un-injected model, i.e., they are
+    not re-optimized for each injection.
+
+    :param int ID: The target id
+    :param str inj_model: The name of the :py:obj:`everest` model to \
+           use. Must already have been run for this target. \
+           Default `"nPLD"`
+    :param float trn_win: The size of the transit window in units of the \
+           transit duration. Default 5
+    :param int poly_order: The order of the polynomial used to fit the \
+           continuum. Default 3
+    :param int batch_size: The maximum number of unmasked injections \
+           de-trended simultaneously. Default 100
+
+    '''
+
+    def __init__(self, ID, inj_model='nPLD', trn_win=5, poly_order=3,
+                 batch_size=100, **kwargs):
+        '''
+
+        '''
+
+        self.inj_model = inj_model
+        self.trn_win = trn_win
+        self.poly_order = poly_order
+        self.batch_size = batch_size
+        self.model = eval(inj_model)(ID, is_parent=True, **kwargs)
+        if isinstance(self.model, iPLD):
+            raise ValueError("Batched injections are not supported for " +
+                             "`iPLD`, whose regressors depend on the flux.")
+        self._precompute()
+
+    def _precompute(self):
+        '''
+        Computes and caches the PLD operator for each chunk.
+
+        '''
+
+        log.info("Pre-computing the PLD operators...")
+        model = self.model
+        self._chunks = []
+        for b, brkpt in enumerate(model.breakpoints):
+
+            # Masks for current chunk
+            m = model.get_masked_chunk(b)
+            c = model.get_chunk(b)
+
+            # This block of the masked covariance matrix
+            mK = GetCovariance(model.kernel, model.kernel_params,
+                               model.time[m], model.fraw_err[m])
+
+            # The X^2 matrices
+            A = np.zeros((len(m), len(m)))
+            B = np.zeros((len(c), len(m)))
+            for n in range(model.pld_order):
+                if (model.lam_idx >= n) and (model.lam[b][n] is not None):
+                    XM = model.X(n, m)
+                    XC = model.X(n, c)
+                    A += model.lam[b][n] * Gram(XM)
+                    B += model.lam[b][n] * Gram(XC, XM)
+                    del XM, XC
+
+            self._chunks.append((m, c, cho_factor(mK + A), B))
+            del A, mK
+
+        # The indices at which the chunks are joined
+        self._joins = self._get_joins(model.mask)
+
+        # Sanity check: we should recover the saved model
+        fraw_model = self.detrend(model.fraw.reshape(-1, 1))[:, 0]
+        if not np.allclose(fraw_model, model.model, rtol=1e-5,
+                           atol=1e-5 * np.nanmedian(np.abs(model.fraw))):
+            log.warn("The cached PLD operator does not reproduce the " +
+                     "saved `%s` model." % model.name)
+
+    def _get_joins(self, mask):
+        '''
+        Returns the number of cadences from the end of the stitched
+        light curve at which each chunk is joined. This mirrors the
+        logic in :py:meth:`everest.basecamp.Basecamp.compute`.
+
+        '''
+
+        mask = set(mask)
+        bpad = self.model.bpad
+        joins = []
+        n = len(self._chunks[0][1]) - bpad
+        for k, (_, c, _, _) in enumerate(self._chunks[1:]):
+            i = 1
+            while n - i in mask:
+                i += 1
+            joins.append(i)
+            if k < len(self._chunks) - 2:
+                n += len(c) - 2 * bpad
+            else:
+                n += len(c) - bpad
+        return joins
+
+    def detrend(self, F, transitmask=[]):
+        '''
+        Returns the PLD model for each of the columns of the raw flux
+        matrix :py:obj:`F`, of shape `(ncadences, ninjections)`. If
+        :py:obj:`transitmask` is specified, those cadences are removed
+        from the regression (masked injection).
+
+        '''
+
+        bpad = self.model.bpad
+        transitmask = np.array(transitmask, dtype=int)
+        mods = []
+        for m, c, cf, B in self._chunks:
+            S = np.where(np.isin(m, transitmask))[0]
+            if len(S) == 0:
+                f = F[m] - np.nanmedian(F[m], axis=0)
+                mods.append(np.dot(B, cho_solve(cf, f)))
+            else:
+                # Solve the system with the rows and columns in `S`
+                # removed using the Schur complement of the cached
+                # factorization
+                keep = np.delete(np.arange(len(m)), S)
+                f = F[m] - np.nanmedian(F[m][keep], axis=0)
+                f[S] = 0
+                u = cho_solve(cf, f)
+                E = np.zeros((len(m), len(S)))
+                E[S, np.arange(len(S))] = 1
+                PS = cho_solve(cf, E)
+                u -= np.dot(PS, np.linalg.solve(PS[S], u[S]))
+                mods.append(np.dot(B, u))
+
+        # Join the chunks after applying the correct offset
+        if len(transitmask):
+            joins = self._get_joins(np.concatenate([self.model.mask,
+                                                    transitmask]))
+        else:
+            joins = self._joins
+        if len(mods) > 1:
+            model = mods[0][:-bpad]
+            for mod, i in zip(mods[1:-1], joins[:-1]):
+                offset = model[-i] - mod[bpad - i]
+                model = np.vstack([model, mod[bpad:-bpad] + offset])
+            i = joins[-1]
+            offset = model[-i] - mods[-1][bpad - i]
+            model = np.vstack([model, mods[-1][bpad:] + offset])
+        else:
+            model = mods[0]
+
+        # Subtract the global median
+        return model - np.nanmedian(model, axis=0)
+
+    def _recover(self, flux, transit_model, t0, per, dur, depth):
+        '''
+
+        '''
+
+        model = self.model
+        mask = model.get_mask_indices(['badmask', 'nanmask'])
+        flux = np.delete(flux / np.nanmedian(flux), mask)
+        time = np.delete(model.time, mask)
+        rec_depth, rec_depth_err, _, _ = RecoverDepth(
+            time, flux, t0, per, dur, depth, trn_win=self.trn_win,
+            poly_order=self.poly_order,
+            transit_model=np.delete(transit_model, mask))
+        return rec_depth, rec_depth_err
+
+    def run(self, t0=None, per=None, dur=0.1, depth=0.001, mask=False,
+            ninj=1, save=True):
+        '''
+        Injects and recovers transits in the target. Any of the
+        transit parameters may be arrays, in which case one injection
+        is performed for each element. Returns a record array with the
+        injected parameters and the recovered depths (for both the
+        injection and the control run). If :py:obj:`save` is
+        :py:obj:`True`, the results are appended to the per-target
+        table :py:attr:`table`.
+
+        :param float t0: The transit ephemeris in days. Default is to draw \
+               from the uniform distributon [0., :py:obj:`per`)
+        :param float per: The injected planet period in days. Default is \
+               to draw from the uniform distribution [3, 10]
+        :param float dur: The transit duration in days. Default 0.1
+        :param float depth: The fractional transit depth. Default 0.001
+        :param bool mask: Explicitly mask the in-transit cadences when \
+               computing the PLD model? Default :py:obj:`False`
+        :param int ninj: The number of injections, if none of the \
+               parameters are arrays. Default 1
+
+        '''
+
+        # Randomize the planet params
+        n = max([ninj] + [len(np.atleast_1d(x)) for x in
+                          [t0, per, dur, depth, mask] if x is not None])
+        if per is None:
+            per = 3. + 7. * np.random.random(n)
+        per = np.ones(n) * per
+        if t0 is None:
+            t0 = per * np.random.random(n)
+        t0 = np.ones(n) * t0
+        dur = np.ones(n) * dur
+        depth = np.ones(n) * depth
+        mask = np.ones(n, dtype=bool) * mask
+
+        results = np.zeros(n, dtype=[(str(k), float) for k in
+                                     ['t0', 'per', 'dur', 'depth', 'mask',
+                                      'rec_depth', 'rec_depth_err',
+                                      'rec_depth_control',
+                                      'rec_depth_err_control']])
+        results['t0'] = t0
+        results['per'] = per
+        results['dur'] = dur
+        results['depth'] = depth
+        results['mask'] = mask
+
+        model = self.model
+        unmasked = np.where(~mask)[0]
+        masked = np.where(mask)[0]
+        for batch in [unmasked[i:i + self.batch_size] for i in
+                      range(0, len(unmasked), self.batch_size)] + \
+                [[i] for i in masked]:
+
+            log.info("Running injections %d-%d/%d..." %
+                     (batch[0] + 1, batch[-1] + 1, n))
+
+            # Inject the transits into the raw flux
+            T = np.array([Transit(model.time, t0=t0[j], per=per[j],
+                                  dur=dur[j], depth=depth[j])
+                          for j in batch]).T
+            F = model.fraw.reshape(-1, 1) * T
+            if mask[batch[0]]:
+                M = self.detrend(F, np.where(T[:, 0] < 1.)[0])
+            else:
+                M = self.detrend(F)
+
+            # Recover the depths
+            for k, j in enumerate(batch):
+                args = (T[:, k], t0[j], per[j], dur[j], depth[j])
+                results['rec_depth'][j], results['rec_depth_err'][j] = \
+                    self._recover(F[:, k] - M[:, k], *args)
+                results['rec_depth_control'][j], \
+                    results['rec_depth_err_control'][j] = \
+                    self._recover(model.fraw * T[:, k] - model.model, *args)
+
+        if save:
+            self.save(results)
+
+        return results
+
+    @property
+    def table(self):
+        '''
+        The full path to the per-target injection results table.
+
+        '''
+
+        return os.path.join(self.model.dir, '%s_Inject.tsv' % self.inj_model)
+
+    def save(self, results):
+        '''
+        Appends the injection :py:obj:`results` to :py:attr:`table`,
+        a tab-separated file with one row per injection.
+
+        '''
+
+        header = "\t".join([k.upper() for k in results.dtype.names])
+        data = np.vstack([results[k] for k in results.dtype.names]).T
+        exists = os.path.exists(self.table)
+        with open(self.table, 'ab') as f:
+            np.savetxt(f, data, fmt=str('%.10e'), delimiter=str('\t'),
+                       header=header if not exists else '')
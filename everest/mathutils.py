@@ -11,36 +11,71 @@ Miscellaneous math utilities used throughout the code.
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 from scipy.signal import medfilt
 from scipy.signal import savgol_filter
+from scipy.ndimage import convolve1d
 from scipy.misc import comb
+from tempfile import NamedTemporaryFile
+import os
 import logging
 log = logging.getLogger(__name__)
 
 
-def Interpolate(time, mask, y):
+def Interpolate(time, mask, y, inplace=False):
     '''
     Masks certain elements in the array `y` and linearly
     interpolates over them, returning an array `y'` of the
-    same length.
+    same length. If `y` is 2-d (i.e., a `(ntime, npix)` pixel
+    array), all columns are interpolated in a single pass, sharing
+    the bracketing indices. Equivalent to calling :py:func:`numpy.interp`
+    on each column.
 
     :param array_like time: The time array
     :param array_like mask: The indices to be interpolated over
     :param array_like y: The dependent array
+    :param bool inplace: Modify `y` in place instead of returning a \
+           copy? Default :py:obj:`False`
 
     '''
 
     # Ensure `y` doesn't get modified in place
-    yy = np.array(y)
-    t_ = np.delete(time, mask)
-    y_ = np.delete(y, mask, axis=0)
-    if len(yy.shape) == 1:
-        yy[mask] = np.interp(time[mask], t_, y_)
-    elif len(yy.shape) == 2:
-        for n in range(yy.shape[1]):
-            yy[mask, n] = np.interp(time[mask], t_, y_[:, n])
+    if inplace:
+        yy = y
     else:
+        yy = np.array(y)
+    if yy.ndim not in [1, 2]:
         raise Exception("Array ``y`` must be either 1- or 2-d.")
+    time = np.asarray(time)
+    mask = np.unique(np.array(mask, dtype=int).reshape(-1))
+    if len(mask) == 0:
+        return yy
+
+    # The unmasked points bracketing each masked point
+    good = np.ones(len(time), dtype=bool)
+    good[mask] = False
+    good = np.flatnonzero(good)
+    if len(good) == 0:
+        raise ValueError("Cannot interpolate: all points are masked.")
+    t_ = time[good]
+    x = time[mask]
+    j = np.clip(np.searchsorted(t_, x, side='right') - 1, 0,
+                max(len(t_) - 2, 0))
+    k = np.minimum(j + 1, len(t_) - 1)
+
+    # Always interpolate in double precision, even for `float32` arrays
+    shape = (-1,) + (1,) * (yy.ndim - 1)
+    yj = np.array(yy[good[j]], dtype='float64')
+    yk = np.array(yy[good[k]], dtype='float64')
+    dt = t_[k] - t_[j]
+    dt[dt == 0] = 1.
+    res = (yk - yj) / dt.reshape(shape) * (x - t_[j]).reshape(shape) + yj
+
+    # Points outside the unmasked range take the value at the edge
+    res[x <= t_[0]] = yy[good[0]]
+    res[x >= t_[-1]] = yy[good[-1]]
+    yy[mask] = res
+
     return yy
 
 
@@ -80,7 +115,8 @@ def Chunks(l, n, all=False):
 
 def Smooth(x, window_len=100, window='hanning'):
     '''
-    Smooth data by convolving on a given timescale.
+    Smooth data by convolving on a given timescale. If :py:obj:`x` is
+    2-d, each of its rows is smoothed.
 
     :param ndarray x: The data array
     :param int window_len: The size of the smoothing window. Default `100`
@@ -91,21 +127,53 @@ def Smooth(x, window_len=100, window='hanning'):
 
     if window_len == 0:
         return np.zeros_like(x)
-    s = np.r_[2 * x[0] - x[window_len - 1::-1],
-              x, 2 * x[-1] - x[-1:-window_len:-1]]
+    x = np.asarray(x)
+    s = np.concatenate([2 * x[..., :1] - x[..., window_len - 1::-1],
+                        x, 2 * x[..., -1:] - x[..., -1:-window_len:-1]],
+                       axis=-1)
     if window == 'flat':
         w = np.ones(window_len, 'd')
     else:
         w = eval('np.' + window + '(window_len)')
-    y = np.convolve(w / w.sum(), s, mode='same')
-    return y[window_len:-window_len + 1]
+    if x.ndim == 1:
+        y = np.convolve(w / w.sum(), s, mode='same')
+    else:
+        # Same alignment as `np.convolve(..., mode='same')`
+        y = convolve1d(s, w / w.sum(), axis=-1, mode='constant',
+                       origin=-((window_len + 1) % 2))
+    return y[..., window_len:-window_len + 1]
+
+
+def RunningStd(y, win):
+    '''
+    Returns the standard deviation of each of the :py:obj:`win`-sized
+    windows of :py:obj:`y` generated by ``Chunks(y, win, all=True)``,
+    computed in a single vectorized step on a strided view of the
+    array. If :py:obj:`y` is 2-d, the windows run along the last axis
+    and one row of standard deviations is returned per row of :py:obj:`y`.
+
+    :param ndarray y: The 1- or 2-d data array
+    :param int win: The window size in cadences
+
+    '''
+
+    y = np.asarray(y)
+    nwin = max(y.shape[-1] - 2 * win + 1, 0)
+    windows = as_strided(y, shape=y.shape[:-1] + (nwin, win),
+                         strides=y.strides[:-1] + (y.strides[-1],
+                                                   y.strides[-1]))
+
+    # `Chunks` never starts a window at an offset of `win - 1`
+    windows = windows[..., np.arange(nwin) % win != win - 1, :]
+    return np.std(windows, axis=-1)
 
 
 def Scatter(y, win=13, remove_outliers=False):
     '''
     Return the scatter in ppm based on the median running standard deviation
     for a window size of :py:obj:`win` = 13 cadences (for K2, this
-    is ~6.5 hours, as in VJ14).
+    is ~6.5 hours, as in VJ14). If :py:obj:`y` is 2-d, returns the
+    scatter of each of its rows.
 
     :param ndarray y: The array whose CDPP is to be computed
     :param int win: The window size in cadences. Default `13`
@@ -114,6 +182,33 @@ def Scatter(y, win=13, remove_outliers=False):
 
     '''
 
+    y = np.asarray(y)
+    if y.ndim == 2:
+        if not y.shape[-1]:
+            return np.nan * np.ones(len(y))
+        if remove_outliers:
+            # Each row loses a different number of points, so move the
+            # points we keep to the front of each row and discard the
+            # windows that would not fit in the shortened rows
+            if y.shape[-1] >= 50:
+                ys = y - Smooth(y, 50)
+            else:
+                ys = y
+            M = np.nanmedian(ys, axis=-1, keepdims=True)
+            MAD = 1.4826 * np.nanmedian(np.abs(ys - M), axis=-1,
+                                        keepdims=True)
+            out = (ys > M + 5 * MAD) | (ys < M - 5 * MAD)
+            order = np.argsort(out, axis=-1, kind='mergesort')
+            y = np.take_along_axis(y, order, axis=-1)
+            std = RunningStd(y, win)
+            start = np.arange(max(y.shape[-1] - 2 * win + 1, 0))
+            start = start[start % win != win - 1]
+            nkeep = y.shape[-1] - np.sum(out, axis=-1, keepdims=True)
+            std[start > nkeep - 2 * win] = np.nan
+        else:
+            std = RunningStd(y, win)
+        return 1.e6 * np.nanmedian(std / np.sqrt(win), axis=-1)
+
     if remove_outliers:
         # Remove 5-sigma outliers from data
         # smoothed on a 1 day timescale
@@ -123,15 +218,10 @@ def Scatter(y, win=13, remove_outliers=False):
             ys = y
         M = np.nanmedian(ys)
         MAD = 1.4826 * np.nanmedian(np.abs(ys - M))
-        out = []
-        for i, _ in enumerate(y):
-            if (ys[i] > M + 5 * MAD) or (ys[i] < M - 5 * MAD):
-                out.append(i)
-        out = np.array(out, dtype=int)
+        out = np.where((ys > M + 5 * MAD) | (ys < M - 5 * MAD))[0]
         y = np.delete(y, out)
     if len(y):
-        return 1.e6 * np.nanmedian([np.std(yi) / np.sqrt(win)
-                                    for yi in Chunks(y, win, all=True)])
+        return 1.e6 * np.nanmedian(RunningStd(y, win) / np.sqrt(win))
     else:
         return np.nan
 
@@ -139,16 +229,94 @@ def Scatter(y, win=13, remove_outliers=False):
 def SavGol(y, win=49):
     '''
     Subtracts a second order Savitsky-Golay filter with window size `win`
-    and returns the result. This acts as a high pass filter.
+    and returns the result. This acts as a high pass filter. If `y` is
+    2-d, each of its rows is filtered.
 
     '''
 
-    if len(y) >= win:
-        return y - savgol_filter(y, win, 2) + np.nanmedian(y)
+    y = np.asarray(y)
+    if y.shape[-1] >= win:
+        return y - savgol_filter(y, win, 2, axis=-1) + \
+            np.nanmedian(y, axis=-1, keepdims=True)
     else:
         return y
 
 
+def Gram(X, Y=None, dtype='float64', blocksize=1024):
+    '''
+    Returns the matrix product :math:`X Y^T` accumulated in precision
+    :py:obj:`dtype`. If the regressors are stored at a lower precision
+    (see the `precision` option of :py:class:`everest.Detrender`),
+    they are cast up :py:obj:`blocksize` columns at a time, so that
+    the full design matrix is never held in double precision.
+
+    :param ndarray X: The first design matrix, shape `(N, K)`
+    :param ndarray Y: The second design matrix, shape `(M, K)`. \
+           Default :py:obj:`X`
+    :param dtype: The precision of the result. Default `float64`
+    :param int blocksize: The number of columns to cast at a time. \
+           Default 1024
+
+    '''
+
+    if Y is None:
+        Y = X
+    dtype = np.dtype(dtype)
+    if X.dtype == dtype and Y.dtype == dtype:
+        return np.dot(X, Y.T)
+    res = np.zeros((X.shape[0], Y.shape[0]), dtype=dtype)
+    for k in range(0, X.shape[1], blocksize):
+        Xk = X[:, k:k + blocksize].astype(dtype)
+        Yk = Xk if Y is X else Y[:, k:k + blocksize].astype(dtype)
+        res += np.dot(Xk, Yk.T)
+    return res
+
+
+def ConjugateGradient(A, b, M=None, tol=1e-8, maxiter=None):
+    '''
+    Solves the symmetric positive definite linear system
+    :math:`A x = b` with the preconditioned conjugate gradient method.
+    The matrices are never needed explicitly.
+
+    :param callable A: A function returning the product :math:`A x`
+    :param ndarray b: The right hand side vector
+    :param callable M: A function returning an approximation to \
+           :math:`A^{-1} r` (the preconditioner). Default :py:obj:`None`
+    :param float tol: The tolerance on the norm of the residual, \
+           relative to the norm of :py:obj:`b`. Default `1e-8`
+    :param int maxiter: The maximum number of iterations. \
+           Default `len(b)`
+
+    '''
+
+    if M is None:
+        M = lambda r: r
+    if maxiter is None:
+        maxiter = len(b)
+    x = np.zeros_like(b, dtype=float)
+    bnorm = np.sqrt(np.dot(b, b))
+    if bnorm == 0:
+        return x
+    r = np.array(b, dtype=float)
+    z = M(r)
+    p = np.array(z)
+    rz = np.dot(r, z)
+    for i in range(maxiter):
+        Ap = A(p)
+        alpha = rz / np.dot(p, Ap)
+        x += alpha * p
+        r -= alpha * Ap
+        if np.sqrt(np.dot(r, r)) <= tol * bnorm:
+            break
+        z = M(r)
+        rz, rzold = np.dot(r, z), rz
+        p = z + (rz / rzold) * p
+    else:
+        log.warn("Conjugate gradient did not converge after %d iterations."
+                 % maxiter)
+    return x
+
+
 def NumRegressors(npix, pld_order, cross_terms=True):
     '''
     Return the number of regressors for `npix` pixels
@@ -186,7 +354,7 @@ def Downbin(x, newsize, axis=0, operation='mean'):
     newshape.insert(axis + 1, oldsize // newsize)
     trim = oldsize % newsize
     if trim:
-        xtrim = x[:-trim]
+        xtrim = x[(slice(None),) * axis + (slice(None, -trim),)]
     else:
         xtrim = x
 
@@ -203,3 +371,252 @@ def Downbin(x, newsize, axis=0, operation='mean'):
                          "`sum`, `quadsum`, or `median`.")
 
     return xbin
+
+
+def SysRem(time, flux, err, ncbv=5, niter=50, sv_win=999,
+           sv_order=3, **kwargs):
+    '''
+    Applies :py:obj:`SysRem` to a given set of light curves.
+
+    :param array_like time: The time array for all of the light curves
+    :param array_like flux: A 2D array of the fluxes for each of the light \
+           curves, shape `(nfluxes, ntime)`
+    :param array_like err: A 2D array of the flux errors for each of the \
+           light curves, shape `(nfluxes, ntime)`
+    :param int ncbv: The number of signals to recover. Default 5
+    :param int niter: The number of :py:obj:`SysRem` iterations to perform. \
+           Default 50
+    :param int sv_win: The Savitsky-Golay filter window size. Default 999
+    :param int sv_order: The Savitsky-Golay filter order. Default 3
+
+    '''
+
+    nflx, tlen = flux.shape
+
+    # Get normalized fluxes
+    med = np.nanmedian(flux, axis=1).reshape(-1, 1)
+    y = flux - med
+
+    # Compute the inverse of the variances
+    invvar = 1. / err ** 2
+
+    # The CBVs for this set of fluxes
+    cbvs = np.zeros((ncbv, tlen))
+
+    # Recover `ncbv` components
+    for n in range(ncbv):
+
+        # Initialize the weights and regressors
+        c = np.zeros(nflx)
+        a = np.ones(tlen)
+        f = y * invvar
+
+        # Perform `niter` iterations
+        for i in range(niter):
+
+            # Compute the `c` vector (the weights)
+            c = np.dot(f, a) / np.dot(invvar, a ** 2)
+
+            # Compute the `a` vector (the regressors)
+            a = np.dot(c, f) / np.dot(c ** 2, invvar)
+
+        # Remove this component from all light curves
+        y -= np.outer(c, a)
+
+        # Save this regressor after smoothing it a bit
+        if sv_win >= len(a):
+            sv_win = len(a) - 1
+            if sv_win % 2 == 0:
+                sv_win -= 1
+        cbvs[n] = savgol_filter(a - np.nanmedian(a), sv_win, sv_order)
+
+    return cbvs
+
+
+def CBVFit(X, flux, mask, breakpoints, ncbv=1):
+    '''
+    Regresses the first :py:obj:`ncbv` CBVs (plus an offset) onto one or
+    more de-trended light curves, one light curve segment at a time, and
+    returns the vertically aligned CBV models. The per-segment regressions
+    of all the light curves are set up as weighted normal equations against
+    the shared design matrix :py:obj:`X` and solved in a single batch.
+
+    :param array_like X: The CBV design matrix, shape `(ntime, 1 + nsignals)`
+    :param array_like flux: The de-trended flux, shape `(ntime,)` or \
+           `(nfluxes, ntime)`
+    :param array_like mask: A boolean array of the same shape as \
+           :py:obj:`flux`, :py:obj:`True` for the cadences that should \
+           not be used in the regression
+    :param array_like breakpoints: The index of the last cadence of each \
+           light curve segment
+    :param int ncbv: The number of CBVs to regress on. Default 1
+
+    '''
+
+    ndim = np.ndim(flux)
+    flux = np.atleast_2d(flux)
+    keep = ~np.atleast_2d(np.asarray(mask, dtype=bool))
+    nflx, tlen = flux.shape
+    X = np.asarray(X)[:, :ncbv + 1]
+    nreg = X.shape[1]
+    y = np.where(keep, flux, 0.)
+    rows = np.arange(nflx)
+
+    # Loop over all the light curve segments
+    m = np.full((nflx, tlen), np.nan)
+    prev = None
+    for b in range(len(breakpoints)):
+
+        # Get the indices for this light curve segment
+        if b > 0:
+            inds = slice(breakpoints[b - 1] + 1, breakpoints[b] + 1)
+        else:
+            inds = slice(0, breakpoints[b] + 1)
+        Xb = X[inds]
+
+        # The normal equations of all the light curves at once
+        XX = (Xb[:, :, None] * Xb[:, None, :]).reshape(len(Xb), -1)
+        A = np.dot(keep[:, inds].astype(float), XX).reshape(nflx, nreg, nreg)
+        B = np.dot(y[:, inds], Xb)
+        try:
+            weights = np.linalg.solve(A, B[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            weights = np.zeros_like(B)
+            for j in range(nflx):
+                try:
+                    weights[j] = np.linalg.solve(A[j], B[j])
+                except np.linalg.LinAlgError:
+                    # Singular matrix
+                    log.warn('Singular matrix!')
+        mb = np.dot(weights, Xb.T)
+
+        # Vertical alignment
+        if b == 0:
+            mb -= np.nanmedian(mb, axis=1).reshape(-1, 1)
+        else:
+            # Match the first finite model point on either side of the
+            # break
+            i0 = prev.shape[1] - 1 - \
+                np.argmax(np.isfinite(prev[:, ::-1]), axis=1)
+            i1 = np.argmax(np.isfinite(mb), axis=1)
+            mb += (prev[rows, i0] - mb[rows, i1]).reshape(-1, 1)
+        m[:, inds] = mb
+        prev = mb
+
+    # Normalize
+    m -= np.nanmedian(m, axis=1).reshape(-1, 1)
+    if ndim == 1:
+        return m[0]
+    return m
+
+
+def RandomizedSVD(A, rank, oversample=10, niter=4, seed=42):
+    '''
+    Computes the truncated singular value decomposition of the matrix
+    :py:obj:`A` with the randomized range finder of Halko et al. (2011).
+    Only products of :py:obj:`A` with thin matrices are required, so
+    this is much cheaper than a full SVD when :py:obj:`rank` is small.
+    Returns the tuple `(U, s, Vt)`, with shapes `(m, rank)`, `(rank,)`
+    and `(rank, n)`.
+
+    :param array_like A: The matrix to decompose, shape `(m, n)`
+    :param int rank: The number of singular vectors to compute
+    :param int oversample: The number of extra random vectors used to \
+           sample the range of :py:obj:`A`. Default 10
+    :param int niter: The number of power iterations. Default 4
+    :param int seed: The random seed. Default 42
+
+    '''
+
+    m, n = A.shape
+    k = min(rank + oversample, m, n)
+    Q = np.dot(A, np.random.RandomState(seed).randn(n, k))
+    Q = np.linalg.qr(Q)[0]
+    for i in range(niter):
+        Q = np.linalg.qr(np.dot(A.T, Q))[0]
+        Q = np.linalg.qr(np.dot(A, Q))[0]
+    U, s, Vt = np.linalg.svd(np.dot(Q.T, A), full_matrices=False)
+    U = np.dot(Q, U)
+
+    return U[:, :rank], s[:rank], Vt[:rank]
+
+
+def PixelBasis(X1, rank=20, **kwargs):
+    '''
+    Returns a low-rank basis of the systematics common to a stack of
+    normalized pixel fluxes, i.e., the first order *PLD* vectors of
+    many stars. The columns of :py:obj:`X1` are centered and their
+    first :py:obj:`rank` principal components are computed with
+    :py:func:`RandomizedSVD`; each basis vector is a principal
+    component scaled to the RMS amplitude it has in a single pixel and
+    offset by the mean normalized pixel flux, so that it can be used in
+    place of the neighbor *PLD* vectors at any *PLD* order. Additional
+    keyword arguments are passed to :py:func:`RandomizedSVD`.
+
+    :param array_like X1: The normalized pixel fluxes, shape \
+           `(ntime, npixels)`
+    :param int rank: The number of basis vectors. Default 20
+
+    '''
+
+    mu = np.mean(X1, axis=0)
+    U, s, _ = RandomizedSVD(X1 - mu, min(rank, X1.shape[1]), **kwargs)
+
+    return np.mean(mu) + U * s / np.sqrt(X1.shape[1])
+
+
+def NeighborBasis(file, stars, GetData, rank=20, max_stars=100, seed=0,
+                  clobber=False):
+    '''
+    Returns the :py:func:`PixelBasis` of the normalized pixel fluxes of
+    up to :py:obj:`max_stars` neighboring stars, which
+    :py:class:`everest.detrender.nPLD` uses in place of the neighbor
+    *PLD* vectors. The basis is computed once and saved to
+    :py:obj:`file`; it is returned as a read-only memory-mapped array
+    of shape `(ntime, rank)`.
+
+    :param str file: The path to the `.npy` file the basis is saved to
+    :param stars: The IDs of the candidate stars, or a function that \
+           returns them. The function is only called if the basis has \
+           to be computed.
+    :param GetData: A function that returns the data \
+           (:py:class:`everest.utils.DataContainer`) of a star given \
+           its ID, or :py:obj:`None` if it is not available
+    :param int rank: The number of basis vectors. Default 20
+    :param int max_stars: The maximum number of stars. Default 100
+    :param int seed: The seed used to shuffle the stars before picking \
+           the first :py:obj:`max_stars`. Default 0
+    :param bool clobber: Overwrite existing files? Default `False`
+
+    '''
+
+    if clobber or not os.path.exists(file):
+
+        if callable(stars):
+            stars = stars()
+        stars = list(stars)
+        np.random.RandomState(seed).shuffle(stars)
+        assert len(stars) > 0, "No stars found for the neighbor basis."
+
+        # Stack their normalized pixel fluxes
+        X1 = []
+        for star in stars[:max_stars]:
+            data = GetData(star)
+            if data is None:
+                continue
+            mask = np.union1d(data.badmask, data.nanmask)
+            X1.append(Interpolate(data.time, mask, data.fpix /
+                                  np.sum(data.fpix, axis=1).reshape(-1, 1)))
+            del data
+        X = PixelBasis(np.hstack(X1), rank=rank)
+
+        # Save atomically, since several workers may get here at once
+        path = os.path.dirname(file)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        f = NamedTemporaryFile(suffix='.npy', delete=False, dir=path)
+        np.save(f, X)
+        f.close()
+        os.rename(f.name, file)
+
+    return np.load(file, mmap_mode='r')
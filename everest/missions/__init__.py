@@ -3,7 +3,29 @@
 
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
-from . import k2, kepler, tess
+import sys
+import importlib
+
+#: The mission submodules, imported on first access
+_MISSIONS = ['k2', 'kepler', 'tess', 'synthetic']
 
 #: A list of the currently available missions
-Missions = ['k2']
+Missions = ['k2', 'synthetic']
+
+
+def __getattr__(name):
+    '''
+    Imports the mission module :py:obj:`name` on first access.
+
+    '''
+
+    if name in _MISSIONS:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module '%s' has no attribute '%s'" %
+                         (__name__, name))
+
+
+# Module-level ``__getattr__`` requires Python 3.7 (PEP 562)
+if sys.version_info < (3, 7):
+    for _name in _MISSIONS:
+        __getattr__(_name)
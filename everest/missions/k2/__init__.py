@@ -8,10 +8,31 @@
 
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
-from .k2 import *
-from .sysrem import GetCBVs
-from . import utils, pbs, pipelines, sysrem
-from .pbs import Download, Run, Status, Publish
+import sys
+import importlib
+
+#: The submodules of this mission, imported on first access
+_SUBMODULES = ['k2', 'utils', 'pbs', 'pipelines', 'sysrem', 'stats',
+               'ingest']
+
+#: The public mission functions and the submodule each one lives in
+_ATTRIBUTES = dict([(name, 'k2') for name in
+                    ['Setup', 'Season', 'Breakpoints', 'GetData',
+                     'GetNeighbors', 'GetNeighborBasis', 'Statistics',
+                     'TargetDirectory', 'HasShortCadence', 'DVSFile',
+                     'InjectionStatistics', 'HDUCards', 'CSVFile',
+                     'FITSFile', 'FITSUrl', 'CDPP', 'GetTargetCBVs',
+                     'FitCBVs', 'PlanetStatistics', 'StatsToCSV']] +
+                   [('GetCBVs', 'sysrem'),
+                    ('CollectStatistics', 'stats'),
+                    ('CollectInjectionStatistics', 'stats'),
+                    ('ProfileReport', 'stats'),
+                    ('Download', 'pbs'),
+                    ('Ingest', 'ingest'),
+                    ('Run', 'pbs'),
+                    ('Status', 'pbs'),
+                    ('Publish', 'pbs'),
+                    ('RefreshCBVs', 'pbs')])
 
 #: The string that identifies individual targets for this mission
 IDSTRING = 'EPIC'
@@ -76,3 +97,27 @@ MASK (int):   0 = Data point was included in the model
               3 = Data point was identified as an outlier
 
 '''
+
+
+def __getattr__(name):
+    '''
+    Imports the submodule or mission function :py:obj:`name` on
+    first access.
+
+    '''
+
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    elif name in _ATTRIBUTES:
+        module = importlib.import_module('.' + _ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module '%s' has no attribute '%s'" %
+                         (__name__, name))
+
+
+# Module-level ``__getattr__`` requires Python 3.7 (PEP 562)
+if sys.version_info < (3, 7):
+    for _name in _SUBMODULES + list(_ATTRIBUTES.keys()):
+        globals()[_name] = __getattr__(_name)
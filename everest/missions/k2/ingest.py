@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`ingest.py` - Offline TPF ingestion
+-------------------------------------------
+
+Routines for ingesting a whole campaign from a local mirror of the
+`K2` target pixel files (``ktwo*-targ.fits.gz``) without talking to
+MAST. The TPFs are parsed and preprocessed in parallel by
+:py:func:`everest.missions.k2.GetData`, which writes the usual
+per-target ``data.npz`` caches under ``EVEREST_DAT/k2``. Network-only
+extras are skipped: no high resolution images are retrieved, the
+nearby sources are only computed if a local `EPIC` catalog is
+provided (see :py:class:`everest.missions.k2.utils.SourceCatalog`),
+and the `K2SFF` apertures are only read if the `K2SFF` light curve
+(``hlsp_k2sff_*.fits``) is in the same directory as the TPF.
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from ...config import EVEREST_DAT
+from ...pool import Pool
+from ...utils import FunctionWrapper
+from .k2 import GetData
+from .utils import K2SFFFile
+import os
+import re
+import sys
+import traceback
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = ['FindTPFs', 'IngestTarget', 'Ingest']
+
+#: Matches the file names of the `K2` target pixel files
+TPFREGEX = re.compile(
+    r'^ktwo(\d{9})-c(\d+)_(lpd|spd)-targ\.fits(\.gz)?$')
+
+
+def FindTPFs(path, campaign=None):
+    '''
+    Recursively searches the directory :py:obj:`path` for `K2` target
+    pixel files. Returns a sorted list of tuples
+    ``(EPIC, campaign, tpf, sc_tpf)``, where ``tpf`` and ``sc_tpf``
+    are the paths to the long and short cadence files. Targets
+    without a long cadence file are skipped; ``sc_tpf`` is
+    :py:obj:`None` if there is no short cadence file.
+
+    :param str path: The root of the local TPF mirror
+    :param int campaign: If set, only return targets observed \
+           in this campaign. Default :py:obj:`None`
+
+    '''
+
+    files = {}
+    for root, _, names in os.walk(path):
+        for name in names:
+            match = TPFREGEX.match(name)
+            if match is None:
+                continue
+            EPIC, c, kind, _ = match.groups()
+            key = (int(EPIC), int(c))
+            if (campaign is not None) and (key[1] != int(campaign)):
+                continue
+            files.setdefault(key, {})[kind] = os.path.join(root, name)
+
+    targets = []
+    for (EPIC, c), f in sorted(files.items()):
+        if 'lpd' not in f:
+            log.warn("No long cadence TPF found for EPIC %d." % EPIC)
+            continue
+        targets.append((EPIC, c, f['lpd'], f.get('spd', None)))
+
+    return targets
+
+
+def _DataFile(EPIC, campaign):
+    '''
+
+    '''
+
+    return os.path.join(EVEREST_DAT, 'k2', 'c%02d' % int(campaign),
+                        ('%09d' % EPIC)[:4] + '00000',
+                        ('%09d' % EPIC)[4:], 'data.npz')
+
+
+def IngestTarget(target, catalog=None, **kwargs):
+    '''
+    Preprocesses a single target from its local TPFs and writes
+    its ``data.npz`` cache. :py:obj:`target` is one of the tuples
+    returned by :py:func:`FindTPFs`. Returns :py:obj:`True` on
+    success and :py:obj:`False` if the TPF could not be processed.
+
+    '''
+
+    EPIC, campaign, tpf, sc_tpf = target
+    k2sff = os.path.join(os.path.dirname(tpf), K2SFFFile(EPIC, campaign))
+    if not os.path.exists(k2sff):
+        k2sff = None
+    try:
+        GetData(EPIC, season=campaign, tpf=tpf, sc_tpf=sc_tpf,
+                download_only=True, get_hires=False,
+                get_nearby=catalog is not None, catalog=catalog,
+                get_k2sff=False, k2sff=k2sff, delete_raw=False, **kwargs)
+    except KeyboardInterrupt:
+        sys.exit()
+    except:
+        # Some targets could be corrupted...
+        log.error("Error ingesting EPIC %d." % EPIC)
+        exctype, value, tb = sys.exc_info()
+        for line in traceback.format_exception_only(exctype, value):
+            log.error(line.replace('\n', ''))
+        return False
+
+    return True
+
+
+def Ingest(path, campaign=None, catalog=None, clobber=False,
+           pool='AnyPool', **kwargs):
+    '''
+    Ingests all target pixel files in the local directory
+    :py:obj:`path` in parallel, writing the per-target ``data.npz``
+    caches that :py:func:`everest.missions.k2.GetData` reads.
+    Targets that already have a cache are skipped unless
+    :py:obj:`clobber` is set. Returns the list of `EPIC` IDs that
+    could not be ingested.
+
+    :param str path: The root of the local TPF mirror
+    :param int campaign: Only ingest targets observed in this \
+           campaign. Default :py:obj:`None` (all campaigns)
+    :param str catalog: The path to a local `EPIC` catalog file used \
+           to find nearby sources. If :py:obj:`None` (default), nearby \
+           sources are not computed
+    :param bool clobber: Overwrite existing caches? \
+           Default :py:obj:`False`
+    :param str pool: The :py:mod:`everest.pool` to use. Default `AnyPool`
+
+    Additional keyword arguments are passed to \
+    :py:func:`everest.missions.k2.GetData`.
+
+    '''
+
+    targets = FindTPFs(path, campaign=campaign)
+    if not clobber:
+        targets = [t for t in targets if not os.path.exists(
+            _DataFile(t[0], t[1]))]
+    log.info("Ingesting %d target(s) from `%s`..." % (len(targets), path))
+    if len(targets) == 0:
+        return []
+
+    f = FunctionWrapper(IngestTarget, catalog=catalog, clobber=True,
+                        **kwargs)
+    with Pool(pool) as p:
+        success = list(p.map(f, targets))
+    failed = [t[0] for t, s in zip(targets, success) if not s]
+    log.info("Ingested %d/%d target(s)." %
+             (len(targets) - len(failed), len(targets)))
+
+    return failed
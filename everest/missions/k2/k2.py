@@ -14,9 +14,12 @@ from . import sysrem
 from .utils import *
 from ...config import EVEREST_SRC, EVEREST_DAT, EVEREST_DEV, MAST_ROOT, \
      EVEREST_MAJOR_MINOR
-from ...utils import DataContainer, sort_like, AP_COLLAPSED_PIXEL, \
-     AP_SATURATED_PIXEL
-from ...mathutils import SavGol, Interpolate, Scatter, Downbin
+from ...utils import DataContainer, sort_like, LazyModule, IndexMap
+from ...mathutils import SavGol, Interpolate, Scatter, Downbin, CBVFit
+from ...modelstore import LoadModel
+from .stats import CollectStatistics, ReadStatistics, StatisticsFile, \
+     ProfileReport, CollectInjectionStatistics, ReadInjectionStatistics, \
+     InjectionStatisticsFile
 try:
     import pyfits
 except ImportError:
@@ -24,21 +27,16 @@ except ImportError:
         import astropy.io.fits as pyfits
     except ImportError:
         raise Exception('Please install the `pyfits` package.')
-import matplotlib.pyplot as pl
-from matplotlib.ticker import ScalarFormatter, MaxNLocator
 import k2plr as kplr
-kplr_client = kplr.API()
-from k2plr.config import KPLR_ROOT
 import numpy as np
-import george
 from tempfile import NamedTemporaryFile
 import random
 import os
-import sys
 import shutil
 import time
 import logging
 log = logging.getLogger(__name__)
+pl = LazyModule('matplotlib.pyplot')
 
 __all__ = ['Setup', 'Season', 'Breakpoints', 'GetData', 'GetNeighbors',
            'Statistics', 'TargetDirectory', 'HasShortCadence', 'DVSFile',
@@ -168,7 +166,8 @@ def Breakpoints(EPIC, season=None, cadence='lc', **kwargs):
 
 def CDPP(flux, mask=[], cadence='lc'):
     '''
-    Compute the proxy 6-hr CDPP metric.
+    Compute the proxy 6-hr CDPP metric. If :py:obj:`flux` is a 2-d
+    stack of light curves (one per row), returns the CDPP of each.
 
     :param array_like flux: The flux array to compute the CDPP for
     :param array_like mask: The indices to be masked
@@ -182,14 +181,19 @@ def CDPP(flux, mask=[], cadence='lc'):
     svgwin = 49
 
     # If short cadence, need to downbin
+    flux = np.asarray(flux)
     if cadence == 'sc':
-        newsize = len(flux) // 30
-        flux = Downbin(flux, newsize, operation='mean')
-
-    flux_savgol = SavGol(np.delete(flux, mask), win=svgwin)
-    if len(flux_savgol):
-        return Scatter(flux_savgol / np.nanmedian(flux_savgol),
+        newsize = flux.shape[-1] // 30
+        flux = Downbin(flux, newsize, axis=flux.ndim - 1, operation='mean')
+
+    flux = np.delete(flux, mask, axis=-1)
+    flux_savgol = SavGol(flux, win=svgwin)
+    if flux_savgol.shape[-1]:
+        return Scatter(flux_savgol / np.nanmedian(flux_savgol, axis=-1,
+                                                  keepdims=True),
                        remove_outliers=True, win=rmswin)
+    elif flux_savgol.ndim == 2:
+        return np.nan * np.ones(len(flux_savgol))
     else:
         return np.nan
 
@@ -198,8 +202,8 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
             aperture_name='k2sff_15', saturated_aperture_name='k2sff_19',
             max_pixels=75, download_only=False, saturation_tolerance=-0.1,
             bad_bits=[1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 12, 13, 14, 16, 17],
-            get_hires=True,
-            get_nearby=True, **kwargs):
+            get_hires=True, get_nearby=True, tpf=None, sc_tpf=None,
+            catalog=None, get_k2sff=True, k2sff=None, **kwargs):
     '''
     Returns a :py:obj:`DataContainer` instance with the
     raw data for the target.
@@ -227,6 +231,22 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
            Default :py:obj:`True`
     :param bool get_nearby: Retrieve location of nearby sources? \
            Default :py:obj:`True`
+    :param str tpf: The path to a local long cadence target pixel file. \
+           If set, nothing is downloaded from MAST. Default :py:obj:`None`
+    :param str sc_tpf: The path to a local short cadence target pixel \
+           file. Only used if :py:obj:`tpf` is set. Default :py:obj:`None`
+    :param catalog: The path to a local `EPIC` catalog (or a catalog \
+           backend) used to find nearby sources instead of querying \
+           MAST. See \
+           :py:func:`everest.missions.k2.utils.GetSourceCatalog`. \
+           Default :py:obj:`None`
+    :param bool get_k2sff: Download the `K2SFF` light curve to get its \
+           apertures? If :py:obj:`False` (i.e., offline) and \
+           :py:obj:`k2sff` is not set, the `k2sff_*` apertures are not \
+           available and `tpf_big` is used instead. \
+           Default :py:obj:`True`
+    :param str k2sff: The path to a local `K2SFF` light curve file to \
+           read the apertures from. Default :py:obj:`None`
 
     '''
 
@@ -241,7 +261,10 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
         campaign = season
 
     # Is there short cadence data available for this target?
-    short_cadence = HasShortCadence(EPIC, season=campaign)
+    if tpf is not None:
+        short_cadence = sc_tpf is not None
+    else:
+        short_cadence = HasShortCadence(EPIC, season=campaign)
     if cadence == 'sc' and not short_cadence:
         raise ValueError("Short cadence data not available for this target.")
 
@@ -254,14 +277,19 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
     if clobber or not os.path.exists(filename):
 
         # Get the TPF
-        tpf = os.path.join(KPLR_ROOT, 'data', 'k2', 'target_pixel_files',
-                           str(EPIC), 'ktwo%09d-c%02d_lpd-targ.fits.gz'
-                           % (EPIC, campaign))
-        sc_tpf = os.path.join(KPLR_ROOT, 'data', 'k2', 'target_pixel_files',
-                              str(EPIC), 'ktwo%09d-c%02d_spd-targ.fits.gz'
-                              % (EPIC, campaign))
-        if clobber or not os.path.exists(tpf):
-            kplr_client.k2_star(EPIC).get_target_pixel_files(fetch=True)
+        local = tpf is not None
+        if not local:
+            tpf = TPFFile(EPIC, campaign, 'lc')
+            sc_tpf = TPFFile(EPIC, campaign, 'sc')
+            if clobber or not os.path.exists(tpf):
+                targets = [(EPIC, 'lc')]
+                if short_cadence:
+                    targets.append((EPIC, 'sc'))
+                if any([isinstance(r, Exception) for r in
+                        DownloadTPFs(targets, campaign, clobber=clobber)]):
+                    # Let `k2plr` try its luck
+                    KPLRClient().k2_star(EPIC).get_target_pixel_files(
+                        fetch=True)
 
         with pyfits.open(tpf) as f:
             qdata = f[1].data
@@ -288,13 +316,23 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
                 sc_qdata = f[1].data
 
         # Get K2SFF apertures
-        try:
-            k2sff = kplr.K2SFF(EPIC, sci_campaign=campaign)
-            k2sff_apertures = k2sff.apertures
-            if delete_raw:
-                os.remove(k2sff._file)
-        except:
-            k2sff_apertures = [None for i in range(20)]
+        k2sff_apertures = [None for i in range(20)]
+        if k2sff is not None:
+            try:
+                k2sff_apertures = K2SFFApertures(k2sff)
+            except (IOError, OSError, KeyError):
+                pass
+        elif get_k2sff:
+            try:
+                k2sff = kplr.K2SFF(EPIC, sci_campaign=campaign)
+                k2sff_apertures = k2sff.apertures
+                if delete_raw:
+                    os.remove(k2sff._file)
+            except:
+                pass
+        if k2sff_apertures[15] is None:
+            log.warn("K2SFF apertures not available for EPIC %d. " % EPIC +
+                     "The `k2sff_*` apertures will default to `tpf_big`.")
 
         # Make a dict of all our apertures
         # We're not getting K2SFF apertures 0-9 any more
@@ -321,12 +359,13 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
 
         # Get nearby sources
         if get_nearby:
-            nearby = GetSources(EPIC)
+            nearby = GetSources(EPIC, tpf=tpf if local else None,
+                                catalog=catalog)
         else:
             nearby = []
 
-        # Delete?
-        if delete_raw:
+        # Delete? (Never delete local copies)
+        if delete_raw and not local:
             os.remove(tpf)
             if short_cadence:
                 os.remove(sc_tpf)
@@ -409,7 +448,7 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
             return
 
     # Load
-    data = np.load(filename)
+    data = np.load(filename, allow_pickle=True)
     apertures = data['apertures'][()]
     pixel_images = data['pixel_images']
     nearby = data['nearby']
@@ -461,25 +500,8 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
     # to compare these to decide if the star is saturated.
     satflx = SaturationFlux(EPIC, campaign=campaign) * \
         (1. + saturation_tolerance)
-    f97 = np.zeros((fpix.shape[1], fpix.shape[2]))
-    for i in range(fpix.shape[1]):
-        for j in range(fpix.shape[2]):
-            if saturated_aperture[i, j]:
-                # Let's remove NaNs...
-                tmp = np.delete(fpix[:, i, j], np.where(
-                    np.isnan(fpix[:, i, j])))
-                # ... and really bad outliers...
-                if len(tmp):
-                    f = SavGol(tmp)
-                    med = np.nanmedian(f)
-                    MAD = 1.4826 * np.nanmedian(np.abs(f - med))
-                    bad = np.where((f > med + 10. * MAD) |
-                                   (f < med - 10. * MAD))[0]
-                    np.delete(tmp, bad)
-                    # ... so we can compute the 97.5th percentile flux
-                    i97 = int(0.975 * len(tmp))
-                    tmp = tmp[np.argsort(tmp)[i97]]
-                    f97[i, j] = tmp
+    f97 = PixelPercentileFlux(fpix, saturated_aperture, 97.5)
+    satcols = np.any(f97 > satflx, axis=0)
 
     # Check if any of the pixels are actually saturated
     if np.nanmax(f97) <= satflx:
@@ -529,12 +551,9 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
         for aperture_name in aperture_names:
             aperture = apertures[aperture_name]
             aperture[np.isnan(fpix[0])] = 0
-            ncol = 0
             apcopy = np.array(aperture)
-            for j in range(apcopy.shape[1]):
-                if np.any(f97[:, j] > satflx):
-                    apcopy[:, j] = 0
-                    ncol += 1
+            apcopy[:, satcols] = 0
+            ncol = np.sum(satcols)
             if np.sum(apcopy) + ncol <= max_pixels:
                 break
         if np.sum(apcopy) + ncol > max_pixels:
@@ -545,9 +564,6 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
 
         # Now, finally, we collapse the saturated columns into single pixels
         # and make the pixel array 2D
-        ncol = 0
-        fpixnew = []
-        ferrnew = []
 
         # HACK: K2SFF sometimes clips the heads/tails of saturated columns
         # That's really bad, since that's where all the information is. Let's
@@ -555,54 +571,11 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
         # of each saturated column. This *could* increase contamination, but
         # it's unlikely since the saturated target is by definition really
         # bright
-        ext = 0
-        for j in range(aperture.shape[1]):
-            if np.any(f97[:, j] > satflx):
-                for i in range(aperture.shape[0]):
-                    if (aperture[i, j] == 0) and \
-                            (np.nanmedian(fpix[:, i, j]) > 0):
-                        if (i + 2 < aperture.shape[0]) and \
-                                aperture[i + 2, j] == 1:
-                            aperture[i, j] = 2
-                            ext += 1
-                        elif (i + 1 < aperture.shape[0]) and \
-                                aperture[i + 1, j] == 1:
-                            aperture[i, j] = 2
-                            ext += 1
-                        elif (i - 1 >= 0) and aperture[i - 1, j] == 1:
-                            aperture[i, j] = 2
-                            ext += 1
-                        elif (i - 2 >= 0) and aperture[i - 2, j] == 1:
-                            aperture[i, j] = 2
-                            ext += 1
+        ext = ExtendSaturatedColumns(fpix, aperture, satcols)
         if ext:
             log.info("Extended saturated columns by %d pixel(s)." % ext)
-
-        for j in range(aperture.shape[1]):
-            if np.any(f97[:, j] > satflx):
-                marked = False
-                collapsed = np.zeros(len(fpix[:, 0, 0]))
-                collapsed_err2 = np.zeros(len(fpix[:, 0, 0]))
-                for i in range(aperture.shape[0]):
-                    if aperture[i, j]:
-                        if not marked:
-                            aperture[i, j] = AP_COLLAPSED_PIXEL
-                            marked = True
-                        else:
-                            aperture[i, j] = AP_SATURATED_PIXEL
-                        collapsed += fpix[:, i, j]
-                        collapsed_err2 += fpix_err[:, i, j] ** 2
-                if np.any(collapsed):
-                    fpixnew.append(collapsed)
-                    ferrnew.append(np.sqrt(collapsed_err2))
-                    ncol += 1
-            else:
-                for i in range(aperture.shape[0]):
-                    if aperture[i, j]:
-                        fpixnew.append(fpix[:, i, j])
-                        ferrnew.append(fpix_err[:, i, j])
-        fpix2D = np.array(fpixnew).T
-        fpix_err2D = np.array(ferrnew).T
+        fpix2D, fpix_err2D, ncol = CollapseSaturatedColumns(
+            fpix, fpix_err, aperture, satcols)
         log.info("Collapsed %d saturated column(s)." % ncol)
 
     else:
@@ -628,18 +601,18 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
         # Make the pixel flux array 2D
         aperture[np.isnan(fpix[0])] = 0
         ap = np.where(aperture & 1)
-        fpix2D = np.array([f[ap] for f in fpix], dtype='float64')
-        fpix_err2D = np.array([p[ap] for p in fpix_err], dtype='float64')
+        fpix2D = np.array(fpix[:, ap[0], ap[1]], dtype='float64')
+        fpix_err2D = np.array(fpix_err[:, ap[0], ap[1]], dtype='float64')
 
     # Compute the background
     binds = np.where(aperture ^ 1)
     if RemoveBackground(EPIC, campaign=campaign) and (len(binds[0]) > 0):
-        bkg = np.nanmedian(np.array([f[binds]
-                                     for f in fpix], dtype='float64'), axis=1)
+        bkg = np.nanmedian(np.array(fpix[:, binds[0], binds[1]],
+                                    dtype='float64'), axis=1)
         # Uncertainty of the median:
         # http://davidmlane.com/hyperstat/A106993.html
-        bkg_err = 1.253 * np.nanmedian(np.array([e[binds] for e in fpix_err],
-                                       dtype='float64'), axis=1) \
+        bkg_err = 1.253 * np.nanmedian(np.array(
+            fpix_err[:, binds[0], binds[1]], dtype='float64'), axis=1) \
             / np.sqrt(len(binds[0]))
         bkg = bkg.reshape(-1, 1)
         bkg_err = bkg_err.reshape(-1, 1)
@@ -662,14 +635,12 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
         badmask += list(np.where(qual & 2 ** (b - 1))[0])
 
     # Flag >10 sigma outliers -- same thing.
-    tmpmask = np.array(list(set(np.concatenate([badmask, nanmask]))))
-    t = np.delete(time, tmpmask)
-    f = np.delete(flux, tmpmask)
-    f = SavGol(f)
+    imap = IndexMap(len(time), np.concatenate([badmask, nanmask]))
+    f = SavGol(imap.apply(flux))
     med = np.nanmedian(f)
     MAD = 1.4826 * np.nanmedian(np.abs(f - med))
     bad = np.where((f > med + 10. * MAD) | (f < med - 10. * MAD))[0]
-    badmask.extend([np.argmax(time == t[i]) for i in bad])
+    badmask.extend(imap.unmask(bad))
 
     # Campaign 2 hack: the first day or two are screwed up
     if campaign == 2:
@@ -682,8 +653,8 @@ def GetData(EPIC, season=None, cadence='lc', clobber=False, delete_raw=False,
     badmask = np.array(sorted(list(set(badmask))))
 
     # Interpolate the nans
-    fpix = Interpolate(time, nanmask, fpix)
-    fpix_err = Interpolate(time, nanmask, fpix_err)
+    fpix = Interpolate(time, nanmask, fpix, inplace=True)
+    fpix_err = Interpolate(time, nanmask, fpix_err, inplace=True)
 
     # Return
     data = DataContainer()
@@ -812,7 +783,8 @@ def GetNeighbors(EPIC, season=None, model=None, neighbors=10,
             # doing neighboring PLD.
             contam = False
             data = np.load(os.path.join(
-                TargetDirectory(star, campaign), 'data.npz'))
+                TargetDirectory(star, campaign), 'data.npz'),
+                allow_pickle=True)
             aperture = data['apertures'][()][aperture_name]
 
             # Check that the aperture exists!
@@ -863,8 +835,9 @@ def GetNeighbors(EPIC, season=None, model=None, neighbors=10,
 
                 # Reject if CDPP out of range
                 if cdpp_range is not None:
-                    cdpp = np.load(os.path.join(TargetDirectory(
-                        star, campaign), model + '.npz'))['cdpp']
+                    with LoadModel(os.path.join(TargetDirectory(
+                            star, campaign), model + '.npz')) as m:
+                        cdpp = m['cdpp']
                     if (cdpp > cdpp_hi) or (cdpp < cdpp_lo):
                         continue
 
@@ -881,6 +854,31 @@ def GetNeighbors(EPIC, season=None, model=None, neighbors=10,
     return targets
 
 
+def GetNeighborBasis(EPIC, season=None, cadence='lc', **kwargs):
+    '''
+    Returns the low-rank basis of the systematics common to the bright
+    stars on the same module as `EPIC`, as a memory-mapped array of shape
+    `(ntime, rank)`. It is computed once per campaign, module and ID
+    parity by :py:func:`everest.missions.k2.sysrem.GetBasis`, to which
+    the keyword arguments are passed; the basis returned here never
+    includes the target itself.
+
+    :param int EPIC: The EPIC ID number
+    :param str cadence: The light curve cadence. Default `lc`
+
+    '''
+
+    if season is None:
+        season = Season(EPIC)
+        if hasattr(season, '__len__'):
+            raise AttributeError(
+                "Please choose a campaign/season for this target: %s."
+                % season)
+
+    return sysrem.GetBasis(season, Module(EPIC, campaign=season),
+                           cadence=cadence, fold=EPIC % 2, **kwargs)
+
+
 def PlanetStatistics(model='nPLD', compare_to='k2sff', **kwargs):
     '''
     Computes and plots the CDPP statistics comparison between `model` and
@@ -905,29 +903,45 @@ def PlanetStatistics(model='nPLD', compare_to='k2sff', **kwargs):
     # Get the stats
     for c in set(campaign):
 
-        # Everest model
-        f = os.path.join(EVEREST_SRC, 'missions', 'k2',
-                         'tables', 'c%02d_%s.cdpp' % (int(c), model))
-        e0, _, _, c0, _, _, _, _, s0 = np.loadtxt(f, unpack=True, skiprows=2)
-        for i, e in enumerate(epic):
-            if e in e0:
-                j = np.argmax(e0 == e)
+        # The planet hosts observed in this campaign
+        hosts = np.where(campaign == c)[0]
+
+        # Everest model. The columnar table is updated incrementally,
+        # so only targets that were (re-)run since the last call are read
+        if os.path.exists(StatisticsFile(c, model)):
+            table = CollectStatistics(c, model=model)
+            e0, c0, s0 = table['EPIC'], table['cdpp'], table['saturated']
+        else:
+            f = os.path.join(EVEREST_SRC, 'missions', 'k2',
+                             'tables', 'c%02d_%s.cdpp' % (int(c), model))
+            e0, _, _, c0, _, _, _, _, s0 = np.loadtxt(f, unpack=True,
+                                                      skiprows=2)
+        rows = dict((int(e), j) for j, e in enumerate(e0))
+        for i in hosts:
+            j = rows.get(epic[i], None)
+            if j is not None:
                 cdpp[i] = c0[j]
                 saturated[i] = s0[j]
 
         # Comparison model
-        f = os.path.join(EVEREST_SRC, 'missions', 'k2', 'tables',
-                         'c%02d_%s.cdpp' % (int(c), compare_to.lower()))
-        if not os.path.exists(f):
-            continue
-        if compare_to.lower() in ['everest1', 'k2sff', 'k2sc']:
-            e1, c1 = np.loadtxt(f, unpack=True, skiprows=2)
+        if compare_to.lower() not in ['everest1', 'k2sff', 'k2sc'] and \
+                os.path.exists(StatisticsFile(c, compare_to)):
+            table = ReadStatistics(c, compare_to)
+            e1, c1 = table['EPIC'], table['cdpp']
         else:
-            e1, _, _, c1, _, _, _, _, _ = np.loadtxt(
-                f, unpack=True, skiprows=2)
-        for i, e in enumerate(epic):
-            if e in e1:
-                j = np.argmax(e1 == e)
+            f = os.path.join(EVEREST_SRC, 'missions', 'k2', 'tables',
+                             'c%02d_%s.cdpp' % (int(c), compare_to.lower()))
+            if not os.path.exists(f):
+                continue
+            if compare_to.lower() in ['everest1', 'k2sff', 'k2sc']:
+                e1, c1 = np.loadtxt(f, unpack=True, skiprows=2)
+            else:
+                e1, _, _, c1, _, _, _, _, _ = np.loadtxt(
+                    f, unpack=True, skiprows=2)
+        rows = dict((int(e), j) for j, e in enumerate(e1))
+        for i in hosts:
+            j = rows.get(epic[i], None)
+            if j is not None:
                 cdpp_1[i] = c1[j]
 
     sat = np.where(saturated == 1)
@@ -990,31 +1004,10 @@ def ShortCadenceStatistics(campaign=None, clobber=False, model='nPLD',
             camp, cadence='sc', epics_only=True), dtype=int)
         outfile = os.path.join(EVEREST_SRC, 'missions', 'k2',
                                'tables', 'c%02d_%s.cdpp' % (int(camp), model))
-        if clobber or not os.path.exists(outfile):
-            with open(outfile, 'w') as f:
-                print("EPIC               Kp           Raw CDPP     " +
-                      "Everest CDPP      Saturated", file=f)
-                print("---------          ------       ---------    " +
-                      "------------      ---------", file=f)
-                all = GetK2Campaign(int(camp), cadence='sc')
-                stars = np.array([s[0] for s in all], dtype=int)
-                kpmgs = np.array([s[1] for s in all], dtype=float)
-                for i, _ in enumerate(stars):
-                    sys.stdout.write(
-                        '\rProcessing target %d/%d...' % (i + 1, len(stars)))
-                    sys.stdout.flush()
-                    nf = os.path.join(EVEREST_DAT, 'k2', 'c%02d' % camp,
-                                      ('%09d' % stars[i])[:4] + '00000',
-                                      ('%09d' % stars[i])[4:], model + '.npz')
-                    try:
-                        data = np.load(nf)
-                        print("{:>09d} {:>15.3f} {:>15.3f} {:>15.3f} {:>15d}".format(
-                              stars[i], kpmgs[i], data['cdppr'][()], data['cdpp'][()],
-                              int(data['saturated'])), file=f)
-                    except:
-                        print("{:>09d} {:>15.3f} {:>15.3f} {:>15.3f} {:>15d}".format(
-                            stars[i], kpmgs[i], np.nan, np.nan, 0), file=f)
-                print("")
+        if clobber or not os.path.exists(outfile) or \
+                os.path.exists(StatisticsFile(camp, model)):
+            CollectStatistics(camp, model=model, cadence='sc',
+                              clobber=clobber)
 
     if not plot:
         return
@@ -1036,8 +1029,14 @@ def ShortCadenceStatistics(campaign=None, clobber=False, model='nPLD',
             camp, cadence='sc', epics_only=True), dtype=int)
         outfile = os.path.join(EVEREST_SRC, 'missions', 'k2',
                                'tables', 'c%02d_%s.cdpp' % (int(camp), model))
-        epic, kp, cdpp6r, cdpp6, saturated = np.loadtxt(
-            outfile, unpack=True, skiprows=2)
+        table = ReadStatistics(camp, model)
+        if table is not None:
+            epic, kp, cdpp6r, cdpp6, saturated = \
+                [table[k] for k in ['EPIC', 'Kp', 'cdppr', 'cdpp',
+                                    'saturated']]
+        else:
+            epic, kp, cdpp6r, cdpp6, saturated = np.loadtxt(
+                outfile, unpack=True, skiprows=2)
         epic = np.array(epic, dtype=int)
         saturated = np.array(saturated, dtype=int)
 
@@ -1121,7 +1120,7 @@ def ShortCadenceStatistics(campaign=None, clobber=False, model='nPLD',
 
 def Statistics(season=None, clobber=False, model='nPLD', injection=False,
                compare_to='kepler', plot=True, cadence='lc', planets=False,
-               **kwargs):
+               profile=False, **kwargs):
     '''
     Computes and plots the CDPP statistics comparison between `model`
     and `compare_to` for all long cadence light curves in a given campaign
@@ -1137,6 +1136,9 @@ def Statistics(season=None, clobber=False, model='nPLD', injection=False,
            :py:obj:`False`
     :param bool planets: Statistics for known K2 planets? \
            Default :py:obj:`False`
+    :param bool profile: Print and return the campaign hot-spot report \
+           (see :py:func:`everest.missions.k2.ProfileReport`) instead of \
+           plotting the CDPP? Default :py:obj:`False`
 
     '''
 
@@ -1161,69 +1163,31 @@ def Statistics(season=None, clobber=False, model='nPLD', injection=False,
         return InjectionStatistics(campaign=campaign, clobber=clobber,
                                    model=model, plot=plot, **kwargs)
 
-    # Compute the statistics
+    # Compute the statistics. The columnar table is updated
+    # incrementally, so only targets that were (re-)run since
+    # the last call are processed.
     sub = np.array([s[0] for s in GetK2Campaign(campaign)], dtype=int)
     outfile = os.path.join(EVEREST_SRC, 'missions', 'k2',
                            'tables', 'c%02d_%s.cdpp' % (int(campaign), model))
-    if clobber or not os.path.exists(outfile):
-        with open(outfile, 'w') as f:
-            print("EPIC               Kp           Raw CDPP     Everest CDPP" +
-                  "      Validation        Outliers[1]     Outliers[2]     " +
-                  "Datapoints     Saturated", file=f)
-            print("---------          ------       ---------    ------------" +
-                  "      ----------        -----------     -----------     " +
-                  "----------     ---------", file=f)
-            all = GetK2Campaign(int(campaign))
-            stars = np.array([s[0] for s in all], dtype=int)
-            kpmgs = np.array([s[1] for s in all], dtype=float)
-            for i, _ in enumerate(stars):
-                sys.stdout.write('\rProcessing target %d/%d...' %
-                                 (i + 1, len(stars)))
-                sys.stdout.flush()
-                nf = os.path.join(EVEREST_DAT, 'k2', 'c%02d' % campaign,
-                                  ('%09d' % stars[i])[:4] + '00000',
-                                  ('%09d' % stars[i])[4:], model + '.npz')
-                try:
-                    data = np.load(nf)
-
-                    # Remove NaNs and flagged cadences
-                    flux = np.delete(data['fraw'] - data['model'], np.array(
-                        list(set(np.concatenate([data['nanmask'],
-                                                 data['badmask']])))))
-                    # Iterative sigma clipping to get 5 sigma outliers
-                    inds = np.array([], dtype=int)
-                    m = 1
-                    while len(inds) < m:
-                        m = len(inds)
-                        ff = SavGol(np.delete(flux, inds))
-                        med = np.nanmedian(ff)
-                        MAD = 1.4826 * np.nanmedian(np.abs(ff - med))
-                        inds = np.append(inds, np.where(
-                            (ff > med + 5. * MAD) | (ff < med - 5. * MAD))[0])
-                    nout = len(inds)
-                    ntot = len(flux)
-
-                    # HACK: Backwards compatibility fix
-                    try:
-                        cdpp = data['cdpp'][()]
-                    except KeyError:
-                        cdpp = data['cdpp6'][()]
-
-                    print("{:>09d} {:>15.3f} {:>15.3f} {:>15.3f} {:>15.3f} {:>15d} {:>15d} {:>15d} {:>15d}".format(
-                          stars[i], kpmgs[i], data['cdppr'][()], cdpp,
-                          data['cdppv'][()], len(data['outmask']), nout,
-                          ntot, int(data['saturated'])), file=f)
-                except:
-                    print("{:>09d} {:>15.3f} {:>15.3f} {:>15.3f} {:>15.3f} {:>15d} {:>15d} {:>15d} {:>15d}".format(
-                          stars[i], kpmgs[i], np.nan, np.nan,
-                          np.nan, 0, 0, 0, 0), file=f)
-            print("")
+    if clobber or not os.path.exists(outfile) or \
+            os.path.exists(StatisticsFile(campaign, model)):
+        CollectStatistics(campaign, model=model, clobber=clobber)
+
+    # Where did the time go?
+    if profile:
+        return ProfileReport(campaign, model=model)
 
     if plot:
 
         # Load all stars
-        epic, kp, cdpp6r, cdpp6, cdpp6v, _, out, tot, saturated = np.loadtxt(
-            outfile, unpack=True, skiprows=2)
+        table = ReadStatistics(campaign, model)
+        if table is not None:
+            epic, kp, cdpp6r, cdpp6, cdpp6v, out, tot, saturated = \
+                [table[k] for k in ['EPIC', 'Kp', 'cdppr', 'cdpp', 'cdppv',
+                                    'outliers5', 'datapoints', 'saturated']]
+        else:
+            epic, kp, cdpp6r, cdpp6, cdpp6v, _, out, tot, saturated = \
+                np.loadtxt(outfile, unpack=True, skiprows=2)
         epic = np.array(epic, dtype=int)
         out = np.array(out, dtype=int)
         tot = np.array(tot, dtype=int)
@@ -1481,64 +1445,38 @@ def InjectionStatistics(campaign=0, clobber=False, model='nPLD', plot=True,
 
     '''
 
-    # Compute the statistics
-    stars = GetK2Campaign(campaign, epics_only=True)
+    from matplotlib.ticker import MaxNLocator
+
+    # Compute the statistics. The columnar table is updated
+    # incrementally, so only the injection runs that were (re-)run
+    # since the last call are processed.
     if type(campaign) is int:
         outfile = os.path.join(EVEREST_SRC, 'missions', 'k2',
                                'tables', 'c%02d_%s.inj' % (campaign, model))
     else:
         outfile = os.path.join(EVEREST_SRC, 'missions', 'k2',
                                'tables', 'c%04.1f_%s.inj' % (campaign, model))
-    if clobber or not os.path.exists(outfile):
-        with open(outfile, 'w') as f:
-            print("EPIC         Depth         UControl      URecovered"+
-                  "    MControl      MRecovered", file=f)
-            print("---------    ----------    ----------    ----------"+
-                  "    ----------    ----------", file=f)
-            for i, _ in enumerate(stars):
-                sys.stdout.write('\rProcessing target %d/%d...' %
-                                 (i + 1, len(stars)))
-                sys.stdout.flush()
-                path = os.path.join(EVEREST_DAT, 'k2', 'c%02d' % int(campaign),
-                                    ('%09d' % stars[i])[:4] + '00000',
-                                    ('%09d' % stars[i])[4:])
-
-                # Loop over all depths
-                for depth in [0.01, 0.001, 0.0001]:
-
-                    try:
-
-                        # Unmasked
-                        data = np.load(os.path.join(
-                            path, '%s_Inject_U%g.npz' % (model, depth)))
-                        assert depth == data['inject'][()]['depth'], ""
-                        ucontrol = data['inject'][()]['rec_depth_control']
-                        urecovered = data['inject'][()]['rec_depth']
-
-                        # Masked
-                        data = np.load(os.path.join(
-                            path, '%s_Inject_M%g.npz' % (model, depth)))
-                        assert depth == data['inject'][()]['depth'], ""
-                        mcontrol = data['inject'][()]['rec_depth_control']
-                        mrecovered = data['inject'][()]['rec_depth']
-
-                        # Log it
-                        print("{:>09d} {:>13.8f} {:>13.8f} {:>13.8f} {:>13.8f} {:>13.8f}".format(
-                              stars[i], depth, ucontrol, urecovered, mcontrol,
-                              mrecovered), file=f)
-
-                    except:
-                        pass
-
-            print("")
+    if clobber or not os.path.exists(outfile) or \
+            os.path.exists(InjectionStatisticsFile(campaign, model)):
+        CollectInjectionStatistics(campaign, model=model, clobber=clobber)
 
     if plot:
 
         # Load the statistics
-        try:
-            epic, depth, ucontrol, urecovered, mcontrol, mrecovered = \
-                np.loadtxt(outfile, unpack=True, skiprows=2)
-        except ValueError:
+        table = ReadInjectionStatistics(campaign, model)
+        if table is not None:
+            good = np.where(table['mtime'] >= 0)[0]
+            depth, ucontrol, urecovered, mcontrol, mrecovered = \
+                [np.array(table[k][good], dtype=float)
+                 for k in ['depth', 'ucontrol', 'urecovered', 'mcontrol',
+                           'mrecovered']]
+        else:
+            try:
+                _, depth, ucontrol, urecovered, mcontrol, mrecovered = \
+                    np.loadtxt(outfile, unpack=True, skiprows=2)
+            except ValueError:
+                depth = []
+        if not len(depth):
             raise Exception("No targets to plot.")
 
         # Normalize to the injected depth
@@ -1887,44 +1825,9 @@ def FitCBVs(model):
     # Need to treat short and long cadences differently
     if model.cadence == 'lc':
 
-        # Loop over all the light curve segments
-        m = [None for b in range(len(model.breakpoints))]
-        weights = [None for b in range(len(model.breakpoints))]
-        for b in range(len(model.breakpoints)):
-
-            # Get the indices for this light curve segment
-            inds = model.get_chunk(b, pad=False)
-            masked_inds = model.get_masked_chunk(b, pad=False)
-
-            # Regress
-            mX = model.XCBV[masked_inds, :ncbv + 1]
-            A = np.dot(mX.T, mX)
-            B = np.dot(mX.T, model.flux[masked_inds])
-            try:
-                weights[b] = np.linalg.solve(A, B)
-            except np.linalg.linalg.LinAlgError:
-                # Singular matrix
-                log.warn('Singular matrix!')
-                weights[b] = np.zeros(mX.shape[1])
-
-            m[b] = np.dot(model.XCBV[inds, :ncbv + 1], weights[b])
-
-            # Vertical alignment
-            if b == 0:
-                m[b] -= np.nanmedian(m[b])
-            else:
-                # Match the first finite model point on either side of the
-                # break
-                # We could consider something more elaborate in the future
-                i0 = -1 - np.argmax([np.isfinite(m[b - 1][-i])
-                                     for i in range(1, len(m[b - 1]) - 1)])
-                i1 = np.argmax([np.isfinite(m[b][i])
-                                for i in range(len(m[b]))])
-                m[b] += (m[b - 1][i0] - m[b][i1])
-
-        # Join model and normalize
-        m = np.concatenate(m)
-        m -= np.nanmedian(m)
+        # Regress all the light curve segments at once
+        m = CBVFit(model.XCBV, model.flux, model.get_mask(),
+                   model.breakpoints, ncbv=ncbv)
 
     else:
 
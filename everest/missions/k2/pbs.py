@@ -11,9 +11,12 @@ Routines for submitting batch jobs to a cluster.
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
 from .utils import *
-from .k2 import GetData, FITSFile
+from .k2 import GetData, FITSFile, TargetDirectory
+from .sysrem import GetCBVs, GetBasis
+from .stats import CollectStatistics, ProfileReport
 from ...config import EVEREST_SRC, EVEREST_DAT, EVEREST_DEV
 from ...utils import ExceptionHook, FunctionWrapper
+from ...fits import RefreshCBVColumns
 from ...pool import Pool
 import os
 import sys
@@ -86,16 +89,24 @@ def _Download(campaign, subcampaign):
     if subcampaign != -1:
         campaign = campaign + 0.1 * subcampaign
     # Get all star IDs for this campaign
-    stars = [s[0] for s in GetK2Campaign(campaign)]
+    targets = GetK2Campaign(campaign)
+    stars = [s[0] for s in targets]
     nstars = len(stars)
+    # The targets that still need to be downloaded
+    todo = [s for s in targets if not os.path.exists(
+        os.path.join(TargetDirectory(s[0], campaign), 'data.npz'))]
+    # Fetch their TPFs concurrently first
+    print("Downloading %d target pixel files..." % len(todo))
+    res = DownloadTPFs([(s[0], 'lc') for s in todo] +
+                       [(s[0], 'sc') for s in todo if s[3]], campaign)
+    for r in res:
+        if isinstance(r, Exception):
+            print("ERROR: %s" % r)
     # Download the TPF data for each one
     for i, EPIC in enumerate(stars):
         print("Downloading data for EPIC %d (%d/%d)..." %
               (EPIC, i + 1, nstars))
-        if not os.path.exists(os.path.join(EVEREST_DAT, 'k2',
-                                           'c%02d' % int(campaign),
-                                           ('%09d' % EPIC)[:4] + '00000',
-                                           ('%09d' % EPIC)[4:],
+        if not os.path.exists(os.path.join(TargetDirectory(EPIC, campaign),
                                            'data.npz')):
             try:
                 GetData(EPIC, season=campaign, download_only=True)
@@ -227,6 +238,17 @@ def _Run(campaign, subcampaign, epic, strkwargs):
                 campaign = campaign + 0.1 * subcampaign
             # Get all the stars
             stars = GetK2Campaign(campaign, epics_only=True, cadence=cadence)
+            # Compute the neighbor bases once
+            if kwargs.get('neighbor_mode', 'stars') == 'basis':
+                for module in range(2, 25):
+                    if Channels(module) is None:
+                        continue
+                    for fold in [0, 1]:
+                        GetBasis(int(campaign), module, cadence=cadence,
+                                 rank=kwargs.get('basis_rank', 20),
+                                 mag_range=kwargs.get('mag_range',
+                                                      (11., 13.)),
+                                 fold=fold)
             # Run
             pool.map(m, stars)
 
@@ -351,9 +373,12 @@ def _Publish(campaign, subcampaign, strkwargs):
 
 
 def Status(season=range(18), model='nPLD', purge=False, injection=False,
-           cadence='lc', **kwargs):
+           cadence='lc', profile=False, **kwargs):
     '''
     Shows the progress of the de-trending runs for the specified campaign(s).
+    If :py:obj:`profile` is set, also collects the run profiles of the
+    processed targets and prints the hot-spot report of each campaign
+    (see :py:func:`everest.missions.k2.ProfileReport`).
 
     '''
 
@@ -467,6 +492,14 @@ def Status(season=range(18), model='nPLD', purge=False, injection=False,
                     print("         %s   %s   %s   %s" % (A, B, C, D))
                     print()
 
+    # Hot-spot reports
+    if profile:
+        for c in sorted(set([int(c) for c in campaign])):
+            print()
+            table = CollectStatistics(c, model=model, cadence=cadence,
+                                      export=False)
+            ProfileReport(c, model=model, table=table)
+
 
 def InjectionStatus(campaign=range(18), model='nPLD', purge=False,
                     depths=[0.01, 0.001, 0.0001], **kwargs):
@@ -533,12 +566,91 @@ def InjectionStatus(campaign=range(18), model='nPLD', purge=False,
                         c, mask, depth, total, done[m][d], err[m][d]) % (color, errcolor))
 
 
-def EverestModel(ID, model='nPLD', publish=False, csv=False, **kwargs):
+def RefreshCBVs(campaign=0, model='nPLD', pool='AnyPool', processes=None,
+                clobber=False, cbv_num=1, cbv_niter=50, cbv_win=999,
+                cbv_order=3, **kwargs):
+    '''
+    Refreshes the CBV correction of all the published long cadence light
+    curves in a campaign, i.e., after its CBVs were recomputed. This runs
+    locally and is a much faster alternative to :py:func:`Publish` with
+    :py:obj:`update=True`: each worker processes all the targets on one
+    module with :py:func:`everest.fits.RefreshCBVColumns`, reading only
+    the fluxes, masks and breakpoints of the stored models and solving
+    all their CBV regressions at once. Targets that cannot be refreshed
+    this way (e.g., those without a *FITS* file) are republished from
+    their models.
+
+    :param int campaign: The `K2` campaign number. Default 0
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param str pool: The :py:func:`everest.pool.Pool` to use. \
+           Default `AnyPool`
+    :param int processes: The number of worker processes of a \
+           :py:class:`everest.pool.MultiPool`. Default is the number \
+           of CPUs
+    :param bool clobber: Recompute the CBVs first? Default :py:obj:`False`
+    :param int cbv_num: The number of CBVs to regress on. Default 1
+
+    '''
+
+    # The CBVs
+    X = GetCBVs(campaign, model=model, clobber=clobber, niter=cbv_niter,
+                sv_win=cbv_win, sv_order=cbv_order)
+
+    # The targets with a model on disk, grouped by module
+    stars = GetK2Campaign(campaign)
+    modules = []
+    ids = {}
+    for module in range(2, 25):
+        channels = Channels(module)
+        if channels is None:
+            continue
+        files = []
+        for star in [s[0] for s in stars if s[2] in channels]:
+            path = TargetDirectory(star, campaign)
+            modelfile = os.path.join(path, model + '.npz')
+            if os.path.exists(modelfile):
+                ids[modelfile] = star
+                files.append((modelfile,
+                              os.path.join(path, FITSFile(star, campaign))))
+        if len(files):
+            modules.append(files)
+
+    # Refresh
+    m = FunctionWrapper(RefreshCBVColumns, X, cbv_num=cbv_num,
+                        cbv_niter=cbv_niter, cbv_win=cbv_win,
+                        cbv_order=cbv_order)
+    with Pool(pool, processes=processes) as p:
+        failed = sum(p.map(m, modules), [])
+
+    # Fall back to the models
+    if len(failed):
+        log.warn('Republishing %d light curves from their models...' %
+                 len(failed))
+        m = FunctionWrapper(EverestModel, season=campaign, model=model,
+                            publish=True, update=True, dvs_mode='none',
+                            cbv_num=cbv_num, **kwargs)
+        with Pool(pool, processes=processes) as p:
+            p.map(m, [ids[f[0]] for f in failed])
+
+
+def EverestModel(ID, model='nPLD', publish=False, csv=False, render=False,
+                 update=False, **kwargs):
     '''
     A wrapper around an :py:obj:`everest` model for PBS runs.
+    If :py:obj:`render` is set, only the DVS figures of models run
+    with :py:obj:`dvs_mode='deferred'` are rendered (see
+    :py:meth:`everest.detrender.Detrender.render`), with the
+    non-interactive `Agg` backend; pass :py:obj:`render=True` to
+    :py:func:`Run` or :py:func:`Publish` to do this on the cluster.
+    If :py:obj:`update` is set, existing *FITS* files are only updated
+    with the new CBV-corrected light curves (see
+    :py:func:`everest.fits.UpdateFITS`).
 
     '''
 
+    if render:
+        import matplotlib
+        matplotlib.use('Agg')
     if model != 'Inject':
         from ... import detrender
 
@@ -557,12 +669,14 @@ def EverestModel(ID, model='nPLD', publish=False, csv=False, **kwargs):
         # Run the model
         m = getattr(detrender, model)(ID, **kwargs)
 
-        # Publish?
-        if publish:
+        # Render or publish?
+        if render:
+            m.render(publish=publish)
+        elif publish:
             if csv:
                 m.publish_csv()
             else:
-                m.publish()
+                m.publish(update=update)
 
     else:
         from ...inject import Inject
@@ -13,13 +13,13 @@ from __future__ import division, print_function, absolute_import, \
      unicode_literals
 from ...config import EVEREST_SRC, EVEREST_DAT, EVEREST_DEV
 from ...mathutils import SavGol
+from ...utils import LazyModule
 import os
 import sys
 import shutil
 import k2plr
 from k2plr.config import KPLR_ROOT
 from six.moves import urllib
-import matplotlib.pyplot as pl
 import numpy as np
 import warnings
 try:
@@ -31,11 +31,43 @@ except ImportError:
         raise Exception('Please install the `pyfits` package.')
 import logging
 log = logging.getLogger(__name__)
+pl = LazyModule('matplotlib.pyplot')
 
 #: The supported pipelines
 Pipelines = ['everest2', 'everest1', 'k2sff', 'k2sc', 'raw']
 
 
+def prefetch(stars, pipeline='everest2', campaign=None):
+    '''
+    Downloads the published :py:obj:`everest` *FITS* files needed by
+    :py:func:`get` for all the EPIC IDs in `stars` concurrently, directly
+    into the :py:mod:`k2plr` cache. Files that are already cached are
+    skipped, and files that cannot be downloaded are left for
+    :py:mod:`k2plr` to retrieve. Does nothing for the other pipelines,
+    if `campaign` is not specified, or on Python < 3.7, which the
+    download manager does not support; :py:func:`get` then downloads
+    the files one at a time as before.
+
+    '''
+
+    if sys.version_info < (3, 7):
+        return
+    from ...download import Request, FetchAll
+    from .k2 import FITSFile, FITSUrl
+    if pipeline.lower() not in ['everest2', 'k2sff', 'raw']:
+        return
+    if campaign is None or int(campaign) != campaign:
+        return
+    campaign = int(campaign)
+    requests = [Request(FITSUrl(ID, campaign) + FITSFile(ID, campaign),
+                        os.path.join(KPLR_ROOT, "data", "everest", str(ID),
+                                     FITSFile(ID, campaign)))
+                for ID in stars]
+    requests = [r for r in requests if not os.path.exists(r.path)]
+    if len(requests):
+        FetchAll(requests)
+
+
 def get(ID, pipeline='everest2', campaign=None):
     '''
     Returns the `time` and `flux` for a given EPIC `ID` and
@@ -167,6 +199,9 @@ def get_cdpp(campaign, pipeline='everest2'):
     stars = list(set(stars) - set(done))
     n = len(done) + 1
 
+    # Download the light curves concurrently first
+    prefetch(stars, pipeline=pipeline, campaign=campaign)
+
     # Open the output file
     with open(file, 'a', 1) as outfile:
 
@@ -229,6 +264,11 @@ def get_outliers(campaign, pipeline='everest2', sigma=5):
     stars = list(set(stars) - set(done))
     n = len(done) + 1
 
+    # Download the light curves and the raw K2 data concurrently first
+    from .utils import DownloadTPFs
+    prefetch(stars, pipeline=pipeline, campaign=campaign)
+    DownloadTPFs([(EPIC, 'lc') for EPIC in stars], campaign)
+
     # Open the output file
     with open(file, 'a', 1) as outfile:
 
@@ -0,0 +1,627 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`stats.py` - Campaign statistics
+----------------------------------------
+
+Routines for collecting the summary statistics (CDPP, number of
+outliers, saturation flag, etc.) of all the de-trended targets in a
+`K2` campaign. The statistics are computed in parallel and stored in
+a single columnar table per campaign and model under
+``EVEREST_DAT/k2/tables``. The table records the modification time
+of each model file, so that subsequent calls only process targets
+that were (re-)run since the last update. The human-readable
+``.cdpp`` tables used by :py:func:`everest.missions.k2.Statistics`
+are exported from this table. The depths recovered in the transit
+injection runs are collected in the same way, in a separate table
+with one row per target and injected depth.
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from ...config import EVEREST_SRC, EVEREST_DAT
+from ...mathutils import SavGol
+from ...modelstore import LoadModel
+from ...pool import Pool
+from ...profiling import STAGES, MergeProfile
+from ...utils import FunctionWrapper
+from .utils import GetK2Campaign
+import os
+import numpy as np
+from tempfile import NamedTemporaryFile
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = ['TargetStatistics', 'CollectStatistics', 'ReadStatistics',
+           'StatisticsFile', 'ProfileReport', 'TargetInjectionStatistics',
+           'CollectInjectionStatistics', 'ReadInjectionStatistics',
+           'InjectionStatisticsFile']
+
+#: The columns of the statistics table and their data types
+COLUMNS = [('EPIC', 'int64'),
+           ('Kp', 'float64'),
+           ('cdppr', 'float64'),
+           ('cdpp', 'float64'),
+           ('cdppv', 'float64'),
+           ('outliers', 'int32'),
+           ('outliers5', 'int32'),
+           ('datapoints', 'int32'),
+           ('saturated', 'int8'),
+           ('mtime', 'float64')] + \
+          [('time_%s' % stage, 'float64') for stage in STAGES] + \
+          [('time', 'float64'),
+           ('rss', 'float64')]
+
+#: The transit depths of the injection runs
+INJECTION_DEPTHS = [0.01, 0.001, 0.0001]
+
+#: The columns of the injection statistics table and their data types
+INJECTION_COLUMNS = [('EPIC', 'int64'),
+                     ('depth', 'float64'),
+                     ('ucontrol', 'float64'),
+                     ('urecovered', 'float64'),
+                     ('mcontrol', 'float64'),
+                     ('mrecovered', 'float64'),
+                     ('mtime', 'float64')]
+
+
+def StatisticsFile(campaign, model='nPLD'):
+    '''
+    Returns the full path to the columnar statistics table for
+    a given `campaign` and `model`.
+
+    '''
+
+    return os.path.join(EVEREST_DAT, 'k2', 'tables',
+                        'c%02d_%s.npz' % (int(campaign), model))
+
+
+def InjectionStatisticsFile(campaign, model='nPLD'):
+    '''
+    Returns the full path to the columnar injection statistics table
+    for a given `campaign` (or sub-campaign) and `model`.
+
+    '''
+
+    return os.path.join(EVEREST_DAT, 'k2', 'tables', '%s_%s.inj.npz' %
+                        (_CampaignName(campaign), model))
+
+
+def _CampaignName(campaign):
+    '''
+    Returns the string used to identify a campaign or sub-campaign
+    (e.g., `c02` or `c02.1`) in the table file names.
+
+    '''
+
+    if int(campaign) == campaign:
+        return 'c%02d' % int(campaign)
+    else:
+        return 'c%04.1f' % campaign
+
+
+def _ModelFile(EPIC, campaign, model):
+    '''
+
+    '''
+
+    return os.path.join(EVEREST_DAT, 'k2', 'c%02d' % int(campaign),
+                        ('%09d' % EPIC)[:4] + '00000',
+                        ('%09d' % EPIC)[4:], model + '.npz')
+
+
+def _ModelMTime(EPIC, campaign, model):
+    '''
+    Returns the time the model or its ``.prof`` file was last modified,
+    or -1 if there is no model.
+
+    '''
+
+    file = _ModelFile(EPIC, campaign, model)
+    if not os.path.exists(file):
+        return -1
+    prof = file[:-4] + '.prof'
+    if os.path.exists(prof):
+        return max(os.path.getmtime(file), os.path.getmtime(prof))
+    return os.path.getmtime(file)
+
+
+def _InjectionFile(EPIC, campaign, model, depth, mask):
+    '''
+    Returns the path to the model of an injection run, where
+    :py:obj:`mask` is `U` (unmasked) or `M` (masked).
+
+    '''
+
+    return os.path.join(os.path.dirname(_ModelFile(EPIC, campaign, model)),
+                        '%s_Inject_%s%g.npz' % (model, mask, depth))
+
+
+def _InjectionMTime(EPIC, campaign, model, depth):
+    '''
+    Returns the time the unmasked or masked injection run of a target
+    was last modified, or -1 if either of them is missing.
+
+    '''
+
+    files = [_InjectionFile(EPIC, campaign, model, depth, mask)
+             for mask in 'UM']
+    if not all([os.path.exists(file) for file in files]):
+        return -1
+    return max([os.path.getmtime(file) for file in files])
+
+
+def _Outliers(flux, sigma=5.):
+    '''
+    Returns the number of `sigma` outliers in the Savitsky-Golay
+    filtered `flux` after iterative sigma clipping.
+
+    '''
+
+    inds = np.array([], dtype=int)
+    m = 1
+    while len(inds) < m:
+        m = len(inds)
+        ff = SavGol(np.delete(flux, inds))
+        med = np.nanmedian(ff)
+        MAD = 1.4826 * np.nanmedian(np.abs(ff - med))
+        inds = np.append(inds, np.where(
+            (ff > med + sigma * MAD) | (ff < med - sigma * MAD))[0])
+    return len(inds)
+
+
+def TargetStatistics(EPIC, campaign, model='nPLD', outliers=True):
+    '''
+    Returns a dictionary with the summary statistics of a
+    single de-trended target. The scalar quantities are read
+    from the model store header; the light curve arrays are only
+    loaded if :py:obj:`outliers` is :py:obj:`True`. Returns
+    :py:obj:`None` if the model does not exist or can't be read.
+
+    :param int EPIC: The EPIC ID of the target
+    :param campaign: The `K2` campaign number
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param bool outliers: Count the number of 5-sigma outliers in \
+           the de-trended light curve? Default :py:obj:`True`
+
+    '''
+
+    file = _ModelFile(EPIC, campaign, model)
+    if not os.path.exists(file):
+        return None
+    try:
+        with LoadModel(file) as data:
+
+            # HACK: Backwards compatibility fix
+            try:
+                cdpp = data['cdpp']
+            except KeyError:
+                cdpp = data['cdpp6']
+            row = {'EPIC': EPIC,
+                   'cdppr': data.get('cdppr', np.nan),
+                   'cdpp': cdpp,
+                   'cdppv': data.get('cdppv', np.nan),
+                   'saturated': int(data.get('saturated', 0)),
+                   'outliers': 0,
+                   'outliers5': 0,
+                   'datapoints': 0,
+                   'mtime': _ModelMTime(EPIC, campaign, model)}
+
+            # The run profile (see :py:mod:`everest.profiling`),
+            # including the stages that ran after the model was saved
+            profile = MergeProfile(file[:-4] + '.prof',
+                                   data.get('profile', None)) or {}
+            for stage in STAGES:
+                row['time_%s' % stage] = \
+                    profile.get(stage, {}).get('time', np.nan)
+            row['time'] = np.sum([v['time'] for k, v in profile.items()
+                                  if k in STAGES]) if len(profile) \
+                else np.nan
+            row['rss'] = profile.get('peak_rss', None) or np.nan
+
+            if outliers:
+                # Remove NaNs and flagged cadences
+                flux = np.delete(data['fraw'] - data['model'], np.array(
+                    list(set(np.concatenate([data['nanmask'],
+                                             data['badmask']]))), dtype=int))
+                row['outliers'] = len(data['outmask'])
+                row['outliers5'] = _Outliers(flux)
+                row['datapoints'] = len(flux)
+
+    except Exception:
+        log.warn("Unable to read the `%s` model for EPIC %d." %
+                 (model, EPIC))
+        return None
+
+    return row
+
+
+def TargetInjectionStatistics(target, campaign, model='nPLD'):
+    '''
+    Returns a dictionary with the depths recovered in the unmasked
+    and masked injection runs (see :py:mod:`everest.inject`) of a
+    single target and injected depth. Returns :py:obj:`None` if
+    either of the runs does not exist or can't be read.
+
+    :param tuple target: The EPIC ID of the target and the injected depth
+    :param campaign: The `K2` campaign number
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+
+    '''
+
+    EPIC, depth = target
+    row = {'EPIC': EPIC, 'depth': depth,
+           'mtime': _InjectionMTime(EPIC, campaign, model, depth)}
+    if row['mtime'] < 0:
+        return None
+    try:
+        for mask in 'UM':
+            with LoadModel(_InjectionFile(EPIC, campaign, model,
+                                          depth, mask)) as m:
+                inject = m['inject']
+            if inject['depth'] != depth:
+                raise ValueError('Injected depth mismatch.')
+            row['%scontrol' % mask.lower()] = inject['rec_depth_control']
+            row['%srecovered' % mask.lower()] = inject['rec_depth']
+    except Exception:
+        log.warn("Unable to read the `%s` injection runs for EPIC %d." %
+                 (model, EPIC))
+        return None
+
+    return row
+
+
+def _ReadTable(file, columns):
+    '''
+    Reads a columnar table. Returns a dictionary of arrays keyed by
+    the names in :py:obj:`columns`, or :py:obj:`None` if the table
+    does not exist.
+
+    '''
+
+    if not os.path.exists(file):
+        return None
+    with np.load(file) as data:
+        table = dict((name, np.array(data[name])) for name, _ in columns
+                     if name in data.files)
+
+    # Tables written by older versions lack some of the columns;
+    # flag all rows as stale so that they get recomputed
+    missing = [(name, dtype) for name, dtype in columns
+               if name not in table]
+    if len(missing):
+        n = len(table['EPIC'])
+        for name, dtype in missing:
+            table[name] = np.zeros(n, dtype=dtype)
+            if table[name].dtype.kind == 'f':
+                table[name][:] = np.nan
+        table['mtime'][:] = -1
+    return table
+
+
+def ReadStatistics(campaign, model='nPLD'):
+    '''
+    Reads the columnar statistics table for a given `campaign` and
+    `model`. Returns a dictionary of arrays keyed by the names in
+    :py:obj:`COLUMNS`, or :py:obj:`None` if the table does not exist.
+
+    '''
+
+    return _ReadTable(StatisticsFile(campaign, model), COLUMNS)
+
+
+def ReadInjectionStatistics(campaign, model='nPLD'):
+    '''
+    Reads the columnar injection statistics table for a given
+    `campaign` and `model`. Returns a dictionary of arrays keyed by
+    the names in :py:obj:`INJECTION_COLUMNS`, or :py:obj:`None` if
+    the table does not exist.
+
+    '''
+
+    return _ReadTable(InjectionStatisticsFile(campaign, model),
+                      INJECTION_COLUMNS)
+
+
+def _SaveStatistics(table, file):
+    '''
+    Atomically writes the columnar table to disk.
+
+    '''
+
+    if not os.path.exists(os.path.dirname(file)):
+        os.makedirs(os.path.dirname(file))
+    f = NamedTemporaryFile("wb", delete=False, dir=os.path.dirname(file))
+    np.savez(f, **table)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.rename(f.name, file)
+
+
+def _WriteCDPPTable(table, outfile, cadence='lc'):
+    '''
+    Exports the columnar table to the human-readable ``.cdpp``
+    format in ``missions/k2/tables``.
+
+    '''
+
+    with open(outfile, 'w') as f:
+        if cadence == 'sc':
+            print("EPIC               Kp           Raw CDPP     " +
+                  "Everest CDPP      Saturated", file=f)
+            print("---------          ------       ---------    " +
+                  "------------      ---------", file=f)
+            for i in range(len(table['EPIC'])):
+                print("{:>09d} {:>15.3f} {:>15.3f} {:>15.3f} {:>15d}".format(
+                      table['EPIC'][i], table['Kp'][i], table['cdppr'][i],
+                      table['cdpp'][i], table['saturated'][i]), file=f)
+        else:
+            print("EPIC               Kp           Raw CDPP     Everest CDPP" +
+                  "      Validation        Outliers[1]     Outliers[2]     " +
+                  "Datapoints     Saturated", file=f)
+            print("---------          ------       ---------    ------------" +
+                  "      ----------        -----------     -----------     " +
+                  "----------     ---------", file=f)
+            for i in range(len(table['EPIC'])):
+                print("{:>09d} {:>15.3f} {:>15.3f} {:>15.3f} {:>15.3f} {:>15d} {:>15d} {:>15d} {:>15d}".format(
+                      table['EPIC'][i], table['Kp'][i], table['cdppr'][i],
+                      table['cdpp'][i], table['cdppv'][i],
+                      table['outliers'][i], table['outliers5'][i],
+                      table['datapoints'][i], table['saturated'][i]),
+                      file=f)
+
+
+def _UpdateTable(file, columns, keys, targets, mtime, f, clobber=False,
+                 pool='AnyPool', chunksize=500, fixed={}):
+    '''
+    Incrementally updates the columnar table in :py:obj:`file`, which
+    has one row per target. The rows are identified by the key
+    columns :py:obj:`keys`, a dictionary of arrays. Rows missing from
+    the table, or whose files were modified (:py:obj:`mtime`) since
+    they were last computed, are recomputed in parallel by calling
+    :py:obj:`f` on the corresponding entry of :py:obj:`targets`; it
+    returns a dictionary of column values, or :py:obj:`None` on
+    failure. The table is saved after every :py:obj:`chunksize`
+    targets. The columns in :py:obj:`fixed` are set for all rows.
+    Returns the table.
+
+    '''
+
+    names = [name for name, _ in columns if name in keys]
+    ntargets = len(targets)
+
+    # Start from the existing table
+    table = None if clobber else _ReadTable(file, columns)
+    if table is None or not all([np.array_equal(table[name], keys[name])
+                                 for name in names]):
+        old = table
+        table = dict((name, np.zeros(ntargets, dtype=dtype))
+                     for name, dtype in columns)
+        for name, dtype in columns:
+            if name in keys:
+                table[name][:] = keys[name]
+            elif table[name].dtype.kind == 'f':
+                table[name][:] = np.nan
+        table['mtime'][:] = -1
+        if old is not None:
+            # Keep the rows we already have
+            rows = dict((key, j) for j, key in
+                        enumerate(zip(*[old[name] for name in names])))
+            ij = [(i, rows[key]) for i, key in
+                  enumerate(zip(*[keys[name] for name in names]))
+                  if key in rows]
+            if len(ij):
+                i, j = np.array(ij, dtype=int).T
+                for name, _ in columns:
+                    table[name][i] = old[name][j]
+    for name, value in fixed.items():
+        table[name][:] = value
+
+    # Find the targets that need updating
+    todo = np.where(np.array(mtime) > table['mtime'])[0]
+    log.info("Collecting statistics for %d/%d targets..." %
+             (len(todo), ntargets))
+
+    if len(todo):
+        with Pool(pool) as p:
+            for n in range(0, len(todo), chunksize):
+                inds = todo[n:n + chunksize]
+                for i, row in zip(inds, p.map(f, [targets[i]
+                                                  for i in inds])):
+                    if row is None:
+                        continue
+                    for name, _ in columns:
+                        if name in row:
+                            table[name][i] = row[name]
+                _SaveStatistics(table, file)
+                log.info("Processed %d/%d targets." %
+                         (min(n + chunksize, len(todo)), len(todo)))
+    elif not os.path.exists(file):
+        _SaveStatistics(table, file)
+
+    return table
+
+
+def CollectStatistics(campaign, model='nPLD', clobber=False, cadence='lc',
+                      pool='AnyPool', chunksize=500, export=True):
+    '''
+    Collects the summary statistics of all targets in a given
+    `campaign` in parallel and stores them in the columnar table
+    :py:func:`StatisticsFile`. Only targets whose model files are
+    missing from the table or have been modified since the last
+    update are processed, unless :py:obj:`clobber` is set. The
+    table is saved after every :py:obj:`chunksize` targets, so an
+    interrupted run can be resumed. Returns the table.
+
+    :param campaign: The `K2` campaign number
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param bool clobber: Recompute the statistics for all targets? \
+           Default :py:obj:`False`
+    :param str cadence: The light curve cadence. Default `lc`
+    :param str pool: The :py:mod:`everest.pool` to use. Default `AnyPool`
+    :param int chunksize: The number of targets to process before \
+           saving the table. Default 500
+    :param bool export: Write the ``.cdpp`` table to \
+           ``missions/k2/tables``? Default :py:obj:`True`
+
+    '''
+
+    if cadence == 'sc' and not model.endswith('.sc'):
+        model = '%s.sc' % model
+
+    # All targets in the campaign
+    all = GetK2Campaign(int(campaign), cadence=cadence)
+    stars = np.array([s[0] for s in all], dtype=int)
+    kpmgs = np.array([s[1] for s in all], dtype=float)
+
+    # Update the table
+    mtime = [_ModelMTime(EPIC, campaign, model) for EPIC in stars]
+    f = FunctionWrapper(TargetStatistics, campaign, model=model,
+                        outliers=(cadence == 'lc'))
+    table = _UpdateTable(StatisticsFile(campaign, model), COLUMNS,
+                         {'EPIC': stars}, stars, mtime, f, clobber=clobber,
+                         pool=pool, chunksize=chunksize,
+                         fixed={'Kp': kpmgs})
+
+    # Export the text table
+    if export:
+        _WriteCDPPTable(table, os.path.join(EVEREST_SRC, 'missions', 'k2',
+                                            'tables', 'c%02d_%s.cdpp' %
+                                            (int(campaign), model)),
+                        cadence=cadence)
+
+    return table
+
+
+def _WriteInjectionTable(table, outfile):
+    '''
+    Exports the columnar injection table to the human-readable
+    ``.inj`` format in ``missions/k2/tables``. Only the targets
+    with both injection runs are listed.
+
+    '''
+
+    good = np.where(table['mtime'] >= 0)[0]
+    with open(outfile, 'w') as f:
+        print("EPIC         Depth         UControl      URecovered" +
+              "    MControl      MRecovered", file=f)
+        print("---------    ----------    ----------    ----------" +
+              "    ----------    ----------", file=f)
+        for i in good:
+            print("{:>09d} {:>13.8f} {:>13.8f} {:>13.8f} {:>13.8f} {:>13.8f}".format(
+                  table['EPIC'][i], table['depth'][i], table['ucontrol'][i],
+                  table['urecovered'][i], table['mcontrol'][i],
+                  table['mrecovered'][i]), file=f)
+
+
+def CollectInjectionStatistics(campaign, model='nPLD', clobber=False,
+                               depths=INJECTION_DEPTHS, pool='AnyPool',
+                               chunksize=500, export=True):
+    '''
+    Collects the depths recovered in the injection runs of all targets
+    in a given `campaign` (or sub-campaign) in parallel and stores them
+    in the columnar table :py:func:`InjectionStatisticsFile`, with one
+    row per target and injected depth. As in :py:func:`CollectStatistics`,
+    only the runs that are new or were modified since the last update
+    are processed, unless :py:obj:`clobber` is set. Returns the table.
+
+    :param campaign: The `K2` campaign or sub-campaign number
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param bool clobber: Recompute the statistics for all targets? \
+           Default :py:obj:`False`
+    :param list depths: The injected depths. Default \
+           :py:obj:`INJECTION_DEPTHS`
+    :param str pool: The :py:mod:`everest.pool` to use. Default `AnyPool`
+    :param int chunksize: The number of runs to process before \
+           saving the table. Default 500
+    :param bool export: Write the ``.inj`` table to \
+           ``missions/k2/tables``? Default :py:obj:`True`
+
+    '''
+
+    # All targets in the campaign, once per depth
+    stars = np.array(GetK2Campaign(campaign, epics_only=True), dtype=int)
+    epics = np.repeat(stars, len(depths))
+    dvals = np.tile(np.array(depths, dtype=float), len(stars))
+    targets = list(zip(epics, dvals))
+
+    # Update the table
+    mtime = [_InjectionMTime(EPIC, campaign, model, depth)
+             for EPIC, depth in targets]
+    f = FunctionWrapper(TargetInjectionStatistics, campaign, model=model)
+    table = _UpdateTable(InjectionStatisticsFile(campaign, model),
+                         INJECTION_COLUMNS, {'EPIC': epics, 'depth': dvals},
+                         targets, mtime, f, clobber=clobber, pool=pool,
+                         chunksize=chunksize)
+
+    # Export the text table
+    if export:
+        _WriteInjectionTable(table, os.path.join(
+            EVEREST_SRC, 'missions', 'k2', 'tables', '%s_%s.inj' %
+            (_CampaignName(campaign), model)))
+
+    return table
+
+
+def ProfileReport(campaign, model='nPLD', table=None, quiet=False):
+    '''
+    Aggregates the run profiles (see :py:mod:`everest.profiling`) of
+    all the targets in a `campaign` into a hot-spot report: for each
+    pipeline stage, the total time spent in it over the whole
+    campaign, its share of the total, the median and 90th percentile
+    time per target, and the median and maximum peak memory usage
+    of the targets. The stages are sorted by total time. Returns the
+    report as a list of dictionaries and prints it unless
+    :py:obj:`quiet` is set.
+
+    :param campaign: The `K2` campaign number
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param dict table: The statistics table. Default is to read it \
+           with :py:func:`ReadStatistics`
+
+    '''
+
+    if table is None:
+        table = ReadStatistics(campaign, model)
+    if table is None:
+        raise ValueError("No statistics table found for campaign %s. " %
+                         campaign + "Please run `CollectStatistics` first.")
+
+    # Only targets with a profile
+    good = np.where(~np.isnan(table['time']))[0]
+    total = np.nansum(table['time'][good])
+    rss = table['rss'][good]
+    report = []
+    for stage in STAGES:
+        t = table['time_%s' % stage][good]
+        t = t[~np.isnan(t)]
+        if len(t) == 0:
+            continue
+        report.append({'stage': stage,
+                       'targets': len(t),
+                       'total': np.sum(t),
+                       'fraction': np.sum(t) / total if total > 0 else np.nan,
+                       'median': np.median(t),
+                       'p90': np.percentile(t, 90)})
+    report = sorted(report, key=lambda r: -r['total'])
+
+    if not quiet:
+        print("Campaign %s, model `%s`: %d/%d targets profiled, " %
+              (campaign, model, len(good), len(table['EPIC'])) +
+              "%.1f hours in total." % (total / 3600.))
+        if len(good):
+            print("Peak memory usage: %.0f MB (median), %.0f MB (max)." %
+                  (np.nanmedian(rss), np.nanmax(rss)))
+        print()
+        print("STAGE                 TOTAL [h]    SHARE    " +
+              "MEDIAN [s]      P90 [s]")
+        print("-----                 ---------    -----    " +
+              "----------      -------")
+        for r in report:
+            print("{:<20s} {:>10.2f} {:>8.1f}% {:>13.2f} {:>12.2f}".format(
+                  r['stage'], r['total'] / 3600., 100 * r['fraction'],
+                  r['median'], r['p90']))
+
+    return report
@@ -5,21 +5,24 @@
 ----------------------------------
 
 Routines for computing the co-trending basis vectors (CBVs)
-for each `K2` campaign using the :py:obj:`SysRem` algorithm.
+for each `K2` campaign using the :py:obj:`SysRem` algorithm,
+and the low-rank neighbor bases used by
+:py:class:`everest.detrender.nPLD`.
 
 '''
 
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
 from ...config import EVEREST_DAT
-from ...utils import InitLog
+from ...utils import InitLog, LazyModule, FunctionWrapper
+from ...modelstore import LoadModel
+from ...mathutils import SysRem, NeighborBasis
 from .utils import GetK2Campaign, Campaign, Channels
 import os
 import numpy as np
-import matplotlib.pyplot as pl
-from scipy.signal import savgol_filter
 import logging
 log = logging.getLogger(__name__)
+pl = LazyModule('matplotlib.pyplot')
 
 
 def GetChunk(time, breakpoints, b, mask=[]):
@@ -73,7 +76,7 @@ def GetStars(campaign, module, model='nPLD', **kwargs):
                           ('%09d' % stars[n])[4:], model + '.npz')
 
         # Get the data
-        data = np.load(nf)
+        data = LoadModel(nf)
         t = data['time']
         if n == 0:
             time = t
@@ -97,71 +100,12 @@ def GetStars(campaign, module, model='nPLD', **kwargs):
         fluxes.append(y)
         errors.append(err)
         kpars.append(data['kernel_params'])
+        data.close()
 
     return time, breakpoints, np.array(fluxes), \
            np.array(errors), np.array(kpars)
 
 
-def SysRem(time, flux, err, ncbv=5, niter=50, sv_win=999,
-           sv_order=3, **kwargs):
-    '''
-    Applies :py:obj:`SysRem` to a given set of light curves.
-
-    :param array_like time: The time array for all of the light curves
-    :param array_like flux: A 2D array of the fluxes for each of the light \
-           curves, shape `(nfluxes, ntime)`
-    :param array_like err: A 2D array of the flux errors for each of the \
-           light curves, shape `(nfluxes, ntime)`
-    :param int ncbv: The number of signals to recover. Default 5
-    :param int niter: The number of :py:obj:`SysRem` iterations to perform. \
-           Default 50
-    :param int sv_win: The Savitsky-Golay filter window size. Default 999
-    :param int sv_order: The Savitsky-Golay filter order. Default 3
-
-    '''
-
-    nflx, tlen = flux.shape
-
-    # Get normalized fluxes
-    med = np.nanmedian(flux, axis=1).reshape(-1, 1)
-    y = flux - med
-
-    # Compute the inverse of the variances
-    invvar = 1. / err ** 2
-
-    # The CBVs for this set of fluxes
-    cbvs = np.zeros((ncbv, tlen))
-
-    # Recover `ncbv` components
-    for n in range(ncbv):
-
-        # Initialize the weights and regressors
-        c = np.zeros(nflx)
-        a = np.ones(tlen)
-        f = y * invvar
-
-        # Perform `niter` iterations
-        for i in range(niter):
-
-            # Compute the `c` vector (the weights)
-            c = np.dot(f, a) / np.dot(invvar, a ** 2)
-
-            # Compute the `a` vector (the regressors)
-            a = np.dot(c, f) / np.dot(c ** 2, invvar)
-
-        # Remove this component from all light curves
-        y -= np.outer(c, a)
-
-        # Save this regressor after smoothing it a bit
-        if sv_win >= len(a):
-            sv_win = len(a) - 1
-            if sv_win % 2 == 0:
-                sv_win -= 1
-        cbvs[n] = savgol_filter(a - np.nanmedian(a), sv_win, sv_order)
-
-    return cbvs
-
-
 def GetCBVs(campaign, model='nPLD', clobber=False, **kwargs):
     '''
     Computes the CBVs for a given campaign.
@@ -202,7 +146,7 @@ def GetCBVs(campaign, model='nPLD', clobber=False, **kwargs):
                          fluxes=fluxes, errors=errors, kpars=kpars)
 
             # Load the light curves
-            lcs = np.load(lcfile)
+            lcs = np.load(lcfile, allow_pickle=True)
             if time is None:
                 time = lcs['time']
                 breakpoints = lcs['breakpoints']
@@ -239,7 +183,7 @@ def GetCBVs(campaign, model='nPLD', clobber=False, **kwargs):
     else:
 
         # Load from disk
-        data = np.load(xfile)
+        data = np.load(xfile, allow_pickle=True)
         X = data['X'][()]
         time = data['time'][()]
         breakpoints = data['breakpoints'][()]
@@ -261,3 +205,69 @@ def GetCBVs(campaign, model='nPLD', clobber=False, **kwargs):
         fig.savefig(plotfile, bbox_inches='tight')
 
     return X
+
+
+def GetBasis(campaign, module, rank=20, cadence='lc', mag_range=(11., 13.),
+             min_stars=10, max_stars=100, fold=0, clobber=False, **kwargs):
+    '''
+    Computes a low-rank basis of the systematics common to the bright
+    stars on a given module in a given campaign (see
+    :py:func:`everest.mathutils.NeighborBasis`). The basis is computed
+    once from the normalized pixel fluxes of up to :py:obj:`max_stars`
+    stars whose data has already been downloaded, and saved to disk in a
+    file named after the fold, the rank and the magnitude range; it is
+    returned as a read-only memory-mapped array of shape
+    `(ntime, rank)`. Additional keyword arguments are passed to
+    :py:func:`everest.missions.k2.GetData`.
+
+    :param int campaign: The campaign number
+    :param int module: The module number
+    :param int rank: The number of basis vectors. Default 20
+    :param str cadence: The light curve cadence. Default `lc`
+    :param tuple mag_range: (`low`, `high`) values for the Kepler \
+           magnitude of the stars. Default (11, 13)
+    :param int min_stars: If there are fewer stars than this on the \
+           module, stars on all modules are used. Default 10
+    :param int max_stars: The maximum number of stars. Default 100
+    :param int fold: The stars are split in two folds by the parity of \
+           their IDs, and basis `fold` is computed from the stars \
+           whose `ID % 2` is *not* `fold`. A target uses the basis of \
+           its own parity, which never includes the target itself, so \
+           its astrophysical signal can't leak into its regressors. \
+           Default 0
+    :param bool clobber: Overwrite existing files? Default `False`
+
+    '''
+
+    from .k2 import GetData, TargetDirectory
+
+    def Stars():
+        '''
+        The bright stars in this fold on this module (or on all modules)
+        whose data has been downloaded.
+
+        '''
+
+        log.info('Computing the neighbor basis for campaign %d, module %d, '
+                 'fold %d...' % (campaign, module, fold))
+        channels = Channels(module)
+        assert channels is not None, "No channels available on this module."
+        stars = [s for s in GetK2Campaign(campaign, cadence=cadence)
+                 if mag_range[0] < s[1] < mag_range[1] and
+                 s[0] % 2 != fold and
+                 os.path.exists(os.path.join(TargetDirectory(s[0], campaign),
+                                             'data.npz'))]
+        if len([s for s in stars if s[2] in channels]) >= min_stars:
+            stars = [s for s in stars if s[2] in channels]
+        return [s[0] for s in stars]
+
+    bfile = os.path.join(EVEREST_DAT, 'k2', 'cbv', 'c%02d' % campaign,
+                         'basis%02d_%s_%d_r%d_m%.2f-%.2f.npy' %
+                         (module, cadence, fold, rank, mag_range[0],
+                          mag_range[1]))
+    return NeighborBasis(bfile, Stars,
+                         FunctionWrapper(GetData, season=campaign,
+                                         cadence=cadence, get_hires=False,
+                                         get_nearby=False, **kwargs),
+                         rank=rank, max_stars=max_stars, seed=module,
+                         clobber=clobber)
@@ -13,7 +13,7 @@ from __future__ import division, print_function, absolute_import, \
      unicode_literals
 from .pipelines import Pipelines
 from ...config import EVEREST_SRC, EVEREST_DAT, EVEREST_DEV
-from ...utils import _float
+from ...utils import _float, AP_COLLAPSED_PIXEL, AP_SATURATED_PIXEL
 from ...mathutils import Chunks
 try:
     import pyfits
@@ -24,22 +24,46 @@ except ImportError:
         raise Exception('Please install the `pyfits` package.')
 from astropy.wcs import WCS
 from scipy.interpolate import griddata
+from scipy.spatial import cKDTree
 from k2plr.api import K2_CAMPAIGNS
 import numpy as np
 from tempfile import NamedTemporaryFile
+from collections import OrderedDict
+from six import string_types
 from six.moves import urllib
 import re
 import os
+import sys
 import subprocess
 import logging
 import k2plr as kplr
+from k2plr.config import KPLR_ROOT
 log = logging.getLogger(__name__)
-kplr_client = kplr.API()
+
+#: The shared :py:mod:`k2plr` API client (see :py:func:`KPLRClient`)
+_kplr_client = None
+#: The MAST url of the `K2` target pixel files
+TPF_ROOT = 'https://archive.stsci.edu/missions/k2/target_pixel_files/'
+#: The campaigns that were split in two. MAST stores each half under its
+#: season number (e.g., `c102`), which is also how :py:obj:`SEASONS`
+#: refers to it
+SPLIT_CAMPAIGNS = {9: [91, 92], 10: [101, 102], 11: [111, 112]}
+#: The local source catalogs, keyed by file (see :py:func:`GetSourceCatalog`)
+_source_catalogs = {}
+#: The most recent results of :py:func:`GetSources`
+_sources_cache = OrderedDict()
+#: The separators in sexagesimal coordinate strings
+_RASEP = re.compile(r'[\s:;,\-|]+')
+_DECSEP = re.compile(r'[\s:;,|]+')
 
 __all__ = ['Campaign', 'GetK2Stars', 'GetK2Campaign', 'Channel',
            'RemoveBackground', 'GetNeighboringChannels', 'GetSources',
            'GetHiResImage', 'GetCustomAperture',
-           'StatsPicker', 'SaturationFlux', 'Module', 'Channels']
+           'StatsPicker', 'SaturationFlux', 'Module', 'Channels',
+           'KPLRClient', 'SourceCatalog', 'MASTSourceCatalog',
+           'GetSourceCatalog', 'ProjectSources', 'PixelPercentileFlux', 'ExtendSaturatedColumns',
+           'CollapseSaturatedColumns', 'TPFFile', 'TPFUrl', 'DownloadTPFs',
+           'K2SFFFile', 'K2SFFApertures']
 
 
 def _range10_90(x):
@@ -149,6 +173,153 @@ class StatsPicker(object):
                 self.show(self.epic[i], mission='k2', model=self.compare_to)
 
 
+def KPLRClient():
+    '''
+    Returns the shared :py:class:`k2plr.API` client. The client is only
+    created the first time it is needed, so that importing this module
+    does not touch the network or the :py:mod:`k2plr` cache.
+
+    '''
+
+    global _kplr_client
+    if _kplr_client is None:
+        _kplr_client = kplr.API()
+    return _kplr_client
+
+
+def TPFFile(EPIC, campaign, cadence='lc'):
+    '''
+    Returns the path to the target pixel file of a given target in the
+    local :py:mod:`k2plr` cache.
+
+    :param int EPIC: The EPIC ID number
+    :param int campaign: The campaign number
+    :param str cadence: The light curve cadence. Default `lc`
+
+    '''
+
+    return os.path.join(KPLR_ROOT, 'data', 'k2', 'target_pixel_files',
+                        str(EPIC), 'ktwo%09d-c%02d_%spd-targ.fits.gz'
+                        % (EPIC, campaign, cadence[0]))
+
+
+def TPFUrl(EPIC, campaign, cadence='lc'):
+    '''
+    Returns the MAST url of the target pixel file of a given target.
+    Split campaigns must be given by season (e.g., `102`, not `10`).
+
+    :param int EPIC: The EPIC ID number
+    :param int campaign: The campaign number
+    :param str cadence: The light curve cadence. Default `lc`
+
+    '''
+
+    if int(campaign) in SPLIT_CAMPAIGNS:
+        raise ValueError("Campaign %d was split. Please choose one of " %
+                         campaign + "the seasons %s." %
+                         SPLIT_CAMPAIGNS[int(campaign)])
+    return TPF_ROOT + 'c%d/%s00000/%s000/' % (campaign, ('%09d' % EPIC)[:4],
+                                             ('%09d' % EPIC)[4:6]) + \
+        os.path.basename(TPFFile(EPIC, campaign, cadence))
+
+
+def K2SFFFile(EPIC, campaign):
+    '''
+    Returns the file name of the `K2SFF` light curve of a given target.
+
+    :param int EPIC: The EPIC ID number
+    :param int campaign: The campaign number
+
+    '''
+
+    return 'hlsp_k2sff_k2_lightcurve_%09d-c%02d_kepler_v1_llc.fits' % \
+        (EPIC, campaign)
+
+
+def K2SFFApertures(file):
+    '''
+    Returns the list of the 20 `K2SFF` apertures (the 10 circular
+    apertures followed by the 10 PRF-based ones) stored in a local
+    `K2SFF` light curve file, in the order used by :py:mod:`k2plr`.
+
+    :param str file: The path to the `K2SFF` *FITS* file
+
+    '''
+
+    with pyfits.open(file) as f:
+        return [np.array(a, dtype=int) for a in f['CIRC_APER_TBL'].data] + \
+               [np.array(a, dtype=int) for a in f['PRF_APER_TBL'].data]
+
+
+def DownloadTPFs(targets, campaign, clobber=False, **kwargs):
+    '''
+    Downloads the target pixel files of many targets concurrently into
+    the local :py:mod:`k2plr` cache with an
+    :py:class:`everest.download.DownloadManager`, to which the keyword
+    arguments are passed. Returns a list with the path to each file or,
+    if it could not be downloaded, the
+    :py:class:`everest.download.DownloadError` instance.
+    Split campaigns must be given by season (e.g., `102`); the whole
+    campaigns `9`, `10` and `11` have no MAST directory of their own,
+    so nothing is downloaded for them. On Python < 3.7, which the
+    download manager does not support, the files are fetched one
+    target at a time with :py:mod:`k2plr` instead.
+
+    :param list targets: A list of `(EPIC, cadence)` tuples
+    :param campaign: The campaign number. A :py:class:`float` in the \
+           form :py:obj:`X.Y` (the :py:obj:`Y^th` decile of campaign \
+           :py:obj:`X`, see :py:func:`GetK2Campaign`) is treated as \
+           campaign :py:obj:`X`
+    :param bool clobber: Overwrite existing files? Default :py:obj:`False`
+
+    '''
+
+    campaign = int(campaign)
+    if sys.version_info >= (3, 7):
+        from ...download import Request, FetchAll, DownloadError
+    else:
+        # The `asyncio` download manager needs Python 3.7
+        FetchAll = None
+        DownloadError = IOError
+    if campaign in SPLIT_CAMPAIGNS:
+        log.warn("Campaign %d was split. Skipping the bulk download; " %
+                 campaign + "please choose one of the seasons %s." %
+                 SPLIT_CAMPAIGNS[campaign])
+        return [DownloadError("No MAST directory for campaign %d." %
+                              campaign) for target in targets]
+    if FetchAll is None:
+        return _KPLRDownloadTPFs(targets, campaign, clobber=clobber)
+    return FetchAll([Request(TPFUrl(EPIC, campaign, cadence),
+                             TPFFile(EPIC, campaign, cadence))
+                     for EPIC, cadence in targets], clobber=clobber, **kwargs)
+
+
+def _KPLRDownloadTPFs(targets, campaign, clobber=False):
+    '''
+    Downloads the target pixel files of many targets one at a time with
+    :py:mod:`k2plr`. This is the fallback of :py:func:`DownloadTPFs`
+    when the :py:mod:`everest.download` manager is unavailable.
+
+    '''
+
+    res = []
+    fetched = set()
+    for EPIC, cadence in targets:
+        file = TPFFile(EPIC, campaign, cadence)
+        if (clobber or not os.path.exists(file)) and (EPIC not in fetched):
+            fetched.add(EPIC)
+            try:
+                KPLRClient().k2_star(EPIC).get_target_pixel_files(fetch=True)
+            except Exception as e:
+                res.append(e)
+                continue
+        if os.path.exists(file):
+            res.append(file)
+        else:
+            res.append(IOError("Unable to download `%s`." % file))
+    return res
+
+
 def Campaign(EPIC, **kwargs):
     '''
     Returns the campaign number(s) for a given EPIC target. If target
@@ -193,7 +364,7 @@ def GetK2Stars(clobber=False):
     # Download
     if clobber:
         print("Downloading K2 star list...")
-        stars = kplr_client.k2_star_info()
+        stars = KPLRClient().k2_star_info()
         print("Writing star list to disk...")
         for campaign in stars.keys():
             if not os.path.exists(os.path.join(EVEREST_SRC, 'missions',
@@ -466,19 +637,9 @@ def sex2dec(ra, dec):
 
     '''
 
-    ra = re.sub('\s+', '|', ra.strip())
-    ra = re.sub(':', '|', ra.strip())
-    ra = re.sub(';', '|', ra.strip())
-    ra = re.sub(',', '|', ra.strip())
-    ra = re.sub('-', '|', ra.strip())
-    ra = ra.split('|')
+    ra = _RASEP.split(ra.strip())
     outra = (float(ra[0]) + float(ra[1]) / 60. + float(ra[2]) / 3600.) * 15.0
-
-    dec = re.sub('\s+', '|', dec.strip())
-    dec = re.sub(':', '|', dec.strip())
-    dec = re.sub(';', '|', dec.strip())
-    dec = re.sub(',', '|', dec.strip())
-    dec = dec.split('|')
+    dec = _DECSEP.split(dec.strip())
 
     if float(dec[0]) > 0.0:
         outdec = float(dec[0]) + float(dec[1]) / 60. + float(dec[2]) / 3600.
@@ -488,7 +649,172 @@ def sex2dec(ra, dec):
     return outra, outdec
 
 
-def GetSources(ID, darcsec=None, stars_only=False):
+class SourceCatalog(object):
+    '''
+    A local `EPIC` source catalog that answers the same box searches
+    as :py:func:`MASTRADec` without any network calls. The catalog is
+    a CSV file with columns `id`, `k2_ra`, `k2_dec` and `kp` (the
+    same columns :py:func:`MASTRADec` requests), with the coordinates
+    in decimal degrees. Lines that don't parse (headers, comments)
+    are skipped. The sources are indexed in a KD-tree on the unit
+    sphere, and the results of the most recent queries are cached.
+
+    :param str file: The path to the catalog file
+    :param int cache_size: The number of queries to cache. Default 1024
+
+    '''
+
+    def __init__(self, file, cache_size=1024):
+        '''
+
+        '''
+
+        self.file = file
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        try:
+            cat = np.atleast_2d(np.genfromtxt(file, delimiter=',',
+                                              comments='#',
+                                              invalid_raise=False,
+                                              usecols=(0, 1, 2, 3)))
+            cat = cat[~np.isnan(cat[:, 0])]
+        except (IOError, OSError, ValueError, IndexError):
+            log.warn('Unable to read source data from `%s`.' % file)
+            cat = np.zeros((0, 4))
+        self.epicid = np.array(cat[:, 0], dtype=int)
+        self.ra = np.array(cat[:, 1])
+        self.dec = np.array(cat[:, 2])
+        self.kepmag = np.array(cat[:, 3])
+        if len(self.epicid):
+            self._tree = cKDTree(self._xyz(self.ra, self.dec))
+        else:
+            self._tree = None
+
+    @staticmethod
+    def _xyz(ra, dec):
+        '''
+        Returns the unit vectors pointing to (`ra`, `dec`).
+
+        '''
+
+        ra = np.radians(ra)
+        dec = np.radians(dec)
+        return np.transpose([np.cos(dec) * np.cos(ra),
+                             np.cos(dec) * np.sin(ra),
+                             np.sin(dec)])
+
+    def query(self, ra, dec, darcsec, stars_only=False):
+        '''
+        Returns the `EPIC` IDs, coordinates and magnitudes of all
+        sources in the box of half-width :py:obj:`darcsec` centered
+        on (`ra`, `dec`), exactly like :py:func:`MASTRADec`. The
+        :py:obj:`stars_only` option is ignored, since the local
+        catalog has no object types.
+
+        '''
+
+        key = (float(ra), float(dec), float(darcsec))
+        res = self._cache.get(key, None)
+        if res is not None:
+            self._cache[key] = self._cache.pop(key)
+            return res
+
+        # coordinate limits
+        d = darcsec / 3600.0
+        ra1 = ra - d / np.cos(dec * np.pi / 180)
+        ra2 = ra + d / np.cos(dec * np.pi / 180)
+        dec1 = dec - d
+        dec2 = dec + d
+
+        # Cone search on the unit sphere around the box, then
+        # trim the result to the box itself
+        if self._tree is not None:
+            r = min(np.pi, 1.01 * np.sqrt(2.) * np.radians(d))
+            inds = np.array(self._tree.query_ball_point(
+                self._xyz(ra, dec), 2 * np.sin(r / 2)), dtype=int)
+            inds = inds[(self.ra[inds] >= ra1) & (self.ra[inds] <= ra2) &
+                        (self.dec[inds] >= dec1) & (self.dec[inds] <= dec2)]
+            inds = np.sort(inds)
+        else:
+            inds = np.array([], dtype=int)
+        res = (self.epicid[inds], self.ra[inds], self.dec[inds],
+               self.kepmag[inds])
+
+        self._cache[key] = res
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        return res
+
+
+class MASTSourceCatalog(object):
+    '''
+    The default source catalog backend, which queries MAST with
+    :py:func:`MASTRADec`. Any object with the same :py:meth:`query`
+    method may be passed to :py:func:`GetSources` instead.
+
+    '''
+
+    def query(self, ra, dec, darcsec, stars_only=False):
+        '''
+
+        '''
+
+        return MASTRADec(ra, dec, darcsec, stars_only)
+
+
+def GetSourceCatalog(catalog=None):
+    '''
+    Returns the source catalog backend for :py:obj:`catalog`. If
+    :py:obj:`None`, returns a :py:class:`MASTSourceCatalog`; if a
+    string, returns the shared :py:class:`SourceCatalog` for that
+    file, which is only loaded (and indexed) the first time it is
+    needed. Any other object is assumed to be a backend and is
+    returned as is.
+
+    '''
+
+    if catalog is None:
+        return MASTSourceCatalog()
+    elif isinstance(catalog, string_types):
+        key = os.path.abspath(catalog)
+        if key not in _source_catalogs:
+            _source_catalogs[key] = SourceCatalog(catalog)
+        return _source_catalogs[key]
+    else:
+        return catalog
+
+
+def ProjectSources(epicid, ra, dec, kepmag, header):
+    '''
+    Projects the sources at (`ra`, `dec`) onto the pixel grid of a
+    target pixel file given the WCS keywords in its aperture
+    extension :py:obj:`header`. Returns a list of dictionaries with
+    keys `ID`, `x`, `y`, `mag`, `x0` and `y0`, as expected by
+    :py:func:`GetSources`.
+
+    '''
+
+    pc = np.array([[header['PC1_1'], header['PC1_2']],
+                   [header['PC2_1'], header['PC2_2']]])
+    pc = np.linalg.inv(pc)
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    dra = (ra - header['CRVAL1']) * np.cos(np.radians(dec)) / \
+        header['CDELT1']
+    ddec = (dec - header['CRVAL2']) / header['CDELT2']
+    sx = pc[0, 0] * dra + pc[0, 1] * ddec + header['CRPIX1'] + \
+        header['CRVAL1P'] - 1.0
+    sy = pc[1, 0] * dra + pc[1, 1] * ddec + header['CRPIX2'] + \
+        header['CRVAL2P'] - 1.0
+    x0 = header['CRVAL1P']
+    y0 = header['CRVAL2P']
+
+    return [dict(ID=epic, x=sx[i], y=sy[i], mag=kepmag[i], x0=x0, y0=y0)
+            for i, epic in enumerate(epicid)]
+
+
+def GetSources(ID, darcsec=None, stars_only=False, tpf=None, catalog=None):
     '''
     Grabs the EPIC coordinates from the TPF and searches MAST
     for other EPIC targets within the same aperture.
@@ -498,48 +824,50 @@ def GetSources(ID, darcsec=None, stars_only=False):
            Default is four times the largest dimension of the aperture.
     :param bool stars_only: If :py:obj:`True`, only returns objects \
            explicitly designated as `"stars"` in MAST. Default :py:obj:`False`
+    :param str tpf: The path to a local copy of the target pixel file. \
+           If :py:obj:`None` (default), it is retrieved with \
+           :py:mod:`k2plr`
+    :param catalog: The source catalog backend (see \
+           :py:func:`GetSourceCatalog`). Either the path to a local \
+           `EPIC` catalog file, in which case no MAST query is \
+           performed and :py:obj:`stars_only` is ignored, or an \
+           object with a :py:meth:`query` method like \
+           :py:meth:`SourceCatalog.query`. Default :py:obj:`None` (MAST)
     :returns: A list of :py:class:`Source` instances containing \
               other :py:obj:`EPIC` targets within or close to this \
               target's aperture
     '''
 
-    client = kplr.API()
-    star = client.k2_star(ID)
-    tpf = star.get_target_pixel_files()[0]
-    with tpf.open() as f:
-        crpix1 = f[2].header['CRPIX1']
-        crpix2 = f[2].header['CRPIX2']
-        crval1 = f[2].header['CRVAL1']
-        crval2 = f[2].header['CRVAL2']
-        cdelt1 = f[2].header['CDELT1']
-        cdelt2 = f[2].header['CDELT2']
-        pc1_1 = f[2].header['PC1_1']
-        pc1_2 = f[2].header['PC1_2']
-        pc2_1 = f[2].header['PC2_1']
-        pc2_2 = f[2].header['PC2_2']
-        pc = np.array([[pc1_1, pc1_2], [pc2_1, pc2_2]])
-        pc = np.linalg.inv(pc)
-        crpix1p = f[2].header['CRPIX1P']
-        crpix2p = f[2].header['CRPIX2P']
-        crval1p = f[2].header['CRVAL1P']
-        crval2p = f[2].header['CRVAL2P']
-        cdelt1p = f[2].header['CDELT1P']
-        cdelt2p = f[2].header['CDELT2P']
+    key = (ID, darcsec, stars_only, tpf,
+           catalog if catalog is None or isinstance(catalog, string_types)
+           else id(catalog))
+    res = _sources_cache.get(key, None)
+    if res is not None:
+        _sources_cache[key] = _sources_cache.pop(key)
+        return [dict(source) for source in res]
+
+    if tpf is None:
+        star = KPLRClient().k2_star(ID)
+        k2ra = star.k2_ra
+        k2dec = star.k2_dec
+        f = star.get_target_pixel_files()[0].open()
+    else:
+        f = pyfits.open(tpf)
+        k2ra = f[0].header['RA_OBJ']
+        k2dec = f[0].header['DEC_OBJ']
+    with f:
+        header = f[2].header
         if darcsec is None:
             darcsec = 4 * max(f[2].data.shape)
+        epicid, ra, dec, kepmag = GetSourceCatalog(catalog).query(
+            k2ra, k2dec, darcsec, stars_only)
+        sources = ProjectSources(epicid, ra, dec, kepmag, header)
 
-    epicid, ra, dec, kepmag = MASTRADec(
-        star.k2_ra, star.k2_dec, darcsec, stars_only)
-    sources = []
-    for i, epic in enumerate(epicid):
-        dra = (ra[i] - crval1) * np.cos(np.radians(dec[i])) / cdelt1
-        ddec = (dec[i] - crval2) / cdelt2
-        sx = pc[0, 0] * dra + pc[0, 1] * ddec + crpix1 + crval1p - 1.0
-        sy = pc[1, 0] * dra + pc[1, 1] * ddec + crpix2 + crval2p - 1.0
-        sources.append(dict(ID=epic, x=sx, y=sy, mag=kepmag[i],
-                            x0=crval1p, y0=crval2p))
+    _sources_cache[key] = sources
+    while len(_sources_cache) > 1024:
+        _sources_cache.popitem(last=False)
 
-    return sources
+    return [dict(source) for source in sources]
 
 
 def GetHiResImage(ID):
@@ -551,7 +879,7 @@ def GetHiResImage(ID):
     '''
 
     # Get the TPF info
-    client = kplr.API()
+    client = KPLRClient()
     star = client.k2_star(ID)
     k2ra = star.k2_ra
     k2dec = star.k2_dec
@@ -639,3 +967,107 @@ def SaturationFlux(EPIC, campaign=None, **kwargs):
                                      unpack=True)
     satflx = well_depth[channel == Channel(EPIC, campaign=campaign)][0] / 6.02
     return satflx
+
+
+def PixelPercentileFlux(fpix, aperture, q=97.5):
+    '''
+    Returns the :py:obj:`q`-th percentile flux of each pixel in
+    :py:obj:`aperture` (zero for pixels outside the aperture or that
+    are always :py:obj:`NaN`), ignoring :py:obj:`NaN` cadences. The
+    percentile is the order statistic ``sorted(f)[int(q / 100 * len(f))]``
+    of each pixel's non-NaN fluxes, computed for all pixels at once.
+
+    :param ndarray fpix: The `(ntime, nrows, ncols)` pixel flux array
+    :param ndarray aperture: The `(nrows, ncols)` aperture
+    :param float q: The percentile. Default `97.5`
+
+    '''
+
+    fq = np.zeros(fpix.shape[1:])
+    rows, cols = np.nonzero(aperture)
+    if len(rows):
+        # `np.sort` places the NaNs at the end of each column
+        f = np.sort(fpix[:, rows, cols], axis=0)
+        n = np.sum(~np.isnan(f), axis=0)
+        good = np.flatnonzero(n)
+        fq[rows[good], cols[good]] = \
+            f[(q / 100. * n[good]).astype(int), good]
+    return fq
+
+
+def ExtendSaturatedColumns(fpix, aperture, satcols):
+    '''
+    Extends the :py:obj:`aperture` in place by up to two pixels at the
+    top and bottom of each saturated column, marking the new pixels
+    with a value of `2`. Only pixels with positive median flux are
+    added. Returns the number of pixels added.
+
+    :param ndarray fpix: The `(ntime, nrows, ncols)` pixel flux array
+    :param ndarray aperture: The `(nrows, ncols)` aperture
+    :param ndarray satcols: Boolean array, :py:obj:`True` for the \
+           saturated columns
+
+    '''
+
+    # Pixels within two rows of an aperture pixel in the same column
+    inap = (aperture == 1)
+    near = np.zeros_like(inap)
+    near[:-2] |= inap[2:]
+    near[:-1] |= inap[1:]
+    near[1:] |= inap[:-1]
+    near[2:] |= inap[:-2]
+
+    ext = np.zeros_like(inap)
+    if np.any(satcols):
+        med = np.nanmedian(fpix[:, :, satcols], axis=0)
+        ext[:, satcols] = (aperture[:, satcols] == 0) & (med > 0) & \
+            near[:, satcols]
+    aperture[ext] = 2
+    return int(np.sum(ext))
+
+
+def CollapseSaturatedColumns(fpix, fpix_err, aperture, satcols):
+    '''
+    Collapses each saturated column of the :py:obj:`aperture` into a
+    single pixel and returns the 2D `(ntime, npix)` flux and flux error
+    arrays, along with the number of collapsed columns. Pixels are
+    ordered by column, then by row. The aperture is updated in place:
+    the first pixel of each collapsed column is marked
+    :py:obj:`AP_COLLAPSED_PIXEL` and the rest :py:obj:`AP_SATURATED_PIXEL`.
+
+    :param ndarray fpix: The `(ntime, nrows, ncols)` pixel flux array
+    :param ndarray fpix_err: The `(ntime, nrows, ncols)` flux error array
+    :param ndarray aperture: The `(nrows, ncols)` aperture
+    :param ndarray satcols: Boolean array, :py:obj:`True` for the \
+           saturated columns
+
+    '''
+
+    # The aperture pixels, ordered by column
+    cols, rows = np.nonzero(aperture.T)
+    sat = satcols[cols]
+    first = np.ones(len(cols), dtype=bool)
+    first[1:] = cols[1:] != cols[:-1]
+    aperture[rows[sat & first], cols[sat & first]] = AP_COLLAPSED_PIXEL
+    aperture[rows[sat & ~first], cols[sat & ~first]] = AP_SATURATED_PIXEL
+
+    # The regular pixels are simply copied over...
+    fpix2D = fpix[:, rows, cols]
+    fpix_err2D = fpix_err[:, rows, cols]
+
+    # ... and the saturated columns are summed into the first pixel
+    keep = ~sat
+    ncol = 0
+    for j in np.flatnonzero(satcols):
+        inds = np.flatnonzero(cols == j)
+        if not len(inds):
+            continue
+        collapsed = np.add.reduce(fpix2D[:, inds].T, axis=0)
+        if np.any(collapsed):
+            fpix2D[:, inds[0]] = collapsed
+            fpix_err2D[:, inds[0]] = np.sqrt(
+                np.add.reduce(fpix_err2D[:, inds].T ** 2, axis=0))
+            keep[inds[0]] = True
+            ncol += 1
+
+    return fpix2D[:, keep], fpix_err2D[:, keep], ncol
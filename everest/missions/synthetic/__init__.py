@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`__init__.py` - Initialization
+--------------------------------------
+
+A synthetic, `K2`-like mission for offline runs and benchmarks.
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+import sys
+import importlib
+
+#: The submodules of this mission, imported on first access
+_SUBMODULES = ['synthetic', 'utils', 'sysrem', 'batch']
+
+#: The public mission functions and the submodule each one lives in
+_ATTRIBUTES = dict([(name, 'synthetic') for name in
+                    ['Setup', 'Season', 'Breakpoints', 'GetData',
+                     'GetNeighbors', 'GetNeighborBasis', 'Statistics',
+                     'TargetDirectory', 'HasShortCadence', 'DVSFile',
+                     'HDUCards', 'CSVFile', 'FITSFile', 'FITSUrl', 'CDPP',
+                     'GetTargetCBVs', 'FitCBVs']] +
+                   [('GetCBVs', 'sysrem'),
+                    ('GetSyntheticCampaign', 'utils'),
+                    ('SyntheticTPF', 'utils'),
+                    ('TargetInfo', 'utils'),
+                    ('CAMPAIGNS', 'utils'),
+                    ('Download', 'batch'),
+                    ('Run', 'batch'),
+                    ('Publish', 'batch'),
+                    ('Render', 'batch'),
+                    ('RefreshCBVs', 'batch')])
+
+#: The string that identifies individual targets for this mission
+IDSTRING = 'SYN'
+#: The character abbreviation of the name given to an
+#: observing "season" for this mission
+SEASONCHAR = 'S'
+#: The string representing the filter/band used in the mission
+MAGSTRING = r'K$_\mathrm{p}$'
+#: The time units for the mission
+TIMEUNITS = 'BJD - 2454833'
+#: The currently supported seasons
+SEASONS = [0, 1, 2]
+#: Returns :py:obj:`True` if argument is a valid synthetic
+#: target identifier (necessary but not sufficient)
+ISTARGET = lambda x: ((type(x) is int) and (x > 9e8) and (x < 1e9))
+#: The published light curve CSV file header
+CSVHEADER = \
+  '''SYN %09d
+=============
+
+
+DESCRIPTION
+-----------
+De-trended light curve of a synthetic target generated by the
+Everest pipeline. The target pixel data was simulated by the
+`everest.missions.synthetic` module and does not correspond to
+a real star.
+
+
+COLUMN INFO
+-----------
+TIME (float): Time (BJD - 2454833)
+CADN (int):   Cadence number
+FCOR (float): CBV-corrected, PLD de-trended flux
+FLUX (float): PLD de-trended flux
+FRAW (float): Raw simple aperture photometry flux
+MASK (int):   0 = Data point was included in the model
+                  calculation
+              1 = Data point was NaN in the raw flux
+              2 = Data point has a flagged QUALITY bit
+              3 = Data point was identified as an outlier
+
+'''
+
+
+def __getattr__(name):
+    '''
+    Imports the submodule or mission function :py:obj:`name` on
+    first access.
+
+    '''
+
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    elif name in _ATTRIBUTES:
+        module = importlib.import_module('.' + _ATTRIBUTES[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module '%s' has no attribute '%s'" %
+                         (__name__, name))
+
+
+# Module-level ``__getattr__`` requires Python 3.7 (PEP 562)
+if sys.version_info < (3, 7):
+    for _name in _SUBMODULES + list(_ATTRIBUTES.keys()):
+        globals()[_name] = __getattr__(_name)
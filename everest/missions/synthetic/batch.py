@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`batch.py` - Local campaign runs
+----------------------------------------
+
+Routines for generating, de-trending and publishing a whole synthetic
+campaign on the local machine. These are the synthetic counterparts of
+the `K2` cluster routines in :py:mod:`everest.missions.k2.pbs`: each
+target is processed by a worker of an :py:mod:`everest.pool` pool,
+which is an :py:class:`everest.pool.MPIPool` when run under `MPI` and
+a :py:class:`everest.pool.MultiPool` otherwise.
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from .utils import GetSyntheticCampaign
+from .synthetic import GetData, TargetDirectory, FITSFile
+from .sysrem import GetCBVs, GetBasis
+from ...utils import FunctionWrapper
+from ...fits import RefreshCBVColumns
+from ...pool import Pool
+import os
+import logging
+log = logging.getLogger(__name__)
+
+
+def Download(season=0, pool='AnyPool', processes=None, clobber=False):
+    '''
+    Generates the target pixel files of all the targets in a
+    synthetic campaign.
+
+    :param int season: The campaign number. Default 0
+    :param str pool: The :py:func:`everest.pool.Pool` to use. \
+           Default `AnyPool`
+    :param int processes: The number of worker processes of a \
+           :py:class:`everest.pool.MultiPool`. Default is the number \
+           of CPUs
+    :param bool clobber: Regenerate existing files? Default :py:obj:`False`
+
+    '''
+
+    stars = GetSyntheticCampaign(season, epics_only=True)
+    m = FunctionWrapper(GetData, season=season, clobber=clobber,
+                        download_only=True)
+    with Pool(pool, processes=processes) as p:
+        p.map(m, stars)
+
+
+def Run(season=0, ID=None, pool='AnyPool', processes=None, **kwargs):
+    '''
+    De-trends all the targets in a synthetic campaign (or a single
+    target, if :py:obj:`ID` is set). Keyword arguments are passed
+    to the model. If `neighbor_mode='basis'`, the neighbor bases of
+    all the modules are computed first.
+
+    :param int season: The campaign number. Default 0
+    :param int ID: The ID of a single target to run. \
+           Default :py:obj:`None`
+    :param str pool: The :py:func:`everest.pool.Pool` to use. \
+           Default `AnyPool`
+    :param int processes: The number of worker processes of a \
+           :py:class:`everest.pool.MultiPool`. Default is the number \
+           of CPUs
+
+    '''
+
+    m = FunctionWrapper(EverestModel, season=season, **kwargs)
+    if ID is not None:
+        m(ID)
+        return
+
+    # Compute the neighbor bases once, before the workers are started
+    if kwargs.get('neighbor_mode', 'stars') == 'basis':
+        for module in sorted(set([s[2] for s in
+                                  GetSyntheticCampaign(season)])):
+            for fold in [0, 1]:
+                GetBasis(season, module, rank=kwargs.get('basis_rank', 20),
+                         mag_range=kwargs.get('mag_range', (11., 13.)),
+                         fold=fold)
+
+    stars = GetSyntheticCampaign(season, epics_only=True)
+    with Pool(pool, processes=processes) as p:
+        p.map(m, stars)
+
+
+def Publish(season=0, model='nPLD', pool='AnyPool', processes=None,
+            cbvs=True, update=False, **kwargs):
+    '''
+    Publishes the *FITS* files (and DVS figures) of all the targets
+    in a synthetic campaign. The CBVs are computed once, before the
+    workers are started. To republish a campaign after recomputing
+    its CBVs, set :py:obj:`update` (and pass `dvs_mode='none'` to
+    skip the figures), or use the faster :py:func:`RefreshCBVs`.
+
+    :param int season: The campaign number. Default 0
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param str pool: The :py:func:`everest.pool.Pool` to use. \
+           Default `AnyPool`
+    :param int processes: The number of worker processes of a \
+           :py:class:`everest.pool.MultiPool`. Default is the number \
+           of CPUs
+    :param bool cbvs: Compute the CBVs first? Default :py:obj:`True`
+    :param bool update: Only update the CBV-corrected light curves of \
+           existing *FITS* files? See :py:func:`everest.fits.UpdateFITS`. \
+           Default :py:obj:`False`
+
+    '''
+
+    if cbvs:
+        GetCBVs(season, model=model)
+    m = FunctionWrapper(EverestModel, season=season, model=model,
+                        publish=True, update=update, **kwargs)
+    stars = GetSyntheticCampaign(season, epics_only=True)
+    with Pool(pool, processes=processes) as p:
+        p.map(m, stars)
+
+
+def Render(season=0, model='nPLD', pool='AnyPool', processes=None,
+           publish=False, **kwargs):
+    '''
+    Renders the DVS figures of all the targets in a synthetic campaign
+    that were de-trended (or published) with :py:obj:`dvs_mode` set to
+    `deferred`. See :py:meth:`everest.detrender.Detrender.render`.
+
+    :param int season: The campaign number. Default 0
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param str pool: The :py:func:`everest.pool.Pool` to use. \
+           Default `AnyPool`
+    :param int processes: The number of worker processes of a \
+           :py:class:`everest.pool.MultiPool`. Default is the number \
+           of CPUs
+    :param bool publish: Render the publication DVS figures? \
+           Default :py:obj:`False`
+
+    '''
+
+    m = FunctionWrapper(EverestModel, season=season, model=model,
+                        publish=publish, render=True, **kwargs)
+    stars = GetSyntheticCampaign(season, epics_only=True)
+    with Pool(pool, processes=processes) as p:
+        p.map(m, stars)
+
+
+def RefreshCBVs(season=0, model='nPLD', pool='AnyPool', processes=None,
+                clobber=False, cbv_num=1, cbv_niter=50, cbv_win=999,
+                cbv_order=3, **kwargs):
+    '''
+    Refreshes the CBV correction of all the published light curves in a
+    synthetic campaign, i.e., after its CBVs were recomputed. This is a
+    much faster alternative to :py:func:`Publish` with :py:obj:`update`
+    set: each worker processes all the targets on one module with
+    :py:func:`everest.fits.RefreshCBVColumns`, reading only the fluxes,
+    masks and breakpoints of the stored models and solving all their
+    CBV regressions at once. Targets that cannot be refreshed this way
+    (e.g., those without a *FITS* file) are republished from their models.
+
+    :param int season: The campaign number. Default 0
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+    :param str pool: The :py:func:`everest.pool.Pool` to use. \
+           Default `AnyPool`
+    :param int processes: The number of worker processes of a \
+           :py:class:`everest.pool.MultiPool`. Default is the number \
+           of CPUs
+    :param bool clobber: Recompute the CBVs first? Default :py:obj:`False`
+    :param int cbv_num: The number of CBVs to regress on. Default 1
+
+    '''
+
+    # The CBVs
+    X = GetCBVs(season, model=model, clobber=clobber, niter=cbv_niter,
+                sv_win=cbv_win, sv_order=cbv_order)
+
+    # The targets with a model on disk, grouped by module
+    modules = {}
+    ids = {}
+    for star, _, module in [s[:3] for s in GetSyntheticCampaign(season)]:
+        path = TargetDirectory(star, season)
+        modelfile = os.path.join(path, model + '.npz')
+        if os.path.exists(modelfile):
+            ids[modelfile] = star
+            modules.setdefault(module, []).append(
+                (modelfile, os.path.join(path, FITSFile(star, season))))
+
+    # Refresh
+    m = FunctionWrapper(RefreshCBVColumns, X, cbv_num=cbv_num,
+                        cbv_niter=cbv_niter, cbv_win=cbv_win,
+                        cbv_order=cbv_order)
+    with Pool(pool, processes=processes) as p:
+        failed = sum(p.map(m, [modules[k] for k in sorted(modules)]), [])
+
+    # Fall back to the models
+    if len(failed):
+        log.warn('Republishing %d light curves from their models...' %
+                 len(failed))
+        m = FunctionWrapper(EverestModel, season=season, model=model,
+                            publish=True, update=True, dvs_mode='none',
+                            cbv_num=cbv_num, **kwargs)
+        with Pool(pool, processes=processes) as p:
+            p.map(m, [ids[f[0]] for f in failed])
+
+
+def EverestModel(ID, model='nPLD', publish=False, csv=False, render=False,
+                 update=False, **kwargs):
+    '''
+    A wrapper around an :py:obj:`everest` model for campaign runs.
+    If :py:obj:`render` is set, only the (deferred) DVS figures are
+    rendered, with the non-interactive `Agg` backend.
+
+    '''
+
+    kwargs.update({'mission': 'synthetic'})
+    if render:
+        import matplotlib
+        matplotlib.use('Agg')
+    if model != 'Inject':
+        from ... import detrender
+
+        # Run the model
+        m = getattr(detrender, model)(ID, **kwargs)
+
+        # Render or publish?
+        if render:
+            m.render(publish=publish)
+        elif publish:
+            if csv:
+                m.publish_csv()
+            else:
+                m.publish(update=update)
+
+    else:
+        from ...inject import Inject
+        Inject(ID, **kwargs)
+    return True
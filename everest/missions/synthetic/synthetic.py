@@ -0,0 +1,570 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`synthetic.py` - Main mission routines
+----------------------------------------------
+
+Implements the mission routines for the synthetic mission, a stand-in
+for `K2` that needs neither network access nor :py:mod:`k2plr`. The
+target pixel files are generated on demand (see
+:py:mod:`everest.missions.synthetic.utils`) and cached as
+``data.npz`` files in the same layout as the `K2` ones, so the
+models, the neighbor selection, the CBVs and the published *FITS*
+files all follow the same code paths as for real data:
+
+.. code-block:: python
+
+    from everest.missions import synthetic
+    synthetic.Download(0)
+    synthetic.Run(0, model='nPLD')
+    synthetic.Publish(0, model='nPLD')
+    synthetic.Statistics(0, model='nPLD')
+
+Campaign 0 has 100 targets, campaign 1 has 1000 and campaign 2 has
+10000 (see :py:data:`everest.missions.synthetic.utils.CAMPAIGNS`).
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from . import sysrem
+from .utils import *
+from ...config import EVEREST_DAT, EVEREST_MAJOR_MINOR
+from ...utils import DataContainer, IndexMap
+from ...mathutils import SavGol, Interpolate, Scatter, CBVFit
+from ...modelstore import LoadModel
+from ...profiling import STAGES, MergeProfile
+import numpy as np
+from tempfile import NamedTemporaryFile
+import os
+import shutil
+import time
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = ['Setup', 'Season', 'Breakpoints', 'GetData', 'GetNeighbors',
+           'Statistics', 'TargetDirectory', 'HasShortCadence', 'DVSFile',
+           'HDUCards', 'CSVFile', 'FITSFile', 'FITSUrl', 'CDPP',
+           'GetTargetCBVs', 'FitCBVs']
+
+
+def Setup():
+    '''
+    Called when the code is installed. Sets up the data directory.
+
+    '''
+
+    if not os.path.exists(os.path.join(EVEREST_DAT, 'synthetic', 'cbv')):
+        os.makedirs(os.path.join(EVEREST_DAT, 'synthetic', 'cbv'))
+
+
+def Season(ID, **kwargs):
+    '''
+    Returns the campaign number for a given synthetic target.
+
+    '''
+
+    return Campaign(ID)
+
+
+def Breakpoints(ID, season=None, cadence='lc', **kwargs):
+    '''
+
+    Returns the location of the breakpoints for a given target. There
+    is a single breakpoint at the mid-campaign data downlink.
+
+    :param int ID: The target ID number
+    :param str cadence: The light curve cadence. Only `lc` is \
+           available. Default `lc`
+
+    '''
+
+    if cadence != 'lc':
+        raise ValueError("Only long cadence data is available.")
+    if season is None:
+        season = Season(ID)
+    if season not in CAMPAIGNS:
+        return None
+    return [CAMPAIGNS[season][1] // 2]
+
+
+def CDPP(flux, mask=[], cadence='lc'):
+    '''
+    Compute the proxy 6-hr CDPP metric, exactly as for `K2`.
+
+    :param array_like flux: The flux array to compute the CDPP for
+    :param array_like mask: The indices to be masked
+    :param str cadence: The light curve cadence. Default `lc`
+
+    '''
+
+    # 13 cadences is 6.5 hours
+    rmswin = 13
+    # Smooth the data on a 2 day timescale
+    svgwin = 49
+
+    flux_savgol = SavGol(np.delete(flux, mask), win=svgwin)
+    if len(flux_savgol):
+        return Scatter(flux_savgol / np.nanmedian(flux_savgol),
+                       remove_outliers=True, win=rmswin)
+    else:
+        return np.nan
+
+
+def GetData(ID, season=None, cadence='lc', clobber=False, delete_raw=False,
+            aperture_name='k2sff_15', saturated_aperture_name='k2sff_19',
+            max_pixels=75, download_only=False, saturation_tolerance=-0.1,
+            bad_bits=[1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 12, 13, 14, 16, 17],
+            get_hires=True, get_nearby=True, **kwargs):
+    '''
+    Returns a :py:obj:`DataContainer` instance with the
+    raw data for the target. The target pixel file is generated the
+    first time it is requested and cached on disk.
+
+    :param int ID: The target ID number
+    :param int season: The observing season (campaign). Default :py:obj:`None`
+    :param str cadence: The light curve cadence. Only `lc` is \
+           available. Default `lc`
+    :param bool clobber: Regenerate the target pixel file? \
+           Default :py:obj:`False`
+    :param str aperture_name: The name of the aperture to use. \
+           Default `k2sff_15`
+    :param int max_pixels: Maximum number of pixels in the TPF. Default 75
+    :param bool download_only: Generate the TPF and return? Default \
+           :py:obj:`False`
+    :param array_like bad_bits: Flagged :py:obj`QUALITY` bits to consider \
+           outliers when computing the model. \
+           Default `[1,2,3,4,5,6,7,8,9,11,12,13,14,16,17]`
+    :param bool get_hires: Return a sharper image of the field? \
+           Default :py:obj:`True`
+    :param bool get_nearby: Return the location of nearby sources? \
+           Default :py:obj:`True`
+
+    .. note :: Saturation is not simulated, so \
+               :py:obj:`saturated_aperture_name` and \
+               :py:obj:`saturation_tolerance` are ignored.
+
+    '''
+
+    if cadence != 'lc':
+        raise ValueError("Short cadence data not available for this target.")
+    if season is None:
+        season = Season(ID)
+    if season is None:
+        raise ValueError("Invalid synthetic target: %s." % ID)
+
+    # Generate the TPF?
+    filename = os.path.join(TargetDirectory(ID, season), 'data.npz')
+    if clobber or not os.path.exists(filename):
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        tpf = SyntheticTPF(ID)
+        tpf['fpix'] = np.array(tpf['fpix'], dtype='float32')
+        tpf['fpix_err'] = np.array(tpf['fpix_err'], dtype='float32')
+        f = NamedTemporaryFile("wb", delete=False,
+                               dir=os.path.dirname(filename))
+        np.savez(f, **tpf)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        shutil.move(f.name, filename)
+        if download_only:
+            return
+    elif download_only:
+        return
+
+    # Load
+    tpf = np.load(filename, allow_pickle=True)
+    apertures = tpf['apertures'][()]
+    time = tpf['time']
+    fpix = np.array(tpf['fpix'], dtype='float64')
+    fpix_err = np.array(tpf['fpix_err'], dtype='float64')
+    qual = tpf['qual']
+
+    # Grab the aperture
+    if aperture_name is None:
+        aperture_name = 'k2sff_15'
+    if aperture_name not in apertures:
+        log.error("Invalid aperture selected. Defaulting to `tpf_big`.")
+        aperture_name = 'tpf_big'
+    aperture = apertures[aperture_name]
+
+    # Pick the largest aperture with fewer than `max_pixels` pixels
+    if np.sum(aperture) > max_pixels:
+        keys = sorted(apertures.keys())
+        npix = np.array([np.sum(apertures[k]) for k in keys])
+        aperture_name = keys[np.argmax(npix * (npix <= max_pixels))]
+        aperture = apertures[aperture_name]
+        if np.sum(aperture) > max_pixels:
+            log.error("No apertures available with fewer than " +
+                      "%d pixels. Aborting." % max_pixels)
+            return None
+        log.warn("Selected aperture is too big. Proceeding with aperture " +
+                 "`%s` instead." % aperture_name)
+
+    # Remove the background
+    ap = np.where(aperture & 1)
+    binds = np.where(aperture ^ 1)
+    if len(binds[0]) > 0:
+        bkg = np.nanmedian(fpix[:, binds[0], binds[1]], axis=1)
+        bkg_err = 1.253 * np.nanmedian(fpix_err[:, binds[0], binds[1]],
+                                       axis=1) / np.sqrt(len(binds[0]))
+        bkg = bkg.reshape(-1, 1)
+        bkg_err = bkg_err.reshape(-1, 1)
+    else:
+        bkg = 0.
+        bkg_err = 0.
+    fpix = fpix[:, ap[0], ap[1]] - bkg
+    fpix_err = np.sqrt(fpix_err[:, ap[0], ap[1]] ** 2 + bkg_err ** 2)
+    flux = np.sum(fpix, axis=1)
+
+    # Get NaN data points
+    nanmask = np.where(np.isnan(flux) | (flux == 0))[0]
+
+    # Get flagged data points -- we won't train our model on them
+    badmask = []
+    for b in bad_bits:
+        badmask += list(np.where(qual & 2 ** (b - 1))[0])
+
+    # Flag >10 sigma outliers -- same thing.
+    imap = IndexMap(len(time), np.concatenate([badmask, nanmask]))
+    f = SavGol(imap.apply(flux))
+    med = np.nanmedian(f)
+    MAD = 1.4826 * np.nanmedian(np.abs(f - med))
+    bad = np.where((f > med + 10. * MAD) | (f < med - 10. * MAD))[0]
+    badmask.extend(imap.unmask(bad))
+    badmask = np.array(sorted(list(set(badmask))))
+
+    # Interpolate the nans
+    fpix = Interpolate(time, nanmask, fpix, inplace=True)
+    fpix_err = Interpolate(time, nanmask, fpix_err, inplace=True)
+
+    # Return
+    data = DataContainer()
+    data.ID = ID
+    data.campaign = season
+    data.cadn = tpf['cadn']
+    data.time = time
+    data.fpix = fpix
+    data.fpix_err = fpix_err
+    data.nanmask = nanmask
+    data.badmask = badmask
+    data.aperture = aperture
+    data.aperture_name = aperture_name
+    data.apertures = apertures
+    data.quality = qual
+    data.Xpos = tpf['pc1']
+    data.Ypos = tpf['pc2']
+    data.meta = tpf['fitsheader']
+    data.mag = data.meta[0]['KEPMAG'][1]
+    data.pixel_images = tpf['pixel_images']
+    data.nearby = list(tpf['nearby']) if get_nearby else []
+    data.hires = tpf['hires'] if get_hires else None
+    data.saturated = False
+    data.bkg = bkg
+
+    return data
+
+
+def GetNeighbors(ID, season=None, model=None, neighbors=10,
+                 mag_range=(11., 13.), cdpp_range=None,
+                 aperture_name='k2sff_15', cadence='lc', **kwargs):
+    '''
+    Return `neighbors` random bright stars on the same module as `ID`.
+    The selection is deterministic for a given target.
+
+    :param int ID: The target ID number
+    :param str model: The :py:obj:`everest` model name. Only used when \
+           imposing CDPP bounds. Default :py:obj:`None`
+    :param int neighbors: Number of neighbors to return. Default 10
+    :param tuple mag_range: (`low`, `high`) values for the Kepler magnitude. \
+           Default (11, 13)
+    :param tuple cdpp_range: (`low`, `high`) values for the de-trended CDPP. \
+           Default :py:obj:`None`
+
+    '''
+
+    # Zero neighbors?
+    if neighbors == 0:
+        return []
+    if season is None:
+        season = Season(ID)
+    module = TargetInfo(ID).module
+
+    # Manage kwargs
+    if mag_range is None:
+        mag_lo, mag_hi = -np.inf, np.inf
+    else:
+        mag_lo, mag_hi = mag_range
+    if cdpp_range is None:
+        cdpp_lo, cdpp_hi = -np.inf, np.inf
+    else:
+        cdpp_lo, cdpp_hi = cdpp_range
+
+    # Shuffle the star list, so we don't always pick the same stars
+    stars = list(GetSyntheticCampaign(season))
+    np.random.RandomState([ID, 2]).shuffle(stars)
+    targets = []
+
+    # First look on the same module, then relax the constraint
+    # If still no targets, widen magnitude range
+    for n in range(3):
+
+        if n == 2:
+            mag_lo -= 1
+            mag_hi += 1
+
+        for star, kp, mod, _, _, _, _ in stars:
+
+            # Preliminary vetting
+            if (n == 0 and mod != module) or not (mag_lo < kp < mag_hi):
+                continue
+
+            # Reject if self or if already in list
+            if (star == ID) or (star in targets):
+                continue
+
+            # Reject if a contaminating source is within
+            # three pixels of the target and not much fainter
+            x, y, _ = TargetInfo(star).sources[0]
+            if any([(np.hypot(sx - x, sy - y) < 3) and (smag < kp + 3)
+                    for sx, sy, smag in TargetInfo(star).sources[1:]]):
+                continue
+
+            # Reject if the model is not present
+            if model is not None:
+                file = os.path.join(TargetDirectory(star, season),
+                                    model + '.npz')
+                if not os.path.exists(file):
+                    continue
+
+                # Reject if CDPP out of range
+                if cdpp_range is not None:
+                    with LoadModel(file) as m:
+                        cdpp = m['cdpp']
+                    if (cdpp > cdpp_hi) or (cdpp < cdpp_lo):
+                        continue
+
+            # Passed all the tests!
+            targets.append(star)
+            if len(targets) == neighbors:
+                return targets
+
+    # If we get to this point, we didn't find enough neighbors...
+    # Return what we have anyway.
+    return targets
+
+
+def GetNeighborBasis(ID, season=None, cadence='lc', **kwargs):
+    '''
+    Returns the low-rank basis of the systematics common to the bright
+    stars on the same module as `ID`, as a memory-mapped array of shape
+    `(ntime, rank)`. It is computed once per campaign, module and ID
+    parity by :py:func:`everest.missions.synthetic.sysrem.GetBasis`, to
+    which the keyword arguments are passed; the basis returned here
+    never includes the target itself.
+
+    :param int ID: The target ID number
+    :param str cadence: The light curve cadence. Default `lc`
+
+    '''
+
+    if season is None:
+        season = Season(ID)
+
+    return sysrem.GetBasis(season, TargetInfo(ID).module, cadence=cadence,
+                           fold=ID % 2, **kwargs)
+
+
+def Statistics(season=0, clobber=False, model='nPLD', **kwargs):
+    '''
+    Computes the raw and de-trended CDPP of every target of a
+    synthetic campaign that has a :py:obj:`model` on disk, along with
+    the wall time and peak memory of its run, and saves them to
+    ``s<season>_<model>.cdpp`` in the campaign directory. Returns the
+    table as a dictionary of arrays.
+
+    :param int season: The campaign number. Default 0
+    :param bool clobber: Recompute the table? Default :py:obj:`False`
+    :param str model: The :py:obj:`everest` model name. Default `nPLD`
+
+    '''
+
+    columns = ['ID', 'Kp', 'cdppr', 'cdpp', 'cdppv', 'depth', 'time', 'rss']
+    outfile = os.path.join(CampaignDirectory(season),
+                           's%02d_%s.cdpp' % (season, model))
+    if clobber or not os.path.exists(outfile):
+        log.info("Computing the statistics for campaign %d..." % season)
+        with open(outfile, 'w') as f:
+            print("ID         Kp         CDPP Raw   CDPP       CDPP Val   " +
+                  "Depth      Time [s]   RSS [MB]", file=f)
+            print("---------  ---------  ---------  ---------  ---------  " +
+                  "---------  ---------  ---------", file=f)
+            for star, kp, _, _, _, _, depth in GetSyntheticCampaign(season):
+                file = os.path.join(TargetDirectory(star, season),
+                                    model + '.npz')
+                if not os.path.exists(file):
+                    continue
+                with LoadModel(file) as m:
+                    profile = MergeProfile(file[:-4] + '.prof',
+                                           m.get('profile', None)) or {}
+                    row = [m['cdppr'], m['cdpp'], m['cdppv']]
+                row += [depth,
+                        sum([v['time'] for k, v in profile.items()
+                             if k in STAGES]),
+                        profile.get('peak_rss', None) or np.nan]
+                print("{:>09d}  {:>9.3f}".format(star, kp) +
+                      "".join(["  {:>9.3f}".format(x) for x in row[:3]]) +
+                      "  {:>9.2e}  {:>9.2f}  {:>9.1f}".format(*row[3:]),
+                      file=f)
+    data = np.loadtxt(outfile, skiprows=2, ndmin=2)
+    table = dict([(c, data[:, i]) for i, c in enumerate(columns)])
+    table['ID'] = np.array(table['ID'], dtype=int)
+    return table
+
+
+def HasShortCadence(ID, season=None):
+    '''
+    Returns `False`: there is no short cadence synthetic data.
+
+    '''
+
+    return False
+
+
+def HDUCards(headers, hdu=0):
+    '''
+    Generates HDU cards for inclusion in the de-trended light curve FITS file.
+    Used internally.
+
+    '''
+
+    if headers is None:
+        return []
+    if hdu == 0:
+        tpf_header = headers[0]
+    elif (hdu == 1) or (hdu == 6):
+        tpf_header = headers[1]
+    elif (hdu == 3) or (hdu == 4) or (hdu == 5):
+        tpf_header = headers[2]
+    else:
+        return []
+
+    cards = []
+    cards.append(('COMMENT', '************************'))
+    cards.append(('COMMENT', '*     MISSION INFO     *'))
+    cards.append(('COMMENT', '************************'))
+    for entry in sorted(tpf_header.keys()):
+        cards.append(tuple(tpf_header[entry]))
+    return cards
+
+
+def TargetDirectory(ID, season, relative=False, **kwargs):
+    '''
+    Returns the location of the :py:mod:`everest` data on disk
+    for a given target.
+
+    :param ID: The target ID
+    :param int season: The target season number
+    :param bool relative: Relative path? Default :py:obj:`False`
+
+    '''
+
+    if season is None:
+        return None
+    if relative:
+        path = ''
+    else:
+        path = EVEREST_DAT
+    return os.path.join(path, 'synthetic', 's%02d' % season,
+                        ('%09d' % ID)[:4] + '00000',
+                        ('%09d' % ID)[4:])
+
+
+def CSVFile(ID, user='rl'):
+    '''
+    Returns the name of the CSV file for a given target.
+
+    :param ID: The target ID
+
+    '''
+
+    return '%09dP-%s%s.csv' % (ID, user, time.strftime('%Y%m%d'))
+
+
+def DVSFile(ID, season, cadence='lc'):
+    '''
+    Returns the name of the DVS PDF for a given target.
+
+    :param ID: The target ID
+    :param int season: The target season number
+    :param str cadence: The cadence type. Default `lc`
+
+    '''
+
+    return 'hlsp_everest_synthetic_llc_%d-s%02d_v%s_dvs.pdf' \
+           % (ID, season, EVEREST_MAJOR_MINOR)
+
+
+def FITSFile(ID, season, cadence='lc'):
+    '''
+    Returns the name of the FITS file for a given target.
+
+    :param ID: The target ID
+    :param int season: The target season number
+    :param str cadence: The cadence type. Default `lc`
+
+    '''
+
+    return 'hlsp_everest_synthetic_llc_%d-s%02d_v%s_%s.fits' \
+           % (ID, season, EVEREST_MAJOR_MINOR, cadence)
+
+
+def FITSUrl(ID, season):
+    '''
+    Returns the path to the FITS file for a given target. Synthetic
+    targets are never online, so this is the local target directory,
+    where :py:func:`everest.missions.synthetic.Publish` writes them.
+
+    :param ID: The target ID
+    :param int season: The target season number
+
+    '''
+
+    return 'file://' + TargetDirectory(ID, season) + '/'
+
+
+def GetTargetCBVs(model):
+    '''
+    Returns the design matrix of CBVs for the given target.
+
+    :param model: An instance of the :py:obj:`everest` model for the target
+
+    '''
+
+    model.XCBV = sysrem.GetCBVs(model.season, model=model.name,
+                                niter=model.cbv_niter,
+                                sv_win=model.cbv_win,
+                                sv_order=model.cbv_order)
+
+
+def FitCBVs(model):
+    '''
+    Fits the CBV design matrix to the de-trended flux of a given target. This
+    is called internally whenever the user accesses the :py:attr:`fcor`
+    attribute.
+
+    :param model: An instance of the :py:obj:`everest` model for the target
+
+    '''
+
+    # Get cbvs?
+    if model.XCBV is None:
+        GetTargetCBVs(model)
+
+    # The number of CBVs to use
+    ncbv = model.cbv_num
+
+    # Regress all the light curve segments at once
+    return CBVFit(model.XCBV, model.flux, model.get_mask(),
+                  model.breakpoints, ncbv=ncbv)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`sysrem.py` - CBV routines
+----------------------------------
+
+Routines for computing the co-trending basis vectors (CBVs)
+for each synthetic campaign using the :py:obj:`SysRem` algorithm,
+and the low-rank neighbor bases used by :py:class:`everest.detrender.nPLD`.
+These mirror :py:mod:`everest.missions.k2.sysrem`.
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from ...config import EVEREST_DAT
+from ...utils import InitLog, FunctionWrapper
+from ...modelstore import LoadModel
+from ...mathutils import SysRem, NeighborBasis
+from .utils import GetSyntheticCampaign, CampaignDirectory
+import os
+import numpy as np
+import logging
+log = logging.getLogger(__name__)
+
+
+def GetStars(season, model='nPLD', **kwargs):
+    '''
+    Returns the de-trended light curves of all stars in a given
+    synthetic campaign.
+
+    '''
+
+    # Stars with a model on disk
+    stars = GetSyntheticCampaign(season, epics_only=True)
+    files = [os.path.join(CampaignDirectory(season),
+                          ('%09d' % star)[:4] + '00000',
+                          ('%09d' % star)[4:], model + '.npz')
+             for star in stars]
+    files = [f for f in files if os.path.exists(f)]
+    assert len(files) > 0, \
+        "No light curves found for campaign %d." % season
+
+    # Loop over all stars and store the fluxes in a list
+    fluxes = []
+    errors = []
+    kpars = []
+    for n, file in enumerate(files):
+
+        # Get the data
+        data = LoadModel(file)
+        t = data['time']
+        if n == 0:
+            time = t
+            breakpoints = data['breakpoints']
+
+        # Get de-trended light curve
+        y = data['fraw'] - data['model']
+        err = data['fraw_err']
+
+        # De-weight outliers and bad timestamps
+        m = np.array(list(set(np.concatenate([data['outmask'], data['badmask'],
+                                              data['nanmask'],
+                                              data['transitmask']]))),
+                     dtype=int)
+
+        # Interpolate over the outliers
+        y = np.interp(t, np.delete(t, m), np.delete(y, m))
+        err = np.interp(t, np.delete(t, m), np.delete(err, m))
+
+        # Append to our running lists
+        fluxes.append(y)
+        errors.append(err)
+        kpars.append(data['kernel_params'])
+        data.close()
+
+    return time, breakpoints, np.array(fluxes), \
+        np.array(errors), np.array(kpars)
+
+
+def GetCBVs(season, model='nPLD', clobber=False, **kwargs):
+    '''
+    Computes the CBVs for a given synthetic campaign.
+
+    :param int season: The campaign number
+    :param str model: The name of the :py:obj:`everest` model. Default `nPLD`
+    :param bool clobber: Overwrite existing files? Default `False`
+
+    '''
+
+    # Initialize logging?
+    if len(logging.getLogger().handlers) == 0:
+        InitLog(file_name=None, screen_level=logging.DEBUG)
+    log.info('Computing CBVs for campaign %d...' % (season))
+
+    # Output path
+    path = os.path.join(EVEREST_DAT, 'synthetic', 'cbv', 's%02d' % season)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    # Get the design matrix
+    xfile = os.path.join(path, '%s.npz' % model)
+    if clobber or not os.path.exists(xfile):
+
+        log.info('Obtaining light curves...')
+        time, breakpoints, fluxes, errors, kpars = GetStars(
+            season, model=model, **kwargs)
+
+        # Update the error arrays with the white GP component
+        errors = np.sqrt(errors ** 2 + kpars[:, :1] ** 2)
+
+        # Compute the design matrix, one segment at a time
+        log.info('Running SysRem...')
+        X = np.ones((len(time), 1 + kwargs.get('ncbv', 5)))
+        M = np.arange(len(time))
+        for b in range(len(breakpoints)):
+            if b > 0:
+                inds = M[(M > breakpoints[b - 1]) & (M <= breakpoints[b])]
+            else:
+                inds = M[M <= breakpoints[b]]
+            X[inds, 1:] = SysRem(time[inds], fluxes[:, inds],
+                                 errors[:, inds], **kwargs).T
+
+        # Save
+        np.savez(xfile, X=X, time=time, breakpoints=breakpoints)
+
+    else:
+
+        # Load from disk
+        X = np.load(xfile)['X'][()]
+
+    return X
+
+
+def GetBasis(season, module, rank=20, cadence='lc', mag_range=(11., 13.),
+             min_stars=10, max_stars=100, fold=0, clobber=False, **kwargs):
+    '''
+    Computes a low-rank basis of the systematics common to the bright
+    stars on a given module of a synthetic campaign (see
+    :py:func:`everest.mathutils.NeighborBasis`). The basis is computed
+    once from the normalized pixel fluxes of up to :py:obj:`max_stars`
+    stars and saved to disk in a file named after the fold, the rank and
+    the magnitude range; it is returned as a read-only memory-mapped
+    array of shape `(ntime, rank)`. Additional keyword arguments are
+    passed to :py:func:`everest.missions.synthetic.GetData`.
+
+    :param int season: The campaign number
+    :param int module: The module number
+    :param int rank: The number of basis vectors. Default 20
+    :param str cadence: The light curve cadence. Default `lc`
+    :param tuple mag_range: (`low`, `high`) values for the magnitude \
+           of the stars. Default (11, 13)
+    :param int min_stars: If there are fewer stars than this on the \
+           module, stars on all modules are used. Default 10
+    :param int max_stars: The maximum number of stars. Default 100
+    :param int fold: The stars are split in two folds by the parity of \
+           their IDs, and basis `fold` is computed from the stars \
+           whose `ID % 2` is *not* `fold`. A target uses the basis of \
+           its own parity, which never includes the target itself, so \
+           its astrophysical signal can't leak into its regressors. \
+           Default 0
+    :param bool clobber: Overwrite existing files? Default `False`
+
+    '''
+
+    from .synthetic import GetData
+
+    def Stars():
+        '''
+        The bright stars in this fold on this module (or on all modules).
+
+        '''
+
+        log.info('Computing the neighbor basis for campaign %d, module %d, '
+                 'fold %d...' % (season, module, fold))
+        stars = [s for s in GetSyntheticCampaign(season)
+                 if mag_range[0] < s[1] < mag_range[1] and s[0] % 2 != fold]
+        if len([s for s in stars if s[2] == module]) >= min_stars:
+            stars = [s for s in stars if s[2] == module]
+        return [s[0] for s in stars]
+
+    bfile = os.path.join(EVEREST_DAT, 'synthetic', 'cbv', 's%02d' % season,
+                         'basis%02d_%s_%d_r%d_m%.2f-%.2f.npy' %
+                         (module, cadence, fold, rank, mag_range[0],
+                          mag_range[1]))
+    return NeighborBasis(bfile, Stars,
+                         FunctionWrapper(GetData, season=season,
+                                         cadence=cadence, get_hires=False,
+                                         get_nearby=False, **kwargs),
+                         rank=rank, max_stars=max_stars, seed=module,
+                         clobber=clobber)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`utils.py` - Synthetic data generator
+---------------------------------------------
+
+Generates `K2`-like target pixel files for the synthetic mission. All
+the targets of a campaign share the same spacecraft pointing: a slow
+roll about the boresight that is reset by a thruster firing every
+~6 hours, a differential velocity aberration drift over the campaign,
+a small re-pointing at the mid-campaign data downlink and a common
+high-frequency jitter. The displacement of each star follows from its
+position on the focal plane, so that stars on the same module see
+nearly the same systematics, as in the real data.
+
+Each target has a (pixel-integrated, slightly elliptical) Gaussian
+PRF, a few faint contaminating sources in its postage stamp, stellar
+variability (rotational modulation plus granulation-like red noise),
+a sky background, and photon and read noise. About one in ten
+targets hosts a transiting planet, whose parameters are listed in the
+campaign star list (see :py:func:`GetSyntheticCampaign`).
+
+Everything is generated from the target ID and the campaign number, so
+the data for a given target is identical across runs and machines.
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from ...config import EVEREST_DAT
+from ...utils import DataContainer
+from scipy.special import erf
+import os
+import numpy as np
+import logging
+log = logging.getLogger(__name__)
+
+#: The synthetic campaigns: number of targets and number of cadences
+CAMPAIGNS = {0: (100, 1000),
+             1: (1000, 3500),
+             2: (10000, 3500)}
+
+#: The ID of the first target of campaign zero
+ID0 = 900000000
+
+#: The range of IDs reserved for each campaign
+IDBLOCK = 100000
+
+#: The module numbers (a 5x5 grid without the corners and the
+#: central module)
+MODULES = [2, 3, 4, 6, 7, 8, 9, 10, 11, 12, 14, 15, 16, 17, 18, 19, 20,
+           22, 23, 24]
+
+#: The long cadence in days
+CADENCE = 0.0204335
+
+#: The effective exposure time of a long cadence in seconds
+EXPTIME = 1625.35
+
+#: The read noise per cadence in electrons
+READNOISE = 1600.
+
+#: The flux of a Kp = 12 star in electrons per second
+ZEROPOINT = 1.74e5
+
+#: The number of cadences between thruster firings, on average
+THRUSTER = 12
+
+#: The quality flags of the generated cadences
+QUALITY_TWEAK = 2 ** 0
+QUALITY_NAN = 2 ** 2
+QUALITY_THRUSTER = 2 ** 20
+
+#: The apertures, ``k2sff_10`` (smallest) to ``k2sff_19`` (largest),
+#: are defined by these fractions of the peak pixel flux
+THRESHOLDS = np.logspace(np.log10(0.3), np.log10(0.003), 10)
+
+#: The pointing of each campaign, generated on first access
+_POINTING = {}
+
+#: The star list of each campaign, read on first access
+_CAMPAIGN = {}
+
+
+def Campaign(ID):
+    '''
+    Returns the campaign number of the synthetic target :py:obj:`ID`,
+    or :py:obj:`None` if it is not a synthetic target.
+
+    '''
+
+    season, n = divmod(ID - ID0, IDBLOCK)
+    if (season not in CAMPAIGNS) or (n < 1) or \
+            (n > CAMPAIGNS[season][0]):
+        return None
+    return season
+
+
+def CampaignDirectory(season):
+    '''
+    Returns the directory where the data for a synthetic campaign
+    is stored.
+
+    '''
+
+    return os.path.join(EVEREST_DAT, 'synthetic', 's%02d' % season)
+
+
+def GetSyntheticCampaign(season, epics_only=False, clobber=False):
+    '''
+    Returns the star list of a synthetic campaign: a list of
+    ``[ID, Kp, module, per, t0, dur, depth]`` for each target, where
+    the last four entries are the period, time of first transit,
+    duration and depth of the planet the star hosts, or zero if it
+    hosts none. The list is written to ``stars.csv`` in the campaign
+    directory the first time it is requested.
+
+    :param int season: The campaign number
+    :param bool epics_only: Return only the target IDs? \
+           Default :py:obj:`False`
+    :param bool clobber: Regenerate the star list? Default :py:obj:`False`
+
+    '''
+
+    if season not in CAMPAIGNS:
+        raise ValueError("Invalid synthetic campaign: %s." % season)
+    if clobber or season not in _CAMPAIGN:
+        file = os.path.join(CampaignDirectory(season), 'stars.csv')
+        if clobber or not os.path.exists(file):
+            log.info("Generating the star list for campaign %d..." % season)
+            if not os.path.exists(os.path.dirname(file)):
+                os.makedirs(os.path.dirname(file))
+            with open(file, 'w') as f:
+                for n in range(1, CAMPAIGNS[season][0] + 1):
+                    info = TargetInfo(ID0 + season * IDBLOCK + n)
+                    planet = info.planet or (0., 0., 0., 0.)
+                    print('%d,%.3f,%d,%.6f,%.6f,%.6f,%.6e'
+                          % ((info.ID, info.mag, info.module) + planet),
+                          file=f)
+        stars = []
+        with open(file, 'r') as f:
+            for line in f:
+                line = line.strip().split(',')
+                stars.append([int(line[0]), float(line[1]), int(line[2])] +
+                             [float(x) for x in line[3:]])
+        _CAMPAIGN[season] = stars
+    if epics_only:
+        return [s[0] for s in _CAMPAIGN[season]]
+    return _CAMPAIGN[season]
+
+
+def Pointing(season):
+    '''
+    Returns a :py:class:`everest.utils.DataContainer` with the
+    spacecraft pointing of a synthetic campaign: the timestamps
+    (:py:attr:`time`, :py:attr:`cadn`), the roll angle
+    (:py:attr:`roll`, in pixels at the edge of the focal plane),
+    the velocity aberration drift (:py:attr:`dva`), the common
+    jitter (:py:attr:`jx`, :py:attr:`jy`), the quality flags
+    (:py:attr:`quality`) and the cadences with no data
+    (:py:attr:`nanmask`).
+
+    '''
+
+    if season in _POINTING:
+        return _POINTING[season]
+
+    ncad = CAMPAIGNS[season][1]
+    rng = np.random.RandomState([season, 0])
+    P = DataContainer()
+    P.cadn = 100000 + 4000 * season + np.arange(ncad)
+    P.time = 2000. + 80. * season + CADENCE * np.arange(ncad)
+    P.quality = np.zeros(ncad, dtype=int)
+
+    # The roll drifts at a (slowly varying) constant rate
+    # and is reset at every thruster firing
+    firings = np.cumsum(rng.randint(THRUSTER - 1, THRUSTER + 2,
+                                    size=ncad // (THRUSTER - 1) + 1))
+    firings = firings[firings < ncad]
+    segment = np.searchsorted(firings, np.arange(ncad), side='right')
+    start = np.append(0, firings)[segment]
+    rate = 0.08 * (1. + 0.2 * np.sin(2 * np.pi * P.time / 17.3)) + \
+        0.005 * rng.randn(ncad)
+    reset = 0.03 * rng.randn(len(firings) + 1)
+    P.roll = rate * (np.arange(ncad) - start) + reset[segment] - 0.4
+    P.quality[firings] |= QUALITY_THRUSTER
+
+    # Differential velocity aberration, plus a small re-pointing
+    # after the mid-campaign downlink
+    x = (P.time - P.time[0]) / (P.time[-1] - P.time[0])
+    P.dva = 0.6 * x ** 2 - 0.2 * x
+    P.dva[ncad // 2:] += 0.15
+
+    # Jitter, with the occasional attitude tweak
+    P.jx = 0.01 * rng.randn(ncad)
+    P.jy = 0.01 * rng.randn(ncad)
+    tweaks = rng.choice(ncad, size=max(1, ncad // 300), replace=False)
+    P.jx[tweaks] += 0.5 * rng.randn(len(tweaks))
+    P.jy[tweaks] += 0.5 * rng.randn(len(tweaks))
+    P.quality[tweaks] |= QUALITY_TWEAK
+
+    # A few cadences with no data
+    P.nanmask = np.sort(rng.choice(ncad, size=max(1, ncad // 1000),
+                                   replace=False))
+    P.quality[P.nanmask] |= QUALITY_NAN
+
+    _POINTING[season] = P
+    return P
+
+
+def TargetInfo(ID):
+    '''
+    Returns a :py:class:`everest.utils.DataContainer` with the
+    properties of the synthetic target :py:obj:`ID`: its magnitude,
+    module and focal plane position, postage stamp, PRF, contaminating
+    sources, variability and planet. This is cheap, and is all that's
+    needed to select neighbors or build the star list.
+
+    '''
+
+    season = Campaign(ID)
+    if season is None:
+        raise ValueError("Invalid synthetic target: %s." % ID)
+    rng = np.random.RandomState([ID, 0])
+    info = DataContainer()
+    info.ID = ID
+    info.campaign = season
+
+    # Faint stars are more common
+    info.mag = 16. - 6. * rng.power(0.4)
+    info.module = MODULES[rng.randint(len(MODULES))]
+
+    # The focal plane coordinates (-1 to 1) and the
+    # location of the postage stamp on the CCD
+    row, col = divmod(info.module - 1, 5)
+    info.u = (col - 2 + rng.uniform(-0.45, 0.45)) / 2.5
+    info.v = (row - 2 + rng.uniform(-0.45, 0.45)) / 2.5
+    info.x0 = rng.randint(12, 1100)
+    info.y0 = rng.randint(20, 1020)
+
+    # Bright stars get bigger stamps; the PRF broadens
+    # towards the edge of the field
+    half = 4 + int(max(0., 13.5 - info.mag))
+    info.shape = (2 * half + 1, 2 * half + 1)
+    info.sigma = (0.9 + 0.25 * np.hypot(info.u, info.v)) * \
+        np.array([1. + 0.1 * rng.rand(), 1. + 0.1 * rng.rand()])
+    info.bkg = 10 ** rng.uniform(1., 2.)
+
+    # The sources in the stamp: (x, y, mag), target first
+    sources = [(half + rng.uniform(-0.5, 0.5),
+                half + rng.uniform(-0.5, 0.5), info.mag)]
+    for n in range(rng.poisson(1.)):
+        sources.append((rng.uniform(-1, 2 * half + 1),
+                        rng.uniform(-1, 2 * half + 1),
+                        info.mag + rng.uniform(1., 6.)))
+    info.sources = sources
+
+    # Stellar variability
+    info.rot_amp = 10 ** rng.uniform(-4., -2.)
+    info.rot_per = 10 ** rng.uniform(0., 1.5)
+    info.rot_phase = rng.uniform(0, 2 * np.pi)
+    info.red_amp = 10 ** rng.uniform(-4.5, -3.)
+
+    # About one in ten stars hosts a transiting planet
+    per = 10 ** rng.uniform(0., 1.3)
+    t0 = 2000. + 80. * season + rng.uniform(0, per)
+    dur = rng.uniform(0.05, 0.12) * per ** (1. / 3.)
+    depth = 10 ** rng.uniform(-3.7, -2.)
+    if rng.rand() < 0.1:
+        info.planet = (per, t0, dur, depth)
+    else:
+        info.planet = None
+
+    return info
+
+
+def Transit(time, per, t0, dur, depth):
+    '''
+    A trapezoidal transit model with ingress and egress lasting
+    a tenth of the total duration each.
+
+    '''
+
+    phase = np.abs((time - t0 + 0.5 * per) % per - 0.5 * per)
+    edge = 0.1 * dur
+    model = np.clip((0.5 * dur - phase) / edge, 0., 1.)
+    return 1. - depth * model
+
+
+def PRF(x, y, sigma, shape):
+    '''
+    Returns the pixel-integrated Gaussian PRF of a source centered at
+    (:py:obj:`x`, :py:obj:`y`) on a stamp of shape :py:obj:`shape`,
+    for each element of the position arrays.
+
+    '''
+
+    x = np.atleast_1d(x).reshape(-1, 1)
+    y = np.atleast_1d(y).reshape(-1, 1)
+    edges = np.arange(shape[1] + 1) - 0.5
+    px = np.diff(erf((edges - x) / (np.sqrt(2) * sigma[0])), axis=1) / 2.
+    edges = np.arange(shape[0] + 1) - 0.5
+    py = np.diff(erf((edges - y) / (np.sqrt(2) * sigma[1])), axis=1) / 2.
+    return py[:, :, None] * px[:, None, :]
+
+
+def SyntheticTPF(ID):
+    '''
+    Generates the target pixel file of the synthetic target
+    :py:obj:`ID`. Returns a dictionary with the same entries as the
+    ``data.npz`` files of the `K2` mission.
+
+    '''
+
+    info = TargetInfo(ID)
+    P = Pointing(info.campaign)
+    rng = np.random.RandomState([ID, 1])
+    ncad = len(P.time)
+
+    # The motion of the star on the detector
+    dx = -P.roll * info.v + P.dva * info.u + P.jx
+    dy = P.roll * info.u + P.dva * info.v + P.jy
+
+    # The astrophysical signal
+    red = np.convolve(rng.randn(ncad + 48), np.ones(49) / 7., mode='valid')
+    signal = 1. + info.rot_amp * np.sin(2 * np.pi * P.time / info.rot_per +
+                                        info.rot_phase) * \
+        (1. + 0.3 * np.sin(np.pi * P.time / info.rot_per)) + \
+        info.red_amp * red
+    if info.planet is not None:
+        signal *= Transit(P.time, *info.planet)
+
+    # The pixels
+    fpix = info.bkg * np.ones((ncad,) + info.shape)
+    for n, (x, y, mag) in enumerate(info.sources):
+        flux = ZEROPOINT * 10 ** (-0.4 * (mag - 12.)) * \
+            (signal if n == 0 else np.ones(ncad))
+        fpix += flux.reshape(-1, 1, 1) * PRF(x + dx, y + dy, info.sigma,
+                                             info.shape)
+    fpix_err = np.sqrt(fpix * EXPTIME + READNOISE ** 2) / EXPTIME
+    fpix += fpix_err * rng.randn(*fpix.shape)
+    fpix[P.nanmask] = np.nan
+
+    # The apertures are contours of the median target image
+    x, y, mag = info.sources[0]
+    image = PRF(x, y, info.sigma, info.shape)[0]
+    apertures = {'tpf': np.ones(info.shape, dtype=int),
+                 'tpf_big': np.ones(info.shape, dtype=int)}
+    for i, threshold in enumerate(THRESHOLDS):
+        apertures['k2sff_%02d' % (i + 10)] = \
+            np.array(image > threshold * image.max(), dtype=int)
+
+    # A sharper, noiseless image of the field
+    hires = np.zeros(info.shape)
+    for x, y, mag in info.sources:
+        hires += 10 ** (-0.4 * (mag - info.mag)) * \
+            PRF(x, y, 0.5 * info.sigma, info.shape)[0]
+
+    # The nearby sources, in detector coordinates
+    nearby = [dict(ID=ID if n == 0 else 0, x=info.x0 + x, y=info.y0 + y,
+                   x0=info.x0, y0=info.y0, mag=mag)
+              for n, (x, y, mag) in enumerate(info.sources)]
+
+    # The FITS header cards
+    fitsheader = [{}, {}, {}]
+    for key, value, comment in [
+            ('TELESCOP', 'Synthetic', 'telescope'),
+            ('INSTRUME', 'Synthetic K2 photometer', 'detector type'),
+            ('OBJECT', 'SYN %09d' % ID, 'string version of target id'),
+            ('KEPLERID', ID, 'unique synthetic target ID'),
+            ('MODULE', info.module, 'CCD module'),
+            ('CAMPAIGN', info.campaign, 'Observing campaign number'),
+            ('KEPMAG', float(info.mag), '[mag] Kepler magnitude (Kp)')]:
+        fitsheader[0][key] = (key, value, comment)
+    for key, value, comment in [
+            ('EXPOSURE', ncad * CADENCE, '[d] time on source'),
+            ('TIMEDEL', CADENCE, '[d] time resolution of data'),
+            ('INT_TIME', EXPTIME / 270., '[s] photon accumulation time')]:
+        fitsheader[1][key] = (key, value, comment)
+    fitsheader[2]['NPIXSAP'] = ('NPIXSAP', int(np.sum(
+        apertures['k2sff_15'])), 'Number of pixels in optimal aperture')
+
+    # The first, mid and last images
+    good = np.delete(np.arange(ncad), P.nanmask)
+    pixel_images = fpix[good[[0, len(good) // 2, -1]]]
+
+    return dict(cadn=P.cadn, time=P.time, fpix=fpix, fpix_err=fpix_err,
+                qual=P.quality, apertures=apertures, pc1=dx, pc2=dy,
+                fitsheader=fitsheader, nearby=nearby, hires=hires,
+                pixel_images=pixel_images)
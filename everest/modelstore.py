@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`modelstore.py` - Compact model storage
+-----------------------------------------------
+
+Routines for saving and loading de-trended :py:obj:`everest` models.
+Models are stored as versioned `npz` archives with a small JSON
+header (scalars, strings, short lists and the array schema) that
+can be read without touching any of the arrays, followed by one
+member per array. Index masks are stored as `int32` and the
+purely diagnostic arrays as `float32`; arrays are only read from
+disk when they are first accessed. Models saved with older
+versions of :py:obj:`everest` (the plain `npz` dump of the model
+:py:obj:`__dict__`) can still be loaded.
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from . import __version__ as EVEREST_VERSION
+import os
+import json
+import numpy as np
+from tempfile import NamedTemporaryFile
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = ['ModelStore', 'SaveModel', 'LoadModel', 'ReadHeader']
+
+#: The current version of the model store format
+STORE_VERSION = 1
+
+#: The name of the header member in the archive
+HEADER_KEY = '__header__'
+
+#: The on-disk data type of known model fields. Masks and cadence
+#: numbers are stored as compact integers; arrays used only for
+#: plotting or bookkeeping are stored in single precision. All other
+#: arrays (time, fluxes, regressors) keep their native precision.
+SCHEMA = {
+    'nanmask': 'int32',
+    'badmask': 'int32',
+    'outmask': 'int32',
+    'transitmask': 'int32',
+    'recmask': 'int32',
+    'cadn': 'int32',
+    'quality': 'int32',
+    'fpix_err': 'float32',
+    'pixel_images': 'float32',
+    'hires': 'float32',
+    'Xpos': 'float32',
+    'Ypos': 'float32',
+    'bkg': 'float32',
+}
+
+#: Attributes that are never written to disk
+EXCLUDE = ['_weights', '_A', '_B', '_f', '_mK', 'K', 'dvs', 'clobber',
+           'clobber_tpf', '_mission', 'debug', 'transit_model',
+           '_transit_model', '_data', '_maskbits', '_maskcache', 'profiler',
+           'dvs_mode']
+
+
+def _jsonify(value):
+    '''
+    Converts :py:obj:`value` into an object that can be serialized
+    by :py:mod:`json`, or raises a :py:class:`TypeError` if this is
+    not possible.
+
+    '''
+
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    elif isinstance(value, (np.bool_, np.integer, np.floating)):
+        return value.item()
+    elif isinstance(value, (str, type(u''))):
+        return value
+    elif isinstance(value, bytes):
+        return value.decode('utf-8')
+    elif isinstance(value, np.ndarray) and value.ndim == 0 and \
+            value.dtype.kind in 'biuf':
+        return value.item()
+    elif isinstance(value, (list, tuple)):
+        return [_jsonify(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((str(k), _jsonify(v)) for k, v in value.items())
+    raise TypeError('Object of type `%s` is not JSON serializable.'
+                    % type(value).__name__)
+
+
+def _is_array(value):
+    '''
+    Returns :py:obj:`True` if :py:obj:`value` can be stored as a
+    regular (non-object) array member.
+
+    '''
+
+    return isinstance(value, np.ndarray) and value.ndim > 0 and \
+        value.dtype.kind in 'biuf'
+
+
+def SaveModel(file, model, exclude=EXCLUDE):
+    '''
+    Saves the attributes of :py:obj:`model` to the model store
+    :py:obj:`file`.
+
+    :param str file: The full path to the `npz` file
+    :param model: The :py:class:`everest.Detrender` (or any other) instance \
+           to save
+    :param list exclude: Attributes that should not be saved. Default \
+           :py:obj:`EXCLUDE`
+
+    '''
+
+    header = {'version': STORE_VERSION,
+              'everest_version': EVEREST_VERSION,
+              'attrs': {},
+              'arrays': {},
+              'groups': {},
+              'objects': []}
+    members = {}
+
+    # Properties that should be saved along with the regular attributes
+    # (i.e., the masks, which models store internally as a bitfield)
+    attrs = dict(model.__dict__)
+    for key in getattr(model, '_store_properties', []):
+        attrs[key] = getattr(model, key)
+
+    for key, value in attrs.items():
+        if key in exclude:
+            continue
+
+        # Known compact fields
+        if key in SCHEMA and value is not None:
+            value = np.asarray(value)
+            if value.dtype.kind in 'biuf':
+                header['arrays'][key] = value.dtype.str
+                members[key] = value.astype(SCHEMA[key])
+                continue
+
+        # Regular arrays
+        if _is_array(value):
+            header['arrays'][key] = value.dtype.str
+            members[key] = value
+            continue
+
+        # Scalars, strings, short lists and dicts
+        try:
+            header['attrs'][key] = _jsonify(value)
+            continue
+        except TypeError:
+            pass
+
+        # Dictionaries of arrays (i.e., the apertures)
+        if isinstance(value, dict) and all([isinstance(k, (str, type(u'')))
+                                            for k in value.keys()]):
+            group = {'attrs': {}, 'arrays': {}}
+            try:
+                for k, v in value.items():
+                    if _is_array(v):
+                        group['arrays'][k] = v.dtype.str
+                        members['%s/%s' % (key, k)] = v
+                    else:
+                        group['attrs'][k] = _jsonify(v)
+                header['groups'][key] = group
+                continue
+            except TypeError:
+                for k in group['arrays'].keys():
+                    members.pop('%s/%s' % (key, k))
+
+        # Anything else gets pickled
+        log.debug("Pickling attribute `%s` in the model store." % key)
+        header['objects'].append(key)
+        members[key] = np.array(value, dtype=object)
+
+    # Write to a temporary file in the same directory and move it
+    # into place, so that a crash never leaves a partial model behind
+    members[HEADER_KEY] = np.array(json.dumps(header))
+    f = NamedTemporaryFile("wb", delete=False,
+                           dir=os.path.dirname(os.path.abspath(file)))
+    try:
+        np.savez(f, **members)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.rename(f.name, file)
+    finally:
+        f.close()
+        if os.path.exists(f.name):
+            os.remove(f.name)
+
+
+class ModelStore(object):
+    '''
+    A read-only, lazy view of a saved :py:obj:`everest` model. Items
+    are accessed like a dictionary; header values are returned without
+    touching the arrays, and arrays are read only when they are first
+    requested. Single precision arrays are cast back to their original
+    data type; masks are returned as `int32` index arrays.
+
+    :param str file: The full path to the `npz` file
+
+    '''
+
+    def __init__(self, file):
+        '''
+
+        '''
+
+        self.file = file
+        self._npz = np.load(file, allow_pickle=True)
+        self._cache = {}
+        if HEADER_KEY in self._npz.files:
+            self.header = json.loads(str(self._npz[HEADER_KEY][()]))
+            if self.header['version'] > STORE_VERSION:
+                raise ValueError("Model '%s' was saved with a newer " % file +
+                                 "version of the model store (%d > %d)."
+                                 % (self.header['version'], STORE_VERSION))
+            self.legacy = False
+        else:
+            self.header = None
+            self.legacy = True
+
+    def __enter__(self):
+        '''
+
+        '''
+
+        return self
+
+    def __exit__(self, *args):
+        '''
+
+        '''
+
+        self.close()
+
+    def close(self):
+        '''
+        Closes the underlying archive.
+
+        '''
+
+        self._npz.close()
+
+    @property
+    def version(self):
+        '''
+        The model store version of this file (0 for legacy files).
+
+        '''
+
+        if self.legacy:
+            return 0
+        return self.header['version']
+
+    def keys(self):
+        '''
+        Returns the names of all the attributes in the store.
+
+        '''
+
+        if self.legacy:
+            return list(self._npz.files)
+        h = self.header
+        return list(h['attrs'].keys()) + list(h['arrays'].keys()) + \
+            list(h['groups'].keys()) + list(h['objects'])
+
+    def __contains__(self, key):
+        '''
+
+        '''
+
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        '''
+
+        '''
+
+        if key in self._cache:
+            return self._cache[key]
+
+        if self.legacy:
+            value = self._npz[key]
+            if value.ndim == 0:
+                value = value[()]
+        elif key in self.header['attrs']:
+            return self.header['attrs'][key]
+        elif key in self.header['arrays']:
+            value = self._npz[key]
+            # Single precision fields are cast back to their original
+            # type; compact integer fields (the masks) are returned as is
+            if value.dtype.kind == 'f':
+                value = value.astype(self.header['arrays'][key], copy=False)
+        elif key in self.header['groups']:
+            group = self.header['groups'][key]
+            value = dict(group['attrs'])
+            for k, dtype in group['arrays'].items():
+                value[k] = self._npz['%s/%s' % (key, k)].astype(dtype,
+                                                                copy=False)
+        elif key in self.header['objects']:
+            value = self._npz[key][()]
+        else:
+            raise KeyError(key)
+
+        self._cache[key] = value
+        return value
+
+    def get(self, key, default=None):
+        '''
+
+        '''
+
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        '''
+        Iterates over all the attributes in the store, loading
+        the arrays one at a time.
+
+        '''
+
+        for key in self.keys():
+            yield key, self[key]
+
+
+def LoadModel(file):
+    '''
+    Opens the model store :py:obj:`file` and returns a lazy
+    :py:class:`ModelStore` view of it.
+
+    '''
+
+    return ModelStore(file)
+
+
+def ReadHeader(file):
+    '''
+    Returns the header attributes of the model store :py:obj:`file`
+    (the scalar statistics such as the `cdpp`, the model parameters,
+    etc.) without reading any of the arrays. Returns an empty
+    dictionary for legacy files.
+
+    '''
+
+    with ModelStore(file) as store:
+        if store.legacy:
+            return {}
+        return dict(store.header['attrs'])
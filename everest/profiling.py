@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+:py:mod:`profiling.py` - Pipeline instrumentation
+-------------------------------------------------
+
+A lightweight profiler for the de-trending pipeline. Each stage of
+a run (loading the TPF, the outlier iterations, the cross-validation
+of each chunk, plotting, saving, publishing...) is wrapped in the
+:py:meth:`Profiler.stage` context manager, which records its wall
+and CPU time and the peak resident set size (RSS) of the process
+while it ran. The RSS is sampled by a background thread, so the
+overhead is negligible. Every record is appended as a JSON line to a
+``.prof`` file next to the model, and the per-stage totals
+(:py:meth:`Profiler.summary`) of the de-trending step are stored in
+the model store and in the FITS header. The stages that run after
+the model is saved (saving, publishing and rendering) are only
+recorded in the ``.prof`` file, which is merged back in when the
+profiles are aggregated over a whole campaign (see
+:py:func:`everest.missions.k2.ProfileReport`).
+
+'''
+
+from __future__ import division, print_function, absolute_import, \
+     unicode_literals
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+import sys
+import json
+import time
+import threading
+import logging
+log = logging.getLogger(__name__)
+
+__all__ = ['Profiler', 'CurrentRSS', 'PeakRSS', 'ReadProfile', 'Summarize',
+           'MergeProfile', 'STAGES']
+
+#: The top-level pipeline stages and the *FITS* header keywords under
+#: which their total wall time is stored
+STAGES = OrderedDict([('load_tpf', 'PRFTPF'),
+                      ('init_kernel', 'PRFKERN'),
+                      ('get_outliers', 'PRFOUT'),
+                      ('update_gp', 'PRFGP'),
+                      ('cross_validate', 'PRFCV'),
+                      ('compute', 'PRFCOMP'),
+                      ('finalize', 'PRFFIN'),
+                      ('final_gp', 'PRFFGP'),
+                      ('plot', 'PRFPLOT'),
+                      ('save_model', 'PRFSAVE'),
+                      ('publish', 'PRFPUB'),
+                      ('render', 'PRFREND')])
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+#: The size of a memory page in bytes
+try:
+    PAGESIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGESIZE = 4096
+
+
+def PeakRSS():
+    '''
+    Returns the peak resident set size of the current process
+    since it started, in MB, or :py:obj:`None` if it can't be
+    determined on this platform.
+
+    '''
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, OS X reports bytes
+    if sys.platform == 'darwin':
+        return rss / 2 ** 20
+    return rss / 2 ** 10
+
+
+def CurrentRSS():
+    '''
+    Returns the current resident set size of the process in MB.
+    On Linux this is read from ``/proc/self/statm``; elsewhere,
+    the peak RSS is returned instead.
+
+    '''
+
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * PAGESIZE / 2 ** 20
+    except (IOError, OSError, IndexError, ValueError):
+        return PeakRSS()
+
+
+class Profiler(object):
+    '''
+    Records the wall time, CPU time and peak RSS of the stages of a
+    pipeline run.
+
+    :param str file: If set, each record is appended as a line of \
+           JSON to this file. Default :py:obj:`None`
+    :param dict tags: Extra fields (i.e., the target ID and the model \
+           name) added to every record. Default :py:obj:`None`
+    :param float interval: The RSS sampling interval in seconds. \
+           Default 0.05
+    :param bool enabled: If :py:obj:`False`, :py:meth:`stage` does \
+           nothing. Default :py:obj:`True`
+
+    '''
+
+    def __init__(self, file=None, tags=None, interval=0.05, enabled=True):
+        '''
+
+        '''
+
+        self.file = file
+        self.tags = dict(tags or {})
+        self.interval = interval
+        self.enabled = enabled
+        self.records = []
+        self._open = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _sample(self):
+        '''
+        The RSS sampling loop. Runs while there are open stages.
+
+        '''
+
+        while True:
+            rss = CurrentRSS()
+            with self._lock:
+                if not len(self._open):
+                    self._thread = None
+                    return
+                if rss is not None:
+                    for key, peak in self._open.items():
+                        if peak is None or rss > peak:
+                            self._open[key] = rss
+            time.sleep(self.interval)
+
+    @contextmanager
+    def stage(self, name, **tags):
+        '''
+        A context manager that profiles the code it wraps. Stages may
+        be nested; the peak RSS of the outer stage includes that of
+        the inner ones. Additional keyword arguments (i.e., the chunk
+        or iteration number) are stored in the record.
+
+        :param str name: The name of the stage
+
+        '''
+
+        if not self.enabled:
+            yield
+            return
+
+        rss0 = CurrentRSS()
+        with self._lock:
+            self._count += 1
+            key = self._count
+            self._open[key] = rss0
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample)
+                self._thread.daemon = True
+                self._thread.start()
+        wall = time.time()
+        cpu = time.process_time() if hasattr(time, 'process_time') \
+            else time.clock()
+        try:
+            yield
+        finally:
+            wall = time.time() - wall
+            cpu = (time.process_time() if hasattr(time, 'process_time')
+                   else time.clock()) - cpu
+            rss1 = CurrentRSS()
+            with self._lock:
+                peak = self._open.pop(key)
+            if peak is None or (rss1 is not None and rss1 > peak):
+                peak = rss1
+            record = OrderedDict([('stage', name),
+                                  ('time', wall),
+                                  ('cpu', cpu),
+                                  ('rss', peak),
+                                  ('drss', None if rss0 is None or
+                                   rss1 is None else rss1 - rss0)])
+            record.update(tags)
+            self.records.append(record)
+            self.emit(record)
+
+    def emit(self, record):
+        '''
+        Appends :py:obj:`record` (along with the profiler tags and a
+        timestamp) as a line of JSON to :py:attr:`file`.
+
+        '''
+
+        if self.file is None:
+            return
+        line = OrderedDict(self.tags)
+        line['timestamp'] = time.time()
+        line.update(record)
+        try:
+            with open(self.file, 'a') as f:
+                print(json.dumps(line), file=f)
+        except (IOError, OSError):
+            log.warn("Unable to write to the profile file `%s`." % self.file)
+            self.file = None
+
+    def reset(self, truncate=True):
+        '''
+        Discards all records and, if :py:obj:`truncate` is set,
+        empties :py:attr:`file`.
+
+        '''
+
+        self.records = []
+        if truncate and self.file is not None and os.path.exists(self.file):
+            open(self.file, 'w').close()
+
+    def summary(self, previous=None):
+        '''
+        Returns a dictionary with the number of calls, the total wall
+        and CPU times (in seconds) and the peak RSS (in MB) of each
+        stage, plus the overall peak RSS of all the stages under the
+        key ``peak_rss``. Unlike :py:func:`PeakRSS`, this is the peak
+        of this run only, even in a long-lived worker process. If
+        :py:obj:`previous` (a summary of an earlier run, i.e., the
+        de-trending step) is given, the stages recorded here are
+        merged into it, replacing any earlier entries for the same
+        stages.
+
+        '''
+
+        return Summarize(self.records, previous=previous)
+
+
+def Summarize(records, previous=None):
+    '''
+    Returns the per-stage summary (see :py:meth:`Profiler.summary`) of
+    a list of profile :py:obj:`records`, i.e., those read from a
+    ``.prof`` file with :py:func:`ReadProfile`.
+
+    '''
+
+    stages = set([record['stage'] for record in records])
+    summary = OrderedDict()
+    if previous:
+        for name, value in previous.items():
+            if name == 'peak_rss':
+                summary[name] = value
+            elif name not in stages:
+                summary[name] = dict(value)
+    for record in records:
+        s = summary.setdefault(record['stage'],
+                               {'calls': 0, 'time': 0., 'cpu': 0.,
+                                'rss': 0.})
+        s['calls'] += 1
+        s['time'] += record['time']
+        s['cpu'] += record['cpu']
+        s['rss'] = max(s['rss'], record['rss'] or 0.)
+    summary['peak_rss'] = max([summary.get('peak_rss') or 0.] +
+                              [s['rss'] for name, s in summary.items()
+                               if name != 'peak_rss'])
+    return summary
+
+
+def ReadProfile(file):
+    '''
+    Reads the JSON lines profile :py:obj:`file` written by a
+    :py:class:`Profiler` and returns the list of records.
+
+    '''
+
+    records = []
+    with open(file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if len(line):
+                records.append(json.loads(line))
+    return records
+
+
+def MergeProfile(file, previous=None):
+    '''
+    Merges the records in the ``.prof`` file :py:obj:`file` into the
+    stored :py:obj:`previous` summary of a model (see
+    :py:func:`Summarize`). The stages in the file replace those in
+    :py:obj:`previous`. If the file is missing or unreadable,
+    :py:obj:`previous` is returned as is.
+
+    '''
+
+    try:
+        records = ReadProfile(file)
+    except (IOError, OSError, ValueError):
+        return previous
+    return Summarize(records, previous=previous)
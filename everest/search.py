@@ -13,7 +13,8 @@ approach is similar to that in Foreman-Mackey et al. (2015).
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
 import numpy as np
-from .mathutils import SavGol
+from .mathutils import SavGol, Gram
+from .utils import IndexMap
 from .gp import GetCovariance
 from .transit import TransitShape
 from scipy.linalg import cho_solve, cho_factor
@@ -36,20 +37,20 @@ def Search(star, pos_tol=2.5, neg_tol=50., **ps_kwargs):
     '''
 
     # Smooth the light curve
-    t = np.delete(star.time, np.concatenate([star.nanmask, star.badmask]))
-    f = np.delete(star.flux, np.concatenate([star.nanmask, star.badmask]))
-    f = SavGol(f)
+    imap = IndexMap(len(star.time),
+                    np.concatenate([star.nanmask, star.badmask]))
+    f = SavGol(imap.apply(star.flux))
     med = np.nanmedian(f)
 
     # Kill positive outliers
     MAD = 1.4826 * np.nanmedian(np.abs(f - med))
     pos_inds = np.where((f > med + pos_tol * MAD))[0]
-    pos_inds = np.array([np.argmax(star.time == t[i]) for i in pos_inds])
+    pos_inds = imap.unmask(pos_inds)
 
     # Kill negative outliers
     MAD = 1.4826 * np.nanmedian(np.abs(f - med))
     neg_inds = np.where((f < med - neg_tol * MAD))[0]
-    neg_inds = np.array([np.argmax(star.time == t[i]) for i in neg_inds])
+    neg_inds = imap.unmask(neg_inds)
 
     # Replace the star.outmask array
     star.outmask = np.concatenate([neg_inds, pos_inds])
@@ -76,7 +77,7 @@ def Search(star, pos_tol=2.5, neg_tol=50., **ps_kwargs):
         A = np.zeros((len(m), len(m)))
         for n in range(star.pld_order):
             XM = star.X(n, m)
-            A += star.lam[b][n] * np.dot(XM, XM.T)
+            A += star.lam[b][n] * Gram(XM)
         K += A
         CDK = cho_factor(K)
 
@@ -16,10 +16,11 @@ import shutil
 import numpy as np
 import everest
 from everest.mathutils import Interpolate, SavGol
-from everest.utils import AP_COLLAPSED_PIXEL, AP_SATURATED_PIXEL, DataContainer
+from everest.utils import DataContainer, IndexMap
 from everest.config import EVEREST_DAT
 from everest.missions.k2.utils import GetHiResImage, GetSources, \
-     SaturationFlux, RemoveBackground
+     SaturationFlux, RemoveBackground, PixelPercentileFlux, \
+     CollapseSaturatedColumns
 from tempfile import NamedTemporaryFile
 import matplotlib
 from matplotlib.widgets import Slider
@@ -511,25 +512,8 @@ def GetData(fitsfile, EPIC, campaign, clobber=False,
     # to compare these to decide if the star is saturated.
     satflx = SaturationFlux(EPIC, campaign=campaign) * \
         (1. + saturation_tolerance)
-    f97 = np.zeros((fpix.shape[1], fpix.shape[2]))
-    for i in range(fpix.shape[1]):
-        for j in range(fpix.shape[2]):
-            if aperture[i, j]:
-                # Let's remove NaNs...
-                tmp = np.delete(fpix[:, i, j], np.where(
-                    np.isnan(fpix[:, i, j])))
-                # ... and really bad outliers...
-                if len(tmp):
-                    f = SavGol(tmp)
-                    med = np.nanmedian(f)
-                    MAD = 1.4826 * np.nanmedian(np.abs(f - med))
-                    bad = np.where((f > med + 10. * MAD) |
-                                   (f < med - 10. * MAD))[0]
-                    np.delete(tmp, bad)
-                    # ... so we can compute the 97.5th percentile flux
-                    i97 = int(0.975 * len(tmp))
-                    tmp = tmp[np.argsort(tmp)[i97]]
-                    f97[i, j] = tmp
+    f97 = PixelPercentileFlux(fpix, aperture, 97.5)
+    satcols = np.any(f97 > satflx, axis=0)
 
     # Check if any of the pixels are actually saturated
     if np.nanmax(f97) <= satflx:
@@ -537,50 +521,24 @@ def GetData(fitsfile, EPIC, campaign, clobber=False,
         saturated = False
         aperture[np.isnan(fpix[0])] = 0
         ap = np.where(aperture & 1)
-        fpix2D = np.array([f[ap] for f in fpix], dtype='float64')
-        fpix_err2D = np.array([p[ap] for p in fpix_err], dtype='float64')
+        fpix2D = np.array(fpix[:, ap[0], ap[1]], dtype='float64')
+        fpix_err2D = np.array(fpix_err[:, ap[0], ap[1]], dtype='float64')
     else:
         # We need to collapse the saturated columns
         saturated = True
-        ncol = 0
-        fpixnew = []
-        ferrnew = []
-        for j in range(aperture.shape[1]):
-            if np.any(f97[:, j] > satflx):
-                marked = False
-                collapsed = np.zeros(len(fpix[:, 0, 0]))
-                collapsed_err2 = np.zeros(len(fpix[:, 0, 0]))
-                for i in range(aperture.shape[0]):
-                    if aperture[i, j]:
-                        if not marked:
-                            aperture[i, j] = AP_COLLAPSED_PIXEL
-                            marked = True
-                        else:
-                            aperture[i, j] = AP_SATURATED_PIXEL
-                        collapsed += fpix[:, i, j]
-                        collapsed_err2 += fpix_err[:, i, j] ** 2
-                if np.any(collapsed):
-                    fpixnew.append(collapsed)
-                    ferrnew.append(np.sqrt(collapsed_err2))
-                    ncol += 1
-            else:
-                for i in range(aperture.shape[0]):
-                    if aperture[i, j]:
-                        fpixnew.append(fpix[:, i, j])
-                        ferrnew.append(fpix_err[:, i, j])
-        fpix2D = np.array(fpixnew).T
-        fpix_err2D = np.array(ferrnew).T
+        fpix2D, fpix_err2D, ncol = CollapseSaturatedColumns(
+            fpix, fpix_err, aperture, satcols)
         log.info("Collapsed %d saturated column(s)." % ncol)
 
     # Compute the background
     binds = np.where(aperture ^ 1)
     if RemoveBackground(EPIC, campaign=campaign) and (len(binds[0]) > 0):
-        bkg = np.nanmedian(np.array([f[binds]
-                                     for f in fpix], dtype='float64'), axis=1)
+        bkg = np.nanmedian(np.array(fpix[:, binds[0], binds[1]],
+                                    dtype='float64'), axis=1)
         # Uncertainty of the median:
         # http://davidmlane.com/hyperstat/A106993.html
-        bkg_err = 1.253 * np.nanmedian(np.array([e[binds] for e in fpix_err],
-                                       dtype='float64'), axis=1) \
+        bkg_err = 1.253 * np.nanmedian(np.array(
+            fpix_err[:, binds[0], binds[1]], dtype='float64'), axis=1) \
             / np.sqrt(len(binds[0]))
         bkg = bkg.reshape(-1, 1)
         bkg_err = bkg_err.reshape(-1, 1)
@@ -602,14 +560,12 @@ def GetData(fitsfile, EPIC, campaign, clobber=False,
         badmask += list(np.where(qual & 2 ** (b - 1))[0])
 
     # Flag >10 sigma outliers -- same thing.
-    tmpmask = np.array(list(set(np.concatenate([badmask, nanmask]))))
-    t = np.delete(time, tmpmask)
-    f = np.delete(flux, tmpmask)
-    f = SavGol(f)
+    imap = IndexMap(len(time), np.concatenate([badmask, nanmask]))
+    f = SavGol(imap.apply(flux))
     med = np.nanmedian(f)
     MAD = 1.4826 * np.nanmedian(np.abs(f - med))
     bad = np.where((f > med + 10. * MAD) | (f < med - 10. * MAD))[0]
-    badmask.extend([np.argmax(time == t[i]) for i in bad])
+    badmask.extend(imap.unmask(bad))
 
     # Campaign 2 hack: the first day or two are screwed up
     if campaign == 2:
@@ -619,8 +575,8 @@ def GetData(fitsfile, EPIC, campaign, clobber=False,
     badmask = np.array(sorted(list(set(badmask))))
 
     # Interpolate the nans
-    fpix = Interpolate(time, nanmask, fpix)
-    fpix_err = Interpolate(time, nanmask, fpix_err)
+    fpix = Interpolate(time, nanmask, fpix, inplace=True)
+    fpix_err = Interpolate(time, nanmask, fpix_err, inplace=True)
 
     # Return
     data = DataContainer()
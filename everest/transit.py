@@ -15,12 +15,12 @@ and the stellar density, which :py:mod:`pysyzygy` expects).
 from __future__ import division, print_function, absolute_import, \
      unicode_literals
 import numpy as np
-import matplotlib.pyplot as pl
 try:
     import pysyzygy as ps
 except:
     ps = None
 from scipy.optimize import fmin
+from collections import OrderedDict
 import logging
 log = logging.getLogger(__name__)
 
@@ -101,37 +101,288 @@ class TransitModel(object):
         # Save the kwargs
         self.params = kwargs
 
-    def __call__(self, time):
-        """Return the model evaluated at `time`."""
+        # The in-transit support and values, cached for each time grid
+        self._halfwidth = None
+        self._cache = OrderedDict()
+
+    def _get_halfwidth(self):
+        '''
+        Returns the maximum distance (in days) from the center of a
+        transit at which the model is non-zero, or :py:obj:`numpy.inf`
+        if this can't be determined.
+
+        '''
+
+        if self._halfwidth is None:
+            h = min(0.5 * self.per, 2.)
+            t = self.t0 + np.linspace(-h, h, 4001)
+            model = self._transit(t)
+            if (model[0] < 1) or (model[-1] < 1) or np.all(model == 1):
+                self._halfwidth = np.inf
+            else:
+                self._halfwidth = np.max(np.abs(t[model < 1] - self.t0)) + \
+                    2 * (t[1] - t[0])
+        return self._halfwidth
+
+    def support(self, time):
+        '''
+        Returns the indices of the cadences in :py:obj:`time` at which the
+        model is non-zero and the value of the model at those cadences.
+        The results are cached for each time grid, so repeated calls
+        (with the same array or a copy of it) are essentially free.
+
+        '''
+
         if ps is None:
             raise Exception("Unable to import `pysyzygy`.")
 
-        model = (self._transit(time) - 1) / self.depth
+        time = np.asarray(time, dtype=float)
+        key = (time.shape, hash(time.tobytes()))
+        res = self._cache.get(key, None)
+        if res is not None:
+            return res
+
+        # Candidate in-transit cadences
+        hw = self._get_halfwidth()
+        if np.isinf(hw) or len(time) == 0:
+            inds = np.arange(len(time))
+        else:
+            times = self.params.get('times', None)
+            if times is not None:
+                tts = np.sort(times)
+            else:
+                n0 = np.floor((np.min(time) - self.t0) / self.per) - 1
+                n1 = np.ceil((np.max(time) - self.t0) / self.per) + 1
+                tts = self.t0 + self.per * np.arange(n0, n1 + 1)
+            if len(tts) == 1:
+                dist = np.abs(time - tts[0])
+            else:
+                j = np.clip(np.searchsorted(tts, time), 1, len(tts) - 1)
+                dist = np.minimum(np.abs(time - tts[j - 1]),
+                                  np.abs(time - tts[j]))
+            inds = np.where(dist <= hw)[0]
 
         # Single transit?
         if self.single:
-            model[np.where(np.abs(time - self.t0) > self.per / 5.)[0]] = 0.
+            inds = inds[np.abs(time[inds] - self.t0) <= self.per / 5.]
+
+        # Evaluate the model only where it can be non-zero
+        if len(inds):
+            values = (self._transit(time[inds]) - 1) / self.depth
+            nz = np.where(values != 0)[0]
+            inds = inds[nz]
+            values = values[nz]
+        else:
+            values = np.array([], dtype=float)
+
+        # Cache (keep only the most recent grids)
+        self._cache[key] = (inds, values)
+        while len(self._cache) > 8:
+            self._cache.popitem(last=False)
+
+        return inds, values
+
+    def __call__(self, time):
+        """Return the model evaluated at `time`."""
+        if ps is None:
+            raise Exception("Unable to import `pysyzygy`.")
+
+        inds, values = self.support(time)
+        model = np.zeros(len(time))
+        model[inds] = values
 
         return model
 
 
+class _LRUCache(object):
+    '''
+    A simple least-recently-used cache.
+
+    '''
+
+    def __init__(self, maxsize=128):
+        '''
+
+        '''
+
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        '''
+
+        '''
+
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        '''
+
+        '''
+
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        '''
+
+        '''
+
+        self._data.clear()
+
+
+#: The orbital periods (in days) at which the inversion tables are computed
+PER_GRID = np.logspace(-0.5, 3., 36)
+#: The stellar densities at which the duration table is computed
+RHOS_GRID = np.logspace(-3., 3., 121)
+#: The radius ratios at which the depth table is computed
+RPRS_GRID = np.logspace(-3.5, -0.5, 121)
+
+#: Cached rows of the duration and depth inversion tables
+_tables = _LRUCache(maxsize=512)
+#: Cached unit-depth transit templates for :py:class:`TransitShape`
+_templates = _LRUCache(maxsize=256)
+
+
+def _CacheKey(kwargs, exclude=['t0', 'times', 'per']):
+    '''
+    Returns a hashable key for the :py:mod:`pysyzygy` keyword arguments
+    (such as the limb darkening coefficients and the exposure time),
+    or :py:obj:`None` if these can't be hashed.
+
+    '''
+
+    try:
+        key = tuple(sorted((k, float(v)) for k, v in kwargs.items()
+                           if k not in exclude))
+    except (TypeError, ValueError):
+        return None
+    return key
+
+
+def _Depth(RpRs, **kwargs):
+    '''
+    The depth of a transit with radius ratio :py:obj:`RpRs`.
+
+    '''
+
+    return 1 - ps.Transit(RpRs=float(RpRs),
+                          **kwargs)([kwargs.get('t0', 0.)])[0]
+
+
+def _Duration(rhos, **kwargs):
+    '''
+    The duration of a transit around a star of density :py:obj:`rhos`.
+
+    '''
+
+    t0 = kwargs.get('t0', 0.)
+    time = np.linspace(t0 - 0.5, t0 + 0.5, 1000)
+    try:
+        t = time[np.where(ps.Transit(rhos=float(rhos), **kwargs)(time) < 1)]
+    except:
+        return 0.
+    if len(t) == 0:
+        return 0.
+    return t[-1] - t[0]
+
+
+def _TableRow(kind, i, key, kwargs):
+    '''
+    Returns the `i`th row (period) of the `kind` inversion table as
+    a tuple `(x, y)` of monotonically increasing `x` (the log of the
+    duration or of the depth) and the corresponding `y` (the log of
+    the stellar density or of the radius ratio).
+
+    '''
+
+    row = _tables.get((kind, i, key))
+    if row is not None:
+        return row
+    kw = dict(kwargs)
+    kw.pop('times', None)
+    kw.update({'t0': 0., 'per': PER_GRID[i]})
+    if kind == 'rhos':
+        y = np.log(RHOS_GRID)
+        x = np.array([_Duration(r, **kw) for r in RHOS_GRID])
+        # Durations are quantized on the time grid; keep one point per
+        # plateau, at the mean density, and only the valid (monotonic) ones
+        good = (x > 0) & (x < 0.99)
+        x, inv = np.unique(x[good], return_inverse=True)
+        y = np.bincount(inv, weights=y[good]) / np.bincount(inv)
+        keep = np.concatenate([[True], np.diff(y) < 0]) if len(y) \
+            else np.array([], dtype=bool)
+        x = np.log(x[keep])
+        y = y[keep]
+    else:
+        y = np.log(RPRS_GRID)
+        x = np.zeros_like(RPRS_GRID)
+        for k, r in enumerate(RPRS_GRID):
+            try:
+                x[k] = _Depth(r, **kw)
+            except:
+                pass
+        good = (x > 0) & np.concatenate([[True], np.diff(x) > 0])
+        x = np.log(x[good])
+        y = y[good]
+    row = (x, y)
+    _tables.set((kind, i, key), row)
+    return row
+
+
+def _Invert(kind, value, **kwargs):
+    '''
+    Inverts the duration -> density or depth -> radius ratio relation
+    by interpolating the lookup tables in `log(value)` and `log(per)`.
+    Returns :py:obj:`None` if the value is outside the tabulated range.
+
+    '''
+
+    key = _CacheKey(kwargs)
+    per = kwargs.get('per', 10.)
+    if key is None or per < PER_GRID[0] or per > PER_GRID[-1]:
+        return None
+    i = min(np.searchsorted(PER_GRID, per, side='right') - 1,
+            len(PER_GRID) - 2)
+    res = []
+    for j in [i, i + 1]:
+        x, y = _TableRow(kind, j, key, kwargs)
+        if len(x) < 2 or np.log(value) < x[0] or np.log(value) > x[-1]:
+            return None
+        res.append(np.interp(np.log(value), x, y))
+    w = (np.log(per) - np.log(PER_GRID[i])) / \
+        (np.log(PER_GRID[i + 1]) - np.log(PER_GRID[i]))
+    return float(np.exp((1 - w) * res[0] + w * res[1]))
+
+
 def Get_RpRs(d, **kwargs):
     '''
     Returns the value of the planet radius over the stellar radius
     for a given depth :py:obj:`d`, given
     the :py:class:`everest.pysyzygy` transit :py:obj:`kwargs`.
+    The value is interpolated from a lookup table computed (once per
+    period and set of :py:obj:`kwargs`) on a grid of radius ratios; if
+    the depth is out of range, falls back to a numerical inversion.
 
     '''
     if ps is None:
             raise Exception("Unable to import `pysyzygy`.")
 
-    def Depth(RpRs, **kwargs):
-        return 1 - ps.Transit(RpRs=RpRs, **kwargs)([kwargs.get('t0', 0.)])
+    RpRs = _Invert('RpRs', d, **kwargs)
+    if RpRs is not None:
+        return RpRs
 
     def DiffSq(r):
-        return 1.e10 * (d - Depth(r, **kwargs)) ** 2
+        return 1.e10 * (d - _Depth(r[0], **kwargs)) ** 2
 
-    return fmin(DiffSq, [np.sqrt(d)], disp=False)
+    return fmin(DiffSq, [np.sqrt(d)], disp=False)[0]
 
 
 def Get_rhos(dur, **kwargs):
@@ -139,6 +390,9 @@ def Get_rhos(dur, **kwargs):
     Returns the value of the stellar density for a given transit
     duration :py:obj:`dur`, given
     the :py:class:`everest.pysyzygy` transit :py:obj:`kwargs`.
+    The value is interpolated from a lookup table computed (once per
+    period and set of :py:obj:`kwargs`) on a grid of stellar densities;
+    if the duration is out of range, falls back to a numerical inversion.
 
     '''
     if ps is None:
@@ -146,19 +400,14 @@ def Get_rhos(dur, **kwargs):
 
     assert dur >= 0.01 and dur <= 0.5, "Invalid value for the duration."
 
-    def Dur(rhos, **kwargs):
-        t0 = kwargs.get('t0', 0.)
-        time = np.linspace(t0 - 0.5, t0 + 0.5, 1000)
-        try:
-            t = time[np.where(ps.Transit(rhos=rhos, **kwargs)(time) < 1)]
-        except:
-            return 0.
-        return t[-1] - t[0]
+    rhos = _Invert('rhos', dur, **kwargs)
+    if rhos is not None:
+        return rhos
 
     def DiffSq(rhos):
-        return (dur - Dur(rhos, **kwargs)) ** 2
+        return (dur - _Duration(rhos[0], **kwargs)) ** 2
 
-    return fmin(DiffSq, [0.2], disp=False)
+    return fmin(DiffSq, [0.2], disp=False)[0]
 
 
 def Transit(time, t0=0., dur=0.1, per=3.56789, depth=0.001, **kwargs):
@@ -216,19 +465,36 @@ class TransitShape(object):
 
         # Update kwargs with correct duration
         kwargs.update({'per': 3.56789})
-        kwargs.update({'rhos': Get_rhos(dur, **kwargs)})
-
-        # Transit window size w/ padding
-        window = dur * 3
-        t = np.linspace(-window / 2, window / 2, 5000)
-
-        # Construct a transit model
-        trn = ps.Transit(t0=0., **kwargs)
-        transit_model = trn(t)
-        transit_model -= 1
-        transit_model *= depth / (1 - trn([0.])[0])
-        self.x = t
-        self.y = transit_model
+
+        # The template is linear in the depth, so we cache the
+        # unit-depth template for each duration and set of kwargs
+        # (limb darkening, exposure time, etc.)
+        key = _CacheKey(kwargs, exclude=[])
+        if key is not None:
+            key = (float(dur), key)
+            template = _templates.get(key)
+        else:
+            template = None
+
+        if template is None:
+
+            kwargs.update({'rhos': Get_rhos(dur, **kwargs)})
+
+            # Transit window size w/ padding
+            window = dur * 3
+            t = np.linspace(-window / 2, window / 2, 5000)
+
+            # Construct a unit-depth transit model
+            trn = ps.Transit(t0=0., **kwargs)
+            transit_model = trn(t)
+            transit_model -= 1
+            transit_model /= (1 - trn([0.])[0])
+            template = (t, transit_model)
+            if key is not None:
+                _templates.set(key, template)
+
+        self.x = template[0]
+        self.y = depth * template[1]
 
     def __call__(self, time, t0=0.):
         """Evalaute the transit model."""
@@ -30,15 +30,15 @@ from . import missions
 from .basecamp import Basecamp
 from .detrender import pPLD
 from .gp import GetCovariance, GP
+from .mathutils import Gram
+from .modelstore import SaveModel
 from .config import QUALITY_BAD, QUALITY_NAN, QUALITY_OUT, QUALITY_REC, \
      QUALITY_TRN, EVEREST_DEV, EVEREST_FITS, EVEREST_MAJOR_MINOR
-from .utils import InitLog, Formatter
-import george
+from .utils import InitLog, Formatter, LazyModule
 import os
 import sys
 import platform
 import numpy as np
-import matplotlib.pyplot as pl
 try:
     import pyfits
 except ImportError:
@@ -52,14 +52,15 @@ from six.moves import urllib
 from tempfile import NamedTemporaryFile
 import shutil
 from distutils.version import LooseVersion
-import k2plr
-k2plr_client = k2plr.API()
 import logging
 log = logging.getLogger(__name__)
+pl = LazyModule('matplotlib.pyplot')
 
 
 def Search(ID, mission='k2'):
     """Why is my target not in the EVEREST database?"""
+    import k2plr
+
     # Only K2 supported for now
     assert mission == 'k2', "Only the K2 mission is supported for now."
     print("Searching for target %d..." % ID)
@@ -78,7 +79,7 @@ def Search(ID, mission='k2'):
         return
 
     # Get the kplr object
-    star = k2plr_client.k2_star(ID)
+    star = missions.k2.utils.KPLRClient().k2_star(ID)
 
     # First check if this is a star
     if star.objtype.lower() != "star":
@@ -134,6 +135,35 @@ def Search(ID, mission='k2'):
     print("http://faculty.washington.edu/rodluger/everest/pipeline.html")
     return
 
+
+def _URLDownload(url, file):
+    '''
+    Downloads :py:obj:`url` to :py:obj:`file` with :py:mod:`urllib`.
+    Returns :py:obj:`None` on success, or the error message.
+
+    '''
+
+    r = urllib.request.Request(url)
+    try:
+        handler = urllib.request.urlopen(r)
+        code = handler.getcode()
+    except (urllib.error.HTTPError, urllib.error.URLError):
+        code = 0
+    if int(code) != 200:
+        return "Error code {0} for URL '{1}'".format(code, url)
+
+    # Read the data
+    data = handler.read()
+
+    # Atomically save to disk
+    f = NamedTemporaryFile("wb", delete=False)
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    shutil.move(f.name, file)
+
+
 def DownloadFile(ID, season=None, mission='k2', cadence='lc',
                  filename=None, clobber=False):
     '''
@@ -182,30 +212,21 @@ def DownloadFile(ID, season=None, mission='k2', cadence='lc',
         fitsurl += '/'
 
     # Download the data
-    r = urllib.request.Request(fitsurl + filename)
-    try:
-        handler = urllib.request.urlopen(r)
-        code = handler.getcode()
-    except (urllib.error.HTTPError, urllib.error.URLError):
-        code = 0
-    if int(code) == 200:
-
-        # Read the data
-        data = handler.read()
-
-        # Atomically save to disk
-        f = NamedTemporaryFile("wb", delete=False)
-        f.write(data)
-        f.flush()
-        os.fsync(f.fileno())
-        f.close()
-        shutil.move(f.name, os.path.join(path, filename))
-
+    if sys.version_info >= (3, 7):
+        from .download import Fetch, DownloadError
+        try:
+            Fetch(fitsurl + filename, os.path.join(path, filename),
+                  clobber=clobber)
+            error = None
+        except DownloadError as e:
+            error = str(e)
     else:
+        # The `asyncio` download manager needs Python 3.7
+        error = _URLDownload(fitsurl + filename, os.path.join(path, filename))
+    if error is not None:
 
         # Something went wrong!
-        log.error("Error code {0} for URL '{1}'".format(
-            code, fitsurl + filename))
+        log.error(error)
 
         # If the files can be accessed by `ssh`, let's try that
         # (development version only!)
@@ -404,10 +425,7 @@ class Everest(Basecamp):
             c = self.get_chunk(b)
 
             # Masked chunk (original mask plus user transit mask)
-            inds = np.array(
-                list(set(np.concatenate([self.transitmask,
-                                         self.recmask]))), dtype=int)
-            M = np.delete(np.arange(len(self.time)), inds, axis=0)
+            M = np.flatnonzero(~self.get_mask(['transitmask', 'recmask']))
             if b > 0:
                 m = M[(M > self.breakpoints[b - 1] - self.bpad)
                       & (M <= self.breakpoints[b] + self.bpad)]
@@ -432,8 +450,8 @@ class Everest(Basecamp):
             for n in range(self.pld_order):
                 XM = self.X(n, m)
                 XC = self.X(n, c)
-                A += self.reclam[b][n] * np.dot(XM, XM.T)
-                B += self.reclam[b][n] * np.dot(XC, XM.T)
+                A += self.reclam[b][n] * Gram(XM)
+                B += self.reclam[b][n] * Gram(XC, XM)
                 del XM, XC
 
             W = np.linalg.solve(mK + A, f)
@@ -690,8 +708,6 @@ class Everest(Basecamp):
 
         # Set up some stuff
         time = self.time
-        badmask = self.badmask
-        nanmask = self.nanmask
         outmask = self.outmask
         transitmask = self.transitmask
         fraw_err = self.fraw_err
@@ -718,9 +734,8 @@ class Everest(Basecamp):
                     ls='none', marker='.', color='k', markersize=ms, alpha=0.5)
 
             # Plot the outliers
-            bnmask = np.array(
-                list(set(np.concatenate([badmask, nanmask]))), dtype=int)
-            bmask = [i for i in self.badmask if i not in self.nanmask]
+            bnmask = self.get_mask_indices(['badmask', 'nanmask'])
+            bmask = self.get_mask_indices(['badmask'], exclude=['nanmask'])
 
             def O1(x): return x[outmask]
 
@@ -789,15 +804,16 @@ class Everest(Basecamp):
 
             # Indicate off-axis outliers
             for i in np.where(flux < ylim[0])[0]:
-                if i in bmask:
+                if self.is_masked(i, ['badmask']) and \
+                        not self.is_masked(i, ['nanmask']):
                     color = "#ffcccc"
                     if not plot_bad:
                         continue
-                elif i in outmask:
+                elif self.is_masked(i, ['outmask']):
                     color = "#cccccc"
                     if not plot_out:
                         continue
-                elif i in nanmask:
+                elif self.is_masked(i, ['nanmask']):
                     continue
                 else:
                     color = "#ccccff"
@@ -805,15 +821,16 @@ class Everest(Basecamp):
                             xytext=(0, 15), textcoords='offset points',
                             arrowprops=dict(arrowstyle="-|>", color=color))
             for i in np.where(flux > ylim[1])[0]:
-                if i in bmask:
+                if self.is_masked(i, ['badmask']) and \
+                        not self.is_masked(i, ['nanmask']):
                     color = "#ffcccc"
                     if not plot_bad:
                         continue
-                elif i in outmask:
+                elif self.is_masked(i, ['outmask']):
                     color = "#cccccc"
                     if not plot_out:
                         continue
-                elif i in nanmask:
+                elif self.is_masked(i, ['nanmask']):
                     continue
                 else:
                     color = "#ccccff"
@@ -953,8 +970,8 @@ class Everest(Basecamp):
         t0 += np.ceil((self.time[0] - dur - t0) / period) * period
         for t in np.arange(t0, self.time[-1] + dur, period):
             mask.extend(np.where(np.abs(self.time - t) < dur / 2.)[0])
-        self.transitmask = np.array(
-            list(set(np.concatenate([self.transitmask, mask]))))
+        self.set_mask('transitmask',
+                      np.concatenate([self.transitmask, mask]))
 
     def _plot_weights(self, show=True):
         '''
@@ -1169,8 +1186,8 @@ class Everest(Basecamp):
                 if (self.lam_idx >= n) and (self.lam[b][n] is not None):
                     XM = self.X(n, m)
                     XC = self.X(n, c)
-                    A += self.lam[b][n] * np.dot(XM, XM.T)
-                    B += self.lam[b][n] * np.dot(XC, XM.T)
+                    A += self.lam[b][n] * Gram(XM)
+                    B += self.lam[b][n] * Gram(XC, XM)
                     del XM, XC
             W = np.linalg.solve(mK + A, f)
             model = np.dot(B, W)
@@ -1191,9 +1208,7 @@ class Everest(Basecamp):
                 alpha=0.5)
 
             # Plot the outliers
-            bnmask = np.array(
-                list(set(np.concatenate([self.badmask, self.nanmask]))),
-                dtype=int)
+            bnmask = self.get_mask_indices(['badmask', 'nanmask'])
 
             def O1(x): return x[self.outmask]
 
@@ -1302,19 +1317,7 @@ class Everest(Basecamp):
         '''
 
         # Save the data
-        d = dict(self.__dict__)
-        d.pop('_weights', None)
-        d.pop('_A', None)
-        d.pop('_B', None)
-        d.pop('_f', None)
-        d.pop('_mK', None)
-        d.pop('K', None)
-        d.pop('dvs', None)
-        d.pop('clobber', None)
-        d.pop('clobber_tpf', None)
-        d.pop('_mission', None)
-        d.pop('debug', None)
-        np.savez(os.path.join(self.dir, self.name + '.npz'), **d)
+        SaveModel(os.path.join(self.dir, self.name + '.npz'), self)
 
     def optimize(self, piter=3, pmaxf=300, ppert=0.1):
         '''
@@ -1492,9 +1495,8 @@ class Everest(Basecamp):
             ax.plot(time, y, 'r-', lw=1, alpha=1)
 
         # Plot the bad data points
-        bnmask = np.array(
-            list(set(np.concatenate([self.badmask, self.nanmask]))), dtype=int)
-        bmask = [i for i in self.badmask if i not in self.nanmask]
+        bnmask = self.get_mask_indices(['badmask', 'nanmask'])
+        bmask = self.get_mask_indices(['badmask'], exclude=['nanmask'])
         ax.plot(time[bmask], flux[bmask], 'r.', markersize=ms, alpha=0.25)
 
         # Appearance
@@ -15,8 +15,8 @@ import os
 import sys
 import traceback
 import pdb
+import importlib
 import logging
-from matplotlib.ticker import FuncFormatter
 log = logging.getLogger(__name__)
 
 #: Marks a pixel into which a row was collapsed.
@@ -183,6 +183,49 @@ def sort_like(l, col1, col2):
     return s
 
 
+class IndexMap(object):
+    '''
+    Records which indices of an array of length :py:obj:`n` survive the
+    removal of :py:obj:`mask` (as in :py:func:`numpy.delete`), so that
+    indices computed on the masked array can be projected back onto the
+    original array in a single vectorized step. This replaces the
+    ``np.argmax(time == t[i])`` lookup, which is `O(N)` per index.
+
+    :param int n: The length of the unmasked array
+    :param array_like mask: The indices to remove, or a boolean array of \
+           length :py:obj:`n` that is :py:obj:`True` for the masked entries
+
+    '''
+
+    def __init__(self, n, mask):
+        '''
+
+        '''
+
+        mask = np.asarray(mask)
+        if mask.dtype == bool and len(mask) == n:
+            self.inds = np.flatnonzero(~mask)
+        else:
+            self.inds = np.delete(np.arange(n), np.array(mask, dtype=int))
+
+    def apply(self, x, axis=0):
+        '''
+        Returns the masked version of array :py:obj:`x`.
+
+        '''
+
+        return np.take(x, self.inds, axis=axis)
+
+    def unmask(self, inds):
+        '''
+        Projects the indices :py:obj:`inds` of the masked array back onto
+        the original (unmasked) array.
+
+        '''
+
+        return self.inds[np.array(inds, dtype=int)]
+
+
 class DataContainer(object):
     '''
     A generic data container. Nothing fancy here.
@@ -216,6 +259,61 @@ class DataContainer(object):
         self.meta = None
 
 
+class LazyModule(object):
+    '''
+    A stand-in for a module that is only imported the first time one
+    of its attributes is accessed. This keeps heavy dependencies (such
+    as :py:mod:`matplotlib.pyplot`) out of the import path of code that
+    never plots anything.
+
+    :param str name: The fully qualified name of the module
+
+    '''
+
+    def __init__(self, name):
+        '''
+
+        '''
+
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        '''
+
+        '''
+
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+class _LazyFuncFormatter(object):
+    '''
+    A :py:class:`matplotlib.ticker.FuncFormatter` class attribute that
+    is only instantiated when it is first accessed.
+
+    '''
+
+    def __init__(self, func):
+        '''
+
+        '''
+
+        self.func = func
+        self.formatter = None
+
+    def __get__(self, obj, cls):
+        '''
+
+        '''
+
+        if self.formatter is None:
+            from matplotlib.ticker import FuncFormatter
+            self.formatter = FuncFormatter(self.func)
+        return self.formatter
+
+
 class Formatter(object):
     '''
     Custom function formatters for displaying ticks on plots.
@@ -223,15 +321,15 @@ class Formatter(object):
     '''
 
     #: Integer formatter for a flux axis
-    Flux = FuncFormatter(lambda x, p: '%6d' % x)
+    Flux = _LazyFuncFormatter(lambda x, p: '%6d' % x)
     #: Integer formatter for a CDPP axis
-    CDPP = FuncFormatter(lambda x, p: '%3d' % x)
+    CDPP = _LazyFuncFormatter(lambda x, p: '%3d' % x)
     #: Floating point formatter for a CDPP axis (1 digit after decimal)
-    CDPP1F = FuncFormatter(lambda x, p: '%.1f' % x)
+    CDPP1F = _LazyFuncFormatter(lambda x, p: '%.1f' % x)
     #: Floating point formatter for a CDPP axis (2 digits after decimal)
-    CDPP2F = FuncFormatter(lambda x, p: '%.2f' % x)
+    CDPP2F = _LazyFuncFormatter(lambda x, p: '%.2f' % x)
     #: Integer formatter for chunk number
-    Chunk = FuncFormatter(lambda x, p: '%2d' % x)
+    Chunk = _LazyFuncFormatter(lambda x, p: '%2d' % x)
 
 
 def prange(*x):
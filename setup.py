@@ -42,7 +42,8 @@ setup(name='everest-pipeline',
       author_email='rodluger@uw.edu',
       license='MIT',
       packages=['everest', 'everest.missions', 'everest.missions.k2',
-                'everest.missions.kepler', 'everest.missions.tess'],
+                'everest.missions.kepler', 'everest.missions.tess',
+                'everest.missions.synthetic'],
       install_requires=[
           'numpy>=1.8',
           'scipy',
@@ -59,7 +60,8 @@ setup(name='everest-pipeline',
       # 'https://github.com/rodluger/k2plr/tarball/dev#egg=k2plr-0.2.7'],
       # not yet 'https://github.com/rodluger/
       #          choldate/tarball/master#egg=choldate-0.0.1',
-      scripts=['bin/everest', 'bin/everest-stats', 'bin/everest-status'],
+      scripts=['bin/everest', 'bin/everest-stats', 'bin/everest-status',
+               'bin/everest-ingest'],
       include_package_data=True,
       zip_safe=False,
       test_suite='nose.collector',
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_basecamp.py
+----------------
+
+Test the cadence mask bitfield of :py:class:`everest.basecamp.Basecamp`.
+
+'''
+
+from everest.basecamp import Basecamp
+import numpy as np
+
+
+def test_masks():
+    '''
+
+    '''
+
+    model = Basecamp()
+    model.time = np.arange(100.)
+    model.outmask = [5, 7]
+    model.nanmask = [7, 90]
+    model.set_mask('transitmask', np.concatenate([model.transitmask, [20]]))
+    assert np.array_equal(model.mask, [5, 7, 20, 90])
+    assert np.array_equal(model.get_mask_indices(['outmask'],
+                                                 exclude=['nanmask']), [5])
+    assert np.array_equal(model.apply_mask(),
+                          np.delete(np.arange(100), [5, 7, 20, 90]))
+
+    # Shortening the light curve drops the cadences past its end
+    model.time = np.arange(50.)
+    assert len(model.get_mask()) == 50
+    assert np.array_equal(model.nanmask, [7])
+    assert np.array_equal(model.apply_mask(),
+                          np.delete(np.arange(50), [5, 7, 20]))
+
+    # Out of range indices are ignored, as with `np.delete`
+    model.badmask = [3, 60]
+    assert np.array_equal(model.badmask, [3])
+    assert len(model.get_mask()) == 50
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_basis.py
+-------------
+
+Test the randomized SVD and the neighbor bases of the synthetic
+and `K2` missions.
+
+'''
+
+from everest.mathutils import RandomizedSVD, PixelBasis
+from everest.missions.synthetic import sysrem, synthetic
+from everest.missions.synthetic.utils import GetSyntheticCampaign, \
+     TargetInfo
+from everest.missions.k2 import k2, sysrem as k2sysrem
+from everest.missions.k2.utils import GetK2Campaign, Channels
+from everest.utils import DataContainer
+import numpy as np
+import tempfile
+import shutil
+import os
+
+#: The synthetic campaign
+SEASON = 0
+
+#: The `K2` campaign
+CAMPAIGN = 1
+
+
+def test_svd():
+    '''
+
+    '''
+
+    # A rank 5 matrix, plus a little noise
+    rng = np.random.RandomState(0)
+    U = np.linalg.qr(rng.randn(500, 5))[0]
+    V = np.linalg.qr(rng.randn(80, 5))[0]
+    s = np.array([100., 50., 20., 10., 5.])
+    A = np.dot(U * s, V.T) + 1e-6 * rng.randn(500, 80)
+
+    for rank in [3, 5]:
+        u, w, vt = RandomizedSVD(A, rank)
+        assert u.shape == (500, rank)
+        assert w.shape == (rank,)
+        assert vt.shape == (rank, 80)
+        assert np.allclose(w, np.linalg.svd(A, compute_uv=False)[:rank],
+                           rtol=1e-6)
+        assert np.allclose(np.abs(np.dot(u.T, U[:, :rank])), np.eye(rank),
+                           atol=1e-6)
+        assert np.allclose(np.abs(np.dot(vt, V[:, :rank])), np.eye(rank),
+                           atol=1e-6)
+
+    # The basis spans the systematics of the pixels
+    X1 = 0.1 + 1e-3 * A[:, :40]
+    basis = PixelBasis(X1, rank=5)
+    assert basis.shape == (500, 5)
+    c = X1 - np.mean(X1, axis=0)
+    B = basis - np.mean(basis, axis=0)
+    resid = c - np.dot(B, np.linalg.lstsq(B, c, rcond=None)[0])
+    assert np.std(resid) < 1e-3 * np.std(c)
+
+
+def Recorder(requested):
+    '''
+    Returns a stand-in for the missions' :py:func:`GetData` that
+    records the stars the basis is computed from, without generating
+    or downloading their target pixel files.
+
+    '''
+
+    def GetData(ID, **kwargs):
+        requested.append(ID)
+        data = DataContainer()
+        data.time = np.arange(100.)
+        data.fpix = 1. + np.random.RandomState(ID % 2 ** 31).rand(100, 4)
+        data.badmask = []
+        data.nanmask = []
+        return data
+
+    return GetData
+
+
+def test_basis():
+    '''
+
+    '''
+
+    requested = []
+    path = tempfile.mkdtemp()
+    GetData = synthetic.GetData
+    EVEREST_DAT = sysrem.EVEREST_DAT
+    synthetic.GetData = Recorder(requested)
+    sysrem.EVEREST_DAT = path
+    try:
+
+        # The basis of a target never includes the target itself
+        stars = GetSyntheticCampaign(SEASON)
+        bright = [s[0] for s in stars if 11. < s[1] < 13.]
+        for ID in bright[:4]:
+            del requested[:]
+            basis = sysrem.GetBasis(SEASON, TargetInfo(ID).module, rank=3,
+                                    fold=ID % 2, clobber=True)
+            assert basis.shape == (100, 3)
+            assert len(requested) > 0
+            assert ID not in requested
+            assert all([star % 2 != ID % 2 for star in requested])
+
+        # The basis is cached...
+        module = TargetInfo(bright[0]).module
+        cbvdir = os.path.join(path, 'synthetic', 'cbv', 's%02d' % SEASON)
+        sysrem.GetBasis(SEASON, module, rank=3, fold=0)
+        del requested[:]
+        sysrem.GetBasis(SEASON, module, rank=3, fold=0)
+        assert len(requested) == 0
+        nfiles = len(os.listdir(cbvdir))
+
+        # ...but recomputed when the rank or the magnitude range change
+        for kwargs in [dict(rank=4), dict(rank=3, mag_range=(10., 13.))]:
+            del requested[:]
+            basis = sysrem.GetBasis(SEASON, module, fold=0, **kwargs)
+            assert len(requested) > 0
+            assert basis.shape == (100, kwargs['rank'])
+            nfiles += 1
+            assert len(os.listdir(cbvdir)) == nfiles
+
+    finally:
+        synthetic.GetData = GetData
+        sysrem.EVEREST_DAT = EVEREST_DAT
+        shutil.rmtree(path)
+
+
+def test_k2_basis():
+    '''
+
+    '''
+
+    requested = []
+    path = tempfile.mkdtemp()
+    GetData = k2.GetData
+    EVEREST_DAT = (k2.EVEREST_DAT, k2sysrem.EVEREST_DAT)
+    k2.GetData = Recorder(requested)
+    k2.EVEREST_DAT = k2sysrem.EVEREST_DAT = path
+    try:
+
+        # The bright stars in fold 0 on the module with the most of them
+        stars = [s for s in GetK2Campaign(CAMPAIGN)
+                 if 11. < s[1] < 13. and s[0] % 2 == 1]
+        module = max(range(2, 25), key=lambda m: len(
+            [s for s in stars if s[2] in (Channels(m) or [])]))
+        channels = Channels(module)
+        on = [s[0] for s in stars if s[2] in channels][:3]
+        off = [s[0] for s in stars if s[2] not in channels][:2]
+
+        # Only the stars whose data has been downloaded are used; an
+        # even star with data is in the other fold
+        even = [s[0] for s in GetK2Campaign(CAMPAIGN)
+                if 11. < s[1] < 13. and s[0] % 2 == 0 and
+                s[2] in channels][0]
+        for star in on + off + [even]:
+            os.makedirs(k2.TargetDirectory(star, CAMPAIGN))
+            open(os.path.join(k2.TargetDirectory(star, CAMPAIGN),
+                              'data.npz'), 'w').close()
+
+        # Stars on the module's channels...
+        basis = k2sysrem.GetBasis(CAMPAIGN, module, rank=3, min_stars=3)
+        assert basis.shape == (100, 3)
+        assert sorted(requested) == sorted(on)
+
+        # ...or on all modules, if there are too few of them
+        del requested[:]
+        k2sysrem.GetBasis(CAMPAIGN, module, rank=3, min_stars=4,
+                          clobber=True)
+        assert sorted(requested) == sorted(on + off)
+
+    finally:
+        k2.GetData = GetData
+        k2.EVEREST_DAT, k2sysrem.EVEREST_DAT = EVEREST_DAT
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    test_svd()
+    test_basis()
+    test_k2_basis()
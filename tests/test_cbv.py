@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_cbv.py
+-----------
+
+Test the batched CBV regression against the original per-segment
+loop, and the in-place refresh of the CBV columns of published
+*FITS* files.
+
+'''
+
+from everest.mathutils import CBVFit
+from everest.fits import UpdateCBVColumns, RefreshCBVColumns
+from everest.modelstore import SaveModel
+from everest.utils import DataContainer
+try:
+    import pyfits
+except ImportError:
+    import astropy.io.fits as pyfits
+import tempfile
+import shutil
+import os
+import numpy as np
+
+#: The number of cadences
+NCAD = 600
+
+#: The light curve segments, as in the `K2` missions
+BREAKPOINTS = [199, 349, 999999]
+
+#: The maximum difference between the models, as a fraction of the flux
+TOL = 1e-10
+
+
+def LoopCBVFit(X, flux, mask, breakpoints, ncbv=1):
+    '''
+    The original, one segment at a time, CBV regression of
+    :py:func:`everest.missions.k2.FitCBVs`.
+
+    '''
+
+    M = np.arange(len(flux))
+    good = np.flatnonzero(~mask)
+    m = [None for b in range(len(breakpoints))]
+    for b in range(len(breakpoints)):
+
+        # Get the indices for this light curve segment
+        if b > 0:
+            inds = M[(M > breakpoints[b - 1]) & (M <= breakpoints[b])]
+            masked_inds = good[(good > breakpoints[b - 1]) &
+                               (good <= breakpoints[b])]
+        else:
+            inds = M[M <= breakpoints[b]]
+            masked_inds = good[good <= breakpoints[b]]
+
+        # Regress
+        mX = X[masked_inds, :ncbv + 1]
+        A = np.dot(mX.T, mX)
+        B = np.dot(mX.T, flux[masked_inds])
+        m[b] = np.dot(X[inds, :ncbv + 1], np.linalg.solve(A, B))
+
+        # Vertical alignment
+        if b == 0:
+            m[b] -= np.nanmedian(m[b])
+        else:
+            i0 = -1 - np.argmax([np.isfinite(m[b - 1][-i])
+                                 for i in range(1, len(m[b - 1]) - 1)])
+            i1 = np.argmax([np.isfinite(m[b][i])
+                            for i in range(len(m[b]))])
+            m[b] += (m[b - 1][i0] - m[b][i1])
+
+    # Join model and normalize
+    m = np.concatenate(m)
+    m -= np.nanmedian(m)
+    return m
+
+
+def Synthetic(nflux, seed=42):
+    '''
+    Returns a CBV design matrix and :py:obj:`nflux` light curves with
+    their masks. Some of the masked cadences are at the segment edges.
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    time = np.linspace(0., 30., NCAD)
+    X = np.vstack([np.ones(NCAD), np.sin(time / 3.), np.cos(time / 7.),
+                   (time / 30.) ** 2]).T
+    flux = 1.e4 + np.dot(rng.randn(nflux, 4), X.T) + rng.randn(nflux, NCAD)
+    for i in range(len(BREAKPOINTS) - 1):
+        flux[:, BREAKPOINTS[i] + 1:] += 10 * rng.randn(nflux, 1)
+    mask = rng.rand(nflux, NCAD) < 0.1
+    mask[:, [0, BREAKPOINTS[0], BREAKPOINTS[0] + 1, NCAD - 1]] = True
+    return X, flux, mask
+
+
+def test_cbvfit():
+    '''
+
+    '''
+
+    X, flux, mask = Synthetic(5)
+    for ncbv in [1, 2, 3]:
+        batch = CBVFit(X, flux, mask, BREAKPOINTS, ncbv=ncbv)
+        assert batch.shape == flux.shape
+        for f, m, model in zip(flux, mask, batch):
+            loop = LoopCBVFit(X, f, m, BREAKPOINTS, ncbv=ncbv)
+            atol = TOL * np.median(f)
+            assert np.allclose(model, loop, rtol=0, atol=atol)
+
+            # One light curve at a time
+            single = CBVFit(X, f, m, BREAKPOINTS, ncbv=ncbv)
+            assert single.shape == f.shape
+            assert np.allclose(single, loop, rtol=0, atol=atol)
+
+
+def WriteFITS(file, fcor, XCBV):
+    '''
+    Writes a minimal *FITS* file with an `ARRAYS` HDU like the one
+    produced by :py:func:`everest.fits.MakeFITS`.
+
+    '''
+
+    cols = [pyfits.Column(name='FCOR', format='D', array=fcor)]
+    for n in range(XCBV.shape[1]):
+        cols.append(pyfits.Column(name='CBV%02d' % (n + 1), format='D',
+                                  array=XCBV[:, n]))
+    hdu = pyfits.BinTableHDU.from_columns(cols, name='ARRAYS')
+    pyfits.HDUList([pyfits.PrimaryHDU(), hdu]).writeto(file)
+
+
+def test_refresh():
+    '''
+
+    '''
+
+    path = tempfile.mkdtemp()
+    try:
+        X, flux, mask = Synthetic(3)
+        files = []
+        for n, (f, m) in enumerate(zip(flux, mask)):
+
+            # A stored model, with its masks...
+            model = DataContainer()
+            model.cadence = 'lc'
+            model.fraw = f
+            model.model = np.zeros_like(f)
+            model.breakpoints = BREAKPOINTS
+            inds = np.flatnonzero(m)
+            model.outmask = inds[::2]
+            model.badmask = inds[1::2]
+            model.transitmask = np.array([], dtype=int)
+            model.nanmask = np.array([], dtype=int)
+            modelfile = os.path.join(path, '%d.npz' % n)
+            SaveModel(modelfile, model)
+
+            # ...and its published light curve, with the old CBVs
+            fitsfile = os.path.join(path, '%d.fits' % n)
+            WriteFITS(fitsfile, np.zeros(NCAD), np.zeros_like(X))
+            files.append((modelfile, fitsfile))
+
+        # A missing file can't be refreshed
+        files.append((os.path.join(path, 'x.npz'),
+                      os.path.join(path, 'x.fits')))
+        failed = RefreshCBVColumns(files, X, cbv_num=2, cbv_niter=10)
+        assert failed == files[-1:]
+
+        for (modelfile, fitsfile), f, m in zip(files, flux, mask):
+            fcor = f - LoopCBVFit(X, f, m, BREAKPOINTS, ncbv=2)
+            with pyfits.open(fitsfile) as hdulist:
+                hdu = hdulist['ARRAYS']
+                assert np.allclose(hdu.data['FCOR'], fcor, rtol=0,
+                                   atol=TOL * np.median(f))
+                for n in range(X.shape[1]):
+                    assert np.array_equal(hdu.data['CBV%02d' % (n + 1)],
+                                          X[:, n])
+                assert hdu.header['CBVNUM'] == 2
+                assert hdu.header['CBVNITER'] == 10
+
+        # The columns must match the design matrix
+        modelfile, fitsfile = files[0]
+        assert not UpdateCBVColumns(fitsfile, flux[0], X[:, :2])
+        assert not UpdateCBVColumns(fitsfile, flux[0][:-1], X)
+        with pyfits.open(fitsfile) as hdulist:
+            assert hdulist['ARRAYS'].header['CBVNUM'] == 2
+        assert UpdateCBVColumns(fitsfile, flux[0], X, cbv_num=3)
+        with pyfits.open(fitsfile) as hdulist:
+            assert np.array_equal(hdulist['ARRAYS'].data['FCOR'], flux[0])
+            assert hdulist['ARRAYS'].header['CBVNUM'] == 3
+
+    finally:
+        shutil.rmtree(path)
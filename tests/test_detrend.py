@@ -16,8 +16,10 @@ import numpy as np
 import shutil
 
 
-def test_detrend():
+def PrepareTarget():
     '''
+    Copies the bundled data for EPIC 201367065 to where
+    :py:mod:`everest` expects to find it.
 
     '''
 
@@ -62,6 +64,14 @@ def test_detrend():
     np.savez(os.path.join(dest, 'X.npz'), time=time,
              X=X, breakpoints=breakpoints)
 
+
+def test_detrend():
+    '''
+
+    '''
+
+    PrepareTarget()
+
     # Run the de-trending
     star = everest.rPLD(201367065, clobber=True, mission='k2',
                         giter=1, gmaxf=3, lambda_arr=[1e0, 1e5, 1e10], oiter=3,
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_download.py
+----------------
+
+Test the download manager against a local HTTP server.
+
+'''
+
+import sys
+import unittest
+if sys.version_info < (3, 7):
+    raise unittest.SkipTest("The download manager requires Python 3.7.")
+from everest.download import DownloadError, Request, Fetch, FetchAll
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+import hashlib
+import tempfile
+import shutil
+import os
+import numpy as np
+
+#: The files served by the stand-in server
+FILES = dict([('/file%02d.fits' % n,
+               np.random.RandomState(n).bytes(100000 + 1000 * n))
+              for n in range(20)])
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    '''
+    A stand-in for MAST that supports ranged requests and can be told
+    to fail.
+
+    '''
+
+    daemon_threads = True
+
+    def __init__(self):
+        '''
+
+        '''
+
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.fail = {}
+        self.truncate = {}
+
+    @property
+    def url(self):
+        '''
+
+        '''
+
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+
+    '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        '''
+
+        '''
+
+        pass
+
+    def setup(self):
+        '''
+
+        '''
+
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        '''
+
+        '''
+
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get('Range')))
+            fail = server.fail.get(self.path, 0)
+            if fail:
+                server.fail[self.path] -= 1
+            truncate = server.truncate.pop(self.path, None)
+
+        if self.path == '/moved':
+            self.send_response(302)
+            self.send_header('Location', '/file00.fits')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if fail:
+            self.send_error(503)
+            return
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+
+        data = FILES[self.path]
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'][6:-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        if truncate is not None:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if truncate is not None:
+            # Drop the connection half way through
+            self.wfile.write(data[start:start + truncate])
+            self.close_connection = True
+        else:
+            self.wfile.write(data[start:])
+
+
+#: The stand-in server, shared by all the tests
+SERVER = None
+
+#: The directory the files are downloaded to
+CACHE = None
+
+
+def setup_module():
+    '''
+
+    '''
+
+    global SERVER, CACHE
+    SERVER = Server()
+    thread = threading.Thread(target=SERVER.serve_forever)
+    thread.daemon = True
+    thread.start()
+    CACHE = tempfile.mkdtemp()
+
+
+def teardown_module():
+    '''
+
+    '''
+
+    SERVER.shutdown()
+    SERVER.server_close()
+    shutil.rmtree(CACHE)
+
+
+def Reset():
+    '''
+    Clears the request log of the server and returns an empty
+    download directory for a test.
+
+    '''
+
+    with SERVER.lock:
+        SERVER.connections = 0
+        del SERVER.requests[:]
+        SERVER.fail.clear()
+        SERVER.truncate.clear()
+    return tempfile.mkdtemp(dir=CACHE)
+
+
+def test_concurrent():
+    '''
+
+    '''
+
+    server = SERVER
+    cache = Reset()
+
+    requests = [Request(server.url + name, os.path.join(cache, 'a', name[1:]))
+                for name in sorted(FILES)]
+    res = FetchAll(requests, concurrency=4)
+    assert res == [r.path for r in requests]
+    for r, name in zip(requests, sorted(FILES)):
+        with open(r.path, 'rb') as f:
+            assert f.read() == FILES[name]
+
+    # Connections are reused
+    assert server.connections <= 4
+
+    # Cached files are not downloaded again
+    nreq = len(server.requests)
+    FetchAll(requests)
+    assert len(server.requests) == nreq
+
+
+def test_retry_and_resume():
+    '''
+
+    '''
+
+    server = SERVER
+    cache = Reset()
+
+    # Transient server errors
+    server.fail['/file01.fits'] = 2
+    path = Fetch(server.url + '/file01.fits',
+                 os.path.join(cache, 'file01.fits'), backoff=0.01)
+    with open(path, 'rb') as f:
+        assert f.read() == FILES['/file01.fits']
+
+    # Dropped connection: the download is resumed where it stopped
+    server.truncate['/file02.fits'] = 30000
+    data = FILES['/file02.fits']
+    path = Fetch(server.url + '/file02.fits',
+                 os.path.join(cache, 'file02.fits'), backoff=0.01,
+                 checksum='md5:' + hashlib.md5(data).hexdigest())
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert ('/file02.fits', 'bytes=30000-') in server.requests
+    assert not os.path.exists(path + '.part')
+
+    # Redirects
+    path = Fetch(server.url + '/moved', os.path.join(cache, 'moved.fits'))
+    with open(path, 'rb') as f:
+        assert f.read() == FILES['/file00.fits']
+
+
+def test_errors():
+    '''
+
+    '''
+
+    server = SERVER
+    cache = Reset()
+
+    # Missing files are not retried
+    try:
+        Fetch(server.url + '/missing.fits', os.path.join(cache, 'missing'))
+    except DownloadError:
+        pass
+    else:
+        raise AssertionError("Missing file did not raise `DownloadError`.")
+    assert len(server.requests) == 1
+
+    # Bad checksums and persistent errors are, and nothing is cached
+    res = FetchAll([Request(server.url + '/file03.fits',
+                            os.path.join(cache, 'file03.fits'),
+                            checksum='md5:0'),
+                    Request(server.url + '/file04.fits',
+                            os.path.join(cache, 'file04.fits'),
+                            size=1)],
+                   retries=2, backoff=0.01)
+    assert all([isinstance(r, DownloadError) for r in res])
+    assert os.listdir(cache) == []
+
+    # Local files
+    src = os.path.join(cache, 'src')
+    with open(src, 'wb') as f:
+        f.write(FILES['/file05.fits'])
+    path = Fetch('file://' + src, os.path.join(cache, 'dst', 'file05.fits'))
+    with open(path, 'rb') as f:
+        assert f.read() == FILES['/file05.fits']
+
+
+if __name__ == '__main__':
+    setup_module()
+    try:
+        test_concurrent()
+        test_retry_and_resume()
+        test_errors()
+    finally:
+        teardown_module()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_gp.py
+----------
+
+Test the matrix-free GP covariance products, the blocked joint
+model solver and the cross-validation predictor against their dense
+and :py:obj:`george` counterparts.
+
+'''
+
+from everest.basecamp import Basecamp
+from everest.gp import GP, GetCovariance, CovarianceProduct, CVPredictor
+from everest.transit import TransitModel
+import numpy as np
+
+#: The maximum difference between the predictions, as a fraction of the data
+TOL = 1e-12
+
+
+class _Target(Basecamp):
+    '''
+    A small synthetic light curve with the attributes needed by
+    :py:meth:`everest.basecamp.Basecamp.compute_joint`.
+
+    '''
+
+    mission = 'k2'
+
+    def __init__(self, kernel, seed=1, N=1200, npix=6):
+        '''
+
+        '''
+
+        rng = np.random.RandomState(seed)
+        self.time = 2000. + np.arange(N) / 48.
+        self.fpix = rng.uniform(100., 200., (N, npix)) * \
+            (1 + 0.01 * np.sin(self.time.reshape(-1, 1) *
+                               np.arange(1, npix + 1)))
+        self.fraw = np.sum(self.fpix, axis=1)
+        self.fraw_err = 0.1 * np.sqrt(self.fraw)
+        self._norm = self.fraw
+        self.breakpoints = np.array([400, 800, N - 1])
+        self.bpad = 20
+        self.kernel = kernel
+        if kernel == 'Basic':
+            self.kernel_params = [1., 50., 3.]
+        else:
+            self.kernel_params = [1., 50., 2., 5.]
+        self.pld_order = 2
+        self.lam_idx = 1
+        self.lam = [[1e3, 1e5] for b in self.breakpoints]
+        self.X1N = None
+        self.XCBV = None
+        self.nanmask = rng.choice(N, 20, replace=False)
+        self.badmask = rng.choice(N, 30, replace=False)
+        self.outmask = rng.choice(N, 10, replace=False)
+        self.transitmask = np.array([], dtype=int)
+        self.transit_model = [TransitModel('b', t0=2001.3, per=3.1,
+                                           sig_RpRs=0.01)]
+
+    def get_cdpp_arr(self, flux=None):
+        '''
+
+        '''
+
+        return np.zeros(len(self.breakpoints))
+
+    def get_cdpp(self, flux=None):
+        '''
+
+        '''
+
+        return 0.
+
+
+def test_covariance_product():
+    '''
+
+    '''
+
+    rng = np.random.RandomState(3)
+    time = np.sort(rng.uniform(0., 20., 500))
+    x = rng.randn(500)
+    zeros = np.zeros_like(time)
+    for kernel, params in [('Basic', [1., 50., 3.]),
+                           ('QuasiPeriodic', [1., 50., 2., 5.])]:
+        K = GetCovariance(kernel, params, time, zeros)
+        assert np.allclose(CovarianceProduct(kernel, params, time, x),
+                           np.dot(K, x), rtol=1e-8, atol=1e-8)
+        assert np.allclose(CovarianceProduct(kernel, params, time, x,
+                                             blocksize=37),
+                           np.dot(K, x), rtol=1e-8, atol=1e-8)
+
+
+def test_compute_joint_blocked():
+    '''
+
+    '''
+
+    for kernel in ['Basic', 'QuasiPeriodic']:
+        dense = _Target(kernel)
+        dense.joint_memory = 1e6
+        dense.compute_joint()
+        blocked = _Target(kernel)
+        blocked.compute_joint_blocked()
+        scale = np.std(dense.model)
+        assert np.max(np.abs(blocked.model - dense.model)) < 1e-6 * scale
+        assert np.allclose(blocked.transit_depth, dense.transit_depth,
+                           rtol=1e-6)
+
+
+def test_cv_predictor():
+    '''
+
+    '''
+
+    rng = np.random.RandomState(5)
+    time = np.sort(rng.uniform(0., 20., 400))
+    errors = rng.uniform(0.5, 1., 400)
+    inds = rng.permutation(400)
+    masks = [np.sort(inds[:100]), np.sort(inds[100:250]), np.arange(20)]
+    for kernel, params in [('Basic', [1., 5., 3.]),
+                           ('QuasiPeriodic', [1., 5., 2., 5.])]:
+        y = rng.randn(400, 3) + np.sin(time).reshape(-1, 1)
+        gp = GP(kernel, params, white=False)
+        gp.compute(time, errors)
+        cv = CVPredictor(kernel, params, time, errors, masks)
+        for i, mask in enumerate(masks):
+            expected = np.vstack([gp.predict(y[:, j], time[mask])[0]
+                                  for j in range(y.shape[1])]).T
+            atol = TOL * np.max(np.abs(y))
+
+            # A single residual vector...
+            assert np.allclose(cv.predict(y[:, 0], i), expected[:, 0],
+                               rtol=0, atol=atol)
+
+            # ...and several at once
+            pred = cv.predict(y, i)
+            assert pred.shape == (len(mask), y.shape[1])
+            assert np.allclose(pred, expected, rtol=0, atol=atol)
+
+
+if __name__ == '__main__':
+    test_covariance_product()
+    test_compute_joint_blocked()
+    test_cv_predictor()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_import.py
+--------------
+
+Make sure ``import everest`` stays cheap.
+
+'''
+
+import os
+import sys
+import json
+import subprocess
+
+#: The maximum time (in seconds) a cold ``import everest`` may take
+IMPORT_BUDGET = float(os.environ.get('EVEREST_IMPORT_BUDGET', 0.25))
+
+#: Modules that must not be imported by ``import everest``
+HEAVY_MODULES = ['matplotlib', 'george', 'k2plr', 'PyPDF2', 'pyfits',
+                 'astropy', 'pysyzygy', 'scipy']
+
+SCRIPT = '''
+import sys, time, json
+t = time.time()
+import everest
+t = time.time() - t
+print(json.dumps({'time': t, 'modules': sorted(sys.modules.keys())}))
+'''
+
+
+def ColdImport():
+    '''
+    Imports :py:mod:`everest` in a fresh interpreter and returns the
+    import time and the list of loaded modules.
+
+    '''
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([root] +
+                                        [p for p in [env.get('PYTHONPATH')]
+                                         if p])
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env)
+    return json.loads(out.decode('utf-8').strip().split('\n')[-1])
+
+
+def test_import_modules():
+    '''
+
+    '''
+
+    modules = ColdImport()['modules']
+    loaded = [m for m in modules if m.split('.')[0] in HEAVY_MODULES]
+    assert len(loaded) == 0, \
+        "`import everest` loaded heavy modules: %s" % ", ".join(loaded)
+
+
+def test_import_time():
+    '''
+
+    '''
+
+    # Take the best of a few runs to beat the noise
+    t = min([ColdImport()['time'] for i in range(3)])
+    assert t < IMPORT_BUDGET, \
+        "`import everest` took %.3f s (budget: %.3f s)." % (t, IMPORT_BUDGET)
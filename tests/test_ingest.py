@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_ingest.py
+--------------
+
+Test the offline ingestion of a local target pixel file, with the
+`K2SFF` apertures read from the bundled `K2SFF` light curve.
+
+'''
+
+from everest.missions.k2 import Ingest, GetData, TargetDirectory
+from everest.missions.k2.utils import K2SFFFile
+import os
+import shutil
+import tempfile
+import numpy as np
+try:
+    import pyfits
+except ImportError:
+    import astropy.io.fits as pyfits
+
+#: The bundled `K2SFF` target
+EPIC = 201367065
+CAMPAIGN = 1
+
+
+def MakeTPF(path, k2sff, ncad=300):
+    '''
+    Writes a minimal long cadence target pixel file for :py:obj:`EPIC`
+    whose pixel grid matches the `K2SFF` apertures in :py:obj:`k2sff`.
+
+    '''
+
+    with pyfits.open(k2sff) as f:
+        image = np.array(f['STACKED_IMG'].data, dtype=float)
+    image = np.abs(image) + 1.
+    ny, nx = image.shape
+    rng = np.random.RandomState(42)
+    flux = image[None] * (1. + 1e-3 * rng.randn(ncad, 1, 1))
+    err = np.sqrt(flux)
+    shape = '(%d,%d)' % (nx, ny)
+    columns = [
+        pyfits.Column(name='CADENCENO', format='J',
+                      array=np.arange(ncad)),
+        pyfits.Column(name='TIME', format='D',
+                      array=1977.3 + np.arange(ncad) / 48.),
+        pyfits.Column(name='FLUX', format='%dE' % (nx * ny), dim=shape,
+                      array=flux),
+        pyfits.Column(name='FLUX_ERR', format='%dE' % (nx * ny), dim=shape,
+                      array=err),
+        pyfits.Column(name='QUALITY', format='J',
+                      array=np.zeros(ncad, dtype=int)),
+        pyfits.Column(name='POS_CORR1', format='E',
+                      array=1e-2 * rng.randn(ncad)),
+        pyfits.Column(name='POS_CORR2', format='E',
+                      array=1e-2 * rng.randn(ncad))]
+    aperture = np.ones((ny, nx), dtype='int32')
+    aperture[image > np.median(image)] = 3
+    name = os.path.join(path, 'ktwo%09d-c%02d_lpd-targ.fits.gz' %
+                        (EPIC, CAMPAIGN))
+    primary = pyfits.PrimaryHDU()
+    primary.header['KEPLERID'] = EPIC
+    primary.header['CAMPAIGN'] = CAMPAIGN
+    primary.header['KEPMAG'] = 12.
+    pyfits.HDUList([primary,
+                    pyfits.BinTableHDU.from_columns(columns),
+                    pyfits.ImageHDU(aperture)]).writeto(name)
+
+
+def test_ingest():
+    '''
+
+    '''
+
+    # A local mirror with a TPF and the K2SFF light curve
+    path = tempfile.mkdtemp()
+    k2sff = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         K2SFFFile(EPIC, CAMPAIGN))
+    shutil.copy(k2sff, path)
+    MakeTPF(path, k2sff)
+
+    # Don't overwrite the real cache for this target
+    cache = os.path.join(TargetDirectory(EPIC, CAMPAIGN), 'data.npz')
+    backup = None
+    if os.path.exists(cache):
+        backup = cache + '.bak'
+        shutil.move(cache, backup)
+
+    try:
+
+        # Ingest
+        assert Ingest(path, campaign=CAMPAIGN, clobber=True,
+                      pool='SerialPool') == []
+
+        # The K2SFF apertures are available and usable
+        data = GetData(EPIC, season=CAMPAIGN, get_hires=False,
+                       get_nearby=False)
+        assert data is not None
+        assert data.aperture_name == 'k2sff_15'
+        assert data.apertures['k2sff_15'].dtype.kind == 'i'
+        assert data.fpix.shape[1] == np.sum(data.aperture)
+
+    finally:
+        shutil.rmtree(path)
+        if os.path.exists(cache):
+            os.remove(cache)
+        if backup is not None:
+            shutil.move(backup, cache)
+
+
+if __name__ == '__main__':
+    test_ingest()
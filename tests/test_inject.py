@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_inject.py
+--------------
+
+Test the batched transit injection and recovery engine on a target
+from the synthetic mission.
+
+'''
+
+from everest.inject import InjectionEngine
+from everest.missions.synthetic.utils import ID0
+import os
+import numpy as np
+
+#: The maximum fractional error in the recovered depth
+DEPTH_TOL = 0.1
+
+
+def test_inject():
+    '''
+
+    '''
+
+    # Inject a deep transit, with and without masking it
+    engine = InjectionEngine(ID0 + 4, inj_model='nPLD', mission='synthetic',
+                             season=0, clobber=True, optimize_gp=False,
+                             dvs_mode='none')
+    if os.path.exists(engine.table):
+        os.remove(engine.table)
+
+    # The cached PLD operator reproduces the saved model
+    model = engine.model
+    fraw_model = engine.detrend(model.fraw.reshape(-1, 1))[:, 0]
+    assert np.allclose(fraw_model, model.model, rtol=1e-5,
+                       atol=1e-5 * np.nanmedian(np.abs(model.fraw))), \
+        "The cached PLD operator does not reproduce the saved model."
+
+    depth = 0.01
+    res = engine.run(t0=1.3, per=[4.1, 4.1], dur=0.2, depth=depth,
+                     mask=[False, True])
+
+    # Check!
+    print("Recovered depths: %.5f (unmasked), %.5f (masked)" %
+          tuple(res['rec_depth']))
+    assert np.all(np.abs(res['rec_depth_control'] - depth) <
+                  DEPTH_TOL * depth), "Control depth was not recovered."
+    assert np.abs(res['rec_depth'][1] - depth) < DEPTH_TOL * depth, \
+        "Masked injection depth was not recovered."
+    assert res['rec_depth'][0] > 0.5 * depth, \
+        "Unmasked injection depth was not recovered."
+
+    # The results table is tab-separated
+    with open(engine.table, 'r') as f:
+        assert f.readline().startswith('# T0\tPER\t')
+    table = np.loadtxt(engine.table, delimiter='\t')
+    assert table.shape == (2, len(res.dtype.names))
+    assert np.allclose(table[:, 5], res['rec_depth'])
+
+
+if __name__ == '__main__':
+    test_inject()
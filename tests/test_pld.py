@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_pld.py
+-----------
+
+Test the gradient-based cross-validation of :py:class:`everest.pPLD`
+on a target from the synthetic mission.
+
+'''
+
+import everest
+from everest.gp import CVPredictor
+from everest.mathutils import Chunks
+from everest.missions.synthetic.utils import ID0
+import numpy as np
+from scipy.optimize import fmin_l_bfgs_b
+from itertools import product
+
+#: The synthetic target
+ID = ID0 + 4
+
+
+def CVArgs(model, b):
+    '''
+    Returns the arguments of :py:meth:`everest.pPLD.validation_scatter`
+    for chunk :py:obj:`b`, as set up in
+    :py:meth:`everest.pPLD.cross_validate`.
+
+    '''
+
+    m = model.get_masked_chunk(b)
+    time = model.time[m]
+    flux = model.fraw[m]
+    med = np.nanmedian(model.fraw)
+    masks = list(Chunks(np.arange(0, len(time)),
+                        len(time) // model.cdivs))
+    gp = CVPredictor(model.kernel, model.kernel_params, time,
+                     model.fraw_err[m], masks)
+    pre_v = [model.cv_precompute(mask, b) for mask in masks]
+    return (b, masks, pre_v, gp, flux, med)
+
+
+def test_lbfgs():
+    '''
+
+    '''
+
+    kwargs = dict(mission='synthetic', season=0, pld_order=2,
+                  optimize_gp=False, dvs_mode='none', clobber=True)
+    nPLD = everest.nPLD(ID, lambda_arr=10 ** np.arange(0., 18., 1.5),
+                        **kwargs)
+    pPLD = everest.pPLD(ID, poptimizer='lbfgs', piter=1, **kwargs)
+    args = CVArgs(pPLD, 0)
+    log_lam0 = np.log10(nPLD.lam[0])
+
+    # The analytic gradient matches finite differences. The objective
+    # involves an ill-conditioned solve, so it is only accurate to ~1e-8
+    # and the step can't be too small
+    for log_lam in [log_lam0, log_lam0 + [0.7, -0.4]]:
+        df = pPLD.smooth_validation_scatter(log_lam, *args)[1]
+        eps = 1e-3
+        fd = [(pPLD.smooth_validation_scatter(log_lam + eps * e, *args)[0] -
+               pPLD.smooth_validation_scatter(log_lam - eps * e, *args)[0]) /
+              (2 * eps) for e in np.eye(len(log_lam))]
+        assert np.allclose(df, fd, rtol=1e-3,
+                           atol=1e-3 * np.max(np.abs(df)))
+
+    # L-BFGS is no worse than a grid search
+    grid = np.arange(pPLD.pbounds[0], pPLD.pbounds[1] + 1e-10, 1.5)
+    s_grid = np.min([pPLD.smooth_validation_scatter(np.array(x), *args)[0]
+                     for x in product(grid, repeat=len(log_lam0))])
+    x, s_lbfgs, _ = fmin_l_bfgs_b(pPLD.smooth_validation_scatter,
+                                  np.clip(log_lam0, *pPLD.pbounds),
+                                  args=args,
+                                  bounds=[pPLD.pbounds] * len(log_lam0))
+    assert s_lbfgs <= s_grid + 1e-8
+
+    # And the final solution is no worse than the nPLD grid search
+    lam = np.array(pPLD.lam[0])
+    s_nPLD = pPLD.validation_scatter(log_lam0, *args)
+    s_pPLD = pPLD.validation_scatter(np.log10(lam), *args)
+    assert s_pPLD <= s_nPLD
+
+
+if __name__ == '__main__':
+    test_lbfgs()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_precision.py
+-----------------
+
+Validate the single precision mode against the full precision
+de-trending of the bundled test target.
+
+'''
+
+import everest
+from test_detrend import PrepareTarget
+import numpy as np
+
+#: The maximum fractional difference in the de-trended CDPP
+CDPP_TOL = 0.01
+
+#: The maximum scatter in the model difference, as a fraction of the CDPP
+MODEL_TOL = 0.1
+
+
+def Detrend(precision):
+    '''
+    De-trends EPIC 201367065 at the given :py:obj:`precision`.
+
+    '''
+
+    return everest.rPLD(201367065, clobber=True, mission='k2',
+                        giter=1, gmaxf=3, lambda_arr=[1e0, 1e5, 1e10],
+                        oiter=3, pld_order=2, get_hires=False,
+                        get_nearby=False, precision=precision)
+
+
+def test_precision():
+    '''
+
+    '''
+
+    PrepareTarget()
+    double = Detrend('double')
+    single = Detrend('single')
+
+    # The pixel data is stored in single precision...
+    assert single.fpix.dtype == np.float32
+    assert single.X(0, slice(0, 10)).dtype == np.float32
+
+    # ...but the results should be the same
+    print("De-trended CDPP: %.3f ppm (double), %.3f ppm (single)" %
+          (double.cdpp, single.cdpp))
+    assert np.abs(single.cdpp - double.cdpp) < CDPP_TOL * double.cdpp, \
+        "Single precision CDPP differs from double precision value."
+    dmodel = 1.e6 * np.nanstd(single.model - double.model) / \
+        np.nanmedian(double.fraw)
+    assert dmodel < MODEL_TOL * double.cdpp, \
+        "Single precision model differs from double precision model."
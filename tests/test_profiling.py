@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_profiling.py
+-----------------
+
+Test the pipeline profiler and its ``.prof`` files.
+
+'''
+
+from everest.profiling import Profiler, ReadProfile, MergeProfile
+import tempfile
+import shutil
+import time
+import os
+
+
+def test_stage():
+    '''
+
+    '''
+
+    path = tempfile.mkdtemp()
+    try:
+        file = os.path.join(path, 'nPLD.prof')
+        profiler = Profiler(file=file, tags={'ID': 1, 'model': 'nPLD'})
+        with profiler.stage('outer'):
+            for n in range(2):
+                with profiler.stage('inner', iter=n):
+                    time.sleep(0.01)
+
+        # The inner stages close first; the outer one includes them
+        assert [r['stage'] for r in profiler.records] == \
+            ['inner', 'inner', 'outer']
+        assert [r.get('iter') for r in profiler.records] == [0, 1, None]
+        inner = sum([r['time'] for r in profiler.records[:2]])
+        assert profiler.records[2]['time'] >= inner >= 0.02
+        for record in profiler.records:
+            assert record['cpu'] >= 0
+            assert record['rss'] is None or record['rss'] > 0
+
+        # The records are written to the file along with the tags
+        records = ReadProfile(file)
+        assert len(records) == 3
+        for record, line in zip(profiler.records, records):
+            assert line['ID'] == 1 and line['model'] == 'nPLD'
+            assert 'timestamp' in line
+            for key, value in record.items():
+                assert line[key] == value
+
+        # A disabled profiler records nothing
+        profiler = Profiler(file=file, enabled=False)
+        with profiler.stage('outer'):
+            pass
+        assert len(profiler.records) == 0
+        assert len(ReadProfile(file)) == 3
+
+        # Resetting truncates the file unless told otherwise
+        profiler = Profiler(file=file)
+        profiler.reset(truncate=False)
+        assert len(ReadProfile(file)) == 3
+        profiler.reset()
+        assert len(ReadProfile(file)) == 0
+
+    finally:
+        shutil.rmtree(path)
+
+
+def test_summary():
+    '''
+
+    '''
+
+    profiler = Profiler()
+    profiler.records = [{'stage': 'a', 'time': 1., 'cpu': 0.5, 'rss': 10.},
+                        {'stage': 'a', 'time': 2., 'cpu': 1.5, 'rss': 30.},
+                        {'stage': 'b', 'time': 4., 'cpu': 4., 'rss': None}]
+    summary = profiler.summary()
+    assert summary['a'] == {'calls': 2, 'time': 3., 'cpu': 2., 'rss': 30.}
+    assert summary['b'] == {'calls': 1, 'time': 4., 'cpu': 4., 'rss': 0.}
+    assert summary['peak_rss'] == 30.
+
+    # Merge a later stage into the earlier summary: stages recorded
+    # again replace the old entries, the others are kept as they are
+    profiler.records = [{'stage': 'b', 'time': 8., 'cpu': 1., 'rss': 20.},
+                        {'stage': 'c', 'time': 1., 'cpu': 1., 'rss': 50.}]
+    merged = profiler.summary(previous=summary)
+    assert merged['a'] == summary['a']
+    assert merged['b'] == {'calls': 1, 'time': 8., 'cpu': 1., 'rss': 20.}
+    assert merged['c'] == {'calls': 1, 'time': 1., 'cpu': 1., 'rss': 50.}
+    assert merged['peak_rss'] == 50.
+    assert summary['b']['time'] == 4.
+
+    # The overall peak is never lower than the earlier one
+    profiler.records = [{'stage': 'a', 'time': 1., 'cpu': 1., 'rss': 5.}]
+    assert profiler.summary(previous=merged)['peak_rss'] == 50.
+
+
+def test_read_profile():
+    '''
+
+    '''
+
+    path = tempfile.mkdtemp()
+    try:
+        file = os.path.join(path, 'nPLD.prof')
+
+        # The stages that close after the model is saved are merged in
+        profiler = Profiler(file=file)
+        with profiler.stage('detrend'):
+            pass
+        stored = profiler.summary()
+        profiler.reset(truncate=False)
+        with profiler.stage('publish'):
+            pass
+        with open(file, 'a') as f:
+            f.write('\n')
+        records = ReadProfile(file)
+        assert [r['stage'] for r in records] == ['detrend', 'publish']
+        merged = MergeProfile(file, stored)
+        assert merged['detrend'] == stored['detrend']
+        assert merged['publish']['calls'] == 1
+
+        # A missing file leaves the stored profile alone
+        assert MergeProfile(os.path.join(path, 'rPLD.prof'), stored) is stored
+
+    finally:
+        shutil.rmtree(path)
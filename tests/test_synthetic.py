@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_synthetic.py
+-----------------
+
+Test the synthetic mission data generator.
+
+'''
+
+from everest.missions.synthetic.utils import SyntheticTPF, TargetInfo, \
+     Campaign, Pointing, CAMPAIGNS, ID0, IDBLOCK
+from everest.missions import synthetic
+import numpy as np
+
+
+def test_ids():
+    '''
+
+    '''
+
+    assert Campaign(ID0 + 1) == 0
+    assert Campaign(ID0 + IDBLOCK + CAMPAIGNS[1][0]) == 1
+    assert Campaign(ID0 + CAMPAIGNS[0][0] + 1) is None
+    assert Campaign(ID0) is None
+    assert Campaign(201367065) is None
+    assert synthetic.ISTARGET(ID0 + 1)
+
+
+def test_tpf():
+    '''
+
+    '''
+
+    ID = ID0 + 7
+    info = TargetInfo(ID)
+    tpf = SyntheticTPF(ID)
+
+    # Deterministic
+    assert np.array_equal(tpf['fpix'], SyntheticTPF(ID)['fpix'],
+                          equal_nan=True)
+    assert TargetInfo(ID).mag == info.mag
+
+    # Shapes and flags
+    ncad = CAMPAIGNS[0][1]
+    assert tpf['fpix'].shape == (ncad,) + info.shape
+    assert np.all(np.isnan(tpf['fpix'][Pointing(0).nanmask]))
+    assert np.any(tpf['qual'] & 2 ** 20)
+    npix = [np.sum(tpf['apertures']['k2sff_%02d' % i])
+            for i in range(10, 20)]
+    assert np.all(np.diff(npix) >= 0)
+
+    # Stars on the same module move together
+    other = [n for n in range(ID + 1, ID0 + CAMPAIGNS[0][0] + 1)
+             if TargetInfo(n).module == info.module][0]
+    pc1 = SyntheticTPF(other)['pc1']
+    assert np.corrcoef(tpf['pc1'], pc1)[0, 1] > 0.9
+
+
+if __name__ == '__main__':
+    test_ids()
+    test_tpf()
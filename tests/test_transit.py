@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+test_transit.py
+---------------
+
+Test the tabulated duration and depth inversions and the transit
+template cache against the original numerical inversions.
+
+'''
+
+from everest import transit
+from everest.transit import Get_rhos, Get_RpRs, TransitShape, PER_GRID
+import pysyzygy as ps
+from scipy.optimize import fmin
+import numpy as np
+
+#: The time resolution of the durations measured by the inversion
+DT = 1. / 999
+
+#: The maximum fractional difference in the radius ratio
+RPRS_TOL = 0.01
+
+
+def FminRhos(dur, **kwargs):
+    '''
+    The original numerical duration -> density inversion.
+
+    '''
+
+    def DiffSq(rhos):
+        return (dur - transit._Duration(rhos[0], **kwargs)) ** 2
+
+    return fmin(DiffSq, [0.2], disp=False)[0]
+
+
+def FminRpRs(d, **kwargs):
+    '''
+    The original numerical depth -> radius ratio inversion.
+
+    '''
+
+    def DiffSq(r):
+        return 1.e10 * (d - transit._Depth(r[0], **kwargs)) ** 2
+
+    return fmin(DiffSq, [np.sqrt(d)], disp=False)[0]
+
+
+def test_inversions():
+    '''
+
+    '''
+
+    for per in [1.3, 3.56789, 25.]:
+
+        # The density that gives each duration
+        for dur in [0.05, 0.1, 0.2]:
+            rhos = Get_rhos(dur, per=per)
+            old = FminRhos(dur, per=per)
+            assert np.abs(transit._Duration(rhos, per=per) - dur) < 3 * DT
+            assert np.abs(transit._Duration(rhos, per=per) -
+                          transit._Duration(old, per=per)) < 3 * DT
+
+        # The radius ratio that gives each depth
+        for depth in [1e-4, 1e-3, 1e-2, 0.1]:
+            RpRs = Get_RpRs(depth, per=per)
+            old = FminRpRs(depth, per=per)
+            assert np.abs(RpRs - old) < RPRS_TOL * old
+            assert np.abs(transit._Depth(RpRs, per=per) - depth) < \
+                2 * RPRS_TOL * depth
+
+    # Out of range values are left to the numerical inversion
+    assert transit._Invert('rhos', 0.1, per=2 * PER_GRID[-1]) is None
+    assert transit._Invert('RpRs', 0.5, per=3.56789) is None
+
+
+def test_template():
+    '''
+
+    '''
+
+    transit._templates.clear()
+
+    # The cached template matches the one built from the
+    # numerical inversion
+    for dur in [0.05, 0.1, 0.2]:
+        shape = TransitShape(depth=1e-3, dur=dur)
+        kwargs = {'per': 3.56789}
+        trn = ps.Transit(t0=0., rhos=FminRhos(dur, **kwargs), **kwargs)
+        y = trn(shape.x) - 1
+        y *= 1e-3 / (1 - trn([0.])[0])
+        assert np.allclose(shape.y.min(), -1e-3, rtol=1e-3)
+        width = np.ptp(shape.x[shape.y < 0])
+        assert np.abs(width - np.ptp(shape.x[y < 0])) < 3 * DT
+        assert np.abs(width - dur) < 3 * DT
+
+    # The template is shared by all depths...
+    transit._templates.clear()
+    a = TransitShape(depth=1e-3, dur=0.1)
+    b = TransitShape(depth=5e-3, dur=0.1)
+    assert len(transit._templates._data) == 1
+    assert np.array_equal(a.x, b.x)
+    assert np.allclose(5 * a.y, b.y)
+    assert np.allclose(b(np.array([0.])), -5e-3, rtol=1e-3)
+
+    # ...but not by different durations, limb darkening or exposure times
+    c = TransitShape(depth=1e-3, dur=0.15)
+    d = TransitShape(depth=1e-3, dur=0.1, u1=0.1, u2=0.1)
+    e = TransitShape(depth=1e-3, dur=0.1, exptime=ps.KEPSHRTEXP)
+    assert len(transit._templates._data) == 4
+    for shape in [c, d, e]:
+        assert not np.allclose(shape.y, a.y)
+
+    # Same arguments, same template
+    f = TransitShape(depth=1e-3, dur=0.1, exptime=ps.KEPSHRTEXP)
+    assert len(transit._templates._data) == 4
+    assert np.array_equal(f.y, e.y)
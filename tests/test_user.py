@@ -9,6 +9,8 @@ Test the user interface.
 '''
 
 import everest
+from everest.missions.synthetic.utils import ID0
+import matplotlib.pyplot as pl
 import os
 import shutil
 
@@ -32,3 +34,25 @@ def test_user():
 
     # Compute the model
     star.compute()
+
+
+def test_plot():
+    '''
+
+    '''
+
+    # Publish a synthetic target and load it back
+    everest.nPLD(ID0 + 4, mission='synthetic', season=0, pld_order=2,
+                 optimize_gp=False, dvs_mode='none', clobber=True).publish()
+    star = everest.Everest(ID0 + 4, mission='synthetic', season=0,
+                           quiet=True)
+
+    # The y axis is clipped, so some cadences are drawn as off-axis arrows
+    for plot_bad in [True, False]:
+        for plot_out in [True, False]:
+            fig, axes = star.plot(show=False, plot_bad=plot_bad,
+                                  plot_out=plot_out)
+            assert len(axes) == 2
+            pl.close(fig)
+    fig, ax = star.plot(show=False, plot_raw=False, plot_gp=False)
+    pl.close(fig)